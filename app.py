@@ -2,13 +2,17 @@ from flask import Flask, render_template, request, send_file, jsonify
 from flask_cors import CORS
 from docxtpl import DocxTemplate
 from datetime import datetime
+import io
 import os
+import sys
 import uuid
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+import template_registry
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-TEMPLATE_PATH = "SpectoV_Cert.docx"
 OUTPUT_DOCX = "static/Final_Certificate.docx"
 
 pronouns = {
@@ -31,7 +35,7 @@ def generate_certificate():
         if not os.path.exists('static'):
             os.makedirs('static')
 
-        doc = DocxTemplate(TEMPLATE_PATH)
+        doc = DocxTemplate(io.BytesIO(template_registry.registry.get(domain).data))
         context = {
             "name": name,
             "domain": domain,
@@ -100,8 +104,8 @@ def generate_certificate_api():
         output_docx = f"static/Certificate_{unique_id}.docx"
         output_pdf = f"static/Certificate_{unique_id}.pdf"
 
-        # Generate certificate using DocxTemplate
-        doc = DocxTemplate(TEMPLATE_PATH)
+        # Generate certificate using DocxTemplate (the domain's template from the registry)
+        doc = DocxTemplate(io.BytesIO(template_registry.registry.get(domain).data))
         context = {
             "name": name,
             "domain": domain,
@@ -145,10 +149,9 @@ def generate_certificate_api():
 
 if __name__ == '__main__':
     # Check if template file exists
-    if not os.path.exists(TEMPLATE_PATH):
-        print(f"Warning: Certificate template '{TEMPLATE_PATH}' not found")
-        print(f"Current working directory: {os.getcwd()}")
-        print(f"Files in current directory: {os.listdir('.')}")
+    default_template = template_registry.registry.resolve()
+    if not os.path.exists(default_template):
+        print(f"Warning: Certificate template '{default_template}' not found")
 
     print("Starting Certificate Generation Flask Server...")
     print("Form interface: http://localhost:5002/")
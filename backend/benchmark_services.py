@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Benchmark the sync Flask service against the async Starlette variant
+Starts each service on a local port in a scratch directory, fires concurrent
+certificate requests with unique names (so nothing is served from cache) and
+reports throughput and latency percentiles.
+
+Usage:
+    python benchmark_services.py --requests 40 --concurrency 8
+    python benchmark_services.py --converter-delay 2.0   # stand-in converter sleeping 2 s
+    python benchmark_services.py --converter-delay lognormal:0.5,0.6   # ... with a latency distribution
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+import statistics
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Stand-in for soffice (see fake_soffice.py), answering after a fixed delay unless
+# FAKE_SOFFICE_LATENCY asks for something else
+STAND_IN_CONVERTER = '''#!{python}
+import os, sys
+sys.path.insert(0, {backend!r})
+os.environ.setdefault('FAKE_SOFFICE_LATENCY', '{delay}')
+import fake_soffice
+sys.exit(fake_soffice.main())
+'''
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def prepare_workdir(workdir, converter_delay):
+    """Copy (or create) the template and write the stand-in converter if requested"""
+    template = os.path.join(BACKEND_DIR, 'SpectoV_Cert.docx')
+    if os.path.exists(template):
+        shutil.copy(template, workdir)
+    else:
+        from docx import Document
+        doc = Document()
+        doc.add_paragraph('This is to certify that {{Name}}')
+        doc.add_paragraph('has completed {{Domain}} from {{Start Date}} to {{End Date}}.')
+        doc.add_paragraph('ISSUED DATE :')
+        doc.save(os.path.join(workdir, 'SpectoV_Cert.docx'))
+
+    if converter_delay is None:
+        return None
+
+    converter = os.path.join(workdir, 'stand_in_soffice')
+    with open(converter, 'w') as f:
+        f.write(STAND_IN_CONVERTER.format(python=sys.executable, backend=BACKEND_DIR, delay=converter_delay))
+    os.chmod(converter, 0o755)
+    return converter
+
+def start_service(kind, port, workdir, converter, workers, concurrency):
+    """Start the sync (gunicorn) or async (uvicorn) service and wait for /health"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = BACKEND_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    env['CERTIFICATE_OUTPUT_DIR'] = os.path.join(workdir, f'static_{kind}')
+    env['CERTIFICATE_REGISTRY_PATH'] = os.path.join(workdir, f'static_{kind}', 'certificates.db')
+    env['CERTIFICATE_CONVERSION_CONCURRENCY'] = str(concurrency)
+    if converter:
+        env['CERTIFICATE_LIBREOFFICE_COMMANDS'] = converter
+
+    if kind == 'sync':
+        command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+                   '--workers', str(workers), '--timeout', '120', 'certificate_service:app']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', '--host', '127.0.0.1', '--port', str(port),
+                   '--log-level', 'warning', 'certificate_service_async:app']
+
+    process = subprocess.Popen(command, cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=10)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{kind} service did not start")
+
+def request_certificate(port, index):
+    body = json.dumps({
+        "name": f"Benchmark Student {index}",
+        "domain": "Web Development",
+        "start_date": "May 1, 2025",
+        "end_date": "June 30, 2025"
+    }).encode()
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}/api/generate-certificate',
+        data=body,
+        headers={'Content-Type': 'application/json'}
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=300) as response:
+        response.read()
+        ok = response.status == 200
+    return time.perf_counter() - start, ok
+
+def run_load(port, total, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda i: request_certificate(port, i), range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p / 100.0 * len(latencies)))]
+
+    return {
+        "requests": total,
+        "errors": sum(1 for _, ok in results if not ok),
+        "seconds": round(elapsed, 2),
+        "throughput_rps": round(total / elapsed, 2),
+        "p50": round(statistics.median(latencies), 3),
+        "p95": round(percentile(95), 3),
+        "p99": round(percentile(99), 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers for the sync service')
+    parser.add_argument('--conversion-slots', type=int, default=8, help='async conversion semaphore size')
+    parser.add_argument('--converter-delay', default=None,
+                        help='use a stand-in converter (fake_soffice.py) instead of LibreOffice, sleeping this '
+                             'many seconds or following a FAKE_SOFFICE_LATENCY distribution')
+    parser.add_argument('--only', choices=['sync', 'async'], default=None)
+    args = parser.parse_args()
+
+    print("Certificate Service Benchmark")
+    print("=" * 40)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        converter = prepare_workdir(workdir, args.converter_delay)
+        for kind in ('sync', 'async'):
+            if args.only and args.only != kind:
+                continue
+            port = free_port()
+            process = start_service(kind, port, workdir, converter, args.workers, args.conversion_slots)
+            try:
+                results[kind] = run_load(port, args.requests, args.concurrency)
+            finally:
+                process.terminate()
+                process.wait(timeout=10)
+            print(f"{kind:6} : {results[kind]}")
+
+    if 'sync' in results and 'async' in results:
+        speedup = results['async']['throughput_rps'] / max(results['sync']['throughput_rps'], 1e-9)
+        print(f"\nAsync throughput: {speedup:.2f}x the sync service")
+
+if __name__ == "__main__":
+    main()
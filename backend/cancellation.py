@@ -0,0 +1,117 @@
+"""
+Cancellation of certificate work whose client has gone away
+A CancellationToken travels with a request through the pipeline (scheduler
+queue, DOCX rendering, converter subprocess). When the client disconnects,
+the token is cancelled: a waiting request leaves the scheduler queue, a
+running converter is killed, and scratch files are removed by the caller.
+"""
+import errno
+import select
+import socket
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# How often the disconnect watcher looks at the client socket (seconds)
+DISCONNECT_POLL_INTERVAL = 0.5
+
+class ConversionCancelled(Exception):
+    """
+    Raised when work is abandoned because its client disconnected
+    """
+
+class CancellationToken:
+    """
+    Shared flag saying the result of some work is no longer wanted
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason='client disconnected'):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, timeout):
+        """
+        Sleep up to timeout seconds, waking early on cancellation
+        Returns True if cancelled
+        """
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self, stage):
+        if self._event.is_set():
+            record_cancelled(stage)
+            raise ConversionCancelled(f"Cancelled during {stage}: {self.reason}")
+
+_stats_lock = threading.Lock()
+_stats = {
+    "cancelled": 0,
+    "by_stage": {},
+    "converter_seconds_killed": 0.0
+}
+
+def record_cancelled(stage, converter_seconds=0.0):
+    """
+    Count one piece of abandoned work and how long its converter had been running
+    """
+    with _stats_lock:
+        _stats["cancelled"] += 1
+        _stats["by_stage"][stage] = _stats["by_stage"].get(stage, 0) + 1
+        _stats["converter_seconds_killed"] += converter_seconds
+    logger.info("Cancelled certificate work during %s (converter ran %.2fs)", stage, converter_seconds)
+
+def summary():
+    with _stats_lock:
+        return {
+            "cancelled": _stats["cancelled"],
+            "by_stage": dict(_stats["by_stage"]),
+            "converter_seconds_killed": round(_stats["converter_seconds_killed"], 3)
+        }
+
+def client_disconnected(sock):
+    """
+    True if the peer has closed the connection
+    A readable socket with nothing to read means EOF; pipelined request bytes
+    leave the socket readable with data, which is not a disconnect.
+    """
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except BlockingIOError:
+        return False
+    except OSError as e:
+        return e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK)
+    except ValueError:
+        # Socket already closed on our side
+        return True
+
+def watch_client_disconnect(environ, token):
+    """
+    Cancel token when the WSGI client socket closes
+    Works with gunicorn (gunicorn.socket) and the Werkzeug dev server
+    (werkzeug.socket). Returns a function that stops the watcher.
+    """
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None:
+        return lambda: None
+
+    stopped = threading.Event()
+
+    def watch():
+        while not stopped.wait(DISCONNECT_POLL_INTERVAL):
+            if client_disconnected(sock):
+                token.cancel()
+                return
+
+    threading.Thread(target=watch, name='disconnect-watcher', daemon=True).start()
+    return stopped.set
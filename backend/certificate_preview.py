@@ -0,0 +1,97 @@
+"""
+Low-resolution PNG/WebP previews of issued certificates
+Previews are rasterized from the first page of the cached PDF, using PyMuPDF
+when it is installed and poppler's pdftoppm otherwise.
+"""
+import os
+import io
+import uuid
+import shutil
+import logging
+import subprocess
+
+from structured_logging import bounded
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pymupdf
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+
+try:
+    from PIL import Image
+    PILLOW_AVAILABLE = True
+except ImportError:
+    PILLOW_AVAILABLE = False
+
+# Resolution of preview images; 50 dpi gives an A4 page of roughly 410x585 px
+PREVIEW_DPI = int(os.environ.get('CERTIFICATE_PREVIEW_DPI', 50))
+PREVIEW_WEBP_QUALITY = 70
+PDFTOPPM_TIMEOUT = 15
+
+def rasterize_with_pymupdf(pdf_path):
+    """
+    Render the first page of a PDF to PNG bytes with PyMuPDF
+    """
+    with pymupdf.open(pdf_path) as pdf:
+        pixmap = pdf[0].get_pixmap(dpi=PREVIEW_DPI)
+        return pixmap.tobytes('png')
+
+def rasterize_with_pdftoppm(pdf_path):
+    """
+    Render the first page of a PDF to PNG bytes with poppler's pdftoppm
+    """
+    pdftoppm = shutil.which('pdftoppm')
+    if not pdftoppm:
+        return None
+
+    result = subprocess.run([
+        pdftoppm, '-png', '-singlefile',
+        '-r', str(PREVIEW_DPI),
+        '-f', '1', '-l', '1',
+        pdf_path
+    ], capture_output=True, timeout=PDFTOPPM_TIMEOUT)
+
+    if result.returncode != 0:
+        logger.warning("pdftoppm failed: %s", bounded(result.stderr.decode(errors='replace').strip()))
+        return None
+    return result.stdout
+
+def render_preview(pdf_path, preview_path, image_format):
+    """
+    Write a low-resolution preview of a certificate PDF
+    image_format is "png" or "webp"
+    Returns True if successful, False otherwise
+    """
+    try:
+        if PYMUPDF_AVAILABLE:
+            png_bytes = rasterize_with_pymupdf(pdf_path)
+        else:
+            png_bytes = rasterize_with_pdftoppm(pdf_path)
+
+        if not png_bytes:
+            logger.error("No PDF rasterizer available (install PyMuPDF or poppler-utils)")
+            return False
+
+        if image_format == 'webp':
+            if not PILLOW_AVAILABLE:
+                logger.error("Pillow not available for WebP previews")
+                return False
+            output = io.BytesIO()
+            Image.open(io.BytesIO(png_bytes)).save(output, 'WEBP', quality=PREVIEW_WEBP_QUALITY)
+            png_bytes = output.getvalue()
+
+        scratch_path = f"{preview_path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(scratch_path, 'wb') as f:
+            f.write(png_bytes)
+        os.replace(scratch_path, preview_path)
+
+        logger.info("Rendered %s preview: %s (%d bytes)", image_format, preview_path, len(png_bytes),
+                    extra={"event": "preview_rendered"})
+        return True
+
+    except Exception as e:
+        logger.error("Preview rendering error: %s", e)
+        return False
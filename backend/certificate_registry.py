@@ -0,0 +1,136 @@
+"""
+Embedded registry of issued certificates
+Every certificate issued by the certificate service is recorded here, keyed by
+its certificate ID, so verification is a primary-key lookup in a local SQLite
+file instead of a query against the Node backend's MySQL table.
+
+Certificates pre-generated from a roster are also indexed by their details,
+so a later request without an issued date gets the roster's certificate.
+"""
+import os
+import sqlite3
+import threading
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Location of the SQLite registry (kept next to the issued certificates by default)
+REGISTRY_PATH = os.environ.get(
+    'CERTIFICATE_REGISTRY_PATH',
+    os.path.join(os.environ.get('CERTIFICATE_OUTPUT_DIR', 'static'), 'certificates.db')
+)
+
+# SQLite limits the number of bound parameters per statement
+BULK_LOOKUP_CHUNK = 500
+
+_local = threading.local()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certificates (
+    certificate_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    issued_date TEXT NOT NULL,
+    created_at TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_certificates_holder
+    ON certificates (name, domain, issued_date);
+CREATE TABLE IF NOT EXISTS pregenerated (
+    name TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    gender TEXT NOT NULL,
+    issued_date TEXT NOT NULL,
+    PRIMARY KEY (name, domain, start_date, end_date, gender)
+) WITHOUT ROWID;
+"""
+
+COLUMNS = ('certificate_id', 'name', 'domain', 'start_date', 'end_date', 'issued_date', 'created_at')
+
+def get_connection():
+    """
+    Return this thread's registry connection, opening it on first use
+    """
+    connection = getattr(_local, 'connection', None)
+    if connection is None or getattr(_local, 'path', None) != REGISTRY_PATH:
+        directory = os.path.dirname(REGISTRY_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(REGISTRY_PATH, timeout=10)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SCHEMA)
+        _local.connection = connection
+        _local.path = REGISTRY_PATH
+    return connection
+
+def record_certificate(certificate_id, name, domain, start_date, end_date, issued_date):
+    """
+    Record an issued certificate. Recording the same ID twice is a no-op.
+    """
+    connection = get_connection()
+    with connection:
+        connection.execute(
+            'INSERT OR IGNORE INTO certificates VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (certificate_id, name, domain, start_date, end_date, issued_date,
+             datetime.utcnow().isoformat(timespec='seconds'))
+        )
+    logger.info("Recorded certificate %s in registry", certificate_id)
+
+def lookup_certificate(certificate_id):
+    """
+    Return the registry record for a certificate ID, or None if it was never issued
+    """
+    row = get_connection().execute(
+        f"SELECT {', '.join(COLUMNS)} FROM certificates WHERE certificate_id = ?",
+        (certificate_id,)
+    ).fetchone()
+    return dict(zip(COLUMNS, row)) if row else None
+
+def lookup_certificates(certificate_ids):
+    """
+    Look up many certificate IDs at once
+    Returns a dict mapping every requested ID to its record (or None)
+    """
+    results = dict.fromkeys(certificate_ids)
+    unique_ids = list(results)
+    connection = get_connection()
+
+    for start in range(0, len(unique_ids), BULK_LOOKUP_CHUNK):
+        chunk = unique_ids[start:start + BULK_LOOKUP_CHUNK]
+        placeholders = ', '.join('?' * len(chunk))
+        rows = connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM certificates WHERE certificate_id IN ({placeholders})",
+            chunk
+        )
+        for row in rows:
+            results[row[0]] = dict(zip(COLUMNS, row))
+
+    return results
+
+def record_pregenerated(name, domain, start_date, end_date, gender, issued_date):
+    """
+    Remember the issued date a certificate was pre-generated with
+    A later roster with the same student replaces it.
+    """
+    connection = get_connection()
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO pregenerated VALUES (?, ?, ?, ?, ?, ?)',
+            (name, domain, start_date, end_date, gender.lower(), issued_date)
+        )
+
+def pregenerated_issued_date(name, domain, start_date, end_date, gender):
+    """
+    Return the issued date of the pre-generated certificate with these details, or None
+    """
+    row = get_connection().execute(
+        'SELECT issued_date FROM pregenerated '
+        'WHERE name = ? AND domain = ? AND start_date = ? AND end_date = ? AND gender = ?',
+        (name, domain, start_date, end_date, gender.lower())
+    ).fetchone()
+    return row[0] if row else None
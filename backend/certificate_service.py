@@ -1,22 +1,48 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g
 from flask_cors import CORS
-from docx import Document
+from docx.shared import Inches
 from datetime import datetime
+# Configure logging (JSON lines through a background queue) before the modules
+# below log anything at import time
+import structured_logging
+from structured_logging import bounded, bounded_listing
+structured_logging.configure_logging()
+import certificate_registry
+import certificate_preview
+import pdf_optimizer
+import pdf_signing
+import pdf_merge
+import deterministic_output
+import request_schema
+import template_registry
+import host_sizing
+import memory_guard
+import render_pipeline
+import email_delivery
+import rate_limiter
+import output_storage
+import cancellation
+import diagnostics
+import tracing
+from cancellation import CancellationToken, ConversionCancelled, watch_client_disconnect
+from converter_supervisor import supervisor
+from conversion_scheduler import ConversionScheduler, LANE_WEIGHTS, INTERACTIVE, BULK
+from collections import OrderedDict
+import io
 import os
+import hashlib
+import contextlib
+import shutil
+import atexit
+import tempfile
+import re
+import json
 import uuid
 import subprocess
+import threading
 import platform
 import logging
-import sys
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+
 logger = logging.getLogger(__name__)
 
 # Try to import docx2pdf, but handle the case where it might not work
@@ -34,84 +60,199 @@ try:
     from reportlab.lib.pagesizes import letter, A4
     from reportlab.lib.styles import getSampleStyleSheet
     from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    from reportlab.graphics.shapes import Drawing
+    from reportlab.graphics.barcode.qr import QrCodeWidget
     REPORTLAB_AVAILABLE = True
     logger.info("reportlab library loaded successfully")
 except ImportError:
     REPORTLAB_AVAILABLE = False
     logger.warning("reportlab not available. Fallback PDF generation may not work.")
 
+# Try to import qrcode for embedding the verification QR code in the DOCX
+try:
+    import qrcode
+    QRCODE_AVAILABLE = True
+except ImportError:
+    QRCODE_AVAILABLE = False
+    logger.warning("qrcode not available. Certificates will not carry a verification QR code.")
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-def convert_with_libreoffice(input_docx, output_pdf):
+# No endpoint accepts more than a full batch; larger bodies get 413 before being read
+app.config['MAX_CONTENT_LENGTH'] = request_schema.MAX_BATCH_BODY_BYTES
+
+# Issued certificates are kept here so they can be downloaded again by ID
+# (on Render this is the /app/static disk mount)
+OUTPUT_DIR = os.environ.get('CERTIFICATE_OUTPUT_DIR', 'static')
+
+# When set (e.g. "/protected-certificates/"), downloads are handed off to the
+# front proxy with an X-Accel-Redirect header instead of being streamed by Flask
+ACCEL_REDIRECT_PREFIX = os.environ.get('CERTIFICATE_ACCEL_REDIRECT_PREFIX')
+
+# How long browsers and proxies may cache a downloaded certificate (seconds)
+CERTIFICATE_MAX_AGE = int(os.environ.get('CERTIFICATE_MAX_AGE', 86400))
+
+# Namespace for deriving stable certificate IDs from the certificate contents
+CERTIFICATE_ID_NAMESPACE = uuid.UUID('6f1c2a52-8e0b-4b9a-9a53-2f5d0c7e4b11')
+CERTIFICATE_ID_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+# LibreOffice executables to try, in order. CERTIFICATE_LIBREOFFICE_COMMANDS
+# (os.pathsep-separated) overrides the list, e.g. to point at a specific install.
+LIBREOFFICE_COMMANDS = [
+    'libreoffice',
+    'soffice',
+    '/usr/bin/libreoffice',
+    '/usr/bin/soffice',
+    '/opt/libreoffice/program/soffice'
+]
+if os.environ.get('CERTIFICATE_LIBREOFFICE_COMMANDS'):
+    LIBREOFFICE_COMMANDS = os.environ['CERTIFICATE_LIBREOFFICE_COMMANDS'].split(os.pathsep)
+
+# Seconds a single LibreOffice attempt may run
+LIBREOFFICE_TIMEOUT = int(os.environ.get('CERTIFICATE_LIBREOFFICE_TIMEOUT', 30))
+
+# Output formats of /api/generate-certificate, in order of preference for "Accept: */*"
+FORMAT_MIMETYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'png': 'image/png',
+    'webp': 'image/webp'
+}
+PREVIEW_FORMATS = ('png', 'webp')
+
+# Text encoded in the verification QR code; "{id}" is replaced by the certificate ID
+# (e.g. "https://example.com/verify/{id}")
+VERIFY_URL_TEMPLATE = os.environ.get('CERTIFICATE_VERIFY_URL', '{id}')
+QR_CODE_SIZE_INCHES = 0.9
+
+# Upper bound on IDs accepted by the bulk verification endpoint
+MAX_BULK_VERIFY = int(os.environ.get('CERTIFICATE_MAX_BULK_VERIFY', 10000))
+
+# Where certificates are kept and how they are handed out ("bytes" streams the
+# file; "url" returns a short-lived signed download URL instead)
+storage = output_storage.create_storage()
+DELIVERY_MODE = os.environ.get('CERTIFICATE_DELIVERY', 'bytes').lower()
+DELIVERY_MODES = ('bytes', 'url')
+ARTIFACT_FILENAME_PATTERN = re.compile(
+    r'^certificate_([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(?:_preview)?\.(pdf|docx|png|webp)$'
+)
+
+# Conversions that may run at once in this process. Conversions of one process
+# share its LibreOffice profile, so this stays at 1; hosts with more CPUs and
+# memory run more workers instead (see host_sizing and gunicorn.conf.py).
+CONVERSION_SLOTS = int(os.environ.get('CERTIFICATE_CONVERSION_CONCURRENCY', 1))
+scheduler = ConversionScheduler(CONVERSION_SLOTS)
+
+# Reap converter processes left behind by crashed or killed workers
+supervisor.start_reaper()
+
+# Background batches go through a render -> convert pipeline (see render_pipeline):
+# threads rendering DOCX files, threads converting them in the bulk lane, and
+# the number of rendered certificates that may wait for a converter
+RENDER_WORKERS = int(os.environ.get('CERTIFICATE_RENDER_WORKERS', 1))
+CONVERT_WORKERS = int(os.environ.get('CERTIFICATE_CONVERT_WORKERS', CONVERSION_SLOTS))
+PIPELINE_QUEUE_SIZE = int(os.environ.get('CERTIFICATE_PIPELINE_QUEUE_SIZE', 2 * CONVERT_WORKERS))
+MAX_BATCH_SIZE = int(os.environ.get('CERTIFICATE_MAX_BATCH_SIZE', 1000))
+MAX_TRACKED_BATCHES = 100
+batches = OrderedDict()
+batches_lock = threading.Lock()
+
+# Merged (print-ready) PDFs kept in the output directory, most recent first
+MAX_MERGED_FILES = int(os.environ.get('CERTIFICATE_MAX_MERGED_FILES', 20))
+
+# Each worker process converts with its own LibreOffice profile, so several
+# gunicorn workers do not block on one profile's lock
+_profile_dir = None
+_profile_pid = None
+_profile_lock = threading.Lock()
+
+def libreoffice_profile():
+    """
+    This process's LibreOffice profile directory, created on first use
+    """
+    global _profile_dir, _profile_pid
+    with _profile_lock:
+        if _profile_pid != os.getpid():
+            _profile_dir = tempfile.mkdtemp(prefix='lo_profile_')
+            _profile_pid = os.getpid()
+            atexit.register(remove_libreoffice_profile, _profile_dir, _profile_pid)
+        return _profile_dir
+
+def remove_libreoffice_profile(profile_dir, owner_pid):
+    # Forked children inherit the handler but not the profile
+    if os.getpid() == owner_pid:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
+def convert_with_libreoffice(input_docx, output_pdf, cancel_token=None):
     """
     Alternative PDF conversion using LibreOffice headless mode
+    The converter runs under the supervisor (own process group, rlimits).
     Returns True if successful, False otherwise
+    Raises ConversionCancelled if cancel_token is cancelled mid-conversion
     """
     try:
-        logger.info(f"Attempting LibreOffice conversion: {input_docx} -> {output_pdf}")
+        logger.info("Attempting LibreOffice conversion: %s -> %s", input_docx, output_pdf)
 
         # Try different LibreOffice executable names
-        libreoffice_commands = [
-            'libreoffice',
-            'soffice',
-            '/usr/bin/libreoffice',
-            '/usr/bin/soffice',
-            '/opt/libreoffice/program/soffice'
-        ]
-
-        for cmd in libreoffice_commands:
+        for cmd in LIBREOFFICE_COMMANDS:
             try:
-                logger.info(f"Trying LibreOffice command: {cmd}")
-
-                # Run LibreOffice in headless mode to convert DOCX to PDF
-                result = subprocess.run([
-                    cmd,
-                    '--headless',
-                    '--convert-to', 'pdf',
-                    '--outdir', os.path.dirname(output_pdf) or '.',
-                    input_docx
-                ], capture_output=True, text=True, timeout=30)
-
-                logger.info(f"LibreOffice command result: return_code={result.returncode}")
-                if result.stdout:
-                    logger.info(f"LibreOffice stdout: {result.stdout}")
-                if result.stderr:
-                    logger.warning(f"LibreOffice stderr: {result.stderr}")
-
-                if result.returncode == 0:
-                    # LibreOffice creates PDF with same name as input but .pdf extension
-                    expected_pdf = os.path.splitext(input_docx)[0] + '.pdf'
-                    logger.info(f"Looking for generated PDF: {expected_pdf}")
-
-                    if os.path.exists(expected_pdf):
-                        logger.info(f"PDF generated successfully: {expected_pdf}")
-                        # Rename to desired output name if different
-                        if expected_pdf != output_pdf:
-                            logger.info(f"Renaming {expected_pdf} to {output_pdf}")
-                            os.rename(expected_pdf, output_pdf)
-                        return True
-                    else:
-                        logger.warning(f"Expected PDF not found: {expected_pdf}")
-                        # List files in current directory for debugging
-                        current_files = os.listdir('.')
-                        logger.info(f"Files in current directory: {current_files}")
+                logger.info("Trying LibreOffice command: %s", cmd, extra={"event": "libreoffice_attempt"})
+
+                with tracing.span('convert.libreoffice', command=cmd) as attempt:
+                    # Run LibreOffice in headless mode to convert DOCX to PDF
+                    returncode, stdout, stderr = supervisor.run([
+                        cmd,
+                        f'-env:UserInstallation=file://{libreoffice_profile()}',
+                        '--headless',
+                        '--convert-to', 'pdf',
+                        '--outdir', os.path.dirname(output_pdf) or '.',
+                        input_docx
+                    ], LIBREOFFICE_TIMEOUT, cancel_token)
+                    attempt.set('returncode', returncode)
+
+                    logger.info("LibreOffice command result: return_code=%s", returncode,
+                                extra={"event": "libreoffice_result", "returncode": returncode})
+                    if stdout:
+                        logger.debug("LibreOffice stdout: %s", bounded(stdout), extra={"event": "libreoffice_output"})
+                    if stderr:
+                        logger.warning("LibreOffice stderr: %s", bounded(stderr))
+
+                    if returncode == 0:
+                        # LibreOffice creates PDF with same name as input but .pdf extension
+                        expected_pdf = os.path.splitext(input_docx)[0] + '.pdf'
+                        if os.path.exists(expected_pdf):
+                            logger.info("PDF generated successfully: %s", expected_pdf)
+                            # Rename to desired output name if different
+                            if expected_pdf != output_pdf:
+                                os.rename(expected_pdf, output_pdf)
+                            return True
+                        else:
+                            # Only this conversion's own files, never the whole (possibly huge) output directory
+                            outdir = os.path.dirname(output_pdf) or '.'
+                            stem = os.path.splitext(os.path.basename(input_docx))[0]
+                            logger.warning("Expected PDF not found: %s (matching files: %s)",
+                                           expected_pdf, bounded_listing(outdir, stem))
 
             except subprocess.TimeoutExpired:
-                logger.warning(f"LibreOffice command timed out: {cmd}")
+                logger.warning("LibreOffice command timed out: %s", cmd)
                 continue
             except FileNotFoundError:
-                logger.warning(f"LibreOffice command not found: {cmd}")
+                logger.warning("LibreOffice command not found: %s", cmd, extra={"event": "libreoffice_missing"})
                 continue
 
         logger.error("All LibreOffice commands failed")
         return False
 
+    except ConversionCancelled:
+        raise
+
     except Exception as e:
-        logger.error(f"LibreOffice conversion error: {e}")
+        logger.error("LibreOffice conversion error: %s", e)
         return False
 
-def convert_with_reportlab(input_docx, output_pdf, name, domain, start_date, end_date, gender):
+def convert_with_reportlab(input_docx, output_pdf, name, domain, start_date, end_date, gender, certificate_id=None,
+                           issued_date=None):
     """
     Fallback PDF generation using reportlab
     Creates a simple certificate PDF when other methods fail
@@ -121,10 +262,11 @@ def convert_with_reportlab(input_docx, output_pdf, name, domain, start_date, end
         return False
 
     try:
-        logger.info(f"Creating fallback PDF with reportlab: {output_pdf}")
+        logger.info("Creating fallback PDF with reportlab: %s", output_pdf)
 
         # Create PDF document
-        doc = SimpleDocTemplate(output_pdf, pagesize=A4)
+        # invariant: fixed creation date and document ID, so the output is reproducible
+        doc = SimpleDocTemplate(output_pdf, pagesize=A4, invariant=int(deterministic_output.DETERMINISTIC))
         styles = getSampleStyleSheet()
         story = []
 
@@ -151,134 +293,469 @@ def convert_with_reportlab(input_docx, output_pdf, name, domain, start_date, end
         from {start_date} to {end_date}.<br/><br/>
         {he_she.capitalize()} has demonstrated proficiency in the subject matter
         and is hereby awarded this certificate.<br/><br/>
-        Issued on: {datetime.today().strftime('%B %d, %Y')}
+        Issued on: {issued_date or datetime.today().strftime('%B %d, %Y')}
         </para>
         """
 
         para = Paragraph(content, normal_style)
         story.append(para)
 
+        # Verification QR code
+        if certificate_id:
+            qr_size = QR_CODE_SIZE_INCHES * 72
+            qr_widget = QrCodeWidget(verification_payload(certificate_id))
+            x1, y1, x2, y2 = qr_widget.getBounds()
+            qr_drawing = Drawing(qr_size, qr_size, transform=[qr_size / (x2 - x1), 0, 0, qr_size / (y2 - y1), 0, 0])
+            qr_drawing.add(qr_widget)
+            story.append(Spacer(1, 20))
+            story.append(qr_drawing)
+
         # Build PDF
         doc.build(story)
 
-        logger.info(f"Fallback PDF created successfully: {output_pdf}")
+        logger.info("Fallback PDF created successfully: %s", output_pdf)
         return True
 
     except Exception as e:
-        logger.error(f"reportlab conversion error: {e}")
+        logger.error("reportlab conversion error: %s", e)
+        return False
+
+def certificate_id_for(name, domain, start_date, end_date, gender, issued_date):
+    """
+    Derive the stable ID of a certificate from its contents.
+    The same details issued on the same day always map to the same ID.
+    """
+    key = json.dumps([name, domain, start_date, end_date, gender.lower(), issued_date])
+    return str(uuid.uuid5(CERTIFICATE_ID_NAMESPACE, key))
+
+def certificate_path(certificate_id, output_format='pdf'):
+    """
+    Path of a cached certificate artifact (the issued PDF by default)
+    """
+    if output_format in PREVIEW_FORMATS:
+        return os.path.join(OUTPUT_DIR, f"certificate_{certificate_id}_preview.{output_format}")
+    return os.path.join(OUTPUT_DIR, f"certificate_{certificate_id}.{output_format}")
+
+def template_marker_path(certificate_id):
+    """
+    File recording the template version a certificate's artifacts were rendered from
+    """
+    return os.path.join(OUTPUT_DIR, f"certificate_{certificate_id}.template")
+
+def discard_stale_artifacts(certificate_id, template_version):
+    """
+    Remove a certificate's cached artifacts if they were rendered from another
+    template version, so they are rebuilt from the current template.
+    The certificate ID does not change. Returns True if anything was removed.
+    """
+    if template_version is None:
+        return False
+    marker = template_marker_path(certificate_id)
+    try:
+        with open(marker) as f:
+            if f.read().strip() == template_version:
+                return False
+    except FileNotFoundError:
+        pass
+
+    removed = False
+    for output_format in ('docx', 'pdf') + PREVIEW_FORMATS:
+        try:
+            os.remove(certificate_path(certificate_id, output_format))
+            removed = True
+        except FileNotFoundError:
+            pass
+    if removed:
+        logger.info("Discarded artifacts of certificate %s rendered from an older template", certificate_id,
+                    extra={"event": "stale_template", "certificate_id": certificate_id})
+    return removed
+
+def merge_certificates(certificate_ids):
+    """
+    One PDF with the pages of the issued certificates, in order, without re-converting them.
+    The result is cached until one of the certificates is re-rendered.
+    Returns the merged PDF's path; raises FileNotFoundError listing IDs that have no issued PDF.
+    """
+    pdf_paths = [certificate_path(certificate_id) for certificate_id in certificate_ids]
+    missing = [certificate_id for certificate_id, path in zip(certificate_ids, pdf_paths) if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"No issued PDF for certificates: {missing[:20]}")
+
+    key = hashlib.sha256()
+    for path in pdf_paths:
+        stat = os.stat(path)
+        key.update(f"{os.path.basename(path)}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+    merged_path = os.path.join(OUTPUT_DIR, f"merged_{key.hexdigest()[:32]}.pdf")
+    if os.path.exists(merged_path):
+        return merged_path
+
+    with tracing.span('merge', certificates=len(pdf_paths)):
+        pdf_merge.merge_pdfs(pdf_paths, merged_path)
+
+    # Keep only the most recent merged files
+    merged_files = sorted(
+        (entry for entry in os.scandir(OUTPUT_DIR) if entry.name.startswith('merged_') and entry.name.endswith('.pdf')),
+        key=lambda entry: entry.stat().st_mtime, reverse=True
+    )
+    for entry in merged_files[MAX_MERGED_FILES:]:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(entry.path)
+    return merged_path
+
+def send_merged(merged_path, download_name, count):
+    response = send_file(merged_path, as_attachment=True, download_name=download_name,
+                         mimetype=FORMAT_MIMETYPES['pdf'], conditional=True, max_age=CERTIFICATE_MAX_AGE)
+    response.headers['X-Certificate-Count'] = str(count)
+    return response
+
+def verification_payload(certificate_id):
+    """
+    Text encoded in a certificate's verification QR code
+    """
+    return VERIFY_URL_TEMPLATE.replace('{id}', certificate_id)
+
+def add_qr_code(doc, certificate_id):
+    """
+    Embed the verification QR code in the document.
+    Uses a {{QR Code}} placeholder when the template has one, otherwise the
+    first section's footer so the page layout is not disturbed.
+    """
+    if not QRCODE_AVAILABLE:
         return False
 
+    image = io.BytesIO()
+    qrcode.make(verification_payload(certificate_id), box_size=4, border=1).save(image)
+    image.seek(0)
+
+    target = None
+    for para in doc.paragraphs:
+        if "{{QR Code}}" in para.text:
+            para.text = para.text.replace("{{QR Code}}", "")
+            target = para
+            break
+
+    if target is None:
+        footer = doc.sections[0].footer
+        target = footer.paragraphs[0] if footer.paragraphs else footer.add_paragraph()
+
+    target.add_run().add_picture(image, width=Inches(QR_CODE_SIZE_INCHES))
+    return True
+
 def generate_certificate(name, domain, start_date, end_date, gender):
-    print("Name: ",name)
     """
     Generate a certificate with the provided details
     Returns the path to the generated PDF file
     """
+    certificate_id, pdf_path = issue_certificate(name, domain, start_date, end_date, gender)
+    return pdf_path
+
+def default_issued_date(name, domain, start_date, end_date, gender):
+    """
+    Issued date of a request that did not give one: the pre-generated
+    certificate's (so it is a cache hit on any later day), otherwise today
+    """
+    issued_date = certificate_registry.pregenerated_issued_date(name, domain, start_date, end_date, gender)
+    return issued_date or datetime.today().strftime('%B %d, %Y')
+
+def issue_certificate(name, domain, start_date, end_date, gender, output_format='pdf', lane=INTERACTIVE,
+                      cancel_token=None, issued_date=None):
+    """
+    Generate (or reuse) the certificate with the provided details in the
+    requested format: "docx", "pdf", or a "png"/"webp" preview.
+    Every format is cached, and each one is built from the cached artifact
+    before it (DOCX -> PDF -> preview) instead of starting over.
+    The PDF conversion waits for a slot in the given scheduler lane.
+    If cancel_token is cancelled (the client went away) the work stops at the
+    next stage and ConversionCancelled is raised.
+    issued_date ("March 31, 2024") defaults to the one the certificate was
+    pre-generated with, else today; supplying it makes the output
+    reproducible (byte-identical in deterministic mode).
+    Returns a (certificate_id, path) tuple
+    """
     try:
-        # === Pronoun mapping ===
-        pronouns = {"male": ("he", "him"), "female": ("she", "her"), "other": ("they", "them")}
-        he_she, him_her = pronouns.get(gender.lower(), ("they", "them"))
+        issued_date = issued_date or default_issued_date(name, domain, start_date, end_date, gender)
 
-        issued_date = datetime.today().strftime('%B %d, %Y')
-
-        # === Load and fill Word document ===
-        template_path = "SpectoV_Cert.docx"
-        if not os.path.exists(template_path):
-            raise FileNotFoundError(f"Certificate template not found: {template_path}")
-            
-        doc = Document(template_path)
-
-        # Replace placeholders in all paragraphs
-        for para in doc.paragraphs:
-            if "{{Domain}}" in para.text:
-                para.text = para.text.replace("{{Domain}}", domain)
-            if "{{Start Date}}" in para.text:
-                para.text = para.text.replace("{{Start Date}}", start_date)
-            if "{{End Date}}" in para.text:
-                para.text = para.text.replace("{{End Date}}", end_date)
-            if "{{he/she/they}}" in para.text:
-                para.text = para.text.replace("{{he/she/they}}", he_she)
-            if "{{him/her/them}}" in para.text:
-                para.text = para.text.replace("{{him/her/them}}", him_her)
-            if "{{Name}}" in para.text:
-                para.text = para.text.replace("{{Name}}", name)
-            if "ISSUED DATE :" in para.text:
-                para.text = para.text.replace("ISSUED DATE :", f"ISSUED DATE : {issued_date}")
-
-        # Also check tables for placeholders
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for para in cell.paragraphs:
-                        if "{{Domain}}" in para.text:
-                            para.text = para.text.replace("{{Domain}}", domain)
-                        if "{{Start Date}}" in para.text:
-                            para.text = para.text.replace("{{Start Date}}", start_date)
-                        if "{{End Date}}" in para.text:
-                            para.text = para.text.replace("{{End Date}}", end_date)
-                        if "{{he/she/they}}" in para.text:
-                            para.text = para.text.replace("{{he/she/they}}", he_she)
-                        if "{{him/her/them}}" in para.text:
-                            para.text = para.text.replace("{{him/her/them}}", him_her)
-                        if "{{Name}}" in para.text:
-                            para.text = para.text.replace("{{Name}}", name)
-                        if "ISSUED DATE :" in para.text:
-                            para.text = para.text.replace("ISSUED DATE :", f"ISSUED DATE : {issued_date}")
-
-        # === Generate unique filenames ===
-        unique_id = str(uuid.uuid4())
-        output_docx = f"temp_certificate_{unique_id}.docx"
-        output_pdf = f"certificate_{unique_id}.pdf"
-        
-        # === Save DOCX ===
-        doc.save(output_docx)
+        # === Reuse the already issued artifact if there is one ===
+        certificate_id = certificate_id_for(name, domain, start_date, end_date, gender, issued_date)
+        discard_stale_artifacts(certificate_id, template_registry.registry.version(domain))
+        final_path = certificate_path(certificate_id, output_format)
+        if os.path.exists(final_path):
+            logger.info("Certificate %s already issued, reusing %s", certificate_id, final_path,
+                        extra={"event": "cache_hit", "certificate_id": certificate_id})
+            return certificate_id, final_path
 
-        # === Convert to PDF ===
-        logger.info(f"Starting PDF conversion. docx2pdf available: {DOCX2PDF_AVAILABLE}")
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-        conversion_successful = False
+        if output_format in PREVIEW_FORMATS:
+            certificate_id, pdf_path = issue_certificate(name, domain, start_date, end_date, gender, 'pdf', lane,
+                                                         cancel_token, issued_date)
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled('previewing')
+            with tracing.span('preview', format=output_format):
+                if not certificate_preview.render_preview(pdf_path, final_path, output_format):
+                    raise Exception(f"Preview rendering failed for format: {output_format}")
+            return certificate_id, final_path
 
-        if DOCX2PDF_AVAILABLE:
-            try:
-                logger.info("Attempting conversion with docx2pdf")
-                convert(output_docx, output_pdf)
-                logger.info("docx2pdf conversion successful")
-                conversion_successful = True
-            except Exception as e:
-                logger.warning(f"docx2pdf conversion failed: {e}")
+        docx_path = certificate_path(certificate_id, 'docx')
+        if not os.path.exists(docx_path):
+            with tracing.span('render', certificate_id=certificate_id):
+                render_certificate_docx(name, domain, start_date, end_date, gender, issued_date, certificate_id, docx_path)
+                certificate_registry.record_certificate(certificate_id, name, domain, start_date, end_date, issued_date)
+
+        if output_format == 'docx':
+            return certificate_id, docx_path
+
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled('rendering')
+
+        # === Generate unique scratch filenames ===
+        # Concurrent requests for the same certificate each convert into their
+        # own scratch files; the finished PDF is moved into place atomically.
+        unique_id = uuid.uuid4().hex[:8]
+        output_docx = os.path.join(OUTPUT_DIR, f"temp_certificate_{certificate_id}_{unique_id}.docx")
+        output_pdf = os.path.join(OUTPUT_DIR, f"temp_certificate_{certificate_id}_{unique_id}.pdf")
+        queue_span = tracing.span('queue', lane=lane)
+        try:
+            shutil.copyfile(docx_path, output_docx)
 
-        # Try LibreOffice if docx2pdf failed or is not available
-        if not conversion_successful:
-            logger.info("Falling back to LibreOffice conversion")
-            if convert_with_libreoffice(output_docx, output_pdf):
-                logger.info("Successfully converted using LibreOffice")
-                conversion_successful = True
-            else:
-                logger.warning("LibreOffice conversion failed")
+            # === Convert to PDF (in a scheduler slot for this lane) ===
+            queue_span.start()
+            with scheduler.slot(lane, cancel_token=cancel_token):
+                queue_span.end()
+                logger.info("Starting PDF conversion. docx2pdf available: %s", DOCX2PDF_AVAILABLE)
 
-        # Try reportlab fallback if all else fails
-        if not conversion_successful:
-            logger.info("Falling back to reportlab PDF generation")
-            if convert_with_reportlab(output_docx, output_pdf, name, domain, start_date, end_date, gender):
-                logger.info("Successfully created PDF using reportlab fallback")
-                conversion_successful = True
-            else:
-                logger.error("All PDF conversion methods failed")
+                conversion_successful = False
 
-        if not conversion_successful:
-            raise Exception("PDF conversion failed. All methods (docx2pdf, LibreOffice, reportlab) failed.")
+                if DOCX2PDF_AVAILABLE:
+                    try:
+                        logger.info("Attempting conversion with docx2pdf")
+                        with tracing.span('convert.docx2pdf'):
+                            convert(output_docx, output_pdf)
+                        logger.info("docx2pdf conversion successful")
+                        conversion_successful = True
+                    except Exception as e:
+                        logger.warning("docx2pdf conversion failed: %s", e, extra={"event": "docx2pdf_failed"})
+
+                # Try LibreOffice if docx2pdf failed or is not available
+                if not conversion_successful:
+                    logger.info("Falling back to LibreOffice conversion")
+                    if convert_with_libreoffice(output_docx, output_pdf, cancel_token):
+                        logger.info("Successfully converted using LibreOffice")
+                        conversion_successful = True
+                    else:
+                        logger.warning("LibreOffice conversion failed")
+
+                # Try reportlab fallback if all else fails
+                if not conversion_successful:
+                    logger.info("Falling back to reportlab PDF generation")
+                    with tracing.span('convert.reportlab'):
+                        converted = convert_with_reportlab(output_docx, output_pdf, name, domain, start_date, end_date,
+                                                           gender, certificate_id=certificate_id,
+                                                           issued_date=issued_date)
+                    if converted:
+                        logger.info("Successfully created PDF using reportlab fallback")
+                        conversion_successful = True
+                    else:
+                        logger.error("All PDF conversion methods failed")
 
-        # Clean up the temporary DOCX file
-        if os.path.exists(output_docx):
-            os.remove(output_docx)
+            if not conversion_successful:
+                raise Exception("PDF conversion failed. All methods (docx2pdf, LibreOffice, reportlab) failed.")
 
-        print("Returning PDF")
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled('optimizing')
 
-        return output_pdf
+            # === Pin dates and IDs so the same request yields the same bytes ===
+            if deterministic_output.DETERMINISTIC:
+                with tracing.span('normalize'):
+                    deterministic_output.normalize_pdf(output_pdf, issued_date)
+
+            # === Optional size optimization (fonts, images, streams, linearization) ===
+            if pdf_optimizer.OPTIMIZE_PDF:
+                with tracing.span('optimize') as optimize_span:
+                    # Size and CPU cost of this certificate's optimization, exported with its trace
+                    optimization = pdf_optimizer.optimize_pdf(output_pdf, certificate_id)
+                    for key, value in (optimization or {}).items():
+                        optimize_span.set(f'pdf.{key}', value)
+
+            # === Optional signature (tamper evidence): always the last change to the file ===
+            if pdf_signing.enabled():
+                with tracing.span('sign'):
+                    signing_time = deterministic_output.pdf_date(issued_date) if deterministic_output.DETERMINISTIC else None
+                    pdf_signing.sign(output_pdf, signing_time)
+
+            os.replace(output_pdf, final_path)
+            logger.info("Issued certificate %s: %s", certificate_id, final_path,
+                        extra={"event": "issued", "certificate_id": certificate_id})
+        finally:
+            # No-op unless the wait for a slot was interrupted
+            queue_span.end()
+            # Scratch files never outlive the request, whether it succeeded, failed or was cancelled
+            for scratch in (output_docx, output_pdf):
+                if os.path.exists(scratch):
+                    os.remove(scratch)
+
+        return certificate_id, final_path
+
+    except ConversionCancelled:
+        raise
 
     except Exception as e:
         raise Exception(f"Error generating certificate: {str(e)}")
 
+def render_certificate_docx(name, domain, start_date, end_date, gender, issued_date, certificate_id, docx_path):
+    """
+    Fill the Word template for one certificate and save it to docx_path
+    """
+    # === Pronoun mapping ===
+    pronouns = {"male": ("he", "him"), "female": ("she", "her"), "other": ("they", "them")}
+    he_she, him_her = pronouns.get(gender.lower(), ("they", "them"))
+
+    # === Load and fill Word document (this domain's template) ===
+    template = template_registry.registry.get(domain)
+    doc = template.document()
+
+    # Replace placeholders in all paragraphs
+    for para in doc.paragraphs:
+        if "{{Domain}}" in para.text:
+            para.text = para.text.replace("{{Domain}}", domain)
+        if "{{Start Date}}" in para.text:
+            para.text = para.text.replace("{{Start Date}}", start_date)
+        if "{{End Date}}" in para.text:
+            para.text = para.text.replace("{{End Date}}", end_date)
+        if "{{he/she/they}}" in para.text:
+            para.text = para.text.replace("{{he/she/they}}", he_she)
+        if "{{him/her/them}}" in para.text:
+            para.text = para.text.replace("{{him/her/them}}", him_her)
+        if "{{Name}}" in para.text:
+            para.text = para.text.replace("{{Name}}", name)
+        if "ISSUED DATE :" in para.text:
+            para.text = para.text.replace("ISSUED DATE :", f"ISSUED DATE : {issued_date}")
+
+    # Also check tables for placeholders
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                for para in cell.paragraphs:
+                    if "{{Domain}}" in para.text:
+                        para.text = para.text.replace("{{Domain}}", domain)
+                    if "{{Start Date}}" in para.text:
+                        para.text = para.text.replace("{{Start Date}}", start_date)
+                    if "{{End Date}}" in para.text:
+                        para.text = para.text.replace("{{End Date}}", end_date)
+                    if "{{he/she/they}}" in para.text:
+                        para.text = para.text.replace("{{he/she/they}}", he_she)
+                    if "{{him/her/them}}" in para.text:
+                        para.text = para.text.replace("{{him/her/them}}", him_her)
+                    if "{{Name}}" in para.text:
+                        para.text = para.text.replace("{{Name}}", name)
+                    if "ISSUED DATE :" in para.text:
+                        para.text = para.text.replace("ISSUED DATE :", f"ISSUED DATE : {issued_date}")
+
+    add_qr_code(doc, certificate_id)
+
+    if deterministic_output.DETERMINISTIC:
+        deterministic_output.set_core_properties(doc, issued_date)
+
+    # === Save DOCX (atomically, it is cached for later requests) ===
+    scratch_docx = f"{docx_path}.{uuid.uuid4().hex[:8]}.tmp"
+    with tracing.span('save'):
+        doc.save(scratch_docx)
+        if deterministic_output.DETERMINISTIC:
+            deterministic_output.normalize_docx(scratch_docx)
+        os.replace(scratch_docx, docx_path)
+    with open(template_marker_path(certificate_id), 'w') as f:
+        f.write(template.version)
+    return docx_path
+
+@app.before_request
+def start_request_trace():
+    """Open the request's root span, continuing the proxy's trace if it sent a traceparent"""
+    rule = request.url_rule.rule if request.url_rule else request.path
+    g.trace_span = tracing.request_span(
+        f"{request.method} {rule}", request.headers.get('traceparent'), method=request.method, path=request.path
+    ).start()
+
+@app.after_request
+def tag_request_trace(response):
+    trace_span = g.get('trace_span')
+    if trace_span is not None:
+        trace_span.set('status_code', response.status_code)
+        response.headers['X-Trace-Id'] = trace_span.trace_id
+    return response
+
+@app.teardown_request
+def finish_request_trace(error=None):
+    trace_span = g.pop('trace_span', None)
+    if trace_span is not None:
+        trace_span.end(error)
+
+@app.before_request
+def start_request_profile():
+    """Profile this request if it asked for it (diagnostics token) or was sampled"""
+    if diagnostics.should_profile(request.headers.get(diagnostics.PROFILE_HEADER)):
+        profile = diagnostics.RequestProfile(f"{request.method} {request.path}")
+        if profile.start():
+            g.profile = profile
+
+@app.after_request
+def finish_request_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.stop()
+        response.headers['X-Profile-Id'] = profile.profile_id
+    return response
+
+@app.teardown_request
+def abandon_request_profile(error=None):
+    # after_request does not run for unhandled exceptions; still write the profile
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.stop()
+
+@app.before_request
+def refuse_over_memory_limit():
+    """Refuse new work while this gunicorn worker is over its hard RSS limit (it is being replaced)"""
+    if request.endpoint != 'health_check' and not memory_guard.guard.admit():
+        response = jsonify({
+            "success": False,
+            "error": "Worker is over its memory limit and being replaced; retry shortly"
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(memory_guard.RETRY_AFTER_SECONDS)
+        response.headers['Connection'] = 'close'
+        return response
+
+@app.teardown_request
+def check_memory_after_request(error=None):
+    # Over the soft limit the worker is recycled once its in-flight requests are done
+    memory_guard.guard.after_request()
+
+def charge_rate_limit(cost):
+    """
+    Charge cost tokens to the calling client; returns a 429 response if its bucket is empty, else None
+    """
+    if not rate_limiter.enabled():
+        return None
+    decision = rate_limiter.limiter.charge(rate_limiter.client_key(request.headers, request.remote_addr), cost)
+    g.rate_limit = decision
+    if decision is None or decision.allowed:
+        return None
+    return jsonify({
+        "success": False,
+        "error": f"Rate limit exceeded; retry in {decision.retry_after} seconds"
+    }), 429
+
+@app.after_request
+def add_rate_limit_headers(response):
+    """RateLimit headers on every response: this request's charge, or the client's current bucket"""
+    if rate_limiter.enabled() and request.endpoint != 'health_check':
+        decision = g.pop('rate_limit', None)
+        if decision is None:
+            decision = rate_limiter.limiter.peek(rate_limiter.client_key(request.headers, request.remote_addr))
+        if decision is not None:
+            response.headers.update(rate_limiter.headers(decision))
+    return response
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -287,7 +764,7 @@ def health_check():
         "service": "certificate-generator",
         "docx2pdf_available": DOCX2PDF_AVAILABLE,
         "reportlab_available": REPORTLAB_AVAILABLE,
-        "template_exists": os.path.exists("SpectoV_Cert.docx"),
+        "template_exists": os.path.exists(template_registry.registry.resolve()),
         "current_directory": os.getcwd(),
         "python_version": platform.python_version(),
         "platform": platform.system()
@@ -295,8 +772,7 @@ def health_check():
 
     # Check LibreOffice availability
     libreoffice_available = False
-    libreoffice_commands = ['libreoffice', 'soffice', '/usr/bin/libreoffice', '/usr/bin/soffice']
-    for cmd in libreoffice_commands:
+    for cmd in LIBREOFFICE_COMMANDS:
         try:
             result = subprocess.run([cmd, '--version'], capture_output=True, text=True, timeout=5)
             if result.returncode == 0:
@@ -306,9 +782,28 @@ def health_check():
             continue
 
     health_info["libreoffice_available"] = libreoffice_available
+    health_info["pdf_optimizer"] = pdf_optimizer.summary()
+    health_info["pdf_signing"] = pdf_signing.summary()
+    health_info["scheduler"] = scheduler.stats()
+    health_info["storage"] = storage.name
+    health_info["cancellation"] = cancellation.summary()
+    health_info["converter_supervisor"] = supervisor.stats()
+    health_info["templates"] = template_registry.registry.stats()
+    health_info["sizing"] = host_sizing.current()
+    health_info["memory_guard"] = memory_guard.guard.stats()
+    health_info["pipeline"] = bulk_pipeline.stats()
+    health_info["email_delivery"] = delivery_queue.stats()
+    health_info["rate_limit"] = rate_limiter.summary()
 
     return jsonify(health_info)
 
+def read_json_body(limit):
+    """
+    The request's JSON body, reading at most limit bytes (raises request_schema.ValidationError)
+    """
+    request_schema.check_content_length(request.content_length, limit)
+    return request_schema.parse_json_body(request.stream.read(limit + 1), limit)
+
 @app.route('/api/generate-certificate', methods=['POST'])
 def generate_certificate_api():
     """
@@ -319,71 +814,664 @@ def generate_certificate_api():
         "domain": "Web Development",
         "start_date": "January 1, 2024",
         "end_date": "March 31, 2024",
-        "gender": "male"  // optional, defaults to "other"
+        "gender": "male",          // optional, defaults to "other"
+        "format": "pdf",           // optional: pdf, docx, png or webp; otherwise taken from Accept
+        "priority": "interactive", // optional: scheduler lane, or the X-Certificate-Priority header
+        "delivery": "bytes",       // optional: "url" returns a signed download URL instead of the file
+        "issued_date": "2024-04-01" // optional: defaults to today; fixing it makes the output reproducible
     }
+    If the client disconnects while the certificate is being produced, the
+    conversion is abandoned and its converter process killed.
     """
+    cancel_token = CancellationToken()
+    stop_watching = watch_client_disconnect(request.environ, cancel_token)
     try:
-        # Get JSON data from request
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({
-                "success": False,
-                "error": "No JSON data provided"
-            }), 400
-        
-        # Extract required fields
-        name = data.get('name')
-        domain = data.get('domain')
-        start_date = data.get('start_date')
-        end_date = data.get('end_date')
-        gender = data.get('gender', 'other')
-        
-        # Validate required fields
-        if not all([name, domain, start_date, end_date]):
-            return jsonify({
-                "success": False,
-                "error": "Missing required fields: name, domain, start_date, end_date"
-            }), 400
-        
+        with tracing.span('parse'):
+            # Validate and normalize before any template or converter work
+            try:
+                data = read_json_body(request_schema.MAX_BODY_BYTES)
+                fields = request_schema.normalize_certificate(data, request_schema.OPTION_FIELDS)
+            except request_schema.ValidationError as e:
+                return jsonify({
+                    "success": False,
+                    "error": str(e)
+                }), e.status_code
+            name = fields['name']
+
+            output_format = negotiate_format(data.get('format'))
+            if output_format is None:
+                return jsonify({
+                    "success": False,
+                    "error": f"Unsupported format. Use one of: {', '.join(FORMAT_MIMETYPES)}"
+                }), 406
+
+            lane = data.get('priority') or request.headers.get('X-Certificate-Priority', INTERACTIVE)
+            if lane not in LANE_WEIGHTS:
+                return jsonify({
+                    "success": False,
+                    "error": f"Unknown priority. Use one of: {', '.join(LANE_WEIGHTS)}"
+                }), 400
+
+            delivery = str(data.get('delivery', DELIVERY_MODE)).lower()
+            if delivery not in DELIVERY_MODES:
+                return jsonify({
+                    "success": False,
+                    "error": f"Unknown delivery. Use one of: {', '.join(DELIVERY_MODES)}"
+                }), 400
+
+        # Charged once the request is known to be valid, before any work
+        limited = charge_rate_limit(rate_limiter.request_cost(output_format))
+        if limited is not None:
+            return limited
+
         # Generate certificate
-        pdf_path = generate_certificate(name, domain, start_date, end_date, gender)
-        
-        # Return the PDF file
-        return send_file(
-            pdf_path,
-            as_attachment=True,
-            download_name=f"certificate_{name.replace(' ', '_')}.pdf",
-            mimetype='application/pdf'
+        certificate_id, output_path = issue_certificate(
+            name, fields['domain'], fields['start_date'], fields['end_date'], fields['gender'], output_format, lane,
+            cancel_token, fields['issued_date']
         )
+
+        with tracing.span('send', delivery=delivery, format=output_format):
+            if delivery == 'url':
+                download_url, expires = storage.signed_url(output_path)
+                return jsonify({
+                    "success": True,
+                    "certificate_id": certificate_id,
+                    "format": output_format,
+                    "download_url": download_url,
+                    "expires_at": expires
+                })
+
+            # Return the certificate file
+            return send_certificate(
+                certificate_id,
+                output_path,
+                f"certificate_{name.replace(' ', '_')}.{output_format}",
+                output_format
+            )
         
     except FileNotFoundError as e:
         return jsonify({
             "success": False,
             "error": str(e)
         }), 404
+
+    except ConversionCancelled as e:
+        # Nobody is listening any more; 499 (client closed request) keeps it out of the 5xx error rate
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 499
         
     except Exception as e:
         return jsonify({
             "success": False,
             "error": str(e)
         }), 500
-    
+
     finally:
-        # Clean up generated PDF file after sending
+        stop_watching()
+
+def render_stage(job):
+    """
+    Pipeline stage 1: render (or reuse) the certificate's DOCX
+    """
+    fields, output_format = job
+    issue_certificate(fields['name'], fields['domain'], fields['start_date'], fields['end_date'],
+                      fields['gender'], 'docx', BULK, issued_date=fields['issued_date'])
+    return job
+
+def convert_stage(job):
+    """
+    Pipeline stage 2: build the requested format from the cached DOCX and store it
+    Returns (certificate_id, path)
+    """
+    fields, output_format = job
+    certificate_id, output_path = issue_certificate(
+        fields['name'], fields['domain'], fields['start_date'], fields['end_date'],
+        fields['gender'], output_format, BULK, issued_date=fields['issued_date']
+    )
+    storage.store(output_path)
+    return certificate_id, output_path
+
+bulk_pipeline = render_pipeline.StagedPipeline(
+    [('render', render_stage, RENDER_WORKERS), ('convert', convert_stage, CONVERT_WORKERS)],
+    PIPELINE_QUEUE_SIZE
+)
+
+def delivery_attachment(certificate_id, output_format):
+    """
+    The issued file an email delivery attaches (None if it is not on this disk)
+    """
+    path = certificate_path(certificate_id, output_format)
+    return path if os.path.exists(path) else None
+
+delivery_queue = email_delivery.DeliveryQueue(email_delivery.Outbox(email_delivery.OUTBOX_PATH), delivery_attachment)
+# Deliveries a previous worker left in the outbox are picked up again
+delivery_queue.start()
+
+def plan_deliveries(entries):
+    """
+    Validate delivery requests for issued certificates
+    ([{"certificate_id": ..., "email": ..., "format": "pdf"}, ...])
+    Returns (deliveries ready for the queue, {index: error} of the first invalid ones)
+    """
+    deliveries = []
+    invalid = {}
+    for index, entry in enumerate(entries):
         try:
-            if 'pdf_path' in locals() and os.path.exists(pdf_path):
-                # Schedule cleanup after response is sent
-                @app.after_request
-                def cleanup_file(response):
-                    try:
-                        if os.path.exists(pdf_path):
-                            os.remove(pdf_path)
-                    except:
-                        pass  # Ignore cleanup errors
-                    return response
-        except:
-            pass  # Ignore cleanup errors
+            if not isinstance(entry, dict):
+                raise request_schema.ValidationError("Expected a JSON object")
+            unknown = sorted(set(entry) - {'certificate_id', 'email', 'format'})
+            if unknown:
+                raise request_schema.ValidationError(f"Unknown fields: {', '.join(map(str, unknown[:10]))}")
+            certificate_id = entry.get('certificate_id')
+            if not isinstance(certificate_id, str) or not CERTIFICATE_ID_PATTERN.match(certificate_id):
+                raise request_schema.ValidationError("Invalid certificate_id")
+            output_format = str(entry.get('format', 'pdf')).lower()
+            if output_format not in FORMAT_MIMETYPES:
+                raise request_schema.ValidationError(f"Unsupported format. Use one of: {', '.join(FORMAT_MIMETYPES)}")
+            recipient = request_schema.normalize_email(entry.get('email'))
+            record = certificate_registry.lookup_certificate(certificate_id)
+            if record is None or delivery_attachment(certificate_id, output_format) is None:
+                raise request_schema.ValidationError(f"Certificate not issued as {output_format}: {certificate_id}")
+        except request_schema.ValidationError as e:
+            if len(invalid) < 20:
+                invalid[index] = str(e)
+            continue
+        deliveries.append({
+            "certificate_id": certificate_id,
+            "format": output_format,
+            "recipient": recipient,
+            "name": record["name"],
+            "domain": record["domain"]
+        })
+    return deliveries, invalid
+
+@app.route('/api/generate-certificates', methods=['POST'])
+def generate_certificates_batch_api():
+    """
+    Queue a batch of certificates in the bulk lane
+    Expected JSON payload:
+    {
+        "certificates": [{"name": ..., "domain": ..., "start_date": ..., "end_date": ..., "gender": ...,
+                          "issued_date": ...}, ...],
+        "format": "pdf",        // optional
+        "issued_date": "..."    // optional default for entries without their own
+    }
+    Entries may also carry an "email": the certificate is then queued for
+    email delivery as soon as it is issued.
+    Returns 202 with a batch ID; progress is at /api/batches/<batch_id>, and a
+    finished PDF batch can be fetched as one print-ready PDF from
+    /api/batches/<batch_id>/merged
+    """
+    try:
+        data = read_json_body(request_schema.MAX_BATCH_BODY_BYTES)
+    except request_schema.ValidationError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), e.status_code
+    entries = data.get('certificates') if isinstance(data, dict) else None
+
+    if not isinstance(entries, list) or not entries:
+        return jsonify({
+            "success": False,
+            "error": "Expected a JSON body with a non-empty 'certificates' list"
+        }), 400
+
+    if len(entries) > MAX_BATCH_SIZE:
+        return jsonify({
+            "success": False,
+            "error": f"Too many certificates: at most {MAX_BATCH_SIZE} per batch"
+        }), 413
+
+    # Every entry is validated up front; entries may carry their own issued_date,
+    # the batch-level one is the default
+    certificates, invalid = request_schema.normalize_batch(entries, data.get('issued_date'))
+    if invalid:
+        return jsonify({
+            "success": False,
+            "error": f"Invalid entries: {sorted(invalid)}",
+            "details": {str(index): error for index, error in invalid.items()}
+        }), 400
+
+    output_format = str(data.get('format', 'pdf')).lower()
+    if output_format not in FORMAT_MIMETYPES:
+        return jsonify({
+            "success": False,
+            "error": f"Unsupported format. Use one of: {', '.join(FORMAT_MIMETYPES)}"
+        }), 406
+
+    if not delivery_queue.enabled and any(entry['email'] for entry in certificates):
+        return jsonify({
+            "success": False,
+            "error": "Email delivery is not configured"
+        }), 503
+
+    limited = charge_rate_limit(rate_limiter.request_cost(output_format, len(certificates)))
+    if limited is not None:
+        return limited
+
+    batch_id = str(uuid.uuid4())
+    batch = {
+        "batch_id": batch_id,
+        "status": "queued",
+        "format": output_format,
+        "total": len(entries),
+        "completed": 0,
+        "failed": 0,
+        "certificates": [None] * len(entries)
+    }
+    with batches_lock:
+        batches[batch_id] = batch
+        while len(batches) > MAX_TRACKED_BATCHES:
+            batches.popitem(last=False)
+
+    def record_entry(index, future):
+        try:
+            certificate_id, output_path = future.result()
+            result = {
+                "certificate_id": certificate_id,
+                "url": f"/api/certificates/{certificate_id}?format={output_format}"
+            }
+        except Exception as e:
+            result = {"error": str(e)}
+
+        # Queueing the email is one outbox insert; sending happens on the delivery threads
+        fields = certificates[index]
+        if fields['email'] and "certificate_id" in result:
+            try:
+                result["delivery_id"], = delivery_queue.enqueue([{
+                    "certificate_id": result["certificate_id"],
+                    "format": output_format,
+                    "recipient": fields['email'],
+                    "name": fields['name'],
+                    "domain": fields['domain']
+                }])
+            except Exception as e:
+                logger.error("Cannot queue the email for %s: %s", result["certificate_id"], e,
+                             extra={"event": "email_queue_failed", "certificate_id": result["certificate_id"]})
+                result["delivery_error"] = str(e)
+
+        with batches_lock:
+            batch["certificates"][index] = result
+            batch["failed" if "error" in result else "completed"] += 1
+            batch["status"] = "done" if batch["completed"] + batch["failed"] == batch["total"] else "running"
+
+    for index, entry in enumerate(certificates):
+        future = bulk_pipeline.submit((entry, output_format))
+        future.add_done_callback(lambda future, index=index: record_entry(index, future))
+
+    return jsonify({
+        "success": True,
+        "batch_id": batch_id,
+        "status_url": f"/api/batches/{batch_id}"
+    }), 202
+
+@app.route('/api/batches/<batch_id>', methods=['GET'])
+def get_batch_api(batch_id):
+    """
+    Progress of a queued batch
+    """
+    with batches_lock:
+        batch = batches.get(batch_id)
+        snapshot = dict(batch, certificates=list(batch["certificates"])) if batch else None
+
+    if snapshot is None:
+        return jsonify({
+            "success": False,
+            "error": f"Batch not found: {batch_id}"
+        }), 404
+
+    return jsonify(dict(snapshot, success=True))
+
+@app.route('/api/batches/<batch_id>/merged', methods=['GET'])
+def get_batch_merged_api(batch_id):
+    """
+    All PDFs of a finished batch as one print-ready PDF (failed entries are left out)
+    """
+    with batches_lock:
+        batch = batches.get(batch_id)
+        snapshot = dict(batch, certificates=list(batch["certificates"])) if batch else None
+
+    if snapshot is None:
+        return jsonify({
+            "success": False,
+            "error": f"Batch not found: {batch_id}"
+        }), 404
+
+    if snapshot["status"] != "done" or snapshot.get("format", "pdf") != "pdf":
+        return jsonify({
+            "success": False,
+            "error": "Only finished PDF batches can be merged"
+        }), 409
+
+    certificate_ids = [entry["certificate_id"] for entry in snapshot["certificates"] if "certificate_id" in entry]
+    if not certificate_ids:
+        return jsonify({
+            "success": False,
+            "error": "No certificate of this batch was issued"
+        }), 404
+
+    try:
+        merged_path = merge_certificates(certificate_ids)
+    except FileNotFoundError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"success": False, "error": f"Error merging certificates: {str(e)}"}), 500
+
+    return send_merged(merged_path, f"batch_{batch_id}.pdf", len(certificate_ids))
+
+@app.route('/api/deliveries', methods=['POST'])
+def queue_deliveries_api():
+    """
+    Queue already issued certificates for email delivery
+    Expected JSON payload:
+    {
+        "deliveries": [{"certificate_id": ..., "email": ..., "format": "pdf"}, ...]
+    }
+    Returns 202 with one delivery ID per entry; each one's progress is at
+    /api/deliveries/<delivery_id>
+    """
+    if not delivery_queue.enabled:
+        return jsonify({
+            "success": False,
+            "error": "Email delivery is not configured"
+        }), 503
+
+    try:
+        data = read_json_body(request_schema.MAX_BATCH_BODY_BYTES)
+    except request_schema.ValidationError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), e.status_code
+    entries = data.get('deliveries') if isinstance(data, dict) else None
+
+    if not isinstance(entries, list) or not entries:
+        return jsonify({
+            "success": False,
+            "error": "Expected a JSON body with a non-empty 'deliveries' list"
+        }), 400
+
+    if len(entries) > MAX_BATCH_SIZE:
+        return jsonify({
+            "success": False,
+            "error": f"Too many deliveries: at most {MAX_BATCH_SIZE} per request"
+        }), 413
+
+    deliveries, invalid = plan_deliveries(entries)
+    if invalid:
+        return jsonify({
+            "success": False,
+            "error": f"Invalid entries: {sorted(invalid)}",
+            "details": {str(index): error for index, error in invalid.items()}
+        }), 400
+
+    delivery_ids = delivery_queue.enqueue(deliveries)
+    return jsonify({
+        "success": True,
+        "deliveries": [{
+            "delivery_id": delivery_id,
+            "certificate_id": delivery["certificate_id"],
+            "status_url": f"/api/deliveries/{delivery_id}"
+        } for delivery_id, delivery in zip(delivery_ids, deliveries)]
+    }), 202
+
+@app.route('/api/deliveries/<delivery_id>', methods=['GET'])
+def get_delivery_api(delivery_id):
+    """
+    Status of a queued email delivery
+    """
+    delivery = delivery_queue.status(delivery_id)
+    if delivery is None:
+        return jsonify({
+            "success": False,
+            "error": f"Delivery not found: {delivery_id}"
+        }), 404
+
+    return jsonify(dict(delivery, success=True))
+
+@app.route('/api/certificates/merge', methods=['POST'])
+def merge_certificates_api():
+    """
+    Previously issued certificates as one print-ready PDF, in the given order
+    Expected JSON payload:
+    {
+        "ids": ["<certificate id>", ...]
+    }
+    """
+    try:
+        data = read_json_body(request_schema.MAX_BATCH_BODY_BYTES)
+    except request_schema.ValidationError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), e.status_code
+    certificate_ids = data.get('ids') if isinstance(data, dict) else None
+
+    if not isinstance(certificate_ids, list) or not certificate_ids or \
+            not all(isinstance(i, str) and CERTIFICATE_ID_PATTERN.match(i) for i in certificate_ids):
+        return jsonify({
+            "success": False,
+            "error": "Expected a JSON body with a non-empty 'ids' list of certificate IDs"
+        }), 400
+
+    if len(certificate_ids) > MAX_BATCH_SIZE:
+        return jsonify({
+            "success": False,
+            "error": f"Too many certificates: at most {MAX_BATCH_SIZE} per merge"
+        }), 413
+
+    try:
+        merged_path = merge_certificates(certificate_ids)
+    except FileNotFoundError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"success": False, "error": f"Error merging certificates: {str(e)}"}), 500
+
+    return send_merged(merged_path, "certificates.pdf", len(certificate_ids))
+
+@app.route('/api/certificates/<certificate_id>', methods=['GET'])
+def get_certificate_api(certificate_id):
+    """
+    Download a previously issued certificate by its ID.
+    The format is negotiated like on /api/generate-certificate (?format=...).
+    Supports If-None-Match / If-Modified-Since (304) and Range (206) requests.
+    """
+    if not CERTIFICATE_ID_PATTERN.match(certificate_id):
+        return jsonify({
+            "success": False,
+            "error": "Invalid certificate ID"
+        }), 400
+
+    output_format = negotiate_format(request.args.get('format'))
+    if output_format is None:
+        return jsonify({
+            "success": False,
+            "error": f"Unsupported format. Use one of: {', '.join(FORMAT_MIMETYPES)}"
+        }), 406
+
+    output_path = certificate_path(certificate_id, output_format)
+    pdf_path = certificate_path(certificate_id)
+    if not os.path.exists(output_path) and output_format in PREVIEW_FORMATS and os.path.exists(pdf_path):
+        certificate_preview.render_preview(pdf_path, output_path, output_format)
+
+    if not os.path.exists(output_path):
+        return jsonify({
+            "success": False,
+            "error": f"Certificate not found: {certificate_id}"
+        }), 404
+
+    return send_certificate(certificate_id, output_path, f"certificate_{certificate_id}.{output_format}", output_format)
+
+@app.route('/api/downloads/<filename>', methods=['GET'])
+def signed_download_api(filename):
+    """
+    Download through a signed URL handed out in "url" delivery mode
+    """
+    match = ARTIFACT_FILENAME_PATTERN.match(filename)
+    if not match or not storage.verify(filename, request.args.get('expires'), request.args.get('signature')):
+        return jsonify({
+            "success": False,
+            "error": "Invalid or expired download link"
+        }), 403
+
+    certificate_id, output_format = match.groups()
+    output_path = os.path.join(OUTPUT_DIR, filename)
+    if not os.path.exists(output_path):
+        return jsonify({
+            "success": False,
+            "error": f"Certificate not found: {certificate_id}"
+        }), 404
+
+    return send_certificate(certificate_id, output_path, filename, output_format)
+
+@app.route('/api/verify/<certificate_id>', methods=['GET'])
+def verify_certificate_api(certificate_id):
+    """
+    Verify a single certificate ID (e.g. scanned from its QR code)
+    """
+    record = None
+    if CERTIFICATE_ID_PATTERN.match(certificate_id):
+        record = certificate_registry.lookup_certificate(certificate_id)
+
+    if record is None:
+        return jsonify({
+            "success": True,
+            "valid": False,
+            "certificate_id": certificate_id
+        }), 404
+
+    return jsonify({
+        "success": True,
+        "valid": True,
+        "certificate_id": certificate_id,
+        "certificate": record
+    })
+
+@app.route('/api/verify', methods=['POST'])
+def verify_certificates_bulk_api():
+    """
+    Verify many certificate IDs in one call
+    Expected JSON payload:
+    {
+        "ids": ["<certificate id>", ...]
+    }
+    """
+    try:
+        data = read_json_body(request_schema.MAX_BATCH_BODY_BYTES)
+    except request_schema.ValidationError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), e.status_code
+    certificate_ids = data.get('ids') if isinstance(data, dict) else None
+
+    if not isinstance(certificate_ids, list) or not all(isinstance(i, str) for i in certificate_ids):
+        return jsonify({
+            "success": False,
+            "error": "Expected a JSON body with an 'ids' list of strings"
+        }), 400
+
+    if len(certificate_ids) > MAX_BULK_VERIFY:
+        return jsonify({
+            "success": False,
+            "error": f"Too many IDs: at most {MAX_BULK_VERIFY} per request"
+        }), 413
+
+    well_formed = [i for i in certificate_ids if CERTIFICATE_ID_PATTERN.match(i)]
+    records = certificate_registry.lookup_certificates(well_formed)
+    results = {certificate_id: records.get(certificate_id) for certificate_id in certificate_ids}
+
+    return jsonify({
+        "success": True,
+        "valid_count": sum(1 for record in results.values() if record),
+        "invalid_count": sum(1 for record in results.values() if not record),
+        "results": results
+    })
+
+def negotiate_format(requested_format=None):
+    """
+    Pick the output format from an explicit format parameter, falling back to
+    the request's Accept header. Returns None if nothing acceptable is supported.
+    """
+    if requested_format:
+        requested_format = str(requested_format).lower()
+        return requested_format if requested_format in FORMAT_MIMETYPES else None
+
+    best_mimetype = request.accept_mimetypes.best_match(list(FORMAT_MIMETYPES.values()))
+    if best_mimetype is None:
+        return 'pdf' if not request.accept_mimetypes else None
+    return next(fmt for fmt, mimetype in FORMAT_MIMETYPES.items() if mimetype == best_mimetype)
+
+def send_certificate(certificate_id, output_path, download_name, output_format='pdf'):
+    """
+    Send an issued certificate with caching validators.
+    Flask handles ETag/Last-Modified/Range; the body itself goes out through the
+    WSGI file wrapper (sendfile under gunicorn) or, when configured, is handed
+    off to the front proxy with X-Accel-Redirect.
+    Previews are sent inline so they can be shown in an <img> tag.
+    """
+    mimetype = FORMAT_MIMETYPES[output_format]
+    disposition = 'inline' if output_format in PREVIEW_FORMATS else 'attachment'
+
+    if ACCEL_REDIRECT_PREFIX:
+        response = app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + os.path.basename(output_path)
+        response.headers['Content-Disposition'] = f'{disposition}; filename="{download_name}"'
+    else:
+        response = send_file(
+            output_path,
+            as_attachment=disposition == 'attachment',
+            download_name=download_name,
+            mimetype=mimetype,
+            conditional=True,
+            max_age=CERTIFICATE_MAX_AGE
+        )
+    response.headers['X-Certificate-Id'] = certificate_id
+    response.headers['Content-Location'] = f"/api/certificates/{certificate_id}?format={output_format}"
+    response.vary.add('Accept')
+    return response
+
+def diagnostics_denied():
+    """
+    Error response if the request may not use the diagnostics endpoints, else None
+    """
+    if not diagnostics.enabled():
+        return jsonify({"success": False, "error": "Endpoint not found"}), 404
+    if not diagnostics.authorized(request.headers.get(diagnostics.TOKEN_HEADER)):
+        return jsonify({"success": False, "error": "Invalid diagnostics token"}), 403
+    return None
+
+@app.route('/api/diagnostics/memory', methods=['GET'])
+def memory_diagnostics_api():
+    """
+    Memory report: RSS, python-docx object counts and, while tracemalloc is on,
+    the top allocators and their growth since the previous report.
+    Query: ?limit=20, ?tracemalloc=start|stop
+    Requires the X-Diagnostics-Token header.
+    """
+    denied = diagnostics_denied()
+    if denied:
+        return denied
+
+    limit = request.args.get('limit', 20, type=int)
+    action = request.args.get('tracemalloc')
+    if action == 'stop':
+        diagnostics.stop_tracing()
+    return jsonify(diagnostics.memory_report(max(1, min(limit, 200)), start_tracing=action == 'start'))
+
+@app.route('/api/diagnostics/profiles', methods=['GET'])
+def profiles_diagnostics_api():
+    """
+    List the stored request profiles (newest first)
+    Requires the X-Diagnostics-Token header.
+    """
+    denied = diagnostics_denied()
+    if denied:
+        return denied
+    return jsonify({"directory": os.path.abspath(diagnostics.DIAGNOSTICS_DIR), "profiles": diagnostics.list_profiles()})
 
 @app.errorhandler(404)
 def not_found(error):
@@ -392,6 +1480,13 @@ def not_found(error):
         "error": "Endpoint not found"
     }), 404
 
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify({
+        "success": False,
+        "error": f"Request body too large: at most {app.config['MAX_CONTENT_LENGTH']} bytes"
+    }), 413
+
 @app.errorhandler(500)
 def internal_error(error):
     return jsonify({
@@ -401,10 +1496,10 @@ def internal_error(error):
 
 if __name__ == '__main__':
     # Check if template file exists
-    if not os.path.exists("SpectoV_Cert.docx"):
-        logger.warning("Certificate template 'SpectoV_Cert.docx' not found in current directory")
-        logger.info(f"Current working directory: {os.getcwd()}")
-        logger.info(f"Files in current directory: {os.listdir('.')}")
+    default_template = template_registry.registry.resolve()
+    if not os.path.exists(default_template):
+        logger.warning("Certificate template %s not found (.docx files in %s: %s)", default_template, os.getcwd(),
+                       [name for name in bounded_listing('.') if name.endswith('.docx')])
 
     logger.info("Starting Certificate Generation Service...")
 
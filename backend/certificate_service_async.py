@@ -0,0 +1,992 @@
+"""
+ASGI variant of the certificate service (Starlette)
+Exposes the same routes as certificate_service, but LibreOffice runs through
+asyncio.create_subprocess_exec with async timeouts, so one process keeps many
+conversions in flight (capped by CERTIFICATE_CONVERSION_CONCURRENCY) instead
+of blocking a whole worker per conversion. Template rendering, the reportlab
+fallback, optimization and previews are CPU-bound Python and run in threads.
+Request profiles (see diagnostics) cover the event loop thread, not that threaded work.
+
+Run with:
+    uvicorn certificate_service_async:app --host 0.0.0.0 --port 5001
+"""
+import os
+import time
+import uuid
+import shutil
+import signal
+import asyncio
+import logging
+import platform
+import tempfile
+import contextlib
+from email.utils import formatdate, parsedate_to_datetime
+
+from starlette.applications import Starlette
+from starlette.datastructures import Headers
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, FileResponse, Response
+from starlette.routing import Route
+
+import cancellation
+import certificate_service
+import diagnostics
+import tracing
+import certificate_preview
+from structured_logging import bounded, bounded_listing
+import certificate_registry
+import deterministic_output
+import request_schema
+import template_registry
+import host_sizing
+import memory_guard
+import pdf_optimizer
+import pdf_signing
+import rate_limiter
+from converter_supervisor import supervisor, kill_group
+from conversion_scheduler import AsyncConversionScheduler, LANE_WEIGHTS, INTERACTIVE, BULK
+from certificate_service import (
+    FORMAT_MIMETYPES,
+    PREVIEW_FORMATS,
+    CERTIFICATE_ID_PATTERN,
+    MAX_BULK_VERIFY,
+    MAX_BATCH_SIZE,
+    MAX_TRACKED_BATCHES,
+    DELIVERY_MODE,
+    DELIVERY_MODES,
+    ARTIFACT_FILENAME_PATTERN,
+    certificate_id_for,
+    certificate_path,
+    default_issued_date,
+    discard_stale_artifacts,
+    merge_certificates,
+    render_certificate_docx,
+    convert_with_reportlab
+)
+
+logger = logging.getLogger(__name__)
+
+# Conversions allowed to run at the same time in this process
+CONVERSION_CONCURRENCY = int(os.environ.get('CERTIFICATE_CONVERSION_CONCURRENCY', 4))
+
+scheduler = AsyncConversionScheduler(CONVERSION_CONCURRENCY)
+batches = {}
+_batch_tasks = set()
+_profile_dirs = None
+_conversion_stats = {
+    "in_flight": 0,
+    "completed": 0,
+    "timed_out": 0,
+    "failed": 0
+}
+
+def get_profile_dirs():
+    """
+    Pool of LibreOffice user profiles, one per conversion slot.
+    Concurrent soffice processes sharing a profile block on its lock file,
+    and creating a fresh profile per run costs seconds, so profiles are reused.
+    """
+    global _profile_dirs
+    if _profile_dirs is None:
+        _profile_dirs = asyncio.Queue()
+        for _ in range(CONVERSION_CONCURRENCY):
+            _profile_dirs.put_nowait(tempfile.mkdtemp(prefix='lo_profile_'))
+    return _profile_dirs
+
+async def kill_process_group(process):
+    """
+    Kill a converter together with the soffice.bin children it started
+    """
+    if not kill_group(process.pid):
+        process.kill()
+    await process.wait()
+
+async def convert_with_libreoffice_async(input_docx, output_pdf):
+    """
+    Convert DOCX to PDF with LibreOffice without blocking the event loop
+    If the calling task is cancelled, the LibreOffice process is killed.
+    Returns True if successful, False otherwise
+    """
+    profile_dirs = get_profile_dirs()
+    profile_dir = await profile_dirs.get()
+    try:
+        for cmd in certificate_service.LIBREOFFICE_COMMANDS:
+            logger.info("Trying LibreOffice command: %s", cmd, extra={"event": "libreoffice_attempt"})
+            with tracing.span('convert.libreoffice', command=cmd) as attempt:
+                try:
+                    command = supervisor.command([
+                        cmd,
+                        '--headless',
+                        f'-env:UserInstallation=file://{profile_dir}',
+                        '--convert-to', 'pdf',
+                        '--outdir', os.path.dirname(output_pdf) or '.',
+                        input_docx
+                    ])
+                except FileNotFoundError:
+                    logger.warning("LibreOffice command not found: %s", cmd, extra={"event": "libreoffice_missing"})
+                    continue
+                kwargs = supervisor.popen_kwargs()
+                try:
+                    process = await asyncio.create_subprocess_exec(
+                        *command,
+                        stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.PIPE,
+                        **kwargs
+                    )
+                except FileNotFoundError:
+                    supervisor.spawn_failed()
+                    logger.warning("LibreOffice command not found: %s", cmd, extra={"event": "libreoffice_missing"})
+                    continue
+                supervisor.register(process.pid)
+
+                started = time.monotonic()
+                try:
+                    stdout, stderr = await asyncio.wait_for(
+                        process.communicate(),
+                        timeout=certificate_service.LIBREOFFICE_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning("LibreOffice command timed out: %s", cmd)
+                    attempt.set('timed_out', True)
+                    _conversion_stats["timed_out"] += 1
+                    supervisor.record("timed_out")
+                    await kill_process_group(process)
+                    continue
+                except asyncio.CancelledError:
+                    await kill_process_group(process)
+                    supervisor.record("cancelled")
+                    cancellation.record_cancelled('converting', time.monotonic() - started)
+                    raise
+                finally:
+                    supervisor.release(process.pid)
+
+                attempt.set('returncode', process.returncode)
+                logger.info("LibreOffice command result: return_code=%s", process.returncode,
+                            extra={"event": "libreoffice_result", "returncode": process.returncode})
+                if stdout:
+                    logger.debug("LibreOffice stdout: %s", bounded(stdout.decode(errors='replace')),
+                                 extra={"event": "libreoffice_output"})
+                if stderr:
+                    logger.warning("LibreOffice stderr: %s", bounded(stderr.decode(errors='replace')))
+
+                if process.returncode == 0:
+                    expected_pdf = os.path.splitext(input_docx)[0] + '.pdf'
+                    if os.path.exists(expected_pdf):
+                        if expected_pdf != output_pdf:
+                            os.rename(expected_pdf, output_pdf)
+                        return True
+                    # Only this conversion's own files, never the whole (possibly huge) output directory
+                    outdir = os.path.dirname(output_pdf) or '.'
+                    stem = os.path.splitext(os.path.basename(input_docx))[0]
+                    logger.warning("Expected PDF not found: %s (matching files: %s)",
+                                   expected_pdf, bounded_listing(outdir, stem))
+
+        logger.error("All LibreOffice commands failed")
+        return False
+
+    finally:
+        profile_dirs.put_nowait(profile_dir)
+
+async def issue_certificate_async(name, domain, start_date, end_date, gender, output_format='pdf', lane=INTERACTIVE,
+                                  issued_date=None):
+    """
+    Async counterpart of certificate_service.issue_certificate
+    docx2pdf is not tried here: it needs Microsoft Word and blocks its thread.
+    Returns a (certificate_id, path) tuple
+    """
+    if not issued_date:
+        issued_date = await asyncio.to_thread(default_issued_date, name, domain, start_date, end_date, gender)
+    certificate_id = certificate_id_for(name, domain, start_date, end_date, gender, issued_date)
+    template_version = await asyncio.to_thread(template_registry.registry.version, domain)
+    await asyncio.to_thread(discard_stale_artifacts, certificate_id, template_version)
+    final_path = certificate_path(certificate_id, output_format)
+    if os.path.exists(final_path):
+        return certificate_id, final_path
+
+    os.makedirs(certificate_service.OUTPUT_DIR, exist_ok=True)
+
+    if output_format in PREVIEW_FORMATS:
+        certificate_id, pdf_path = await issue_certificate_async(name, domain, start_date, end_date, gender, 'pdf', lane,
+                                                                 issued_date)
+        with tracing.span('preview', format=output_format):
+            rendered = await asyncio.to_thread(certificate_preview.render_preview, pdf_path, final_path, output_format)
+        if not rendered:
+            raise Exception(f"Preview rendering failed for format: {output_format}")
+        return certificate_id, final_path
+
+    docx_path = certificate_path(certificate_id, 'docx')
+    if not os.path.exists(docx_path):
+        with tracing.span('render', certificate_id=certificate_id):
+            await asyncio.to_thread(
+                render_certificate_docx,
+                name, domain, start_date, end_date, gender, issued_date, certificate_id, docx_path
+            )
+            await asyncio.to_thread(
+                certificate_registry.record_certificate,
+                certificate_id, name, domain, start_date, end_date, issued_date
+            )
+
+    if output_format == 'docx':
+        return certificate_id, docx_path
+
+    unique_id = uuid.uuid4().hex[:8]
+    output_docx = os.path.join(certificate_service.OUTPUT_DIR, f"temp_certificate_{certificate_id}_{unique_id}.docx")
+    output_pdf = os.path.join(certificate_service.OUTPUT_DIR, f"temp_certificate_{certificate_id}_{unique_id}.pdf")
+    shutil.copyfile(docx_path, output_docx)
+
+    queue_span = tracing.span('queue', lane=lane)
+    try:
+        queue_span.start()
+        async with scheduler.slot(lane):
+            queue_span.end()
+            _conversion_stats["in_flight"] += 1
+            try:
+                converted = await convert_with_libreoffice_async(output_docx, output_pdf)
+            finally:
+                _conversion_stats["in_flight"] -= 1
+
+        if not converted:
+            logger.info("Falling back to reportlab PDF generation")
+            with tracing.span('convert.reportlab'):
+                converted = await asyncio.to_thread(
+                    convert_with_reportlab,
+                    output_docx, output_pdf, name, domain, start_date, end_date, gender,
+                    certificate_id=certificate_id, issued_date=issued_date
+                )
+
+        if not converted:
+            _conversion_stats["failed"] += 1
+            raise Exception("PDF conversion failed. All methods (LibreOffice, reportlab) failed.")
+
+        if deterministic_output.DETERMINISTIC:
+            with tracing.span('normalize'):
+                await asyncio.to_thread(deterministic_output.normalize_pdf, output_pdf, issued_date)
+
+        if pdf_optimizer.OPTIMIZE_PDF:
+            with tracing.span('optimize') as optimize_span:
+                optimization = await asyncio.to_thread(pdf_optimizer.optimize_pdf, output_pdf, certificate_id)
+                for key, value in (optimization or {}).items():
+                    optimize_span.set(f'pdf.{key}', value)
+
+        if pdf_signing.enabled():
+            with tracing.span('sign'):
+                signing_time = deterministic_output.pdf_date(issued_date) if deterministic_output.DETERMINISTIC else None
+                await asyncio.to_thread(pdf_signing.sign, output_pdf, signing_time)
+
+        os.replace(output_pdf, final_path)
+        _conversion_stats["completed"] += 1
+        return certificate_id, final_path
+
+    finally:
+        queue_span.end()
+        for scratch in (output_docx, output_pdf):
+            if os.path.exists(scratch):
+                os.remove(scratch)
+
+def negotiate_format(request, requested_format=None):
+    """
+    Pick the output format from an explicit format parameter, falling back to
+    the Accept header (same rules as certificate_service.negotiate_format)
+    """
+    if requested_format:
+        requested_format = str(requested_format).lower()
+        return requested_format if requested_format in FORMAT_MIMETYPES else None
+
+    accept = request.headers.get('accept')
+    if not accept:
+        return 'pdf'
+
+    accepted = []
+    for item in accept.split(','):
+        parts = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in parts[1:]:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        accepted.append((parts[0].lower(), quality))
+
+    best_format, best_quality = None, 0.0
+    for fmt, mimetype in FORMAT_MIMETYPES.items():
+        major = mimetype.split('/')[0]
+        for pattern, quality in accepted:
+            if pattern in (mimetype, f'{major}/*', '*/*') and quality > best_quality:
+                best_format, best_quality = fmt, quality
+    return best_format
+
+def error_response(message, status_code):
+    return JSONResponse({"success": False, "error": message}, status_code=status_code)
+
+def peer_address(scope):
+    client = scope.get('client')
+    return client[0] if client else None
+
+async def charge_rate_limit(request, cost):
+    """
+    Charge cost tokens to the calling client; returns a 429 response if its bucket is empty, else None
+    """
+    if not rate_limiter.enabled():
+        return None
+    client = rate_limiter.client_key(request.headers, peer_address(request.scope))
+    decision = await asyncio.to_thread(rate_limiter.limiter.charge, client, cost)
+    request.state.rate_limit = decision
+    if decision is None or decision.allowed:
+        return None
+    return error_response(f"Rate limit exceeded; retry in {decision.retry_after} seconds", 429)
+
+async def read_json_body(request, limit):
+    """
+    The request's JSON body, reading at most limit bytes (raises request_schema.ValidationError)
+    """
+    request_schema.check_content_length(request.headers.get('content-length'), limit)
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            break
+    return request_schema.parse_json_body(bytes(body), limit)
+
+def certificate_response(request, certificate_id, output_path, download_name, output_format='pdf'):
+    """
+    File response with ETag / Last-Modified validators, 304 handling and Range support
+    """
+    stat = os.stat(output_path)
+    etag = f'"{int(stat.st_mtime)}-{stat.st_size}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+        'Cache-Control': f'public, max-age={certificate_service.CERTIFICATE_MAX_AGE}',
+        'X-Certificate-Id': certificate_id,
+        'Content-Location': f"/api/certificates/{certificate_id}?format={output_format}",
+        'Vary': 'Accept'
+    }
+
+    if_none_match = request.headers.get('if-none-match')
+    if_modified_since = request.headers.get('if-modified-since')
+    not_modified = False
+    if if_none_match:
+        not_modified = etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    elif if_modified_since:
+        try:
+            not_modified = int(stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            not_modified = False
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    disposition = 'inline' if output_format in PREVIEW_FORMATS else 'attachment'
+    if certificate_service.ACCEL_REDIRECT_PREFIX:
+        headers['X-Accel-Redirect'] = (
+            certificate_service.ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + os.path.basename(output_path)
+        )
+        headers['Content-Disposition'] = f'{disposition}; filename="{download_name}"'
+        return Response(media_type=FORMAT_MIMETYPES[output_format], headers=headers)
+
+    return FileResponse(
+        output_path,
+        headers=headers,
+        media_type=FORMAT_MIMETYPES[output_format],
+        filename=download_name,
+        stat_result=stat,
+        content_disposition_type=disposition
+    )
+
+async def health_check(request):
+    """Health check endpoint"""
+    return JSONResponse({
+        "status": "healthy",
+        "service": "certificate-generator-async",
+        "reportlab_available": certificate_service.REPORTLAB_AVAILABLE,
+        "template_exists": os.path.exists(template_registry.registry.resolve()),
+        "python_version": platform.python_version(),
+        "platform": platform.system(),
+        "conversion_concurrency": CONVERSION_CONCURRENCY,
+        "conversions": dict(_conversion_stats),
+        "scheduler": scheduler.stats(),
+        "pdf_optimizer": pdf_optimizer.summary(),
+        "pdf_signing": pdf_signing.summary(),
+        "storage": certificate_service.storage.name,
+        "cancellation": cancellation.summary(),
+        "converter_supervisor": supervisor.stats(),
+        "templates": template_registry.registry.stats(),
+        "sizing": host_sizing.current(),
+        "memory_guard": memory_guard.guard.stats(),
+        "email_delivery": certificate_service.delivery_queue.stats(),
+        "rate_limit": rate_limiter.summary()
+    })
+
+async def run_while_connected(request, coroutine):
+    """
+    Run coroutine, cancelling it if the client disconnects first
+    Raises ConversionCancelled when the client went away.
+    """
+    task = asyncio.ensure_future(coroutine)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=cancellation.DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                raise cancellation.ConversionCancelled("Cancelled: client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
+
+async def generate_certificate_api(request):
+    """
+    API endpoint to generate certificate (same payload as the Flask service)
+    """
+    with tracing.span('parse'):
+        # Validate and normalize before any template or converter work
+        try:
+            data = await read_json_body(request, request_schema.MAX_BODY_BYTES)
+            fields = request_schema.normalize_certificate(data, request_schema.OPTION_FIELDS)
+        except request_schema.ValidationError as e:
+            return error_response(str(e), e.status_code)
+
+    output_format = negotiate_format(request, data.get('format'))
+    if output_format is None:
+        return error_response(f"Unsupported format. Use one of: {', '.join(FORMAT_MIMETYPES)}", 406)
+
+    lane = data.get('priority') or request.headers.get('x-certificate-priority', INTERACTIVE)
+    if lane not in LANE_WEIGHTS:
+        return error_response(f"Unknown priority. Use one of: {', '.join(LANE_WEIGHTS)}", 400)
+
+    delivery = str(data.get('delivery', DELIVERY_MODE)).lower()
+    if delivery not in DELIVERY_MODES:
+        return error_response(f"Unknown delivery. Use one of: {', '.join(DELIVERY_MODES)}", 400)
+
+    # Charged once the request is known to be valid, before any work
+    limited = await charge_rate_limit(request, rate_limiter.request_cost(output_format))
+    if limited is not None:
+        return limited
+
+    try:
+        certificate_id, output_path = await run_while_connected(request, issue_certificate_async(
+            fields['name'], fields['domain'], fields['start_date'], fields['end_date'], fields['gender'],
+            output_format, lane, fields['issued_date']
+        ))
+    except FileNotFoundError as e:
+        return error_response(str(e), 404)
+    except cancellation.ConversionCancelled as e:
+        return error_response(str(e), 499)
+    except Exception as e:
+        return error_response(f"Error generating certificate: {str(e)}", 500)
+
+    with tracing.span('send', delivery=delivery, format=output_format):
+        if delivery == 'url':
+            download_url, expires = await asyncio.to_thread(certificate_service.storage.signed_url, output_path)
+            return JSONResponse({
+                "success": True,
+                "certificate_id": certificate_id,
+                "format": output_format,
+                "download_url": download_url,
+                "expires_at": expires
+            })
+
+        return certificate_response(
+            request,
+            certificate_id,
+            output_path,
+            f"certificate_{fields['name'].replace(' ', '_')}.{output_format}",
+            output_format
+        )
+
+async def generate_certificates_batch_api(request):
+    """
+    Queue a batch of certificates in the bulk lane (same payload as the Flask service)
+    """
+    try:
+        data = await read_json_body(request, request_schema.MAX_BATCH_BODY_BYTES)
+    except request_schema.ValidationError as e:
+        return error_response(str(e), e.status_code)
+    entries = data.get('certificates') if isinstance(data, dict) else None
+
+    if not isinstance(entries, list) or not entries:
+        return error_response("Expected a JSON body with a non-empty 'certificates' list", 400)
+
+    if len(entries) > MAX_BATCH_SIZE:
+        return error_response(f"Too many certificates: at most {MAX_BATCH_SIZE} per batch", 413)
+
+    # Entries may carry their own issued_date; the batch-level one is the default
+    certificates, invalid = request_schema.normalize_batch(entries, data.get('issued_date'))
+    if invalid:
+        return JSONResponse({
+            "success": False,
+            "error": f"Invalid entries: {sorted(invalid)}",
+            "details": {str(index): error for index, error in invalid.items()}
+        }, status_code=400)
+
+    output_format = str(data.get('format', 'pdf')).lower()
+    if output_format not in FORMAT_MIMETYPES:
+        return error_response(f"Unsupported format. Use one of: {', '.join(FORMAT_MIMETYPES)}", 406)
+
+    delivery_queue = certificate_service.delivery_queue
+    if not delivery_queue.enabled and any(entry['email'] for entry in certificates):
+        return error_response("Email delivery is not configured", 503)
+
+    limited = await charge_rate_limit(request, rate_limiter.request_cost(output_format, len(certificates)))
+    if limited is not None:
+        return limited
+
+    batch_id = str(uuid.uuid4())
+    batch = {
+        "batch_id": batch_id,
+        "status": "queued",
+        "format": output_format,
+        "total": len(entries),
+        "completed": 0,
+        "failed": 0,
+        "certificates": [None] * len(entries)
+    }
+    batches[batch_id] = batch
+    while len(batches) > MAX_TRACKED_BATCHES:
+        batches.pop(next(iter(batches)))
+
+    async def run_entry(index, entry):
+        try:
+            certificate_id, output_path = await issue_certificate_async(
+                entry['name'], entry['domain'], entry['start_date'], entry['end_date'],
+                entry['gender'], output_format, BULK, entry['issued_date']
+            )
+            await asyncio.to_thread(certificate_service.storage.store, output_path)
+        except Exception as e:
+            batch["certificates"][index] = {"error": str(e)}
+            batch["failed"] += 1
+        else:
+            result = {
+                "certificate_id": certificate_id,
+                "url": f"/api/certificates/{certificate_id}?format={output_format}"
+            }
+            if entry['email']:
+                try:
+                    result["delivery_id"], = await asyncio.to_thread(delivery_queue.enqueue, [{
+                        "certificate_id": certificate_id,
+                        "format": output_format,
+                        "recipient": entry['email'],
+                        "name": entry['name'],
+                        "domain": entry['domain']
+                    }])
+                except Exception as e:
+                    logger.error("Cannot queue the email for %s: %s", certificate_id, e,
+                                 extra={"event": "email_queue_failed", "certificate_id": certificate_id})
+                    result["delivery_error"] = str(e)
+            batch["certificates"][index] = result
+            batch["completed"] += 1
+        batch["status"] = "done" if batch["completed"] + batch["failed"] == batch["total"] else "running"
+
+    for index, entry in enumerate(certificates):
+        task = asyncio.create_task(run_entry(index, entry))
+        _batch_tasks.add(task)
+        task.add_done_callback(_batch_tasks.discard)
+
+    return JSONResponse({"success": True, "batch_id": batch_id, "status_url": f"/api/batches/{batch_id}"},
+                        status_code=202)
+
+async def get_batch_api(request):
+    """
+    Progress of a queued batch
+    """
+    batch = batches.get(request.path_params['batch_id'])
+    if batch is None:
+        return error_response(f"Batch not found: {request.path_params['batch_id']}", 404)
+    return JSONResponse(dict(batch, success=True))
+
+async def queue_deliveries_api(request):
+    """
+    Queue already issued certificates for email delivery (same payload as the Flask service)
+    """
+    delivery_queue = certificate_service.delivery_queue
+    if not delivery_queue.enabled:
+        return error_response("Email delivery is not configured", 503)
+
+    try:
+        data = await read_json_body(request, request_schema.MAX_BATCH_BODY_BYTES)
+    except request_schema.ValidationError as e:
+        return error_response(str(e), e.status_code)
+    entries = data.get('deliveries') if isinstance(data, dict) else None
+
+    if not isinstance(entries, list) or not entries:
+        return error_response("Expected a JSON body with a non-empty 'deliveries' list", 400)
+
+    if len(entries) > MAX_BATCH_SIZE:
+        return error_response(f"Too many deliveries: at most {MAX_BATCH_SIZE} per request", 413)
+
+    deliveries, invalid = await asyncio.to_thread(certificate_service.plan_deliveries, entries)
+    if invalid:
+        return JSONResponse({
+            "success": False,
+            "error": f"Invalid entries: {sorted(invalid)}",
+            "details": {str(index): error for index, error in invalid.items()}
+        }, status_code=400)
+
+    delivery_ids = await asyncio.to_thread(delivery_queue.enqueue, deliveries)
+    return JSONResponse({
+        "success": True,
+        "deliveries": [{
+            "delivery_id": delivery_id,
+            "certificate_id": delivery["certificate_id"],
+            "status_url": f"/api/deliveries/{delivery_id}"
+        } for delivery_id, delivery in zip(delivery_ids, deliveries)]
+    }, status_code=202)
+
+async def get_delivery_api(request):
+    """
+    Status of a queued email delivery
+    """
+    delivery_id = request.path_params['delivery_id']
+    delivery = await asyncio.to_thread(certificate_service.delivery_queue.status, delivery_id)
+    if delivery is None:
+        return error_response(f"Delivery not found: {delivery_id}", 404)
+    return JSONResponse(dict(delivery, success=True))
+
+def merged_response(merged_path, download_name, count):
+    return FileResponse(
+        merged_path,
+        media_type=FORMAT_MIMETYPES['pdf'],
+        filename=download_name,
+        headers={'X-Certificate-Count': str(count)}
+    )
+
+async def get_batch_merged_api(request):
+    """
+    All PDFs of a finished batch as one print-ready PDF (failed entries are left out)
+    """
+    batch = batches.get(request.path_params['batch_id'])
+    if batch is None:
+        return error_response(f"Batch not found: {request.path_params['batch_id']}", 404)
+    if batch["status"] != "done" or batch["format"] != "pdf":
+        return error_response("Only finished PDF batches can be merged", 409)
+
+    certificate_ids = [entry["certificate_id"] for entry in batch["certificates"] if "certificate_id" in entry]
+    if not certificate_ids:
+        return error_response("No certificate of this batch was issued", 404)
+
+    try:
+        merged_path = await asyncio.to_thread(merge_certificates, certificate_ids)
+    except FileNotFoundError as e:
+        return error_response(str(e), 404)
+    except Exception as e:
+        return error_response(f"Error merging certificates: {str(e)}", 500)
+    return merged_response(merged_path, f"batch_{batch['batch_id']}.pdf", len(certificate_ids))
+
+async def merge_certificates_api(request):
+    """
+    Previously issued certificates as one print-ready PDF, in the given order
+    """
+    try:
+        data = await read_json_body(request, request_schema.MAX_BATCH_BODY_BYTES)
+    except request_schema.ValidationError as e:
+        return error_response(str(e), e.status_code)
+    certificate_ids = data.get('ids') if isinstance(data, dict) else None
+
+    if not isinstance(certificate_ids, list) or not certificate_ids or \
+            not all(isinstance(i, str) and CERTIFICATE_ID_PATTERN.match(i) for i in certificate_ids):
+        return error_response("Expected a JSON body with a non-empty 'ids' list of certificate IDs", 400)
+
+    if len(certificate_ids) > MAX_BATCH_SIZE:
+        return error_response(f"Too many certificates: at most {MAX_BATCH_SIZE} per merge", 413)
+
+    try:
+        merged_path = await asyncio.to_thread(merge_certificates, certificate_ids)
+    except FileNotFoundError as e:
+        return error_response(str(e), 404)
+    except Exception as e:
+        return error_response(f"Error merging certificates: {str(e)}", 500)
+    return merged_response(merged_path, "certificates.pdf", len(certificate_ids))
+
+async def get_certificate_api(request):
+    """
+    Download a previously issued certificate by its ID
+    """
+    certificate_id = request.path_params['certificate_id']
+    if not CERTIFICATE_ID_PATTERN.match(certificate_id):
+        return error_response("Invalid certificate ID", 400)
+
+    output_format = negotiate_format(request, request.query_params.get('format'))
+    if output_format is None:
+        return error_response(f"Unsupported format. Use one of: {', '.join(FORMAT_MIMETYPES)}", 406)
+
+    output_path = certificate_path(certificate_id, output_format)
+    pdf_path = certificate_path(certificate_id)
+    if not os.path.exists(output_path) and output_format in PREVIEW_FORMATS and os.path.exists(pdf_path):
+        await asyncio.to_thread(certificate_preview.render_preview, pdf_path, output_path, output_format)
+
+    if not os.path.exists(output_path):
+        return error_response(f"Certificate not found: {certificate_id}", 404)
+
+    return certificate_response(
+        request, certificate_id, output_path, f"certificate_{certificate_id}.{output_format}", output_format
+    )
+
+async def signed_download_api(request):
+    """
+    Download through a signed URL handed out in "url" delivery mode
+    """
+    filename = request.path_params['filename']
+    match = ARTIFACT_FILENAME_PATTERN.match(filename)
+    if not match or not certificate_service.storage.verify(
+            filename, request.query_params.get('expires'), request.query_params.get('signature')):
+        return error_response("Invalid or expired download link", 403)
+
+    certificate_id, output_format = match.groups()
+    output_path = os.path.join(certificate_service.OUTPUT_DIR, filename)
+    if not os.path.exists(output_path):
+        return error_response(f"Certificate not found: {certificate_id}", 404)
+
+    return certificate_response(request, certificate_id, output_path, filename, output_format)
+
+async def verify_certificate_api(request):
+    """
+    Verify a single certificate ID
+    """
+    certificate_id = request.path_params['certificate_id']
+    record = None
+    if CERTIFICATE_ID_PATTERN.match(certificate_id):
+        record = await asyncio.to_thread(certificate_registry.lookup_certificate, certificate_id)
+
+    if record is None:
+        return JSONResponse({"success": True, "valid": False, "certificate_id": certificate_id}, status_code=404)
+
+    return JSONResponse({"success": True, "valid": True, "certificate_id": certificate_id, "certificate": record})
+
+async def verify_certificates_bulk_api(request):
+    """
+    Verify many certificate IDs in one call
+    """
+    try:
+        data = await read_json_body(request, request_schema.MAX_BATCH_BODY_BYTES)
+    except request_schema.ValidationError as e:
+        return error_response(str(e), e.status_code)
+    certificate_ids = data.get('ids') if isinstance(data, dict) else None
+
+    if not isinstance(certificate_ids, list) or not all(isinstance(i, str) for i in certificate_ids):
+        return error_response("Expected a JSON body with an 'ids' list of strings", 400)
+
+    if len(certificate_ids) > MAX_BULK_VERIFY:
+        return error_response(f"Too many IDs: at most {MAX_BULK_VERIFY} per request", 413)
+
+    well_formed = [i for i in certificate_ids if CERTIFICATE_ID_PATTERN.match(i)]
+    records = await asyncio.to_thread(certificate_registry.lookup_certificates, well_formed)
+    results = {certificate_id: records.get(certificate_id) for certificate_id in certificate_ids}
+
+    return JSONResponse({
+        "success": True,
+        "valid_count": sum(1 for record in results.values() if record),
+        "invalid_count": sum(1 for record in results.values() if not record),
+        "results": results
+    })
+
+def diagnostics_denied(request):
+    """
+    Error response if the request may not use the diagnostics endpoints, else None
+    """
+    if not diagnostics.enabled():
+        return error_response("Endpoint not found", 404)
+    if not diagnostics.authorized(request.headers.get(diagnostics.TOKEN_HEADER)):
+        return error_response("Invalid diagnostics token", 403)
+    return None
+
+async def memory_diagnostics_api(request):
+    """
+    Memory report (same as the Flask service); requires the X-Diagnostics-Token header
+    """
+    denied = diagnostics_denied(request)
+    if denied:
+        return denied
+
+    try:
+        limit = int(request.query_params.get('limit', 20))
+    except ValueError:
+        limit = 20
+    action = request.query_params.get('tracemalloc')
+    if action == 'stop':
+        diagnostics.stop_tracing()
+    report = await asyncio.to_thread(
+        diagnostics.memory_report, max(1, min(limit, 200)), action == 'start'
+    )
+    return JSONResponse(report)
+
+async def profiles_diagnostics_api(request):
+    """
+    List the stored request profiles (newest first); requires the X-Diagnostics-Token header
+    """
+    denied = diagnostics_denied(request)
+    if denied:
+        return denied
+    return JSONResponse({"directory": os.path.abspath(diagnostics.DIAGNOSTICS_DIR),
+                         "profiles": diagnostics.list_profiles()})
+
+class TracingMiddleware:
+    """
+    Open a root span per HTTP request (continuing the caller's traceparent)
+    and return its trace ID in X-Trace-Id
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope['headers'])
+        traceparent = headers.get(b'traceparent', b'').decode('latin-1')
+        with tracing.request_span(f"{scope['method']} {scope['path']}", traceparent,
+                                  method=scope['method'], path=scope['path']) as root:
+            async def send_with_trace_id(message):
+                if message['type'] == 'http.response.start':
+                    root.set('status_code', message['status'])
+                    message['headers'] = list(message.get('headers', [])) + [
+                        (b'x-trace-id', root.trace_id.encode())
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace_id)
+
+class ProfilingMiddleware:
+    """
+    Profile a request that asked for it (diagnostics token) or was sampled,
+    and return the profile's ID in X-Profile-Id
+    cProfile only sees the event loop thread: the profile holds this request's
+    coroutines and any other request's that ran on the loop meanwhile, but not
+    the work handed to threads (rendering, the reportlab fallback, previews).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not diagnostics.should_profile(
+                Headers(scope=scope).get(diagnostics.PROFILE_HEADER)):
+            await self.app(scope, receive, send)
+            return
+
+        profile = diagnostics.RequestProfile(f"{scope['method']} {scope['path']}")
+        if not profile.start():
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_profile_id(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'x-profile-id', profile.profile_id.encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            # The profiler has to be stopped on the thread that started it
+            profile.stop()
+
+_retiring = False
+
+def retire_process():
+    """
+    Shut this process down gracefully, once: on SIGTERM uvicorn (or gunicorn's
+    uvicorn worker) stops accepting connections and finishes in-flight requests.
+    A gunicorn master starts a replacement worker; under plain uvicorn the
+    process manager (Render, a Docker restart policy) restarts the service.
+    """
+    global _retiring
+    if not _retiring:
+        _retiring = True
+        os.kill(os.getpid(), signal.SIGTERM)
+
+class MemoryGuardMiddleware:
+    """
+    Refuse new work over the hard RSS limit (gunicorn workers only), check the
+    soft limit after each request, and retire the process once either is crossed
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] == '/health':
+            await self.app(scope, receive, send)
+            return
+
+        if not memory_guard.guard.admit():
+            response = error_response("Worker is over its memory limit and being replaced; retry shortly", 503)
+            response.headers['Retry-After'] = str(memory_guard.RETRY_AFTER_SECONDS)
+            response.headers['Connection'] = 'close'
+            await response(scope, receive, send)
+            retire_process()
+            return
+
+        recycle = False
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            recycle = memory_guard.guard.after_request()
+        if recycle:
+            retire_process()
+
+class RateLimitMiddleware:
+    """
+    RateLimit headers on every response: the request's charge, or the client's current bucket
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] == '/health' or not rate_limiter.enabled():
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_rate_limit(message):
+            if message['type'] == 'http.response.start':
+                decision = scope.get('state', {}).get('rate_limit')
+                if decision is None:
+                    client = rate_limiter.client_key(Headers(scope=scope), peer_address(scope))
+                    decision = await asyncio.to_thread(rate_limiter.limiter.peek, client)
+                if decision is not None:
+                    fields = rate_limiter.headers(decision)
+                    message['headers'] = list(message.get('headers', [])) + [
+                        (name.lower().encode(), value.encode()) for name, value in fields.items()
+                    ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_rate_limit)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    supervisor.start_reaper()
+    yield
+    # Let in-flight conversions finish, then kill whatever is left
+    await asyncio.to_thread(supervisor.shutdown)
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route('/health', health_check, methods=['GET']),
+    Route('/api/generate-certificate', generate_certificate_api, methods=['POST']),
+    Route('/api/generate-certificates', generate_certificates_batch_api, methods=['POST']),
+    Route('/api/batches/{batch_id}', get_batch_api, methods=['GET']),
+    Route('/api/batches/{batch_id}/merged', get_batch_merged_api, methods=['GET']),
+    Route('/api/deliveries', queue_deliveries_api, methods=['POST']),
+    Route('/api/deliveries/{delivery_id}', get_delivery_api, methods=['GET']),
+    Route('/api/certificates/merge', merge_certificates_api, methods=['POST']),
+    Route('/api/certificates/{certificate_id}', get_certificate_api, methods=['GET']),
+    Route('/api/downloads/{filename}', signed_download_api, methods=['GET']),
+    Route('/api/verify/{certificate_id}', verify_certificate_api, methods=['GET']),
+    Route('/api/verify', verify_certificates_bulk_api, methods=['POST']),
+    Route('/api/diagnostics/memory', memory_diagnostics_api, methods=['GET']),
+    Route('/api/diagnostics/profiles', profiles_diagnostics_api, methods=['GET'])
+], middleware=[
+    Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+    Middleware(TracingMiddleware),
+    Middleware(ProfilingMiddleware),
+    Middleware(MemoryGuardMiddleware),
+    Middleware(RateLimitMiddleware)
+])
@@ -0,0 +1,198 @@
+"""
+Conversion scheduler with priority lanes
+Conversion slots are handed out by weighted fair queuing between lanes, so a
+student downloading one certificate ("interactive") is not stuck behind an
+admin generating a whole cohort ("bulk"). With the default weights of 8:1
+the interactive lane gets 8 of every 9 free slots while both lanes are busy,
+and the bulk lane still makes progress.
+
+ConversionScheduler is used by the threaded Flask service and
+AsyncConversionScheduler by the asyncio service; both share FairQueue.
+"""
+import os
+import time
+import asyncio
+import threading
+import contextlib
+from collections import deque
+
+from cancellation import ConversionCancelled, record_cancelled
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+def parse_lane_weights(value):
+    """
+    Parse "interactive=8,bulk=1" into {"interactive": 8.0, "bulk": 1.0}
+    """
+    weights = {}
+    for item in value.split(','):
+        lane, _, weight = item.partition('=')
+        if lane.strip():
+            weights[lane.strip()] = float(weight)
+    return weights
+
+# Relative share of conversion slots per lane
+LANE_WEIGHTS = parse_lane_weights(os.environ.get('CERTIFICATE_LANE_WEIGHTS', f'{INTERACTIVE}=8,{BULK}=1'))
+
+# Recent wait times kept per lane for the percentile report
+WAIT_SAMPLES = 1000
+
+class Ticket:
+    """
+    One request for a conversion slot
+    """
+    __slots__ = ('lane', 'start_tag', 'finish_tag', 'enqueued_at', 'granted', 'future')
+
+    def __init__(self, lane, start_tag, finish_tag):
+        self.lane = lane
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.future = None
+
+class FairQueue:
+    """
+    Weighted fair queuing over a fixed number of slots (not thread-safe;
+    the schedulers below provide the locking)
+    """
+
+    def __init__(self, slots, weights):
+        self.free_slots = slots
+        self.slots = slots
+        self.weights = dict(weights)
+        self.virtual_time = 0.0
+        self.last_finish = {lane: 0.0 for lane in self.weights}
+        self.waiting = {lane: deque() for lane in self.weights}
+        self.running = {lane: 0 for lane in self.weights}
+        self.granted = {lane: 0 for lane in self.weights}
+        self.wait_samples = {lane: deque(maxlen=WAIT_SAMPLES) for lane in self.weights}
+
+    def enqueue(self, lane, cost=1.0):
+        if lane not in self.weights:
+            raise ValueError(f"Unknown lane: {lane}")
+        start_tag = max(self.virtual_time, self.last_finish[lane])
+        finish_tag = start_tag + cost / self.weights[lane]
+        self.last_finish[lane] = finish_tag
+        ticket = Ticket(lane, start_tag, finish_tag)
+        self.waiting[lane].append(ticket)
+        return ticket
+
+    def remove(self, ticket):
+        """
+        Drop a ticket that gave up waiting
+        """
+        try:
+            self.waiting[ticket.lane].remove(ticket)
+        except ValueError:
+            pass
+
+    def dispatch(self):
+        """
+        Grant free slots to the waiting tickets with the smallest finish tags
+        Returns the newly granted tickets
+        """
+        granted = []
+        while self.free_slots > 0:
+            heads = [queue[0] for queue in self.waiting.values() if queue]
+            if not heads:
+                break
+            ticket = min(heads, key=lambda t: t.finish_tag)
+            self.waiting[ticket.lane].popleft()
+            self.virtual_time = max(self.virtual_time, ticket.start_tag)
+            self.free_slots -= 1
+            self.running[ticket.lane] += 1
+            self.granted[ticket.lane] += 1
+            self.wait_samples[ticket.lane].append(time.monotonic() - ticket.enqueued_at)
+            ticket.granted = True
+            granted.append(ticket)
+        return granted
+
+    def release(self, ticket):
+        self.free_slots += 1
+        self.running[ticket.lane] -= 1
+
+    def stats(self):
+        lanes = {}
+        for lane in self.weights:
+            samples = sorted(self.wait_samples[lane])
+            lanes[lane] = {
+                "weight": self.weights[lane],
+                "queue_depth": len(self.waiting[lane]),
+                "running": self.running[lane],
+                "granted": self.granted[lane],
+                "wait_avg_seconds": round(sum(samples) / len(samples), 4) if samples else 0.0,
+                "wait_p99_seconds": round(samples[min(len(samples) - 1, int(0.99 * len(samples)))], 4) if samples else 0.0
+            }
+        return {"slots": self.slots, "free_slots": self.free_slots, "lanes": lanes}
+
+class ConversionScheduler:
+    """
+    Thread-based scheduler: `with scheduler.slot(lane):` blocks until the lane is granted a slot
+    """
+
+    def __init__(self, slots, weights=None):
+        self._queue = FairQueue(slots, weights or LANE_WEIGHTS)
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self, lane=INTERACTIVE, cost=1.0, cancel_token=None):
+        with self._condition:
+            ticket = self._queue.enqueue(lane, cost)
+            self._queue.dispatch()
+            self._condition.notify_all()
+            while not ticket.granted:
+                if cancel_token is not None and cancel_token.cancelled:
+                    self._queue.remove(ticket)
+                    record_cancelled('queued')
+                    raise ConversionCancelled(f"Cancelled while queued: {cancel_token.reason}")
+                self._condition.wait(timeout=0.25 if cancel_token is not None else None)
+        try:
+            yield ticket
+        finally:
+            with self._condition:
+                self._queue.release(ticket)
+                self._queue.dispatch()
+                self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return self._queue.stats()
+
+class AsyncConversionScheduler:
+    """
+    asyncio scheduler: `async with scheduler.slot(lane):` waits without blocking the loop
+    """
+
+    def __init__(self, slots, weights=None):
+        self._queue = FairQueue(slots, weights or LANE_WEIGHTS)
+
+    def _wake(self):
+        for ticket in self._queue.dispatch():
+            if ticket.future is not None and not ticket.future.done():
+                ticket.future.set_result(True)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, lane=INTERACTIVE, cost=1.0):
+        ticket = self._queue.enqueue(lane, cost)
+        ticket.future = asyncio.get_running_loop().create_future()
+        self._wake()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.granted:
+                self._queue.release(ticket)
+                self._wake()
+            else:
+                self._queue.remove(ticket)
+                record_cancelled('queued')
+            raise
+        try:
+            yield ticket
+        finally:
+            self._queue.release(ticket)
+            self._wake()
+
+    def stats(self):
+        return self._queue.stats()
@@ -0,0 +1,320 @@
+"""
+Supervisor for converter subprocesses (LibreOffice)
+Killing the soffice launcher on timeout is not enough: the soffice.bin
+child it starts survives and keeps burning CPU and memory. The supervisor
+therefore starts every conversion in its own process group (session) with
+CPU-time and memory rlimits and kills the whole group on completion,
+timeout, cancellation or shutdown.
+
+The rlimits are applied by running the converter under prlimit(1) rather
+than from a preexec_fn: workers are multi-threaded, and code run between
+fork and exec can deadlock on a lock another thread held at fork time.
+
+Every converter process carries a marker environment variable naming the
+worker that started it. A background reaper kills marked processes that
+are no longer tracked by a live worker, e.g. leftovers of a worker that
+crashed or was killed mid-conversion.
+"""
+import os
+import time
+import atexit
+import signal
+import shutil
+import logging
+import threading
+import subprocess
+
+import cancellation
+from cancellation import ConversionCancelled
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    # Windows has no rlimits or process groups
+    RESOURCE_AVAILABLE = False
+
+# CPU seconds a single conversion may use (0 disables the limit)
+CPU_LIMIT_SECONDS = int(os.environ.get('CERTIFICATE_CONVERTER_CPU_SECONDS', 60))
+
+# Address space a single conversion may use, in MB (0 disables the limit).
+# soffice.bin reserves far more virtual memory than it touches, so this is a
+# runaway guard well above its footprint, not a memory budget.
+MEMORY_LIMIT_MB = int(os.environ.get('CERTIFICATE_CONVERTER_MEMORY_MB', 4096))
+
+# util-linux prlimit, which applies the rlimits and execs the converter
+PRLIMIT = shutil.which('prlimit')
+
+# How often strays are looked for (seconds, 0 disables the reaper)
+REAP_INTERVAL = float(os.environ.get('CERTIFICATE_REAP_INTERVAL', 60))
+
+# How long shutdown waits for in-flight conversions before killing them (seconds)
+DRAIN_TIMEOUT = float(os.environ.get('CERTIFICATE_DRAIN_TIMEOUT', 30))
+
+# Environment variable marking converter processes with the owning worker's pid
+OWNER_ENV = 'CERTIFICATE_CONVERTER_OWNER'
+
+class SupervisorShuttingDown(Exception):
+    """
+    Raised when a conversion is requested after shutdown has started
+    """
+
+def limited_command(args, cpu_seconds=None, memory_mb=None):
+    """
+    argv running args under the CPU and memory rlimits (through prlimit)
+    Raises FileNotFoundError if the program does not exist, as Popen would.
+    Without prlimit (or rlimits) the command runs unlimited.
+    """
+    cpu_seconds = CPU_LIMIT_SECONDS if cpu_seconds is None else cpu_seconds
+    memory_mb = MEMORY_LIMIT_MB if memory_mb is None else memory_mb
+    program = shutil.which(args[0])
+    if program is None:
+        raise FileNotFoundError(f"Converter not found: {args[0]}")
+
+    limits = []
+    if cpu_seconds:
+        # SIGXCPU at the soft limit, SIGKILL shortly after
+        limits.append(f'--cpu={cpu_seconds}:{cpu_seconds + 5}')
+    if memory_mb:
+        limits.append(f'--as={memory_mb * 1024 * 1024}')
+    if not limits or not RESOURCE_AVAILABLE or PRLIMIT is None:
+        return [program] + list(args[1:])
+    return [PRLIMIT] + limits + ['--', program] + list(args[1:])
+
+def kill_group(pgid):
+    """
+    SIGKILL every process in a process group
+    Returns True if the group still existed
+    """
+    if not RESOURCE_AVAILABLE:
+        return False
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+        return True
+    except (ProcessLookupError, PermissionError):
+        return False
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+def marked_processes():
+    """
+    Yield (pid, pgid, owner_pid) of processes carrying the converter marker
+    Reads /proc, so it finds nothing where /proc is unavailable.
+    """
+    marker = f'{OWNER_ENV}='.encode()
+    try:
+        pids = [int(entry) for entry in os.listdir('/proc') if entry.isdigit()]
+    except OSError:
+        return
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/environ', 'rb') as f:
+                environ = f.read()
+            pgid = os.getpgid(pid)
+        except (OSError, ProcessLookupError):
+            continue
+        for variable in environ.split(b'\0'):
+            if variable.startswith(marker):
+                try:
+                    yield pid, pgid, int(variable[len(marker):])
+                except ValueError:
+                    pass
+                break
+
+class ConverterSupervisor:
+    """
+    Runs converter subprocesses in supervised process groups
+    """
+
+    def __init__(self, cpu_seconds=None, memory_mb=None):
+        self.cpu_seconds = CPU_LIMIT_SECONDS if cpu_seconds is None else cpu_seconds
+        self.memory_mb = MEMORY_LIMIT_MB if memory_mb is None else memory_mb
+        self._lock = threading.Condition()
+        self._groups = {}
+        self._accepting = True
+        self._reaper = None
+        self._spawning = 0
+        self._stats = {"started": 0, "timed_out": 0, "cancelled": 0, "killed_on_shutdown": 0, "reaped": 0}
+
+    def popen_kwargs(self):
+        """
+        Keyword arguments for subprocess.Popen / asyncio.create_subprocess_exec
+        Must be followed by register() (or spawn_failed()) once the process exists.
+        """
+        with self._lock:
+            if not self._accepting:
+                raise SupervisorShuttingDown("Converter supervisor is shutting down")
+            # Until register() the new process is untracked; keep the reaper off it
+            self._spawning += 1
+        env = dict(os.environ)
+        env[OWNER_ENV] = str(os.getpid())
+        kwargs = {"env": env}
+        if RESOURCE_AVAILABLE:
+            kwargs["start_new_session"] = True
+        return kwargs
+
+    def command(self, args):
+        """
+        argv for a converter run under this supervisor's rlimits (see limited_command)
+        """
+        return limited_command(args, self.cpu_seconds, self.memory_mb)
+
+    def register(self, pid):
+        """
+        Track a started converter; with start_new_session its pid is the group id
+        """
+        with self._lock:
+            self._spawning -= 1
+            self._groups[pid] = time.monotonic()
+            self._stats["started"] += 1
+
+    def spawn_failed(self):
+        with self._lock:
+            self._spawning -= 1
+
+    def release(self, pid):
+        """
+        Kill whatever is left of a finished converter's group and stop tracking it
+        """
+        kill_group(pid)
+        with self._lock:
+            self._groups.pop(pid, None)
+            self._lock.notify_all()
+
+    def record(self, outcome, count=1):
+        with self._lock:
+            self._stats[outcome] += count
+
+    def run(self, args, timeout, cancel_token=None):
+        """
+        Run a converter, killing its process group on timeout or cancellation
+        Returns (returncode, stdout, stderr)
+        """
+        command = self.command(args)
+        kwargs = self.popen_kwargs()
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **kwargs)
+        except Exception:
+            self.spawn_failed()
+            raise
+        self.register(process.pid)
+        started = time.monotonic()
+        try:
+            while True:
+                try:
+                    stdout, stderr = process.communicate(timeout=0.25)
+                    return process.returncode, stdout, stderr
+                except subprocess.TimeoutExpired:
+                    if process.poll() is not None:
+                        # The launcher is done but a child still holds its output pipes
+                        kill_group(process.pid)
+                        stdout, stderr = process.communicate()
+                        return process.returncode, stdout, stderr
+                    elapsed = time.monotonic() - started
+                    if cancel_token is not None and cancel_token.cancelled:
+                        self._kill(process)
+                        self.record("cancelled")
+                        cancellation.record_cancelled('converting', elapsed)
+                        raise ConversionCancelled(f"Converter killed: {cancel_token.reason}")
+                    if elapsed > timeout:
+                        self._kill(process)
+                        self.record("timed_out")
+                        raise subprocess.TimeoutExpired(args, timeout)
+        finally:
+            if process.poll() is None:
+                self._kill(process)
+            self.release(process.pid)
+
+    def _kill(self, process):
+        if not kill_group(process.pid):
+            process.kill()
+        process.communicate()
+
+    def reap_strays(self):
+        """
+        Kill marked converter processes that no live worker is tracking
+        Returns the number of processes killed
+        """
+        me = os.getpid()
+        with self._lock:
+            tracked = set(self._groups)
+            spawning = self._spawning > 0
+        reaped = 0
+        for pid, pgid, owner in marked_processes():
+            if pid == me or pgid in tracked:
+                continue
+            if (owner == me and not spawning) or (owner != me and not pid_alive(owner)):
+                logger.warning("Reaping stray converter process %d (group %d, owner %s)", pid, pgid, owner,
+                               extra={"event": "converter_reaped"})
+                if kill_group(pgid):
+                    reaped += 1
+        if reaped:
+            self.record("reaped", reaped)
+        return reaped
+
+    def start_reaper(self, interval=None):
+        """
+        Start the background stray reaper (once per process)
+        """
+        interval = REAP_INTERVAL if interval is None else interval
+        if not interval or not RESOURCE_AVAILABLE:
+            return
+        with self._lock:
+            if self._reaper is not None and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reap_forever, args=(interval,),
+                                            name='converter-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                if not self._accepting:
+                    return
+            try:
+                self.reap_strays()
+            except Exception as e:
+                logger.error("Stray converter reaping failed: %s", e)
+
+    def shutdown(self, drain_timeout=None):
+        """
+        Stop accepting conversions, wait for in-flight ones, then kill the rest
+        Returns the number of conversions killed
+        """
+        drain_timeout = DRAIN_TIMEOUT if drain_timeout is None else drain_timeout
+        deadline = time.monotonic() + drain_timeout
+        with self._lock:
+            self._accepting = False
+            while self._groups and time.monotonic() < deadline:
+                self._lock.wait(timeout=deadline - time.monotonic())
+            remaining = list(self._groups)
+        for pgid in remaining:
+            logger.warning("Killing converter group %d still running at shutdown", pgid)
+            kill_group(pgid)
+        if remaining:
+            self.record("killed_on_shutdown", len(remaining))
+        return len(remaining)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._groups),
+                "accepting": self._accepting,
+                "cpu_limit_seconds": self.cpu_seconds,
+                "memory_limit_mb": self.memory_mb,
+                "rlimits_enforced": bool(RESOURCE_AVAILABLE and PRLIMIT and (self.cpu_seconds or self.memory_mb)),
+                **self._stats
+            }
+
+supervisor = ConverterSupervisor()
+atexit.register(supervisor.shutdown)
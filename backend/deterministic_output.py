@@ -0,0 +1,115 @@
+"""
+Deterministic (byte-reproducible) certificate outputs
+The same request must produce byte-identical files so downstream caches and
+storage can key on content hashes. Left alone, every run differs in:
+
+- DOCX: zip entry timestamps and the core properties (created/modified)
+- PDF: CreationDate/ModDate, the XMP packet (dates, random document IDs)
+  and the trailer /ID
+- the issued date itself, which is "today" unless the caller supplies it
+
+In deterministic mode (CERTIFICATE_DETERMINISTIC, on by default) all of these
+are derived from the issued date, so identical inputs give identical bytes.
+"""
+import os
+import uuid
+import logging
+import zipfile
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pikepdf
+    PIKEPDF_AVAILABLE = True
+except ImportError:
+    PIKEPDF_AVAILABLE = False
+
+DETERMINISTIC = os.environ.get('CERTIFICATE_DETERMINISTIC', '1').lower() in ('1', 'true', 'yes', 'on')
+
+ISSUED_DATE_FORMAT = '%B %d, %Y'
+
+# Earliest timestamp a zip entry can carry
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+def issued_datetime(issued_date):
+    """
+    Midnight UTC of an issued date ("March 31, 2024"); falls back to the zip epoch
+    """
+    try:
+        return datetime.strptime(issued_date, ISSUED_DATE_FORMAT).replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return datetime(*ZIP_EPOCH, tzinfo=timezone.utc)
+
+def set_core_properties(doc, issued_date):
+    """
+    Pin the DOCX core properties that python-docx / the template would otherwise vary
+    """
+    moment = issued_datetime(issued_date).replace(tzinfo=None)
+    properties = doc.core_properties
+    properties.created = moment
+    properties.modified = moment
+    properties.last_printed = moment
+    properties.revision = 1
+
+def normalize_docx(path):
+    """
+    Rewrite a DOCX (zip) in place with fixed entry timestamps and attributes
+    Entry order and content are kept.
+    """
+    scratch = f"{path}.{uuid.uuid4().hex[:8]}.zip"
+    try:
+        with zipfile.ZipFile(path) as source, zipfile.ZipFile(scratch, 'w', zipfile.ZIP_DEFLATED) as target:
+            for entry in source.infolist():
+                info = zipfile.ZipInfo(entry.filename, date_time=ZIP_EPOCH)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0o644 << 16
+                info.create_system = 0
+                target.writestr(info, source.read(entry.filename))
+        os.replace(scratch, path)
+    finally:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+
+def pdf_date(issued_date):
+    return issued_datetime(issued_date).strftime("D:%Y%m%d%H%M%SZ")
+
+def normalize_pdf(path, issued_date):
+    """
+    Rewrite a PDF in place with dates taken from the issued date, no XMP packet
+    and a trailer /ID derived from the content
+    Returns False (file untouched) if pikepdf is not installed.
+    """
+    if not PIKEPDF_AVAILABLE:
+        logger.warning("pikepdf not available; PDF output is not byte-reproducible")
+        return False
+
+    scratch = f"{path}.{uuid.uuid4().hex[:8]}.pdf"
+    try:
+        with pikepdf.open(path) as pdf:
+            # The XMP packet duplicates the dates and carries random document/instance IDs
+            if '/Metadata' in pdf.Root:
+                del pdf.Root.Metadata
+            date = pdf_date(issued_date)
+            pdf.docinfo[pikepdf.Name.CreationDate] = date
+            pdf.docinfo[pikepdf.Name.ModDate] = date
+            pdf.save(scratch, deterministic_id=True)
+        os.replace(scratch, path)
+        return True
+    finally:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+
+def parse_issued_date(value):
+    """
+    Canonical issued date ("March 31, 2024") from "March 31, 2024" or "2024-03-31"
+    Returns None if the value is not a valid date.
+    """
+    if not isinstance(value, str):
+        return None
+    for date_format in (ISSUED_DATE_FORMAT, '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value.strip(), date_format).strftime(ISSUED_DATE_FORMAT)
+        except ValueError:
+            continue
+    return None
@@ -0,0 +1,212 @@
+"""
+Opt-in diagnostics for a live instance
+- Per-request profiling: a request carrying the diagnostics token in the
+  X-Certificate-Profile header, or picked by CERTIFICATE_PROFILE_SAMPLE_RATE,
+  is run under cProfile. The profile is written to the diagnostics directory
+  as a .prof file (for snakeviz / pstats) plus a plain-text top-functions summary.
+- Memory report: tracemalloc top allocators, growth since the previous report,
+  live object counts for python-docx classes and the process RSS.
+
+Everything is off unless CERTIFICATE_DIAGNOSTICS_TOKEN is set.
+"""
+import os
+import gc
+import io
+import hmac
+import time
+import random
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Shared secret for profiling requests and the memory endpoint (unset: disabled)
+DIAGNOSTICS_TOKEN = os.environ.get('CERTIFICATE_DIAGNOSTICS_TOKEN')
+
+# Where profiles are written. Kept out of the static output directory so they are never served.
+DIAGNOSTICS_DIR = os.environ.get('CERTIFICATE_DIAGNOSTICS_DIR', 'diagnostics')
+
+# Fraction of requests profiled without the header (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.environ.get('CERTIFICATE_PROFILE_SAMPLE_RATE', 0))
+
+# Oldest profiles are deleted beyond this many
+MAX_PROFILES = int(os.environ.get('CERTIFICATE_MAX_PROFILES', 50))
+
+# Frames kept per allocation when tracemalloc is started at import (0: start on demand)
+TRACEMALLOC_FRAMES = int(os.environ.get('CERTIFICATE_TRACEMALLOC_FRAMES', 0))
+
+PROFILE_HEADER = 'X-Certificate-Profile'
+TOKEN_HEADER = 'X-Diagnostics-Token'
+
+# Only one cProfile can be active per process; concurrent requests just skip profiling
+_profile_lock = threading.Lock()
+_previous_snapshot = None
+_snapshot_lock = threading.Lock()
+
+if DIAGNOSTICS_TOKEN and TRACEMALLOC_FRAMES and not tracemalloc.is_tracing():
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+
+def enabled():
+    return bool(DIAGNOSTICS_TOKEN)
+
+def authorized(token):
+    """
+    True if token matches the configured diagnostics token
+    """
+    return enabled() and bool(token) and hmac.compare_digest(token, DIAGNOSTICS_TOKEN)
+
+def should_profile(header_value):
+    """
+    Decide whether to profile a request from its X-Certificate-Profile header and the sample rate
+    """
+    if not enabled():
+        return False
+    if header_value:
+        return authorized(header_value)
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+class RequestProfile:
+    """
+    cProfile of a single request
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(4).hex()}"
+        self.profiler = cProfile.Profile()
+        self.started = None
+
+    def start(self):
+        """
+        Start profiling; returns False if another request is already being profiled
+        """
+        if not _profile_lock.acquire(blocking=False):
+            return False
+        try:
+            self.started = time.perf_counter()
+            self.profiler.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is active
+            _profile_lock.release()
+            return False
+        return True
+
+    def stop(self):
+        """
+        Stop profiling and write the profile
+        Returns the path of the .prof file
+        """
+        try:
+            self.profiler.disable()
+        finally:
+            _profile_lock.release()
+        elapsed = time.perf_counter() - self.started
+
+        os.makedirs(DIAGNOSTICS_DIR, exist_ok=True)
+        base = os.path.join(DIAGNOSTICS_DIR, f"profile_{self.profile_id}")
+        self.profiler.dump_stats(base + '.prof')
+
+        summary = io.StringIO()
+        summary.write(f"{self.label} took {elapsed:.3f}s\n\n")
+        pstats.Stats(self.profiler, stream=summary).sort_stats('cumulative').print_stats(30)
+        with open(base + '.txt', 'w') as f:
+            f.write(summary.getvalue())
+
+        prune_profiles()
+        logger.info("Profiled %s (%.3fs): %s.prof", self.label, elapsed, base, extra={"event": "request_profiled"})
+        return base + '.prof'
+
+def list_profiles():
+    """
+    Stored profiles, newest first
+    """
+    if not os.path.isdir(DIAGNOSTICS_DIR):
+        return []
+    names = [name for name in os.listdir(DIAGNOSTICS_DIR) if name.startswith('profile_') and name.endswith('.prof')]
+    return sorted(names, reverse=True)
+
+def prune_profiles():
+    for name in list_profiles()[MAX_PROFILES:]:
+        for path in (name, name[:-len('.prof')] + '.txt'):
+            try:
+                os.remove(os.path.join(DIAGNOSTICS_DIR, path))
+            except FileNotFoundError:
+                pass
+
+def current_rss_mb():
+    """
+    Resident set size of this process in MB (None where /proc is unavailable)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+    except (OSError, ValueError):
+        return None
+
+def docx_object_counts(limit=20):
+    """
+    Live objects per python-docx class (documents, paragraphs, runs, oxml elements)
+    """
+    counts = Counter()
+    for obj in gc.get_objects():
+        module = getattr(type(obj), '__module__', None)
+        if isinstance(module, str) and (module == 'docx' or module.startswith('docx.')):
+            counts[f"{module}.{type(obj).__name__}"] += 1
+    return dict(counts.most_common(limit))
+
+def memory_report(limit=20, start_tracing=False, frames=10):
+    """
+    Build the memory diagnostics report
+    Allocator statistics need tracemalloc; it is started on request because
+    tracing slows every allocation down while it is on.
+    """
+    global _previous_snapshot
+    report = {
+        "rss_mb": current_rss_mb(),
+        "gc_counts": gc.get_count(),
+        "docx_objects": docx_object_counts(limit),
+        "tracemalloc": tracemalloc.is_tracing()
+    }
+
+    if start_tracing and not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        report["tracemalloc"] = True
+        report["note"] = "tracemalloc started; allocation statistics are available from the next report"
+        return report
+
+    if not tracemalloc.is_tracing():
+        return report
+
+    with _snapshot_lock:
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        report["traced_mb"] = round(current / (1024 * 1024), 2)
+        report["traced_peak_mb"] = round(peak / (1024 * 1024), 2)
+        report["top_allocators"] = [
+            {"location": str(stat.traceback[0]), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+            for stat in snapshot.statistics('lineno')[:limit]
+        ]
+        if _previous_snapshot is not None:
+            report["growth_since_last_report"] = [
+                {"location": str(stat.traceback[0]), "size_diff_kb": round(stat.size_diff / 1024, 1),
+                 "count_diff": stat.count_diff}
+                for stat in snapshot.compare_to(_previous_snapshot, 'lineno')[:limit]
+                if stat.size_diff > 0
+            ]
+        _previous_snapshot = snapshot
+
+    return report
+
+def stop_tracing():
+    global _previous_snapshot
+    with _snapshot_lock:
+        _previous_snapshot = None
+    tracemalloc.stop()
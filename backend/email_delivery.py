@@ -0,0 +1,471 @@
+"""
+Queued email delivery of issued certificates
+Deliveries are written to a small SQLite outbox and sent by background
+threads, so queueing one is a single insert and never holds up generation.
+Each sender thread keeps its SMTP connection open and sends many messages per
+session (up to MESSAGES_PER_CONNECTION) instead of one session per message;
+sending is throttled to a configured rate, and failures are retried with
+exponential backoff. Permanent rejections (5xx) fail the delivery at once.
+
+The outbox survives worker restarts and recycling: a delivery claimed by a
+worker that went away is picked up again once its lease runs out. All
+workers share the outbox and each sends at its share of the configured rate.
+
+SMTP settings are the ones the Node backend already uses (EMAIL_HOST,
+EMAIL_PORT, EMAIL_SECURE, EMAIL_USER, EMAIL_PASSWORD, EMAIL_FROM); delivery is
+disabled while EMAIL_HOST is unset.
+"""
+import os
+import time
+import uuid
+import random
+import smtplib
+import sqlite3
+import logging
+import mimetypes
+import threading
+from datetime import datetime
+from email.message import EmailMessage
+from email.utils import make_msgid
+
+logger = logging.getLogger(__name__)
+
+SMTP_HOST = os.environ.get('EMAIL_HOST')
+SMTP_PORT = int(os.environ.get('EMAIL_PORT') or 587)
+# Implicit TLS (port 465); otherwise STARTTLS is used whenever the server offers it
+SMTP_SECURE = os.environ.get('EMAIL_SECURE', '').lower() == 'true'
+SMTP_USER = os.environ.get('EMAIL_USER')
+SMTP_PASSWORD = os.environ.get('EMAIL_PASSWORD')
+EMAIL_FROM = os.environ.get('EMAIL_FROM') or SMTP_USER
+SMTP_TIMEOUT = 30
+
+EMAIL_SUBJECT = os.environ.get('CERTIFICATE_EMAIL_SUBJECT', 'Your {domain} certificate')
+EMAIL_BODY = os.environ.get('CERTIFICATE_EMAIL_BODY', (
+    "Dear {name},\n\n"
+    "Congratulations on completing {domain}. Your certificate is attached.\n\n"
+    "Certificate ID: {certificate_id}\n"
+))
+
+# Sender threads (and so SMTP connections) per worker process
+POOL_SIZE = int(os.environ.get('CERTIFICATE_SMTP_POOL_SIZE', 2))
+
+# Messages sent over one SMTP session before it is replaced
+MESSAGES_PER_CONNECTION = int(os.environ.get('CERTIFICATE_SMTP_MESSAGES_PER_CONNECTION', 100))
+
+# Idle sessions are closed after this long (seconds)
+IDLE_TIMEOUT = 30.0
+
+# Messages per second across all workers (0: unthrottled)
+SEND_RATE = float(os.environ.get('CERTIFICATE_EMAIL_RATE', 5))
+
+# Attempts before a delivery is given up, and the retry backoff (seconds)
+MAX_ATTEMPTS = int(os.environ.get('CERTIFICATE_EMAIL_MAX_ATTEMPTS', 6))
+RETRY_BASE_SECONDS = float(os.environ.get('CERTIFICATE_EMAIL_RETRY_SECONDS', 30))
+RETRY_MAX_SECONDS = 3600.0
+
+# A claimed delivery not finished within this long is retried by any worker (seconds)
+LEASE_SECONDS = 300.0
+
+# How often idle senders look for due retries (seconds)
+POLL_INTERVAL = 5.0
+
+OUTBOX_PATH = os.environ.get(
+    'CERTIFICATE_OUTBOX_PATH',
+    os.path.join(os.environ.get('CERTIFICATE_OUTPUT_DIR', 'static'), 'outbox.db')
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    delivery_id TEXT PRIMARY KEY,
+    certificate_id TEXT NOT NULL,
+    format TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    name TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    lease_until REAL,
+    last_error TEXT,
+    created_at TEXT NOT NULL,
+    sent_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_deliveries_due ON deliveries (status, next_attempt);
+"""
+
+COLUMNS = ('delivery_id', 'certificate_id', 'format', 'recipient', 'name', 'domain', 'status',
+           'attempts', 'next_attempt', 'lease_until', 'last_error', 'created_at', 'sent_at')
+
+class PermanentDeliveryError(Exception):
+    """
+    A delivery that retrying cannot fix (rejected recipient, missing certificate)
+    """
+
+class Outbox:
+    """
+    SQLite-backed delivery queue shared by all worker processes
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def add(self, deliveries):
+        """
+        Queue deliveries (dicts with certificate_id, format, recipient, name, domain)
+        Returns their delivery IDs.
+        """
+        now = time.time()
+        created_at = datetime.now().isoformat(timespec='seconds')
+        rows = [(str(uuid.uuid4()), d['certificate_id'], d['format'], d['recipient'], d['name'], d['domain'],
+                 'queued', now, created_at) for d in deliveries]
+        connection = self.connection()
+        connection.execute('BEGIN')
+        try:
+            connection.executemany(
+                'INSERT INTO deliveries (delivery_id, certificate_id, format, recipient, name, domain, status, '
+                'next_attempt, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows
+            )
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return [row[0] for row in rows]
+
+    def claim(self, limit):
+        """
+        Lease up to limit due deliveries to the caller (oldest first)
+        """
+        now = time.time()
+        cursor = self.connection().execute(
+            f"UPDATE deliveries SET status = 'sending', lease_until = ?, attempts = attempts + 1 "
+            f"WHERE delivery_id IN (SELECT delivery_id FROM deliveries "
+            f"WHERE (status = 'queued' AND next_attempt <= ?) OR (status = 'sending' AND lease_until < ?) "
+            f"ORDER BY next_attempt, rowid LIMIT ?) RETURNING rowid, {', '.join(COLUMNS)}",
+            (now + LEASE_SECONDS, now, now, limit)
+        )
+        # RETURNING comes in no particular order; deliveries queued together go out in queue order
+        rows = sorted(cursor.fetchall(), key=lambda row: (row[COLUMNS.index('next_attempt') + 1], row[0]))
+        return [dict(zip(COLUMNS, row[1:])) for row in rows]
+
+    def finish(self, delivery_id, status, error=None, next_attempt=None):
+        self.connection().execute(
+            "UPDATE deliveries SET status = ?, last_error = ?, lease_until = NULL, "
+            "next_attempt = COALESCE(?, next_attempt), sent_at = CASE WHEN ? = 'sent' THEN ? END "
+            "WHERE delivery_id = ?",
+            (status, error, next_attempt, status, datetime.now().isoformat(timespec='seconds'), delivery_id)
+        )
+
+    def release(self, delivery_id):
+        """
+        Hand a claimed delivery back unattempted
+        """
+        self.connection().execute(
+            "UPDATE deliveries SET status = 'queued', attempts = attempts - 1, lease_until = NULL "
+            "WHERE delivery_id = ?", (delivery_id,)
+        )
+
+    def next_due(self):
+        """
+        Seconds until the next queued delivery is due (None if there is none)
+        """
+        row = self.connection().execute(
+            "SELECT MIN(next_attempt) FROM deliveries WHERE status = 'queued'"
+        ).fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def get(self, delivery_id):
+        row = self.connection().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM deliveries WHERE delivery_id = ?", (delivery_id,)
+        ).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def counts(self):
+        return dict(self.connection().execute('SELECT status, COUNT(*) FROM deliveries GROUP BY status').fetchall())
+
+class Throttle:
+    """
+    Spaces calls at most rate per second apart, shared by the threads that use it
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class SmtpSession:
+    """
+    One reusable SMTP connection; reconnects on demand
+    """
+
+    def __init__(self, host, port, secure=False, user=None, password=None, timeout=SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.secure = secure
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.smtp = None
+        self.sent = 0
+        self.last_used = 0.0
+
+    def open(self):
+        if self.secure:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            smtp.ehlo()
+            if smtp.has_extn('starttls'):
+                smtp.starttls()
+                smtp.ehlo()
+        if self.user:
+            smtp.login(self.user, self.password or '')
+        self.smtp = smtp
+        self.sent = 0
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self.smtp.close()
+            self.smtp = None
+
+    def send(self, message):
+        """
+        Send one message, opening (or replacing a worn-out) session first
+        Returns True if a new session was opened for it.
+        """
+        opened = False
+        if self.smtp is not None and self.sent >= MESSAGES_PER_CONNECTION:
+            self.close()
+        if self.smtp is None:
+            self.open()
+            opened = True
+        try:
+            self.smtp.send_message(message)
+        except smtplib.SMTPRecipientsRefused:
+            # Answered and reset by the server: the session is still good
+            raise
+        except OSError:
+            # The session is in an unknown state: never reuse it
+            self.close()
+            raise
+        self.sent += 1
+        self.last_used = time.monotonic()
+        return opened
+
+def build_message(delivery, attachment_path, sender=None):
+    message = EmailMessage()
+    message['From'] = sender or EMAIL_FROM
+    message['To'] = delivery['recipient']
+    message['Subject'] = EMAIL_SUBJECT.format(**delivery)
+    # Stable per delivery: a resend after an ambiguous failure can be deduplicated
+    message['Message-ID'] = make_msgid(idstring=delivery['delivery_id'])
+    message.set_content(EMAIL_BODY.format(**delivery))
+
+    mimetype = mimetypes.guess_type(attachment_path)[0] or 'application/octet-stream'
+    maintype, subtype = mimetype.split('/', 1)
+    with open(attachment_path, 'rb') as f:
+        message.add_attachment(f.read(), maintype=maintype, subtype=subtype,
+                               filename=f"Certificate_{delivery['name'].replace(' ', '_')}.{delivery['format']}")
+    return message
+
+def is_permanent(error):
+    """
+    Whether retrying a delivery that failed with this error is pointless
+    """
+    if isinstance(error, PermanentDeliveryError):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 500 <= error.smtp_code < 600
+    return False
+
+def retry_delay(attempts):
+    """
+    Backoff before attempt number attempts + 1, with jitter
+    """
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+class DeliveryQueue:
+    """
+    Background senders draining the outbox over pooled SMTP sessions
+
+    attachment(certificate_id, output_format) returns the file to attach, or
+    None if the certificate is not available (the delivery then fails).
+    """
+
+    def __init__(self, outbox, attachment, host=SMTP_HOST, port=SMTP_PORT, secure=SMTP_SECURE, user=SMTP_USER,
+                 password=SMTP_PASSWORD, sender=EMAIL_FROM, pool_size=POOL_SIZE, rate=None):
+        self.outbox = outbox
+        self.attachment = attachment
+        self.host = host
+        self.port = port
+        self.secure = secure
+        self.user = user
+        self.password = password
+        self.sender = sender
+        self.pool_size = max(1, pool_size)
+        if rate is None:
+            # The configured rate is for the whole service; every worker process sends its share
+            rate = SEND_RATE / max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+        self.rate = rate
+        self.throttle = Throttle(rate)
+        self._wakeup = threading.Condition()
+        self._pending_wakeups = 0
+        self._threads = []
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._stats = {
+            "sent": 0,
+            "retried": 0,
+            "failed": 0,
+            "sessions_opened": 0
+        }
+
+    @property
+    def enabled(self):
+        return bool(self.host)
+
+    def enqueue(self, deliveries):
+        """
+        Queue deliveries and wake the senders; returns the delivery IDs
+        """
+        delivery_ids = self.outbox.add(deliveries)
+        self.start()
+        with self._wakeup:
+            self._pending_wakeups += len(delivery_ids)
+            self._wakeup.notify_all()
+        return delivery_ids
+
+    def start(self):
+        with self._lock:
+            if self._threads or not self.enabled:
+                return
+            self._stopping = False
+            for index in range(self.pool_size):
+                thread = threading.Thread(target=self._run, name=f'email-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=10):
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _wait_for_work(self, timeout):
+        with self._wakeup:
+            if not self._pending_wakeups and not self._stopping:
+                self._wakeup.wait(timeout)
+            self._pending_wakeups = 0
+
+    def _run(self):
+        session = SmtpSession(self.host, self.port, self.secure, self.user, self.password)
+        while not self._stopping:
+            try:
+                deliveries = self.outbox.claim(min(MESSAGES_PER_CONNECTION, 20))
+            except sqlite3.Error as e:
+                logger.error("Cannot read the email outbox: %s", e, extra={"event": "email_outbox_error"})
+                deliveries = []
+
+            if not deliveries:
+                if session.smtp is not None and time.monotonic() - session.last_used > IDLE_TIMEOUT:
+                    session.close()
+                due = self.outbox.next_due()
+                self._wait_for_work(POLL_INTERVAL if due is None else min(POLL_INTERVAL, due))
+                continue
+
+            for delivery in deliveries:
+                if self._stopping:
+                    self.outbox.release(delivery['delivery_id'])
+                    continue
+                self._deliver(session, delivery)
+        session.close()
+
+    def _deliver(self, session, delivery):
+        try:
+            path = self.attachment(delivery['certificate_id'], delivery['format'])
+            if path is None or not os.path.exists(path):
+                raise PermanentDeliveryError(f"Certificate not available: {delivery['certificate_id']}")
+            message = build_message(delivery, path, self.sender)
+            self.throttle.wait()
+            if session.send(message):
+                with self._lock:
+                    self._stats["sessions_opened"] += 1
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if is_permanent(e) or delivery['attempts'] >= MAX_ATTEMPTS:
+                self.outbox.finish(delivery['delivery_id'], 'failed', error)
+                with self._lock:
+                    self._stats["failed"] += 1
+                logger.warning("Email delivery %s to %s failed: %s", delivery['delivery_id'], delivery['recipient'],
+                               error, extra={"event": "email_failed", "certificate_id": delivery['certificate_id']})
+            else:
+                delay = retry_delay(delivery['attempts'])
+                self.outbox.finish(delivery['delivery_id'], 'queued', error, time.time() + delay)
+                with self._lock:
+                    self._stats["retried"] += 1
+                logger.info("Email delivery %s will be retried in %.0fs: %s", delivery['delivery_id'], delay, error,
+                            extra={"event": "email_retry", "certificate_id": delivery['certificate_id']})
+            return
+
+        self.outbox.finish(delivery['delivery_id'], 'sent')
+        with self._lock:
+            self._stats["sent"] += 1
+        logger.info("Emailed certificate %s to %s", delivery['certificate_id'], delivery['recipient'],
+                    extra={"event": "email_sent", "certificate_id": delivery['certificate_id']})
+
+    def status(self, delivery_id):
+        delivery = self.outbox.get(delivery_id)
+        if delivery is None:
+            return None
+        return {key: delivery[key] for key in ('delivery_id', 'certificate_id', 'recipient', 'status',
+                                               'attempts', 'last_error', 'created_at', 'sent_at')}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        sessions = stats["sessions_opened"]
+        outbox = None
+        if self.enabled:
+            try:
+                outbox = self.outbox.counts()
+            except sqlite3.Error:
+                pass
+        return dict(
+            stats,
+            enabled=self.enabled,
+            senders=len(self._threads),
+            rate_per_second=self.rate,
+            messages_per_session=round(stats["sent"] / sessions, 2) if sessions else 0.0,
+            outbox=outbox
+        )
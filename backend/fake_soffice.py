@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the LibreOffice executable, with injectable faults
+Accepts the `soffice --headless --convert-to pdf --outdir DIR FILE` calls made
+by convert_with_libreoffice and writes a small valid one-page PDF, so the
+converter path can be tested and load-tested without LibreOffice. Point the
+service at it with:
+
+    CERTIFICATE_LIBREOFFICE_COMMANDS=/path/to/backend/fake_soffice.py
+
+Behaviour is configured through environment variables (inherited from the
+service, so they can be changed between requests):
+
+    FAKE_SOFFICE_LATENCY       seconds before answering, a number or a distribution:
+                               "fixed:0.5", "uniform:0.1,0.9", "normal:0.5,0.1",
+                               "lognormal:-1.0,0.5" (mu, sigma), "exponential:0.5" (mean)
+    FAKE_SOFFICE_HANG_RATE     probability of never finishing (until killed)
+    FAKE_SOFFICE_FAIL_RATE     probability of exiting with FAKE_SOFFICE_EXIT_CODE (default 1)
+    FAKE_SOFFICE_CRASH_RATE    probability of dying from SIGKILL (like the OOM killer)
+    FAKE_SOFFICE_MISSING_RATE  probability of exiting 0 without writing the PDF
+    FAKE_SOFFICE_ORPHAN        1: leave a sleeping child process behind, like a stuck soffice.bin
+    FAKE_SOFFICE_SEED          seed for the random choices (reproducible runs)
+    FAKE_SOFFICE_LOG           JSON-lines file receiving one record per invocation
+
+Faults are drawn in the order hang, crash, fail, missing.
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+
+VERSION = "LibreOffice 7.6.0.0 (fake_soffice)"
+
+def sample_latency(spec, rng):
+    """
+    Seconds to wait for a latency spec ("0.5", "uniform:0.1,0.9", ...)
+    """
+    if not spec:
+        return 0.0
+    kind, _, params = spec.partition(':')
+    if not params:
+        return max(0.0, float(kind))
+    values = [float(value) for value in params.split(',')]
+    if kind == 'fixed':
+        latency = values[0]
+    elif kind == 'uniform':
+        latency = rng.uniform(values[0], values[1])
+    elif kind == 'normal':
+        latency = rng.gauss(values[0], values[1])
+    elif kind == 'lognormal':
+        latency = rng.lognormvariate(values[0], values[1])
+    elif kind == 'exponential':
+        latency = rng.expovariate(1.0 / values[0])
+    else:
+        raise ValueError(f"Unknown latency distribution: {kind}")
+    return max(0.0, latency)
+
+def pdf_document(title):
+    """
+    A minimal, well-formed one-page PDF with a line of text
+    """
+    text = title.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    content = f"BT /F1 18 Tf 72 760 Td ({text}) Tj ET".encode('latin-1', 'replace')
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        b"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length " + str(len(content)).encode() + b" >>\nstream\n" + content + b"\nendstream",
+        b"<< /Producer (fake_soffice) >>"
+    ]
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode()
+    output += (f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R /Info {len(objects)} 0 R >>\n"
+               f"startxref\n{xref}\n%%EOF\n").encode()
+    return bytes(output)
+
+def parse_args(argv):
+    """
+    (outdir, source files) from a soffice command line
+    """
+    args = [arg for arg in argv if not arg.startswith('-env:')]
+    outdir = '.'
+    sources = []
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg == '--outdir':
+            outdir = args[index + 1]
+            index += 2
+            continue
+        if arg == '--convert-to':
+            index += 2
+            continue
+        if not arg.startswith('-'):
+            sources.append(arg)
+        index += 1
+    return outdir, sources
+
+def log(record):
+    path = os.environ.get('FAKE_SOFFICE_LOG')
+    if path:
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+def rate(name):
+    return float(os.environ.get(name, 0) or 0)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if '--version' in argv:
+        print(VERSION)
+        return 0
+
+    seed = os.environ.get('FAKE_SOFFICE_SEED')
+    rng = random.Random(f"{seed}:{argv}" if seed is not None else None)
+    outdir, sources = parse_args(argv)
+    latency = sample_latency(os.environ.get('FAKE_SOFFICE_LATENCY', ''), rng)
+
+    if rng.random() < rate('FAKE_SOFFICE_HANG_RATE'):
+        outcome = 'hang'
+    elif rng.random() < rate('FAKE_SOFFICE_CRASH_RATE'):
+        outcome = 'crash'
+    elif rng.random() < rate('FAKE_SOFFICE_FAIL_RATE'):
+        outcome = 'fail'
+    elif rng.random() < rate('FAKE_SOFFICE_MISSING_RATE'):
+        outcome = 'missing'
+    else:
+        outcome = 'ok'
+
+    child = None
+    if os.environ.get('FAKE_SOFFICE_ORPHAN', '').lower() in ('1', 'true', 'yes', 'on'):
+        child = os.fork()
+        if child == 0:
+            # Detach from the output pipes like a daemonized soffice.bin, then idle
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            time.sleep(3600)
+            os._exit(0)
+
+    log({"pid": os.getpid(), "pgid": os.getpgid(0), "child": child, "outcome": outcome,
+         "latency": round(latency, 4), "sources": sources})
+
+    if outcome == 'hang':
+        while True:
+            time.sleep(3600)
+
+    time.sleep(latency)
+
+    if outcome == 'crash':
+        sys.stdout.flush()
+        os.kill(os.getpid(), signal.SIGKILL)
+    if outcome == 'fail':
+        print("Error: source file could not be loaded", file=sys.stderr)
+        return int(os.environ.get('FAKE_SOFFICE_EXIT_CODE', 1))
+
+    for source in sources:
+        target = os.path.join(outdir, os.path.splitext(os.path.basename(source))[0] + '.pdf')
+        if outcome == 'ok':
+            with open(target, 'wb') as f:
+                f.write(pdf_document(f"Converted by fake_soffice: {os.path.basename(source)}"))
+        print(f"convert {source} -> {target} using filter : writer_pdf_Export")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
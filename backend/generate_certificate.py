@@ -1,10 +1,11 @@
-from docx import Document
 from datetime import datetime
 from docx2pdf import convert
 import os
 import sys
 import json
 
+import template_registry
+
 def generate_certificate(name, domain, start_date, end_date, gender):
     """
     Generate a certificate with the provided details
@@ -16,12 +17,8 @@ def generate_certificate(name, domain, start_date, end_date, gender):
 
         issued_date = datetime.today().strftime('%B %d, %Y')
 
-        # === Load and fill Word document ===
-        template_path = "SpectoV_Cert.docx"
-        if not os.path.exists(template_path):
-            raise FileNotFoundError(f"Certificate template not found: {template_path}")
-            
-        doc = Document(template_path)
+        # === Load and fill Word document (this domain's template) ===
+        doc = template_registry.registry.get(domain).document()
 
         # Replace placeholders in all paragraphs
         for para in doc.paragraphs:
@@ -0,0 +1,52 @@
+"""
+Gunicorn configuration of the certificate service
+Workers, threads and timeouts come from host_sizing's startup calibration
+(CPUs, memory limit and one sample conversion) instead of fixed flags:
+
+    gunicorn -c backend/gunicorn.conf.py certificate_service:app
+
+WEB_CONCURRENCY, CERTIFICATE_THREADS, CERTIFICATE_LIBREOFFICE_TIMEOUT and
+CERTIFICATE_REQUEST_TIMEOUT still override the calibrated values, and
+CERTIFICATE_CALIBRATE=0 skips the sample conversion.
+
+Workers over their RSS limits (memory_guard) are recycled gracefully from the
+post_request hook instead of after a fixed max_requests.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import host_sizing
+
+plan = host_sizing.apply(host_sizing.calibrate())
+
+# Imported after the plan is applied: its default RSS limits are this plan's per-worker share
+import memory_guard
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+workers = int(os.environ['WEB_CONCURRENCY'])
+threads = int(os.environ['CERTIFICATE_THREADS'])
+timeout = int(os.environ['CERTIFICATE_REQUEST_TIMEOUT'])
+graceful_timeout = timeout
+
+def on_starting(server):
+    server.log.info("Host sizing: %d workers x %d threads, converter pool %d, converter timeout %ds, "
+                    "request timeout %ds (%s CPUs, %s MB memory, sample conversion %s)",
+                    workers, threads, plan["converter_pool"], plan["converter_timeout"], timeout,
+                    plan["cpus"], plan["memory_mb"], plan["sample_conversion"])
+    server.log.info("Worker RSS limits: soft %s MB, hard %s MB",
+                    memory_guard.guard.soft_mb, memory_guard.guard.hard_mb)
+
+def post_worker_init(worker):
+    # This master replaces the worker when it retires, so over the hard limit it may refuse work
+    memory_guard.guard.worker = worker
+
+def post_request(worker, req, environ, resp):
+    memory_guard.guard.recycle_if_requested(worker)
+
+def worker_exit(server, worker):
+    stats = memory_guard.guard.stats()
+    server.log.info("Worker %d exiting after %d requests: RSS %s MB (peak %s MB), recycled: %s",
+                    stats["pid"], stats["requests"], stats["rss_mb"], stats["peak_rss_mb"],
+                    stats["recycle_requested"] or "no")
@@ -0,0 +1,286 @@
+"""
+Host-aware sizing of the certificate service
+At startup (from gunicorn.conf.py, in the gunicorn master) the host is
+measured once:
+
+- usable CPUs: the affinity mask, capped by a cgroup CPU quota
+- memory: physical memory, capped by a cgroup memory limit
+- the cost of one sample conversion: wall time and peak memory of the
+  converter on the certificate template
+
+From these the sizing plan derives how many conversions the host can run at
+once (each sync worker converts one certificate at a time, so this is also
+the worker count), the converter timeout and the request timeout. The plan
+is logged, handed to the workers through CERTIFICATE_* environment
+variables (explicitly set variables always win) and shown by /health, so the
+same image fits the free plan and larger instances.
+"""
+import os
+import json
+import math
+import time
+import shutil
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+# Set to 0 to skip the sample conversion (the defaults below are used instead)
+CALIBRATE = os.environ.get('CERTIFICATE_CALIBRATE', '1').lower() not in ('0', 'false', 'no', 'off')
+
+# Longest the sample conversion may take (seconds)
+CALIBRATION_TIMEOUT = float(os.environ.get('CERTIFICATE_CALIBRATION_TIMEOUT', 120))
+
+# Memory of one worker process without conversions, and of one conversion when
+# it could not be measured (MB)
+WORKER_MEMORY_MB = int(os.environ.get('CERTIFICATE_WORKER_MEMORY_MB', 120))
+DEFAULT_CONVERSION_MEMORY_MB = 300
+
+# Fraction of the memory limit the service plans to use; the rest is headroom
+MEMORY_BUDGET_FRACTION = 0.8
+
+# Upper bound on workers, whatever the host
+MAX_WORKERS = int(os.environ.get('CERTIFICATE_MAX_WORKERS', 8))
+
+# Converter timeout: this many times the sample conversion, within the bounds
+TIMEOUT_FACTOR = 6
+MIN_CONVERTER_TIMEOUT = 10
+MAX_CONVERTER_TIMEOUT = 120
+DEFAULT_CONVERTER_TIMEOUT = 30
+
+# Request threads per worker (rendering and sending overlap with conversions)
+THREADS_PER_WORKER = int(os.environ.get('CERTIFICATE_THREADS', 4))
+
+# Environment variable carrying the plan from the gunicorn master to its workers
+PLAN_ENV = 'CERTIFICATE_SIZING'
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+# cgroup v1 reports "no limit" as a huge page-aligned number
+UNLIMITED_BYTES = 1 << 60
+
+DEFAULT_CONVERTERS = ('soffice', 'libreoffice')
+
+_plan = None
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def cgroup_cpu_limit(root=CGROUP_ROOT):
+    """
+    CPUs allowed by the cgroup CPU quota, or None without a quota
+    """
+    quota = _read(os.path.join(root, 'cpu.max'))
+    if quota is not None:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        limit, _, period = quota.partition(' ')
+        if limit != 'max' and period:
+            return int(limit) / int(period)
+        return None
+
+    limit = _read(os.path.join(root, 'cpu', 'cpu.cfs_quota_us'))
+    period = _read(os.path.join(root, 'cpu', 'cpu.cfs_period_us'))
+    if limit and period and int(limit) > 0:
+        return int(limit) / int(period)
+    return None
+
+def cgroup_memory_limit(root=CGROUP_ROOT):
+    """
+    Bytes allowed by the cgroup memory limit, or None without a limit
+    """
+    for path in (os.path.join(root, 'memory.max'), os.path.join(root, 'memory', 'memory.limit_in_bytes')):
+        limit = _read(path)
+        if limit is None:
+            continue
+        if limit == 'max' or int(limit) >= UNLIMITED_BYTES:
+            return None
+        return int(limit)
+    return None
+
+def available_cpus(root=CGROUP_ROOT):
+    """
+    CPUs this process may use (fractional quotas round up to a whole CPU)
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_limit(root)
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+def available_memory_mb(root=CGROUP_ROOT):
+    """
+    Memory this process tree may use (MB), or None if unknown
+    """
+    limits = [cgroup_memory_limit(root)]
+    try:
+        limits.append(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))
+    except (AttributeError, ValueError, OSError):
+        pass
+    limits = [limit for limit in limits if limit]
+    return min(limits) // (1024 * 1024) if limits else None
+
+def find_converter():
+    """
+    The first LibreOffice executable found, honouring CERTIFICATE_LIBREOFFICE_COMMANDS
+    """
+    commands = os.environ.get('CERTIFICATE_LIBREOFFICE_COMMANDS')
+    for command in (commands.split(os.pathsep) if commands else DEFAULT_CONVERTERS):
+        path = shutil.which(command)
+        if path:
+            return path
+    return None
+
+def _children_peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024 if RESOURCE_AVAILABLE else 0.0
+
+def sample_conversion(source_docx=None, converter=None, timeout=None):
+    """
+    Convert one document with the converter and measure it
+    Returns {"converter", "seconds", "peak_memory_mb"}, or None if no
+    converter is installed or the conversion failed.
+    """
+    from converter_supervisor import supervisor
+
+    converter = converter or find_converter()
+    if converter is None:
+        return None
+    if source_docx is None:
+        import template_registry
+        source_docx = template_registry.registry.resolve()
+
+    timeout = CALIBRATION_TIMEOUT if timeout is None else timeout
+    workdir = tempfile.mkdtemp(prefix='calibration_')
+    try:
+        sample = os.path.join(workdir, 'sample.docx')
+        if os.path.exists(source_docx):
+            shutil.copyfile(source_docx, sample)
+        else:
+            # No template (yet): a one-page document still measures the converter's start-up and memory
+            from docx import Document
+            document = Document()
+            document.add_paragraph('This is to certify that the sample has completed the calibration.')
+            document.save(sample)
+        args = [
+            converter,
+            f'-env:UserInstallation=file://{os.path.join(workdir, "profile")}',
+            '--headless',
+            '--convert-to', 'pdf',
+            '--outdir', workdir,
+            sample
+        ]
+        peak_before = _children_peak_rss_mb()
+        started = time.perf_counter()
+        try:
+            returncode, _, _ = supervisor.run(args, timeout)
+        except Exception as e:
+            logger.warning("Sample conversion failed to run: %s", e, extra={"event": "calibration_failed"})
+            return None
+        seconds = time.perf_counter() - started
+
+        if returncode != 0 or not os.path.exists(os.path.join(workdir, 'sample.pdf')):
+            logger.warning("Sample conversion failed: return_code=%s", returncode,
+                           extra={"event": "calibration_failed"})
+            return None
+
+        # A new peak means this conversion was the largest child so far
+        peak = _children_peak_rss_mb()
+        return {
+            "converter": converter,
+            "seconds": round(seconds, 3),
+            "peak_memory_mb": round(peak, 1) if peak > peak_before else None
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def size_for(cpus, memory_mb, sample=None):
+    """
+    The sizing plan for a host with cpus CPUs, memory_mb MB (None: unknown)
+    and a sample conversion (None: not measured)
+    """
+    conversion_mb = DEFAULT_CONVERSION_MEMORY_MB
+    converter_timeout = DEFAULT_CONVERTER_TIMEOUT
+    if sample:
+        if sample.get("peak_memory_mb"):
+            conversion_mb = max(sample["peak_memory_mb"], 50)
+        converter_timeout = min(MAX_CONVERTER_TIMEOUT,
+                                max(MIN_CONVERTER_TIMEOUT, math.ceil(sample["seconds"] * TIMEOUT_FACTOR)))
+
+    # Conversions are CPU-bound: at most one per CPU, and as many as fit in memory
+    converter_pool = cpus
+    if memory_mb is not None:
+        budget_mb = memory_mb * MEMORY_BUDGET_FRACTION
+        converter_pool = min(converter_pool, int(budget_mb // (WORKER_MEMORY_MB + conversion_mb)))
+    converter_pool = max(1, min(converter_pool, MAX_WORKERS))
+
+    return {
+        "cpus": cpus,
+        "memory_mb": memory_mb,
+        "sample_conversion": sample,
+        "conversion_memory_mb": conversion_mb,
+        "converter_pool": converter_pool,
+        "workers": converter_pool,
+        "threads": THREADS_PER_WORKER,
+        "converter_timeout": converter_timeout,
+        # Room for one conversion queued ahead, the request's own one and rendering
+        "request_timeout": max(30, converter_timeout * 2 + 10)
+    }
+
+def calibrate():
+    """
+    Measure this host and return its sizing plan
+    """
+    sample = sample_conversion() if CALIBRATE else None
+    return size_for(available_cpus(), available_memory_mb(), sample)
+
+def apply(plan):
+    """
+    Hand the plan to worker processes through the environment
+    Variables that are already set are left alone; returns the plan with
+    the values that are in effect after overrides.
+    """
+    effective = dict(plan)
+    overrides = {
+        'WEB_CONCURRENCY': 'workers',
+        'CERTIFICATE_THREADS': 'threads',
+        'CERTIFICATE_LIBREOFFICE_TIMEOUT': 'converter_timeout',
+        'CERTIFICATE_REQUEST_TIMEOUT': 'request_timeout'
+    }
+    for variable, key in overrides.items():
+        if os.environ.get(variable):
+            effective[key] = int(os.environ[variable])
+            effective.setdefault("overridden", []).append(key)
+        else:
+            os.environ[variable] = str(plan[key])
+    os.environ[PLAN_ENV] = json.dumps(effective)
+
+    global _plan
+    _plan = effective
+    return effective
+
+def current():
+    """
+    The plan in effect: the one computed at startup, or (outside gunicorn)
+    one for this host without a sample conversion
+    """
+    global _plan
+    if _plan is None:
+        try:
+            _plan = json.loads(os.environ[PLAN_ENV])
+        except (KeyError, ValueError):
+            _plan = size_for(available_cpus(), available_memory_mb())
+            _plan["calibrated"] = False
+    return _plan
@@ -0,0 +1,261 @@
+"""
+Per-worker RSS guardrails
+Workers grow over time (python-docx object trees, reportlab state, allocator
+fragmentation). Instead of blind max_requests restarts, each worker watches
+its own resident set size:
+
+- soft limit: checked after every request. Above it the worker first
+  collects garbage; if it is still above, it is recycled gracefully: gunicorn
+  stops routing new connections to it, lets in-flight requests finish and
+  starts a fresh worker (the same mechanism max_requests uses).
+- hard limit: checked before every request. Above it a gunicorn worker
+  refuses new work with 503 + Retry-After (other workers, or the
+  replacement, take the retry) and is recycled as soon as its in-flight
+  requests are done. Without gunicorn nothing would replace the process, so
+  requests are not refused; the ASGI service shuts itself down gracefully
+  instead and is restarted by its process manager.
+
+Every recycle is counted by reason (soft / hard) in a small SQLite file
+(CERTIFICATE_RECYCLE_STATS_PATH) shared by all workers on the host, so
+/health shows them after the recycled worker is gone.
+
+Limits default to this worker's share of the memory budget from host_sizing
+(after the converters' share); CERTIFICATE_RSS_SOFT_LIMIT_MB and
+CERTIFICATE_RSS_HARD_LIMIT_MB override them, 0 disables a limit.
+"""
+import gc
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+import diagnostics
+import host_sizing
+
+logger = logging.getLogger(__name__)
+
+# Soft limit as a fraction of the hard limit, when only the hard one is known
+SOFT_LIMIT_FRACTION = 0.8
+
+# Smallest default hard limit: a fresh worker must fit well below it
+MIN_HARD_LIMIT_MB = 2 * host_sizing.WORKER_MEMORY_MB
+
+# Seconds a refused request is asked to wait before retrying
+RETRY_AFTER_SECONDS = 1
+
+RECYCLE_STATS_PATH = os.environ.get(
+    'CERTIFICATE_RECYCLE_STATS_PATH',
+    os.path.join(os.environ.get('CERTIFICATE_OUTPUT_DIR', 'static'), 'worker_recycles.db')
+)
+
+RECYCLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recycles (
+    reason TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    last_pid INTEGER NOT NULL,
+    last_rss_mb REAL,
+    last_requests INTEGER NOT NULL,
+    last_at REAL NOT NULL
+);
+"""
+
+class RecycleCounter:
+    """
+    Worker recycles per reason, kept in SQLite so they outlive the recycled worker
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(RECYCLE_SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def record(self, reason, rss, requests):
+        try:
+            self.connection().execute(
+                'INSERT INTO recycles VALUES (?, 1, ?, ?, ?, ?) '
+                'ON CONFLICT(reason) DO UPDATE SET count = count + 1, last_pid = excluded.last_pid, '
+                'last_rss_mb = excluded.last_rss_mb, last_requests = excluded.last_requests, '
+                'last_at = excluded.last_at',
+                (reason, os.getpid(), rss, requests, time.time())
+            )
+        except sqlite3.Error as e:
+            logger.warning("Could not record the worker recycle: %s", e)
+
+    def summary(self):
+        """
+        {"soft": {"count", "last_pid", ...}, "hard": {...}} for every recorded reason
+        """
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            rows = self.connection().execute(
+                'SELECT reason, count, last_pid, last_rss_mb, last_requests, last_at FROM recycles'
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("Recycle stats unavailable: %s", e)
+            return None
+        return {
+            reason: {"count": count, "last_pid": pid, "last_rss_mb": rss, "last_requests": requests,
+                     "last_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(at))}
+            for reason, count, pid, rss, requests, at in rows
+        }
+
+def default_limits(plan=None):
+    """
+    (soft, hard) RSS limits in MB for one worker of the plan (None: no limit)
+    """
+    plan = host_sizing.current() if plan is None else plan
+    if not plan.get("memory_mb"):
+        return None, None
+    budget_mb = plan["memory_mb"] * host_sizing.MEMORY_BUDGET_FRACTION
+    workers = max(1, plan["workers"])
+    share_mb = (budget_mb - plan["converter_pool"] * plan["conversion_memory_mb"]) / workers
+    hard = max(MIN_HARD_LIMIT_MB, int(share_mb))
+    return int(hard * SOFT_LIMIT_FRACTION), hard
+
+def _limit(variable, default):
+    value = os.environ.get(variable)
+    if value is None or value == '':
+        return default
+    return float(value) or None
+
+class MemoryGuard:
+    """
+    Soft / hard RSS limits of this worker process
+    """
+
+    def __init__(self, soft_mb=None, hard_mb=None, rss=diagnostics.current_rss_mb, counter=None):
+        self.soft_mb = soft_mb
+        self.hard_mb = hard_mb
+        self._rss = rss
+        self.counter = counter
+        # The gunicorn worker running this process (set from post_worker_init);
+        # only then is there a master to replace it, so refusing work makes sense
+        self.worker = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._stats = self._new_stats()
+
+    def _new_stats(self):
+        return {
+            "requests": 0,
+            "collections": 0,
+            "refused": 0,
+            "recycle_requested": None,
+            "peak_rss_mb": 0.0,
+            "started": time.time()
+        }
+
+    def _process_stats(self):
+        # A forked worker starts its own counts
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._stats = self._new_stats()
+        return self._stats
+
+    def _measure(self):
+        rss = self._rss()
+        if rss is not None:
+            stats = self._process_stats()
+            stats["peak_rss_mb"] = max(stats["peak_rss_mb"], rss)
+        return rss
+
+    def _request_recycle(self, reason, rss):
+        stats = self._process_stats()
+        if stats["recycle_requested"] is None:
+            stats["recycle_requested"] = reason
+            logger.warning("Recycling worker %d: RSS %.1f MB over the %s limit after %d requests",
+                           os.getpid(), rss, reason, stats["requests"],
+                           extra={"event": "worker_recycle", "reason": reason, "rss_mb": rss,
+                                  "requests": stats["requests"],
+                                  "uptime_seconds": round(time.time() - stats["started"], 1)})
+            if self.counter is not None:
+                self.counter.record(reason, rss, stats["requests"])
+
+    def admit(self):
+        """
+        True if a new request may start; False when over the hard limit in a
+        gunicorn worker (which is then replaced). Without gunicorn the recycle
+        is only requested: refusing would never end.
+        """
+        if self.hard_mb is None:
+            return True
+        rss = self._measure()
+        if rss is None or rss <= self.hard_mb:
+            return True
+        with self._lock:
+            self._request_recycle('hard', rss)
+            if self.worker is None:
+                return True
+            self._process_stats()["refused"] += 1
+        return False
+
+    def after_request(self):
+        """
+        Count a finished request and check the soft limit
+        Returns True if the worker should be recycled.
+        """
+        with self._lock:
+            stats = self._process_stats()
+            stats["requests"] += 1
+            if self.soft_mb is not None and stats["recycle_requested"] is None:
+                rss = self._measure()
+                if rss is not None and rss > self.soft_mb:
+                    # Often enough: cyclic python-docx trees waiting for a collection
+                    gc.collect()
+                    stats["collections"] += 1
+                    rss = self._measure()
+                    if rss is not None and rss > self.soft_mb:
+                        self._request_recycle('soft', rss)
+            return stats["recycle_requested"] is not None
+
+    def recycle_if_requested(self, worker):
+        """
+        Retire a gunicorn worker whose limit was crossed (from the post_request hook)
+        """
+        with self._lock:
+            requested = self._process_stats()["recycle_requested"] is not None
+        if requested and worker.alive:
+            # Stop accepting; gunicorn finishes in-flight requests and replaces the worker
+            worker.alive = False
+            return True
+        return False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._process_stats())
+        return {
+            "pid": os.getpid(),
+            "rss_mb": self._rss(),
+            "soft_limit_mb": self.soft_mb,
+            "hard_limit_mb": self.hard_mb,
+            **stats,
+            # Across all workers of the host, including recycled ones
+            "recycles": self.counter.summary() if self.counter is not None else None
+        }
+
+def create_guard():
+    """
+    The guard for this process, with limits from the environment or the sizing plan
+    """
+    soft, hard = default_limits()
+    hard = _limit('CERTIFICATE_RSS_HARD_LIMIT_MB', hard)
+    soft = _limit('CERTIFICATE_RSS_SOFT_LIMIT_MB', soft)
+    if soft is not None and hard is not None:
+        soft = min(soft, hard)
+    return MemoryGuard(soft, hard, counter=RecycleCounter(RECYCLE_STATS_PATH))
+
+guard = create_guard()
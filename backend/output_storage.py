@@ -0,0 +1,163 @@
+"""
+Pluggable storage for generated certificates
+Certificates are always produced in the local output directory first; the
+storage backend decides where they are kept and how a client downloads them:
+
+- "local": files stay on the local disk (the /app/static mount on Render)
+  and are downloaded through short-lived HMAC-signed /api/downloads URLs
+- "s3": files are uploaded to an S3-compatible bucket (AWS S3, MinIO, ...)
+  and downloaded through presigned URLs straight from the bucket
+
+With signed URLs the proxy only forwards a small JSON body or redirect, so
+its CPU and memory stay flat however large the certificates get.
+"""
+import os
+import hmac
+import time
+import hashlib
+import logging
+import secrets
+
+logger = logging.getLogger(__name__)
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+    BOTO3_AVAILABLE = True
+except ImportError:
+    BOTO3_AVAILABLE = False
+
+# Which backend to use: "local" or "s3"
+STORAGE_BACKEND = os.environ.get('CERTIFICATE_STORAGE', 'local').lower()
+
+# Lifetime of signed download URLs (seconds)
+SIGNED_URL_TTL = int(os.environ.get('CERTIFICATE_URL_TTL', 300))
+
+# Secret for signing local download URLs. It must be shared by all workers;
+# without it each worker signs with its own random key.
+URL_SECRET = os.environ.get('CERTIFICATE_URL_SECRET')
+if not URL_SECRET:
+    URL_SECRET = secrets.token_hex(32)
+    logger.warning("CERTIFICATE_URL_SECRET not set. Signed download URLs only work within this worker.")
+
+# Optional absolute base for local download URLs (e.g. "https://certs.example.com")
+PUBLIC_BASE_URL = os.environ.get('CERTIFICATE_PUBLIC_BASE_URL', '').rstrip('/')
+
+def sign(filename, expires):
+    """
+    HMAC signature of a local download URL
+    """
+    message = f"{filename}:{expires}".encode()
+    return hmac.new(URL_SECRET.encode(), message, hashlib.sha256).hexdigest()
+
+def file_digest(path):
+    """
+    SHA-256 hex digest of a file's contents
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class LocalStorage:
+    """
+    Certificates stay in the local output directory
+    """
+    name = 'local'
+
+    def store(self, path):
+        """
+        Nothing to do: files are produced in the output directory
+        """
+        return os.path.basename(path)
+
+    def signed_url(self, path, ttl=None):
+        filename = os.path.basename(path)
+        expires = int(time.time()) + (ttl or SIGNED_URL_TTL)
+        return f"{PUBLIC_BASE_URL}/api/downloads/{filename}?expires={expires}&signature={sign(filename, expires)}", expires
+
+    def verify(self, filename, expires, signature):
+        """
+        Check a signed local download URL
+        Returns True if the signature is valid and unexpired
+        """
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        if expires < time.time() or not signature:
+            return False
+        return hmac.compare_digest(sign(filename, expires), signature)
+
+class S3Storage:
+    """
+    Certificates are uploaded to an S3-compatible bucket
+    """
+    name = 's3'
+
+    def __init__(self, bucket, prefix='certificates/', endpoint_url=None, region=None):
+        if not BOTO3_AVAILABLE:
+            raise RuntimeError("boto3 is required for the s3 storage backend")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self._uploaded = set()
+
+    def key(self, path):
+        return self.prefix + os.path.basename(path)
+
+    def store(self, path):
+        """
+        Upload a certificate unless the bucket already holds these bytes
+        A certificate re-rendered under the same name (after a template change)
+        has a different digest, so its object is overwritten.
+        """
+        key = self.key(path)
+        stat = os.stat(path)
+        version = (key, stat.st_mtime_ns, stat.st_size)
+        if version in self._uploaded:
+            return key
+        digest = file_digest(path)
+        try:
+            current = self.client.head_object(Bucket=self.bucket, Key=key).get('Metadata', {}).get('sha256') == digest
+        except ClientError:
+            current = False
+        if not current:
+            self.client.upload_file(path, self.bucket, key, ExtraArgs={'Metadata': {'sha256': digest}})
+            logger.info("Uploaded %s to s3://%s/%s", path, self.bucket, key, extra={"event": "storage_upload"})
+        self._uploaded.add(version)
+        return key
+
+    def signed_url(self, path, ttl=None):
+        ttl = ttl or SIGNED_URL_TTL
+        key = self.store(path)
+        url = self.client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.bucket,
+                'Key': key,
+                'ResponseContentDisposition': f'attachment; filename="{os.path.basename(path)}"'
+            },
+            ExpiresIn=ttl
+        )
+        return url, int(time.time()) + ttl
+
+    def verify(self, filename, expires, signature):
+        """
+        Bucket downloads never go through the service
+        """
+        return False
+
+def create_storage():
+    """
+    Build the configured storage backend
+    """
+    if STORAGE_BACKEND == 's3':
+        return S3Storage(
+            bucket=os.environ['CERTIFICATE_S3_BUCKET'],
+            prefix=os.environ.get('CERTIFICATE_S3_PREFIX', 'certificates/'),
+            endpoint_url=os.environ.get('CERTIFICATE_S3_ENDPOINT_URL'),
+            region=os.environ.get('CERTIFICATE_S3_REGION')
+        )
+    return LocalStorage()
@@ -0,0 +1,150 @@
+"""
+Print-ready merged PDFs of many certificates
+Pages of already issued certificate PDFs are copied into one document as page
+objects: nothing is re-rendered or re-converted. Certificates from the same
+template embed the same fonts, background images and graphics states, so
+after copying every page resource is replaced by a single shared copy of
+each distinct object. A 500-certificate booklet then stays close to the size
+of one certificate plus each page's text and QR code.
+"""
+import os
+import time
+import uuid
+import hashlib
+import logging
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pikepdf
+    PIKEPDF_AVAILABLE = True
+except ImportError:
+    PIKEPDF_AVAILABLE = False
+
+# Page resource categories whose entries are shared between pages when identical
+RESOURCE_CATEGORIES = ('/Font', '/XObject', '/ExtGState', '/ColorSpace', '/Pattern', '/Shading', '/Properties')
+
+# Dictionary entries that do not describe the object itself
+IGNORED_KEYS = ('/Length', '/Parent')
+
+class ResourceHasher:
+    """
+    Structural hash of PDF objects: equal hashes mean interchangeable objects
+    Streams are hashed by their encoded bytes and dictionary, containers
+    recursively; indirect objects are hashed once.
+    """
+
+    def __init__(self):
+        self._memo = {}
+
+    def __call__(self, obj):
+        return self._hash(obj).hexdigest()
+
+    def _hash(self, obj):
+        objgen = obj.objgen if isinstance(obj, pikepdf.Object) and obj.is_indirect else None
+        if objgen is not None:
+            cached = self._memo.get(objgen)
+            if cached is not None:
+                return cached.copy()
+            # Placeholder against reference cycles
+            self._memo[objgen] = hashlib.sha256(f"cycle {objgen}".encode())
+
+        digest = hashlib.sha256()
+        if isinstance(obj, pikepdf.Stream):
+            digest.update(b'stream')
+            digest.update(obj.read_raw_bytes())
+            self._update_dictionary(digest, obj.stream_dict)
+        elif isinstance(obj, pikepdf.Dictionary):
+            digest.update(b'dict')
+            self._update_dictionary(digest, obj)
+        elif isinstance(obj, pikepdf.Array):
+            digest.update(b'array')
+            for item in obj:
+                digest.update(self._hash(item).digest())
+        else:
+            digest.update(repr(obj).encode())
+
+        if objgen is not None:
+            self._memo[objgen] = digest.copy()
+        return digest
+
+    def _update_dictionary(self, digest, dictionary):
+        for key in sorted(dictionary.keys()):
+            if key in IGNORED_KEYS:
+                continue
+            digest.update(key.encode())
+            digest.update(self._hash(dictionary[key]).digest())
+
+def share_resources(pdf):
+    """
+    Point every page at one copy of each distinct font, image, form, ...
+    Returns the number of resource references redirected to a shared copy
+    """
+    hasher = ResourceHasher()
+    canonical = {}
+    shared = 0
+
+    for page in pdf.pages:
+        resources = page.obj.get('/Resources')
+        if not isinstance(resources, pikepdf.Dictionary):
+            continue
+        for category in RESOURCE_CATEGORIES:
+            entries = resources.get(category)
+            if not isinstance(entries, pikepdf.Dictionary):
+                continue
+            for name in list(entries.keys()):
+                resource = entries[name]
+                if not resource.is_indirect:
+                    continue
+                original = canonical.setdefault(hasher(resource), resource)
+                if original.objgen != resource.objgen:
+                    entries[name] = original
+                    shared += 1
+
+    return shared
+
+def merge_pdfs(pdf_paths, output_pdf):
+    """
+    Concatenate the pages of pdf_paths (in order) into output_pdf, sharing identical resources
+    Returns a stats dict
+    """
+    if not PIKEPDF_AVAILABLE:
+        raise RuntimeError("pikepdf is not installed; merged PDFs are unavailable")
+
+    wall_start = time.perf_counter()
+    scratch = f"{output_pdf}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        # Copied pages read their streams from the source files until the merged file is saved
+        with contextlib.ExitStack() as sources, pikepdf.new() as merged:
+            for path in pdf_paths:
+                source = sources.enter_context(pikepdf.open(path))
+                merged.pages.extend(source.pages)
+
+            pages = len(merged.pages)
+            shared = share_resources(merged)
+            merged.remove_unreferenced_resources()
+            merged.save(
+                scratch,
+                compress_streams=True,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                deterministic_id=True
+            )
+        os.replace(scratch, output_pdf)
+    finally:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+
+    stats = {
+        "documents": len(pdf_paths),
+        "pages": pages,
+        "shared_resources": shared,
+        "bytes_in": sum(os.path.getsize(path) for path in pdf_paths),
+        "bytes_out": os.path.getsize(output_pdf),
+        "wall_seconds": round(time.perf_counter() - wall_start, 4)
+    }
+
+    logger.info("Merged %d PDFs into %s: %d -> %d bytes, %d shared resources, %.2fs",
+                stats["documents"], output_pdf, stats["bytes_in"], stats["bytes_out"], shared,
+                stats["wall_seconds"], extra={"event": "pdf_merged"})
+    return stats
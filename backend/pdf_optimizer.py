@@ -0,0 +1,232 @@
+"""
+Optional post-processing of generated certificate PDFs
+Deduplicates images, recompresses streams, packs objects into object streams
+and linearizes the file for fast web view. Fonts can additionally be subset
+with Ghostscript when it is installed.
+
+Enable with CERTIFICATE_OPTIMIZE_PDF=1. Every run reports the size change
+and the CPU time it cost, so the stage can be switched on only where
+bandwidth matters more than CPU. The CPU time is the optimizing thread's own
+plus that of its Ghostscript child, so concurrent requests do not inflate it.
+"""
+import os
+import time
+import shutil
+import hashlib
+import logging
+import subprocess
+import threading
+
+from structured_logging import bounded
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pikepdf
+    PIKEPDF_AVAILABLE = True
+except ImportError:
+    PIKEPDF_AVAILABLE = False
+    logger.warning("pikepdf not available. PDF optimization is disabled.")
+
+def _env_flag(name, default='0'):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+# Run the optimization stage on every issued certificate
+OPTIMIZE_PDF = _env_flag('CERTIFICATE_OPTIMIZE_PDF')
+
+# Linearize ("fast web view") the optimized PDF
+LINEARIZE_PDF = _env_flag('CERTIFICATE_LINEARIZE_PDF', '1')
+
+# Subset embedded fonts with Ghostscript (only if gs is installed)
+SUBSET_FONTS = _env_flag('CERTIFICATE_SUBSET_FONTS')
+GHOSTSCRIPT_TIMEOUT = 30
+
+_stats_lock = threading.Lock()
+_totals = {
+    "optimized": 0,
+    "failed": 0,
+    "bytes_before": 0,
+    "bytes_after": 0,
+    "cpu_seconds": 0.0
+}
+
+def run_measured(args, timeout):
+    """
+    Run a child process to completion, measuring only that child
+    Returns (returncode, stderr, cpu_seconds); returncode is None if the child
+    was killed for running longer than timeout seconds.
+    """
+    process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        stderr = process.stderr.read()
+        # wait4 reaps exactly this child and returns its own resource usage,
+        # unlike RUSAGE_CHILDREN, which sums every child the process has reaped
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    finally:
+        timer.cancel()
+        process.stderr.close()
+    return (None if timed_out.is_set() else process.returncode), stderr, usage.ru_utime + usage.ru_stime
+
+def subset_fonts(input_pdf, output_pdf):
+    """
+    Rewrite the PDF with Ghostscript so only the used glyphs of each font are embedded
+    Returns the CPU seconds Ghostscript used, or None if subsetting failed
+    """
+    gs = shutil.which('gs')
+    if not gs:
+        logger.info("Ghostscript not found, skipping font subsetting")
+        return None
+
+    returncode, stderr, cpu_seconds = run_measured([
+        gs, '-q', '-dNOPAUSE', '-dBATCH', '-dSAFER',
+        '-sDEVICE=pdfwrite',
+        '-dSubsetFonts=true',
+        '-dCompressFonts=true',
+        '-dDetectDuplicateImages=true',
+        f'-sOutputFile={output_pdf}',
+        input_pdf
+    ], GHOSTSCRIPT_TIMEOUT)
+
+    if returncode is None:
+        logger.warning("Ghostscript font subsetting timed out: %s", input_pdf)
+        return None
+    if returncode != 0:
+        logger.warning("Ghostscript font subsetting failed: %s", bounded(stderr.strip()))
+        return None
+    return cpu_seconds if os.path.exists(output_pdf) else None
+
+def _image_key(image):
+    """
+    Identity of an image XObject: its encoded bytes plus the entries that affect decoding
+    """
+    digest = hashlib.sha256(image.read_raw_bytes())
+    for key in ('/Filter', '/DecodeParms', '/Width', '/Height', '/ColorSpace',
+                '/BitsPerComponent', '/SMask', '/Mask', '/Decode'):
+        if key in image:
+            value = image[key]
+            digest.update(key.encode())
+            digest.update(repr(value.objgen if isinstance(value, pikepdf.Stream) else value).encode())
+    return digest.hexdigest()
+
+def deduplicate_images(pdf):
+    """
+    Point every page at a single copy of each distinct image
+    Returns the number of duplicate references removed
+    """
+    canonical = {}
+    removed = 0
+
+    for page in pdf.pages:
+        xobjects = page.obj.get('/Resources', {}).get('/XObject')
+        if not xobjects:
+            continue
+        for name in list(xobjects.keys()):
+            xobject = xobjects[name]
+            if not isinstance(xobject, pikepdf.Stream) or xobject.get('/Subtype') != '/Image':
+                continue
+            key = _image_key(xobject)
+            original = canonical.setdefault(key, xobject)
+            if original.objgen != xobject.objgen:
+                xobjects[name] = original
+                removed += 1
+
+    return removed
+
+def optimize_pdf(pdf_path, certificate_id=None):
+    """
+    Optimize a PDF in place
+    Returns a stats dict, or None if the file was left untouched
+    """
+    if not PIKEPDF_AVAILABLE:
+        return None
+
+    label = certificate_id or os.path.basename(pdf_path)
+    bytes_before = os.path.getsize(pdf_path)
+    wall_start = time.perf_counter()
+    # Only this thread's CPU time: other requests run in the same process
+    cpu_start = time.thread_time()
+    subset_pdf = pdf_path + '.subset.pdf'
+    optimized_pdf = pdf_path + '.optimized.pdf'
+
+    try:
+        source_pdf = pdf_path
+        fonts_subset = False
+        ghostscript_cpu = 0.0
+        if SUBSET_FONTS:
+            subset_cpu = subset_fonts(pdf_path, subset_pdf)
+            if subset_cpu is not None:
+                source_pdf = subset_pdf
+                fonts_subset = True
+                ghostscript_cpu = subset_cpu
+
+        with pikepdf.open(source_pdf) as pdf:
+            duplicate_images = deduplicate_images(pdf)
+            pdf.remove_unreferenced_resources()
+            pdf.save(
+                optimized_pdf,
+                compress_streams=True,
+                recompress_flate=True,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                linearize=LINEARIZE_PDF,
+                # /ID from the content instead of a random one (reproducible output)
+                deterministic_id=True
+            )
+
+        os.replace(optimized_pdf, pdf_path)
+
+    except Exception as e:
+        logger.warning("PDF optimization failed for %s: %s", label, e)
+        with _stats_lock:
+            _totals["failed"] += 1
+        return None
+
+    finally:
+        for scratch in (subset_pdf, optimized_pdf):
+            if os.path.exists(scratch):
+                os.remove(scratch)
+
+    bytes_after = os.path.getsize(pdf_path)
+    stats = {
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "reduction_percent": round(100.0 * (bytes_before - bytes_after) / bytes_before, 1) if bytes_before else 0.0,
+        "duplicate_images": duplicate_images,
+        "fonts_subset": fonts_subset,
+        "linearized": LINEARIZE_PDF,
+        "cpu_seconds": round(time.thread_time() - cpu_start + ghostscript_cpu, 4),
+        "ghostscript_cpu_seconds": round(ghostscript_cpu, 4),
+        "wall_seconds": round(time.perf_counter() - wall_start, 4)
+    }
+
+    with _stats_lock:
+        _totals["optimized"] += 1
+        _totals["bytes_before"] += bytes_before
+        _totals["bytes_after"] += bytes_after
+        _totals["cpu_seconds"] += stats["cpu_seconds"]
+
+    logger.info(
+        "Optimized PDF %s: %d -> %d bytes (%s%%), cpu=%ss, duplicate_images=%d, fonts_subset=%s",
+        label, bytes_before, bytes_after, stats['reduction_percent'], stats['cpu_seconds'],
+        duplicate_images, fonts_subset,
+        extra=dict(stats, event="pdf_optimized", certificate_id=certificate_id)
+    )
+    return stats
+
+def summary():
+    """
+    Totals across all optimized certificates, for the health endpoint
+    """
+    with _stats_lock:
+        totals = dict(_totals)
+    totals["enabled"] = OPTIMIZE_PDF and PIKEPDF_AVAILABLE
+    totals["cpu_seconds"] = round(totals["cpu_seconds"], 4)
+    return totals
@@ -0,0 +1,294 @@
+"""
+Optional digital signatures on issued certificate PDFs (tamper evidence)
+Every PDF gets an invisible adbe.pkcs7.detached signature, appended as an
+incremental update after normalization and optimization, so any later change
+to the file breaks it in every PDF viewer.
+
+Enable with CERTIFICATE_SIGNING_KEY (PEM private key) and
+CERTIFICATE_SIGNING_CERT (PEM certificate, optionally followed by its chain).
+Everything that does not depend on the document is done once per worker when
+the module is imported: the key and chain are loaded and parsed, the CMS
+builder is prepared with the signer and chain, and the signature dictionary
+and its /Contents placeholder are pre-rendered. Per certificate only the
+update objects, the digest and one private-key operation remain, and those
+run in the thread that converted the certificate, so signing scales with the
+convert workers. stats() reports the time signing adds per certificate.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+
+import deterministic_output
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pikepdf
+    PIKEPDF_AVAILABLE = True
+except ImportError:
+    PIKEPDF_AVAILABLE = False
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.serialization import pkcs7
+    CRYPTOGRAPHY_AVAILABLE = True
+except ImportError:
+    CRYPTOGRAPHY_AVAILABLE = False
+
+SIGNING_KEY = os.environ.get('CERTIFICATE_SIGNING_KEY')
+SIGNING_CERT = os.environ.get('CERTIFICATE_SIGNING_CERT')
+SIGNING_KEY_PASSWORD = os.environ.get('CERTIFICATE_SIGNING_KEY_PASSWORD')
+SIGNING_REASON = os.environ.get('CERTIFICATE_SIGNING_REASON', 'Certificate of completion issued by SpectoV')
+
+# Room left in /Contents beyond the measured signature size (bytes)
+CONTENTS_MARGIN = 256
+
+# Width reserved for each /ByteRange number, patched in place once offsets are known
+BYTE_RANGE_WIDTH = 10
+
+STARTXREF_PATTERN = re.compile(rb'startxref\s+(\d+)\s+%%EOF\s*$')
+
+class SigningError(Exception):
+    pass
+
+def _pdf_string(text):
+    return b'(' + text.encode('latin-1', 'replace').replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+class PdfSigner:
+    """
+    Signs PDFs with one key; construct once per process
+    """
+
+    def __init__(self, key_path, cert_path, password=None, reason=SIGNING_REASON, deterministic=True):
+        if not (PIKEPDF_AVAILABLE and CRYPTOGRAPHY_AVAILABLE):
+            raise SigningError("PDF signing needs pikepdf and cryptography")
+
+        started = time.perf_counter()
+        try:
+            with open(key_path, 'rb') as f:
+                self.key = serialization.load_pem_private_key(f.read(), password.encode() if password else None)
+            with open(cert_path, 'rb') as f:
+                chain = x509.load_pem_x509_certificates(f.read())
+        except (OSError, ValueError, TypeError) as e:
+            raise SigningError(f"Cannot load signing key material: {e}")
+        self.certificate = chain[0]
+
+        # Signed attributes carry the signing time; without them the same
+        # PDF always gets the same (RSA) signature bytes
+        self._options = [pkcs7.PKCS7Options.DetachedSignature, pkcs7.PKCS7Options.Binary]
+        if deterministic:
+            self._options.append(pkcs7.PKCS7Options.NoAttributes)
+        builder = pkcs7.PKCS7SignatureBuilder().add_signer(self.certificate, self.key, hashes.SHA256())
+        for certificate in chain[1:]:
+            builder = builder.add_certificate(certificate)
+        self._builder = builder
+
+        # The signature size is fixed for a key and chain: measure it once
+        contents_size = len(self._cms(b'')) + CONTENTS_MARGIN
+        self._contents_placeholder = b'<' + b'0' * (2 * contents_size) + b'>'
+        self._byte_range_placeholder = b'[' + b' '.join([b'0'] + [b' ' * BYTE_RANGE_WIDTH] * 3) + b']'
+
+        common_name = self.certificate.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)
+        self._signature_head = (
+            b'<< /Type /Sig /Filter /Adobe.PPKLite /SubFilter /adbe.pkcs7.detached'
+            + (b' /Name ' + _pdf_string(common_name[0].value) if common_name else b'')
+            + b' /Reason ' + _pdf_string(reason) + b' /M '
+        )
+
+        self._lock = threading.Lock()
+        self._stats = {
+            "signed": 0,
+            "failed": 0,
+            "seconds": 0.0,
+            "bytes_added": 0
+        }
+        self.load_seconds = time.perf_counter() - started
+        logger.info("Loaded PDF signing key for %s in %.1f ms", self.subject, 1000 * self.load_seconds,
+                    extra={"event": "signing_key_loaded"})
+
+    @property
+    def subject(self):
+        return self.certificate.subject.rfc4514_string()
+
+    def _cms(self, data):
+        return self._builder.set_data(data).sign(serialization.Encoding.DER, self._options)
+
+    def _update_objects(self, path):
+        """
+        The objects an incremental update adds or replaces to carry a signature
+        Returns (pdf bytes, [(objgen, body bytes or None for the signature)], trailer entries, xref is a stream)
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        match = STARTXREF_PATTERN.search(data[-1024:])
+        if not match:
+            raise SigningError("No startxref at the end of the PDF")
+        previous_xref = int(match.group(1))
+
+        with pikepdf.open(path) as pdf:
+            if pdf.is_encrypted:
+                raise SigningError("Encrypted PDFs are not signed")
+            page = pdf.pages[0].obj
+            signature = pdf.make_indirect(pikepdf.Dictionary())
+
+            acroform = pdf.Root.get('/AcroForm')
+            fields = list(acroform.get('/Fields', [])) if acroform is not None else []
+            field = pdf.make_indirect(pikepdf.Dictionary(
+                Type=pikepdf.Name.Annot, Subtype=pikepdf.Name.Widget, FT=pikepdf.Name.Sig,
+                T=pikepdf.String(f'Signature{len(fields) + 1}'), V=signature,
+                Rect=[0, 0, 0, 0], F=132, P=page
+            ))
+            entries = dict(acroform.items()) if acroform is not None else {}
+            entries.update({'/Fields': pikepdf.Array(fields + [field]), '/SigFlags': 3})
+            acroform = pdf.make_indirect(pikepdf.Dictionary(entries))
+            pdf.Root.AcroForm = acroform
+
+            changed = [field, acroform, pdf.Root]
+            annots = page.get('/Annots')
+            if annots is None:
+                page.Annots = pikepdf.Array([field])
+            else:
+                annots.append(field)
+                if annots.is_indirect:
+                    changed.append(annots)
+            if page.objgen not in {obj.objgen for obj in changed}:
+                changed.append(page)
+
+            objects = [(signature.objgen, None)]
+            objects += [(obj.objgen, obj.unparse(resolved=True)) for obj in changed]
+            trailer = {"Size": int(pdf.trailer.Size), "Root": pdf.Root.objgen, "Prev": previous_xref}
+            if '/ID' in pdf.trailer:
+                trailer["ID"] = pdf.trailer.ID.unparse()
+            if '/Info' in pdf.trailer:
+                trailer["Info"] = pdf.trailer.Info.objgen
+
+        return data, objects, trailer, not data[previous_xref:previous_xref + 4] == b'xref'
+
+    def _signed_bytes(self, path, signing_time):
+        data, objects, trailer, xref_stream = self._update_objects(path)
+        out = bytearray(data)
+        if not out.endswith(b'\n'):
+            out += b'\n'
+
+        offsets = {}
+        for (number, generation), body in objects:
+            offsets[number] = (len(out), generation)
+            out += b'%d %d obj\n' % (number, generation)
+            if body is None:
+                out += self._signature_head + _pdf_string(signing_time) + b' /ByteRange '
+                byte_range_at = len(out)
+                out += self._byte_range_placeholder + b' /Contents '
+                contents_at = len(out)
+                out += self._contents_placeholder + b' >>'
+            else:
+                out += body
+            out += b'\nendobj\n'
+
+        refs = b' /Root %d %d R' % trailer["Root"]
+        if "Info" in trailer:
+            refs += b' /Info %d %d R' % trailer["Info"]
+        if "ID" in trailer:
+            refs += b' /ID ' + trailer["ID"]
+
+        xref_at = len(out)
+        numbers = sorted(offsets)
+        if xref_stream:
+            # Files whose last xref is a stream (object streams) get a stream in the update too
+            xref_number = max(trailer["Size"], numbers[-1] + 1)
+            offsets[xref_number] = (xref_at, 0)
+            numbers.append(xref_number)
+            rows = b''.join(b'\x01' + offsets[n][0].to_bytes(4, 'big') + offsets[n][1].to_bytes(2, 'big')
+                            for n in numbers)
+            index = b' '.join(b'%d 1' % n for n in numbers)
+            out += (b'%d 0 obj\n<< /Type /XRef /Size %d /Prev %d /W [1 4 2] /Index [%s] /Length %d%s >>\nstream\n'
+                    % (xref_number, xref_number + 1, trailer["Prev"], index, len(rows), refs))
+            out += rows + b'\nendstream\nendobj\n'
+        else:
+            out += b'xref\n'
+            for number in numbers:
+                out += b'%d 1\n%010d %05d n \n' % (number, *offsets[number])
+            size = max(trailer["Size"], numbers[-1] + 1)
+            out += b'trailer\n<< /Size %d /Prev %d%s >>\n' % (size, trailer["Prev"], refs)
+        out += b'startxref\n%d\n%%%%EOF\n' % xref_at
+
+        # Sign everything but the /Contents hex string
+        contents_end = contents_at + len(self._contents_placeholder)
+        byte_range = b'0 %d %d %d' % (contents_at, contents_end, len(out) - contents_end)
+        out[byte_range_at:byte_range_at + len(self._byte_range_placeholder)] = \
+            b'[' + byte_range.ljust(len(self._byte_range_placeholder) - 2) + b']'
+        signature = self._cms(bytes(out[:contents_at]) + bytes(out[contents_end:])).hex().encode()
+        if len(signature) + 2 > len(self._contents_placeholder):
+            raise SigningError("Signature does not fit the reserved /Contents")
+        out[contents_at + 1:contents_at + 1 + len(signature)] = signature
+        return out, len(out) - len(data)
+
+    def sign(self, path, signing_time=None):
+        """
+        Sign a PDF in place
+        signing_time is a PDF date ("D:20240331000000Z"); defaults to now.
+        """
+        started = time.perf_counter()
+        signing_time = signing_time or datetime.now(timezone.utc).strftime("D:%Y%m%d%H%M%SZ")
+        scratch = f"{path}.signing"
+        try:
+            signed, added = self._signed_bytes(path, signing_time)
+            with open(scratch, 'wb') as f:
+                f.write(signed)
+            os.replace(scratch, path)
+        except Exception as e:
+            with self._lock:
+                self._stats["failed"] += 1
+            if isinstance(e, SigningError):
+                raise
+            raise SigningError(f"Cannot sign {os.path.basename(path)}: {e}")
+        finally:
+            if os.path.exists(scratch):
+                os.remove(scratch)
+
+        with self._lock:
+            self._stats["signed"] += 1
+            self._stats["seconds"] += time.perf_counter() - started
+            self._stats["bytes_added"] += added
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            "subject": self.subject,
+            "key_load_ms": round(1000 * self.load_seconds, 2),
+            "signed": stats["signed"],
+            "failed": stats["failed"],
+            "avg_ms": round(1000 * stats["seconds"] / stats["signed"], 2) if stats["signed"] else 0.0,
+            "avg_bytes_added": stats["bytes_added"] // stats["signed"] if stats["signed"] else 0
+        }
+
+def create_signer():
+    """
+    The process-wide signer from the environment, or None if signing is off
+    """
+    if not (SIGNING_KEY and SIGNING_CERT):
+        return None
+    return PdfSigner(SIGNING_KEY, SIGNING_CERT, SIGNING_KEY_PASSWORD, deterministic=deterministic_output.DETERMINISTIC)
+
+signer = create_signer()
+
+def enabled():
+    return signer is not None
+
+def sign(path, signing_time=None):
+    """
+    Sign a PDF in place with the process-wide signer
+    """
+    signer.sign(path, signing_time)
+
+def summary():
+    """
+    Signing stats for the health endpoint
+    """
+    if signer is None:
+        return {"enabled": False}
+    return dict(signer.stats(), enabled=True)
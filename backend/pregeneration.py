@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Inbox pre-generation daemon: warm the certificate cache before students ask
+Watches an inbox directory for roster files and issues every certificate on
+them into the service's output cache, through the bulk render -> convert
+pipeline, at low CPU priority and optionally only inside a time window. When
+a student later asks for the certificate, on any day, it is a cache hit: a
+request without an issued date gets the one the certificate was pre-generated
+with (recorded in the certificate registry).
+
+Rosters are CSV files with a header row (name, domain, start_date, end_date,
+gender and optionally issued_date; "Start Date" style headers work too) or
+JSON files holding a list of entries or {"certificates": [...],
+"issued_date": ..., "format": ...}. Rows without an issued_date get the
+roster's, or the date the roster was first processed.
+
+Progress and failures are written to <roster>.manifest.json next to the
+roster: status, counts and, per row, the certificate ID and download URL or
+the error. A roster is processed again when its content changes; a daemon
+restarted mid-roster resumes it (finished rows are cache hits).
+
+Usage:
+    python pregeneration.py                      # watch CERTIFICATE_INBOX_DIR
+    python pregeneration.py --window 22:00-06:00 --nice 15
+    python pregeneration.py --once               # process what is there and exit
+"""
+import os
+import csv
+import sys
+import json
+import time
+import signal
+import hashlib
+import logging
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+import certificate_service
+import certificate_registry
+import deterministic_output
+import request_schema
+
+logger = logging.getLogger(__name__)
+
+INBOX_DIR = os.environ.get('CERTIFICATE_INBOX_DIR', 'inbox')
+
+# How often the inbox is scanned (seconds)
+POLL_INTERVAL = float(os.environ.get('CERTIFICATE_INBOX_POLL_SECONDS', 10))
+
+# Local time window for pre-generation, e.g. "22:00-06:00" (unset: any time)
+WINDOW = os.environ.get('CERTIFICATE_PREGENERATE_WINDOW')
+
+# Niceness added to the daemon (and so to its converters)
+NICE = int(os.environ.get('CERTIFICATE_PREGENERATE_NICE', 10))
+
+# Rosters still being written are left alone until unchanged for this long (seconds)
+SETTLE_SECONDS = 2.0
+
+# Manifests are rewritten at most this often while a roster is processed (seconds)
+MANIFEST_INTERVAL = 2.0
+
+# Rows handed to the pipeline ahead of the one being recorded
+MAX_IN_FLIGHT = (certificate_service.RENDER_WORKERS + certificate_service.CONVERT_WORKERS
+                 + certificate_service.PIPELINE_QUEUE_SIZE)
+
+MAX_ROSTER_SIZE = int(os.environ.get('CERTIFICATE_MAX_ROSTER_SIZE', 50000))
+
+ROSTER_EXTENSIONS = ('.csv', '.json')
+MANIFEST_SUFFIX = '.manifest.json'
+
+class RosterError(Exception):
+    """
+    A roster file that cannot be read at all
+    """
+
+def parse_window(spec):
+    """
+    (start, end) datetime.time of a "HH:MM-HH:MM" window, or None for no window
+    """
+    if not spec:
+        return None
+    try:
+        start, end = (datetime.strptime(part.strip(), '%H:%M').time() for part in spec.split('-'))
+    except ValueError:
+        raise ValueError(f"Invalid time window {spec!r}: use HH:MM-HH:MM, e.g. 22:00-06:00")
+    return start, end
+
+def in_window(window, now=None):
+    """
+    True if now (local time) falls inside the window; windows may wrap midnight
+    """
+    if window is None:
+        return True
+    current = (now or datetime.now()).time()
+    start, end = window
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+def seconds_until_window(window, now=None):
+    """
+    Seconds until the window next opens (0 when it is open)
+    """
+    now = now or datetime.now()
+    if in_window(window, now):
+        return 0.0
+    opens = datetime.combine(now.date(), window[0])
+    if opens <= now:
+        opens += timedelta(days=1)
+    return (opens - now).total_seconds()
+
+def _column(header):
+    return header.strip().lower().replace(' ', '_').replace('-', '_')
+
+def read_roster(path):
+    """
+    (entries, options) of a roster; options may hold issued_date and format
+    Raises RosterError.
+    """
+    try:
+        if path.endswith('.json'):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            options = {}
+            if isinstance(data, dict):
+                options = {key: data[key] for key in ('issued_date', 'format') if data.get(key) is not None}
+                data = data.get('certificates')
+            if not isinstance(data, list):
+                raise RosterError("Expected a list of certificates or {\"certificates\": [...]}")
+            entries = data
+        else:
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                reader = csv.DictReader(f)
+                if not reader.fieldnames:
+                    raise RosterError("Empty roster")
+                entries = [{_column(key): value for key, value in row.items() if key is not None and value}
+                           for row in reader]
+            options = {}
+    except (OSError, UnicodeDecodeError, ValueError, csv.Error) as e:
+        raise RosterError(f"Cannot read roster: {e}")
+
+    if len(entries) > MAX_ROSTER_SIZE:
+        raise RosterError(f"Too many certificates: at most {MAX_ROSTER_SIZE} per roster")
+    return entries, options
+
+def manifest_path(roster_path):
+    return roster_path + MANIFEST_SUFFIX
+
+def load_manifest(roster_path):
+    try:
+        with open(manifest_path(roster_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_manifest(roster_path, manifest):
+    """
+    Replace the roster's manifest atomically
+    """
+    manifest["updated"] = datetime.now().isoformat(timespec='seconds')
+    path = manifest_path(roster_path)
+    scratch = f"{path}.{os.getpid()}.tmp"
+    with open(scratch, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(scratch, path)
+
+def fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class Pregenerator:
+    """
+    Issues the certificates of every roster in an inbox directory
+    """
+
+    def __init__(self, inbox=INBOX_DIR, window=None, stop_event=None):
+        self.inbox = inbox
+        self.window = window
+        self.stop_event = stop_event or threading.Event()
+
+    def pending_rosters(self):
+        """
+        Rosters that are new, changed since their manifest, or unfinished
+        """
+        if not os.path.isdir(self.inbox):
+            return []
+        pending = []
+        for name in sorted(os.listdir(self.inbox)):
+            path = os.path.join(self.inbox, name)
+            if (name.startswith('.') or name.endswith(MANIFEST_SUFFIX) or not name.lower().endswith(ROSTER_EXTENSIONS)
+                    or not os.path.isfile(path)):
+                continue
+            if time.time() - os.path.getmtime(path) < SETTLE_SECONDS:
+                continue
+            manifest = load_manifest(path)
+            if (manifest is None or manifest.get("fingerprint") != fingerprint(path)
+                    or manifest.get("status") not in ('done', 'failed')):
+                pending.append(path)
+        return pending
+
+    def wait_for_window(self, roster_path, manifest):
+        """
+        Block until the window opens; False if stopped meanwhile
+        """
+        delay = seconds_until_window(self.window)
+        if delay <= 0:
+            return True
+        manifest["status"] = "waiting"
+        write_manifest(roster_path, manifest)
+        logger.info("Outside the pre-generation window; waiting %.0fs", delay,
+                    extra={"event": "pregenerate_waiting", "roster": roster_path})
+        return not self.stop_event.wait(delay)
+
+    def process(self, roster_path):
+        """
+        Issue every certificate of one roster, keeping its manifest up to date
+        Returns the manifest.
+        """
+        previous = load_manifest(roster_path) or {}
+        roster_fingerprint = fingerprint(roster_path)
+        manifest = {
+            "roster": os.path.basename(roster_path),
+            "fingerprint": roster_fingerprint,
+            "status": "running",
+            "started": datetime.now().isoformat(timespec='seconds'),
+            "total": 0,
+            "completed": 0,
+            "failed": 0,
+            "certificates": []
+        }
+
+        try:
+            entries, options = read_roster(roster_path)
+        except RosterError as e:
+            manifest.update(status="failed", error=str(e))
+            write_manifest(roster_path, manifest)
+            logger.error("Roster %s rejected: %s", roster_path, e, extra={"event": "pregenerate_failed"})
+            return manifest
+
+        # A resumed roster keeps the issued date it started with, so its certificate IDs do not change
+        default_issued_date = options.get('issued_date')
+        if default_issued_date is not None:
+            default_issued_date = deterministic_output.parse_issued_date(str(default_issued_date))
+            if default_issued_date is None:
+                manifest.update(status="failed", error=f"Invalid issued_date: {options['issued_date']}")
+                write_manifest(roster_path, manifest)
+                return manifest
+        if default_issued_date is None and previous.get("fingerprint") == roster_fingerprint:
+            default_issued_date = previous.get("issued_date")
+        if default_issued_date is None:
+            default_issued_date = datetime.today().strftime('%B %d, %Y')
+        output_format = str(options.get('format', 'pdf')).lower()
+
+        manifest.update(total=len(entries), issued_date=default_issued_date, format=output_format)
+        if output_format not in certificate_service.FORMAT_MIMETYPES:
+            manifest.update(status="failed", error=f"Unsupported format: {output_format}")
+            write_manifest(roster_path, manifest)
+            return manifest
+
+        write_manifest(roster_path, manifest)
+        logger.info("Pre-generating %d certificates from %s", len(entries), roster_path,
+                    extra={"event": "pregenerate_started", "roster": roster_path, "total": len(entries)})
+
+        # Rows go through the service's render -> convert pipeline, a few at a time,
+        # so rendering the next rows overlaps converting the current one
+        in_flight = deque()
+        last_write = time.monotonic()
+
+        def record_oldest():
+            row, fields, future = in_flight.popleft()
+            record = {"row": row}
+            try:
+                certificate_id, output_path = future.result()
+                certificate_registry.record_pregenerated(fields['name'], fields['domain'], fields['start_date'],
+                                                         fields['end_date'], fields['gender'], fields['issued_date'])
+                record.update(name=fields['name'], certificate_id=certificate_id,
+                              url=f"/api/certificates/{certificate_id}?format={output_format}")
+                manifest["completed"] += 1
+            except Exception as e:
+                record["error"] = str(e)
+                manifest["failed"] += 1
+                logger.warning("Roster %s row %d failed: %s", roster_path, row, e,
+                               extra={"event": "pregenerate_row_failed"})
+            manifest["certificates"].append(record)
+
+        for row, entry in enumerate(entries, start=1):
+            if self.stop_event.is_set() or not self.wait_for_window(roster_path, manifest):
+                while in_flight:
+                    record_oldest()
+                manifest["status"] = "paused"
+                write_manifest(roster_path, manifest)
+                return manifest
+            manifest["status"] = "running"
+
+            fields = None
+            try:
+                if isinstance(entry, dict) and not entry.get('issued_date'):
+                    entry = dict(entry, issued_date=default_issued_date)
+                fields = request_schema.normalize_certificate(entry)
+                future = certificate_service.bulk_pipeline.submit((fields, output_format))
+            except request_schema.ValidationError as e:
+                future = Future()
+                future.set_exception(e)
+            in_flight.append((row, fields, future))
+
+            while len(in_flight) > MAX_IN_FLIGHT:
+                record_oldest()
+            if time.monotonic() - last_write >= MANIFEST_INTERVAL:
+                write_manifest(roster_path, manifest)
+                last_write = time.monotonic()
+
+        while in_flight:
+            record_oldest()
+
+        manifest.update(status="done", finished=datetime.now().isoformat(timespec='seconds'))
+        write_manifest(roster_path, manifest)
+        logger.info("Pre-generated %s: %d issued, %d failed", roster_path, manifest["completed"], manifest["failed"],
+                    extra={"event": "pregenerate_done", "roster": roster_path,
+                           "completed": manifest["completed"], "failed": manifest["failed"]})
+        return manifest
+
+    def run_once(self):
+        """
+        Process every pending roster; returns their manifests
+        """
+        manifests = []
+        for roster_path in self.pending_rosters():
+            if self.stop_event.is_set():
+                break
+            manifests.append(self.process(roster_path))
+        return manifests
+
+    def run(self, poll_interval=POLL_INTERVAL):
+        """
+        Watch the inbox until stopped
+        """
+        os.makedirs(self.inbox, exist_ok=True)
+        logger.info("Watching %s for rosters (window: %s)", os.path.abspath(self.inbox), self.window or "any time",
+                    extra={"event": "pregenerate_watching"})
+        while not self.stop_event.is_set():
+            self.run_once()
+            self.stop_event.wait(poll_interval)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--inbox', default=INBOX_DIR, help="directory watched for roster files")
+    parser.add_argument('--window', default=WINDOW, help="only pre-generate between these local times, e.g. 22:00-06:00")
+    parser.add_argument('--nice', type=int, default=NICE, help="niceness added to this process and its converters")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, help="seconds between inbox scans")
+    parser.add_argument('--once', action='store_true', help="process the pending rosters and exit")
+    args = parser.parse_args(argv)
+
+    try:
+        window = parse_window(args.window)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.nice and hasattr(os, 'nice'):
+        os.nice(args.nice)
+
+    stop_event = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        # Finish the current certificate, record the manifest as paused and exit
+        signal.signal(signum, lambda *_: stop_event.set())
+
+    pregenerator = Pregenerator(args.inbox, window, stop_event)
+    if args.once:
+        manifests = pregenerator.run_once()
+        return 0 if all(manifest["status"] == 'done' for manifest in manifests) else 1
+    pregenerator.run(args.poll_interval)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+Per-client rate limiting of the generation endpoints
+Every generated certificate can cost a multi-second conversion, so one
+client looping on the API could keep every worker busy. Each client gets a
+token bucket measured in conversions rather than requests: a PDF costs one
+token, a DOCX (no conversion) a quarter, a preview a little more than a PDF,
+and a batch the sum of its certificates. The bucket holds up to
+CERTIFICATE_RATE_LIMIT_BURST tokens and refills at CERTIFICATE_RATE_LIMIT
+tokens per minute. A request larger than the whole bucket (a big batch) is
+let through when the bucket is full and leaves it in debt, so the client
+waits for the refill afterwards.
+
+Clients are identified by an API key from CERTIFICATE_API_KEYS (sent in
+X-API-Key), otherwise by their address: the X-Forwarded-For entry added by
+the outermost of CERTIFICATE_TRUSTED_PROXIES proxies, or the peer address
+without a proxy. Buckets live in a small SQLite file
+(CERTIFICATE_RATE_LIMIT_PATH) shared by all workers on the host.
+
+Responses carry RateLimit-Limit, RateLimit-Remaining, RateLimit-Reset and
+RateLimit-Policy (IETF RateLimit header fields), in tokens and seconds;
+refused requests get 429 with Retry-After. Limiting is off while
+CERTIFICATE_RATE_LIMIT is 0; if the store fails, requests are let through.
+"""
+import os
+import math
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Tokens (conversions) per minute each client regains; 0 turns limiting off
+RATE_PER_MINUTE = float(os.environ.get('CERTIFICATE_RATE_LIMIT', 0))
+
+# Bucket size: the most a client can spend at once
+BURST = float(os.environ.get('CERTIFICATE_RATE_LIMIT_BURST', 10))
+
+STORE_PATH = os.environ.get(
+    'CERTIFICATE_RATE_LIMIT_PATH',
+    os.path.join(os.environ.get('CERTIFICATE_OUTPUT_DIR', 'static'), 'rate_limits.db')
+)
+
+# Keys that identify a client instead of its address
+API_KEYS = frozenset(key.strip() for key in os.environ.get('CERTIFICATE_API_KEYS', '').split(',') if key.strip())
+API_KEY_HEADER = 'X-API-Key'
+
+# Proxies in front of the service whose X-Forwarded-For entries are trusted
+TRUSTED_PROXIES = int(os.environ.get('CERTIFICATE_TRUSTED_PROXIES', 1))
+
+# Cost of one certificate per output format, in conversions
+FORMAT_COSTS = {
+    'pdf': 1.0,
+    'docx': 0.25,
+    'png': 1.25,
+    'webp': 1.25
+}
+
+# Full buckets are dropped from the store every this many charges
+PRUNE_INTERVAL = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    client TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+Decision = namedtuple('Decision', ('allowed', 'limit', 'remaining', 'reset', 'retry_after', 'window'))
+
+def request_cost(output_format, count=1):
+    """
+    Tokens charged for count certificates in output_format
+    """
+    return FORMAT_COSTS.get(output_format, 1.0) * count
+
+def client_key(headers, remote_addr):
+    """
+    Bucket key of a request: its API key (if it is a known one) or client address
+    API keys are stored hashed.
+    """
+    api_key = headers.get(API_KEY_HEADER)
+    if api_key and api_key in API_KEYS:
+        return 'key:' + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+    address = remote_addr
+    if TRUSTED_PROXIES:
+        # Each proxy appends the address it was called from; the entry added by
+        # the outermost trusted proxy is the client (earlier ones can be forged)
+        forwarded = [part.strip() for part in headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+        if forwarded:
+            address = forwarded[-min(TRUSTED_PROXIES, len(forwarded))]
+    return f'ip:{address or "unknown"}'
+
+class RateLimiter:
+    """
+    Token buckets per client, kept in SQLite so all workers share them
+    """
+
+    def __init__(self, path, rate_per_minute, burst):
+        self.path = path
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+        self.store_errors = 0
+        self._charges = 0
+
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def _tokens(self, row, now):
+        if row is None:
+            return self.burst
+        tokens, updated = row
+        return min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+
+    def _decision(self, allowed, tokens, needed=0.0):
+        retry_after = 0
+        if not allowed:
+            retry_after = max(1, math.ceil((needed - tokens) / self.rate))
+        return Decision(
+            allowed=allowed,
+            limit=int(self.burst),
+            remaining=max(0, int(tokens)),
+            reset=max(0, math.ceil((self.burst - tokens) / self.rate)),
+            retry_after=retry_after,
+            window=math.ceil(self.burst / self.rate)
+        )
+
+    def charge(self, client, cost):
+        """
+        Take cost tokens from the client's bucket if it has them; returns a Decision
+        Returns None if the store is unavailable (the request is let through).
+        """
+        now = time.time()
+        # A request larger than the bucket needs a full one, and leaves it in debt
+        needed = min(cost, self.burst)
+        try:
+            connection = self.connection()
+            # BEGIN IMMEDIATE serializes charges across workers
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute('SELECT tokens, updated FROM buckets WHERE client = ?', (client,)).fetchone()
+                tokens = self._tokens(row, now)
+                allowed = tokens >= needed
+                if allowed:
+                    tokens -= cost
+                connection.execute(
+                    'INSERT INTO buckets (client, tokens, updated) VALUES (?, ?, ?) '
+                    'ON CONFLICT(client) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                    (client, tokens, now)
+                )
+            except sqlite3.Error:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        except sqlite3.Error as e:
+            with self._lock:
+                self.store_errors += 1
+            logger.warning("Rate limit store unavailable, request let through: %s", e)
+            return None
+
+        with self._lock:
+            if allowed:
+                self.allowed += 1
+            else:
+                self.limited += 1
+            self._charges += 1
+            prune = self._charges % PRUNE_INTERVAL == 0
+        if prune:
+            self.prune(now)
+        if not allowed:
+            logger.info("Rate limited %s (cost %.2f, %.2f tokens left)", client, cost, tokens,
+                        extra={"event": "rate_limited"})
+        return self._decision(allowed, tokens, needed)
+
+    def peek(self, client):
+        """
+        The client's current bucket without charging it (None if the store is unavailable)
+        """
+        try:
+            row = self.connection().execute(
+                'SELECT tokens, updated FROM buckets WHERE client = ?', (client,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Rate limit store unavailable: %s", e)
+            return None
+        return self._decision(True, self._tokens(row, time.time()))
+
+    def prune(self, now=None):
+        """
+        Drop buckets that have refilled completely (a missing bucket is a full one)
+        """
+        now = time.time() if now is None else now
+        try:
+            self.connection().execute(
+                'DELETE FROM buckets WHERE tokens + (? - updated) * ? >= ?', (now, self.rate, self.burst)
+            )
+        except sqlite3.Error as e:
+            logger.warning("Could not prune the rate limit store: %s", e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate_per_minute": self.rate * 60,
+                "burst": self.burst,
+                "allowed": self.allowed,
+                "limited": self.limited,
+                "store_errors": self.store_errors
+            }
+
+def headers(decision):
+    """
+    RateLimit header fields (and Retry-After for a refused request) of a Decision
+    """
+    fields = {
+        'RateLimit-Limit': str(decision.limit),
+        'RateLimit-Remaining': str(decision.remaining),
+        'RateLimit-Reset': str(decision.reset),
+        'RateLimit-Policy': f'{decision.limit};w={decision.window}'
+    }
+    if not decision.allowed:
+        fields['Retry-After'] = str(decision.retry_after)
+    return fields
+
+def create_limiter():
+    """
+    The process-wide limiter from the environment, or None if limiting is off
+    """
+    if RATE_PER_MINUTE <= 0:
+        return None
+    return RateLimiter(STORE_PATH, RATE_PER_MINUTE, BURST)
+
+limiter = create_limiter()
+
+def enabled():
+    return limiter is not None
+
+def summary():
+    """
+    Rate limiting stats for the health endpoint
+    """
+    if limiter is None:
+        return {"enabled": False}
+    return dict(limiter.stats(), enabled=True)
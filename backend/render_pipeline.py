@@ -0,0 +1,187 @@
+"""
+Two-stage render -> convert pipeline for bulk certificate work
+Rendering a certificate (python-docx, CPU-bound Python) and converting it
+(LibreOffice, an external process) use different resources. Running them one
+after the other per certificate leaves one of them idle at any time. The
+pipeline gives each stage its own, independently sized pool of threads,
+connected by a bounded queue: while a converter works on one certificate the
+render pool is already preparing the next ones, and when conversion falls
+behind the full queue holds rendering back instead of piling up DOCX files.
+
+Per-stage utilization (busy workers over the last minute), queue depth,
+time items wait for a stage and time a stage is blocked by a full queue are
+reported by stats(), so each pool can be sized from live numbers: a stage
+near 100% with a full queue in front of it is the one to grow.
+"""
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Seconds of history utilization is computed over
+UTILIZATION_WINDOW = 60.0
+
+class _Job:
+    __slots__ = ('payload', 'future', 'enqueued')
+
+    def __init__(self, payload, future):
+        self.payload = payload
+        self.future = future
+        self.enqueued = time.monotonic()
+
+class Stage:
+    """
+    One pool of worker threads applying fn to the jobs of its input queue
+    """
+
+    def __init__(self, name, fn, workers, queue_size=0):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.input = queue.Queue(queue_size)
+        self.next = None
+        self.first = True
+        self.created = time.monotonic()
+        self._lock = threading.Lock()
+        self._busy = {}
+        self._intervals = deque()
+        self._stats = {
+            "processed": 0,
+            "failed": 0,
+            "busy_seconds": 0.0,
+            "wait_seconds": 0.0,
+            "blocked_seconds": 0.0,
+            "max_queue_depth": 0
+        }
+
+    def start(self):
+        for index in range(self.workers):
+            threading.Thread(target=self._work, name=f'{self.name}-{index}', daemon=True).start()
+
+    def put(self, job):
+        """
+        Queue a job, blocking while the queue is full; returns the seconds blocked
+        """
+        started = time.monotonic()
+        self.input.put(job)
+        with self._lock:
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self.input.qsize())
+        return time.monotonic() - started
+
+    def _work(self):
+        while True:
+            job = self.input.get()
+            # Only the first stage starts the future; a cancelled job goes no further
+            if self.first and not job.future.set_running_or_notify_cancel():
+                continue
+
+            started = time.monotonic()
+            thread = threading.get_ident()
+            with self._lock:
+                self._stats["wait_seconds"] += started - job.enqueued
+                self._busy[thread] = started
+
+            failed = False
+            try:
+                job.payload = self.fn(job.payload)
+            except BaseException as e:
+                failed = True
+                job.future.set_exception(e)
+
+            finished = time.monotonic()
+            with self._lock:
+                del self._busy[thread]
+                self._intervals.append((started, finished))
+                self._stats["busy_seconds"] += finished - started
+                self._stats["failed" if failed else "processed"] += 1
+                self._prune(finished)
+
+            if failed:
+                continue
+            if self.next is None:
+                job.future.set_result(job.payload)
+            else:
+                # Waiting for room in the next queue is not work: it shows up as blocked time
+                job.enqueued = finished
+                blocked = self.next.put(job)
+                with self._lock:
+                    self._stats["blocked_seconds"] += blocked
+
+    def _prune(self, now):
+        while self._intervals and self._intervals[0][1] < now - UTILIZATION_WINDOW:
+            self._intervals.popleft()
+
+    def utilization(self, now=None):
+        """
+        Fraction of worker time spent busy over the recent window
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._prune(now)
+            window = min(UTILIZATION_WINDOW, now - self.created) or 1e-9
+            cutoff = now - window
+            busy = sum(end - max(start, cutoff) for start, end in self._intervals if end > cutoff)
+            busy += sum(now - max(start, cutoff) for start in self._busy.values())
+        return min(1.0, busy / (self.workers * window))
+
+    def stats(self):
+        utilization = self.utilization()
+        with self._lock:
+            stats = dict(self._stats)
+            busy_workers = len(self._busy)
+        done = stats["processed"] + stats["failed"]
+        return {
+            "workers": self.workers,
+            "busy_workers": busy_workers,
+            "utilization": round(utilization, 3),
+            "queue_depth": self.input.qsize(),
+            "queue_capacity": self.input.maxsize or None,
+            "max_queue_depth": stats["max_queue_depth"],
+            "processed": stats["processed"],
+            "failed": stats["failed"],
+            "avg_seconds": round(stats["busy_seconds"] / done, 4) if done else 0.0,
+            "avg_wait_seconds": round(stats["wait_seconds"] / done, 4) if done else 0.0,
+            "blocked_seconds": round(stats["blocked_seconds"], 3)
+        }
+
+class StagedPipeline:
+    """
+    Stages run in order; each job's future resolves to the last stage's result
+
+        pipeline = StagedPipeline([('render', render, 2), ('convert', convert, 1)], queue_size=4)
+        future = pipeline.submit(job)
+
+    The first stage's queue is unbounded (submitting never blocks the caller);
+    the queues between stages hold at most queue_size jobs.
+    """
+
+    def __init__(self, stages, queue_size):
+        self.stages = [Stage(name, fn, max(1, workers), queue_size if index else 0)
+                       for index, (name, fn, workers) in enumerate(stages)]
+        for stage, following in zip(self.stages, self.stages[1:]):
+            stage.next = following
+            following.first = False
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def submit(self, payload):
+        with self._start_lock:
+            if not self._started:
+                for stage in self.stages:
+                    stage.start()
+                self._started = True
+        future = Future()
+        self.stages[0].put(_Job(payload, future))
+        return future
+
+    def stats(self):
+        stages = {stage.name: stage.stats() for stage in self.stages}
+        busiest = max(stages, key=lambda name: stages[name]["utilization"])
+        return {
+            "stages": stages,
+            "bottleneck": busiest if stages[busiest]["utilization"] > 0 else None
+        }
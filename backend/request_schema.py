@@ -0,0 +1,217 @@
+"""
+Strict validation of certificate requests
+Every field of a certificate request is checked against a precompiled table
+(length limit, allowed characters, enum or date) before any template or
+converter work starts, and normalized so equal requests produce equal
+certificate IDs and cache keys:
+
+- text is NFC-normalized with whitespace collapsed
+- dates are parsed from the accepted spellings into "March 1, 2024"
+  (issued dates keep their "March 01, 2024" certificate format)
+- gender is lower-cased and must be one of the pronoun sets
+
+Bodies larger than the configured limits are rejected with 413 without being
+parsed; unknown fields are rejected rather than silently ignored.
+"""
+import os
+import re
+import json
+import unicodedata
+from datetime import datetime
+
+import deterministic_output
+
+# Largest accepted body of a single-certificate request, and of a batch
+MAX_BODY_BYTES = int(os.environ.get('CERTIFICATE_MAX_BODY_BYTES', 16 * 1024))
+MAX_BATCH_BODY_BYTES = int(os.environ.get('CERTIFICATE_MAX_BATCH_BODY_BYTES', 1024 * 1024))
+
+MAX_NAME_LENGTH = 100
+MAX_DOMAIN_LENGTH = 100
+MAX_DATE_LENGTH = 40
+MAX_EMAIL_LENGTH = 254
+
+GENDERS = ('male', 'female', 'other')
+
+# Accepted date spellings; the first is also the canonical form
+DATE_FORMATS = ('%B %d, %Y', '%b %d, %Y', '%B %d %Y', '%b %d %Y', '%d %B %Y', '%d %b %Y', '%Y-%m-%d')
+MIN_YEAR = 1900
+MAX_YEAR = 2100
+
+# Besides letters, combining marks (the vowel signs of Indic scripts) and
+# digits, only these characters are accepted; anything else (markup, braces,
+# control characters, ...) is rejected
+NAME_PUNCTUATION = frozenset(" .,'’-")
+DOMAIN_PUNCTUATION = NAME_PUNCTUATION | frozenset("&/()+#:")
+# Zero-width non-joiner and joiner select conjunct forms in Indic scripts
+JOINERS = frozenset('\u200c\u200d')
+LETTER_PATTERN = re.compile(r"[^\W\d_]")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# Same rule as the Node backend's registration check
+EMAIL_PATTERN = re.compile(r"^[^\s@]+@[^\s@]+\.[^\s@]+$")
+
+CERTIFICATE_FIELDS = ('name', 'domain', 'start_date', 'end_date', 'gender', 'issued_date')
+
+# Request options that are not part of the certificate itself
+OPTION_FIELDS = ('format', 'priority', 'delivery')
+
+class ValidationError(ValueError):
+    """
+    A request that does not match the schema; carries the HTTP status to answer with
+    """
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def parse_json_body(body, limit):
+    """
+    Decode a JSON request body of at most limit bytes
+    """
+    if len(body) > limit:
+        raise ValidationError(f"Request body too large: at most {limit} bytes", 413)
+    if not body:
+        raise ValidationError("No JSON data provided")
+    try:
+        return json.loads(body)
+    except (UnicodeDecodeError, ValueError):
+        raise ValidationError("Request body is not valid JSON")
+
+def check_content_length(content_length, limit):
+    """
+    Reject a declared body size over the limit before reading anything
+    """
+    if content_length is None:
+        return
+    try:
+        content_length = int(content_length)
+    except (TypeError, ValueError):
+        raise ValidationError("Invalid Content-Length header")
+    if content_length < 0:
+        raise ValidationError("Invalid Content-Length header")
+    if content_length > limit:
+        raise ValidationError(f"Request body too large: at most {limit} bytes", 413)
+
+def allowed_text(value, punctuation):
+    """
+    True if every character is a letter, mark, digit, joiner or one of punctuation
+    """
+    return all(ch in punctuation or ch in JOINERS or unicodedata.category(ch)[0] in 'LMN' for ch in value)
+
+def _text(data, field, max_length, punctuation):
+    value = data.get(field)
+    if value is None or value == '':
+        raise ValidationError(f"Missing required field: {field}")
+    if not isinstance(value, str):
+        raise ValidationError(f"Field '{field}' must be a string")
+    if len(value) > 4 * max_length:
+        # Far too long: do not even normalize it
+        raise ValidationError(f"Field '{field}' is longer than {max_length} characters")
+    value = WHITESPACE_PATTERN.sub(' ', unicodedata.normalize('NFC', value)).strip()
+    if not value:
+        raise ValidationError(f"Missing required field: {field}")
+    if len(value) > max_length:
+        raise ValidationError(f"Field '{field}' is longer than {max_length} characters")
+    if not allowed_text(value, punctuation) or not LETTER_PATTERN.search(value):
+        raise ValidationError(f"Field '{field}' contains characters that are not allowed")
+    return value
+
+def parse_date(value):
+    """
+    The date a string spells in one of DATE_FORMATS, or None
+    """
+    if not isinstance(value, str) or len(value) > MAX_DATE_LENGTH:
+        return None
+    value = WHITESPACE_PATTERN.sub(' ', value).strip()
+    for date_format in DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+        return parsed if MIN_YEAR <= parsed.year <= MAX_YEAR else None
+    return None
+
+def canonical_date(date):
+    return f"{date:%B} {date.day}, {date.year}"
+
+def _date(data, field):
+    value = data.get(field)
+    if value is None or value == '':
+        raise ValidationError(f"Missing required field: {field}")
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValidationError(f"Invalid {field}. Use a date like \"March 1, 2024\" or \"2024-03-01\"")
+    return parsed
+
+def normalize_certificate(data, extra_fields=()):
+    """
+    Validated, normalized certificate fields of a request (or batch entry)
+    Returns a dict with name, domain, start_date, end_date, gender and
+    issued_date (None when not given). Fields listed in extra_fields are
+    allowed but left to the caller. Raises ValidationError.
+    """
+    if not isinstance(data, dict):
+        raise ValidationError("Expected a JSON object")
+
+    unknown = sorted(set(data) - set(CERTIFICATE_FIELDS) - set(extra_fields))
+    if unknown:
+        raise ValidationError(f"Unknown fields: {', '.join(map(str, unknown[:10]))}")
+
+    name = _text(data, 'name', MAX_NAME_LENGTH, NAME_PUNCTUATION)
+    domain = _text(data, 'domain', MAX_DOMAIN_LENGTH, DOMAIN_PUNCTUATION)
+    start_date = _date(data, 'start_date')
+    end_date = _date(data, 'end_date')
+    if end_date < start_date:
+        raise ValidationError("end_date is before start_date")
+
+    gender = data.get('gender')
+    gender = 'other' if gender in (None, '') else gender
+    if not isinstance(gender, str) or gender.strip().lower() not in GENDERS:
+        raise ValidationError(f"Invalid gender. Use one of: {', '.join(GENDERS)}")
+
+    issued_date = data.get('issued_date')
+    if issued_date is not None:
+        issued_date = deterministic_output.parse_issued_date(str(issued_date)[:MAX_DATE_LENGTH + 1])
+        if issued_date is None:
+            raise ValidationError("Invalid issued_date. Use \"March 31, 2024\" or \"2024-03-31\"")
+
+    return {
+        "name": name,
+        "domain": domain,
+        "start_date": canonical_date(start_date),
+        "end_date": canonical_date(end_date),
+        "gender": gender.strip().lower(),
+        "issued_date": issued_date
+    }
+
+def normalize_email(value):
+    """
+    A validated recipient address; raises ValidationError
+    """
+    if not isinstance(value, str) or not value.strip():
+        raise ValidationError("Field 'email' must be an email address")
+    value = value.strip()
+    if len(value) > MAX_EMAIL_LENGTH or not EMAIL_PATTERN.match(value):
+        raise ValidationError("Invalid email address")
+    return value
+
+def normalize_batch(entries, default_issued_date=None):
+    """
+    Validate every entry of a batch
+    Entries may carry an email address to deliver the certificate to; it is
+    returned under "email" (None when not given).
+    Returns (normalized entries, {index: error} of the first invalid ones)
+    """
+    certificates = []
+    invalid = {}
+    for index, entry in enumerate(entries):
+        if isinstance(entry, dict) and default_issued_date is not None and 'issued_date' not in entry:
+            entry = dict(entry, issued_date=default_issued_date)
+        try:
+            fields = normalize_certificate(entry, ('email',))
+            email = entry.get('email')
+            fields['email'] = None if email is None else normalize_email(email)
+            certificates.append(fields)
+        except ValidationError as e:
+            if len(invalid) < 20:
+                invalid[index] = str(e)
+    return certificates, invalid
@@ -10,6 +10,7 @@ const fetch = require('node-fetch');
 const { spawn } = require('child_process');
 const path = require('path');
 const fs = require('fs');
+const crypto = require('crypto');
 const PDFDocument = require('pdfkit');
 
 // Load environment variables
@@ -2109,8 +2110,73 @@ app.get('/api/recommend-courses-all/:userId', async (req, res) => {
 
 
 
+// Request tracing for certificate calls.
+// A W3C traceparent is accepted from the client (or generated) and forwarded
+// to the certificate service, so proxy and service spans share one trace ID.
+// Spans are appended as JSON lines to CERTIFICATE_TRACE_FILE, the same format
+// the certificate service writes.
+const TRACE_FILE = process.env.CERTIFICATE_TRACE_FILE;
+const TRACEPARENT_PATTERN = /^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$/;
+
+function startSpan(name, traceId, parentId, kind) {
+  return {
+    trace_id: traceId,
+    span_id: crypto.randomBytes(8).toString('hex'),
+    parent_id: parentId || null,
+    name,
+    service: 'node-proxy',
+    kind: kind || 'internal',
+    start: process.hrtime.bigint(),
+    start_ns: BigInt(Date.now()) * 1000000n,
+    attributes: {}
+  };
+}
+
+function endSpan(span, error) {
+  if (span.ended) {
+    return;
+  }
+  span.ended = true;
+  if (!TRACE_FILE) {
+    return;
+  }
+  const elapsed = process.hrtime.bigint() - span.start;
+  const record = {
+    trace_id: span.trace_id,
+    span_id: span.span_id,
+    parent_id: span.parent_id,
+    name: span.name,
+    service: span.service,
+    kind: span.kind,
+    start_ns: span.start_ns.toString(),
+    end_ns: (span.start_ns + elapsed).toString(),
+    duration_ms: Number(elapsed) / 1e6,
+    attributes: span.attributes,
+    error: error ? String(error.message || error) : null
+  };
+  fs.appendFile(TRACE_FILE, JSON.stringify(record) + '\n', (err) => {
+    if (err) {
+      console.error('Span export failed:', err.message);
+    }
+  });
+}
+
+function startRequestTrace(req, name) {
+  const match = TRACEPARENT_PATTERN.exec(req.headers.traceparent || '');
+  const traceId = match ? match[1] : crypto.randomBytes(16).toString('hex');
+  return startSpan(name, traceId, match ? match[2] : null, 'server');
+}
+
 // Certificate generation endpoint
 app.post('/api/generate-certificate', async (req, res) => {
+  const rootSpan = startRequestTrace(req, 'proxy POST /api/generate-certificate');
+  res.setHeader('X-Trace-Id', rootSpan.trace_id);
+  res.on('close', () => {
+    rootSpan.attributes.status_code = res.statusCode;
+    rootSpan.attributes.completed = res.writableFinished;
+    endSpan(rootSpan);
+  });
+
   try {
     const { name, domain, start_date, end_date, gender } = req.body;
 
@@ -2135,12 +2201,50 @@ app.post('/api/generate-certificate', async (req, res) => {
     // Call Flask certificate service (app.py server)
     const FLASK_SERVICE_URL = process.env.FLASK_SERVICE_URL || 'http://localhost:5002';
     console.log(`Calling to: ${FLASK_SERVICE_URL}/api/generate-certificate`)
-    const response = await fetch(`${FLASK_SERVICE_URL}/api/generate-certificate`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify(certificateData)
+    // In direct-download mode the certificate service returns a short-lived
+    // signed URL and the client is redirected to it, so the file never
+    // passes through this process (unless the URL is only reachable from here).
+    const directDownload = process.env.CERTIFICATE_DIRECT_DOWNLOAD === 'true';
+    if (directDownload) {
+      certificateData.delivery = 'url';
+    }
+
+    // If the client goes away before we answer, abort the upstream request so
+    // the certificate service can stop the conversion instead of finishing
+    // work nobody will download.
+    const upstream = new AbortController();
+    res.on('close', () => {
+      if (!res.writableFinished) {
+        upstream.abort();
+      }
+    });
+
+    const upstreamSpan = startSpan('proxy.upstream', rootSpan.trace_id, rootSpan.span_id, 'client');
+    let response;
+    try {
+      response = await fetch(`${FLASK_SERVICE_URL}/api/generate-certificate`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          traceparent: `00-${upstreamSpan.trace_id}-${upstreamSpan.span_id}-01`,
+          // The certificate service rate-limits per client address
+          'X-Forwarded-For': [req.headers['x-forwarded-for'], req.socket.remoteAddress].filter(Boolean).join(', ')
+        },
+        body: JSON.stringify(certificateData),
+        signal: upstream.signal
+      });
+      upstreamSpan.attributes.status_code = response.status;
+      endSpan(upstreamSpan);
+    } catch (error) {
+      endSpan(upstreamSpan, error);
+      throw error;
+    }
+
+    ['ratelimit-limit', 'ratelimit-remaining', 'ratelimit-reset', 'ratelimit-policy', 'retry-after'].forEach((header) => {
+      const value = response.headers.get(header);
+      if (value) {
+        res.setHeader(header, value);
+      }
     });
 
     if (!response.ok) {
@@ -2167,6 +2271,34 @@ app.post('/api/generate-certificate', async (req, res) => {
     //   // Continue with file sending even if database insert fails
     // }
 
+    if (directDownload) {
+      const { download_url } = await response.json();
+      if (!download_url.startsWith('/')) {
+        return res.redirect(302, download_url);
+      }
+      // A relative URL is on the certificate service, which clients can only
+      // reach through CERTIFICATE_PUBLIC_BASE_URL; without one, proxy the file
+      const publicBaseUrl = (process.env.CERTIFICATE_PUBLIC_BASE_URL || '').replace(/\/+$/, '');
+      if (publicBaseUrl) {
+        return res.redirect(302, `${publicBaseUrl}${download_url}`);
+      }
+      const download = await fetch(`${FLASK_SERVICE_URL}${download_url}`, { signal: upstream.signal });
+      if (!download.ok) {
+        return res.status(download.status).json({
+          message: 'Failed to download certificate',
+          error: 'Flask service error'
+        });
+      }
+      res.status(download.status);
+      ['content-type', 'content-length', 'content-disposition'].forEach((header) => {
+        const value = download.headers.get(header);
+        if (value) {
+          res.setHeader(header, value);
+        }
+      });
+      return download.body.pipe(res);
+    }
+
     // Forward the PDF response from Flask service
     res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document');
     res.setHeader('Content-Disposition', `attachment; filename="${name.replace(/[^a-zA-Z0-9]/g, '_')}_Certificate.docx"`);
@@ -2176,6 +2308,10 @@ app.post('/api/generate-certificate', async (req, res) => {
     response.body.pipe(res);
 
   } catch (error) {
+    if (error.name === 'AbortError') {
+      console.log('Certificate request aborted: client disconnected');
+      return;
+    }
     console.error('Certificate generation error:', error);
     res.status(500).json({
       message: 'Certificate generation failed',
@@ -2184,6 +2320,47 @@ app.post('/api/generate-certificate', async (req, res) => {
   }
 });
 
+// Download a previously issued certificate by ID.
+// Conditional and Range headers are forwarded so the Flask service can answer
+// with 304 / 206 and browsers can cache and resume downloads.
+app.get('/api/certificates/:id', async (req, res) => {
+  try {
+    const FLASK_SERVICE_URL = process.env.FLASK_SERVICE_URL || 'http://localhost:5002';
+    const forwardedHeaders = {};
+    ['if-none-match', 'if-modified-since', 'range', 'if-range'].forEach((header) => {
+      if (req.headers[header]) {
+        forwardedHeaders[header] = req.headers[header];
+      }
+    });
+
+    const response = await fetch(
+      `${FLASK_SERVICE_URL}/api/certificates/${encodeURIComponent(req.params.id)}`,
+      { headers: forwardedHeaders }
+    );
+
+    res.status(response.status);
+    ['content-type', 'content-length', 'content-range', 'content-disposition', 'accept-ranges',
+      'etag', 'last-modified', 'cache-control', 'x-certificate-id'].forEach((header) => {
+      const value = response.headers.get(header);
+      if (value) {
+        res.setHeader(header, value);
+      }
+    });
+
+    if (response.status === 304) {
+      return res.end();
+    }
+    response.body.pipe(res);
+
+  } catch (error) {
+    console.error('Certificate download error:', error);
+    res.status(500).json({
+      message: 'Certificate download failed',
+      error: error.message
+    });
+  }
+});
+
 // Start server
 const PORT = process.env.PORT || 5000;
 app.listen(PORT, () => {
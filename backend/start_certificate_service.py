@@ -21,7 +21,8 @@ def check_requirements():
 
 def check_template():
     """Check if certificate template exists"""
-    template_path = "SpectoV_Cert.docx"
+    import template_registry
+    template_path = template_registry.registry.resolve()
     if os.path.exists(template_path):
         print(f"✓ Certificate template found: {template_path}")
         return True
@@ -0,0 +1,163 @@
+"""
+Structured, non-blocking logging for the certificate services
+- JSON lines on stdout (CERTIFICATE_LOG_FORMAT=text keeps the classic format)
+- Request threads only put records on an in-memory queue; a listener thread
+  formats and writes them, so slow stdout never stalls a conversion
+- Messages are formatted lazily: %-style arguments are only merged when a
+  record is actually written, i.e. after level checks and sampling
+- High-volume INFO/DEBUG events tagged with extra={"event": ...} can be
+  sampled (CERTIFICATE_LOG_SAMPLE_RATE); warnings and errors are always kept
+- Records carry the current trace ID, so logs line up with request traces
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from itertools import islice
+
+import tracing
+
+# "json" (default) or "text"
+LOG_FORMAT = os.environ.get('CERTIFICATE_LOG_FORMAT', 'json').lower()
+
+LOG_LEVEL = os.environ.get('CERTIFICATE_LOG_LEVEL', 'INFO').upper()
+
+# Fraction of sampled (event-tagged, below WARNING) records that are kept
+LOG_SAMPLE_RATE = float(os.environ.get('CERTIFICATE_LOG_SAMPLE_RATE', 1.0))
+
+# Records waiting for the listener before new ones are dropped
+LOG_QUEUE_SIZE = 10000
+
+# Longest converter output / directory listing written to a single record
+MAX_DUMP_CHARS = 2000
+MAX_DUMP_ENTRIES = 20
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger, message, trace ID and extra fields
+    """
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a fraction of high-volume records
+    Only INFO/DEBUG records tagged with an "event" are sampled.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1.0 or record.levelno >= logging.WARNING or not hasattr(record, 'event'):
+            return True
+        return random.random() < self.rate
+
+class TraceContextFilter(logging.Filter):
+    """
+    Attach the current trace ID; runs in the logging thread, where the context variable is set
+    """
+
+    def filter(self, record):
+        span = tracing.current_span()
+        if span is not None:
+            record.trace_id = span.trace_id
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that defers message formatting to the listener and drops records when the queue is full
+    """
+
+    def prepare(self, record):
+        # Exception text must be rendered here, while the traceback is still alive
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+def bounded(text, limit=MAX_DUMP_CHARS):
+    """
+    Truncate a potentially large dump (converter output, ...) for logging
+    """
+    if text is None or len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more characters]"
+
+def bounded_listing(directory, prefix='', limit=MAX_DUMP_ENTRIES):
+    """
+    At most `limit` entry names of directory starting with prefix
+    Stops scanning once enough entries are found, so a directory full of
+    certificates costs no more than a small one.
+    """
+    try:
+        with os.scandir(directory) as entries:
+            return [entry.name for entry in islice((e for e in entries if e.name.startswith(prefix)), limit)]
+    except OSError:
+        return []
+
+def configure_logging():
+    """
+    Install the queue handler on the root logger (once per process)
+    Like logging.basicConfig, does nothing if the root logger already has handlers.
+    """
+    global _listener
+    root = logging.getLogger()
+    if root.handlers:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == 'text':
+        output.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        output.setFormatter(JsonFormatter())
+
+    records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(records)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    handler.addFilter(TraceContextFilter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """
+    Flush queued records and stop the listener thread
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
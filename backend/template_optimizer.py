@@ -0,0 +1,511 @@
+"""
+Template compile step: a smaller, cleaner copy of each certificate template
+Every certificate opens, rewrites and converts its Word template, so whatever
+the template carries is paid for on every request. The optimizer rewrites a
+template once:
+
+- merges adjacent runs with the same formatting (and drops revision ids and
+  proofing marks that split them), so placeholders sit in a single run
+- removes styles nothing uses, keeping defaults and everything they are
+  based on, linked to or followed by
+- removes parts nothing references: the thumbnail, the glossary (building
+  blocks), Word 2010's duplicate styles, unreferenced images and embedded
+  fonts of fonts that are not used
+- downsamples embedded images to the size they are printed at
+  (CERTIFICATE_TEMPLATE_DPI) and recompresses them, keeping the smaller file
+
+With CERTIFICATE_OPTIMIZE_TEMPLATES=1 the template registry serves the
+optimized copy. It is written next to the template (<name>.optimized.docx,
+with a <name>.optimized.json report) and reused by every worker until the
+template changes. Run `python template_optimizer.py [template ...]` to
+compile templates ahead of time and compare size, DOCX load/save time and
+LibreOffice conversion time before and after.
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import zipfile
+import tempfile
+import posixpath
+
+from lxml import etree
+from docx import Document
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    logger.warning("Pillow not available. Template images will not be downsampled.")
+
+def _env_flag(name, default='0'):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+# Serve templates through the optimizer (see template_registry)
+OPTIMIZE_TEMPLATES = _env_flag('CERTIFICATE_OPTIMIZE_TEMPLATES')
+
+# Resolution embedded images are downsampled to, at their printed size
+PRINT_DPI = int(os.environ.get('CERTIFICATE_TEMPLATE_DPI', 300))
+
+# Quality of downsampled JPEG images
+JPEG_QUALITY = 85
+
+# Images are only resampled when they are this much larger than needed
+RESAMPLE_THRESHOLD = 1.1
+
+EMU_PER_INCH = 914400
+
+# Zip entries get a fixed timestamp, so every worker compiles the same bytes (and template version)
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+R = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+A = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+WP = 'http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing'
+PR = 'http://schemas.openxmlformats.org/package/2006/relationships'
+CT = 'http://schemas.openxmlformats.org/package/2006/content-types'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+REL_IMAGE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+REL_FONT = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/font'
+# Relationships that are only ever dropped as a whole
+REL_UNUSED = {
+    'http://schemas.openxmlformats.org/package/2006/relationships/metadata/thumbnail',
+    'http://schemas.openxmlformats.org/officeDocument/2006/relationships/glossaryDocument',
+    'http://schemas.microsoft.com/office/2007/relationships/stylesWithEffects'
+}
+
+RSID_ATTRIBUTES = {f'{{{W}}}{name}' for name in
+                   ('rsidR', 'rsidRPr', 'rsidRDefault', 'rsidP', 'rsidDel', 'rsidTr', 'rsidSect')}
+
+STYLE_REFERENCES = {f'{{{W}}}{name}' for name in ('pStyle', 'rStyle', 'tblStyle', 'numStyleLink', 'styleLink')}
+STYLE_CHAIN = {f'{{{W}}}{name}' for name in ('basedOn', 'next', 'link')}
+# Styles python-docx applies to parts the renderer may add (the QR code's footer)
+RENDERER_STYLES = {'Header', 'Footer'}
+
+FONT_ATTRIBUTES = {f'{{{W}}}{name}' for name in ('ascii', 'hAnsi', 'cs', 'eastAsia')}
+
+class Package:
+    """
+    The parts of a DOCX (zip) archive, with their relationships
+    """
+
+    def __init__(self, data):
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.parts = {info.filename: archive.read(info) for info in archive.infolist() if not info.is_dir()}
+        self._xml = {}
+
+    def xml(self, name):
+        """Parsed XML of a part (cached; serialized back by save)"""
+        if name not in self._xml:
+            self._xml[name] = etree.fromstring(self.parts[name])
+        return self._xml[name]
+
+    @staticmethod
+    def rels_name(name):
+        directory, base = posixpath.split(name)
+        return posixpath.join(directory, '_rels', base + '.rels')
+
+    @staticmethod
+    def source_name(rels_name):
+        directory, base = posixpath.split(rels_name)
+        return posixpath.join(posixpath.dirname(directory), base[:-len('.rels')])
+
+    def relationships(self, name):
+        """[(rels element, relationship element, target part)] of a part ('' for the package)"""
+        rels_name = self.rels_name(name) if name else '_rels/.rels'
+        if rels_name not in self.parts:
+            return []
+        root = self.xml(rels_name)
+        base = posixpath.dirname(name)
+        result = []
+        for rel in root.findall(f'{{{PR}}}Relationship'):
+            target = None
+            if rel.get('TargetMode') != 'External':
+                target = rel.get('Target')
+                if target.startswith('/'):
+                    target = target.lstrip('/')
+                else:
+                    target = posixpath.normpath(posixpath.join(base, target))
+            result.append((root, rel, target))
+        return result
+
+    def remove(self, name):
+        self.parts.pop(name, None)
+        self._xml.pop(name, None)
+        rels_name = self.rels_name(name)
+        self.parts.pop(rels_name, None)
+        self._xml.pop(rels_name, None)
+        types = self.xml('[Content_Types].xml')
+        for override in types.findall(f'{{{CT}}}Override'):
+            if override.get('PartName').lstrip('/') == name:
+                types.remove(override)
+
+    def save(self):
+        for name, root in self._xml.items():
+            self.parts[name] = etree.tostring(root, xml_declaration=True, encoding='UTF-8', standalone=True)
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
+            # [Content_Types].xml first, as Word expects
+            for name in sorted(self.parts, key=lambda name: (name != '[Content_Types].xml', name)):
+                info = zipfile.ZipInfo(name, ZIP_DATE_TIME)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(info, self.parts[name])
+        return output.getvalue()
+
+def _content_parts(package):
+    """XML parts holding document content (body, headers, footers, notes, comments, numbering)"""
+    return [name for name in package.parts if name.startswith('word/') and name.endswith('.xml')
+            and '/' not in name[len('word/'):] and name not in ('word/styles.xml', 'word/fontTable.xml')]
+
+def merge_runs(package):
+    """
+    Merge adjacent text runs with the same formatting; returns the number of runs merged away
+    Revision ids and proofing marks are removed first: they are what splits
+    runs that look the same.
+    """
+    merged = 0
+    for name in _content_parts(package) + ['word/styles.xml']:
+        if name not in package.parts:
+            continue
+        root = package.xml(name)
+        for element in root.iter(etree.Element):
+            for attribute in RSID_ATTRIBUTES & set(element.attrib):
+                del element.attrib[attribute]
+        for element in list(root.iter(f'{{{W}}}proofErr', f'{{{W}}}lastRenderedPageBreak')):
+            element.getparent().remove(element)
+        if name == 'word/settings.xml':
+            for element in root.findall(f'{{{W}}}rsids'):
+                root.remove(element)
+            continue
+
+        for paragraph in root.iter(f'{{{W}}}p'):
+            previous = None
+            for child in list(paragraph):
+                text = _text_only(child)
+                if text is None:
+                    previous = None
+                    continue
+                if previous is not None and _formatting(previous) == _formatting(child):
+                    previous_text = previous.find(f'{{{W}}}t')
+                    previous_text.text = (previous_text.text or '') + text
+                    previous_text.set(XML_SPACE, 'preserve')
+                    paragraph.remove(child)
+                    merged += 1
+                else:
+                    previous = child
+    return merged
+
+def _text_only(element):
+    """The text of a run holding a single text element (and formatting), else None"""
+    if element.tag != f'{{{W}}}r':
+        return None
+    children = [child for child in element if child.tag != f'{{{W}}}rPr']
+    if len(children) != 1 or children[0].tag != f'{{{W}}}t':
+        return None
+    return children[0].text or ''
+
+def _formatting(run):
+    properties = run.find(f'{{{W}}}rPr')
+    return b'' if properties is None else etree.tostring(properties, method='c14n')
+
+def remove_unused_styles(package):
+    """
+    Remove styles no content refers to; returns the number removed
+    Default styles, the renderer's styles and the basedOn/next/link chains of
+    every kept style stay. Latent style definitions (Word's style gallery) go.
+    """
+    if 'word/styles.xml' not in package.parts:
+        return 0
+    styles = package.xml('word/styles.xml')
+    for latent in styles.findall(f'{{{W}}}latentStyles'):
+        styles.remove(latent)
+
+    definitions = {style.get(f'{{{W}}}styleId'): style for style in styles.findall(f'{{{W}}}style')}
+    used = set(RENDERER_STYLES)
+    used.update(style_id for style_id, style in definitions.items() if style.get(f'{{{W}}}default') in ('1', 'true'))
+    for name in _content_parts(package):
+        for element in package.xml(name).iter(*STYLE_REFERENCES):
+            used.add(element.get(f'{{{W}}}val'))
+
+    pending = list(used)
+    while pending:
+        style = definitions.get(pending.pop())
+        if style is None:
+            continue
+        for element in style.iter(*STYLE_CHAIN):
+            style_id = element.get(f'{{{W}}}val')
+            if style_id not in used:
+                used.add(style_id)
+                pending.append(style_id)
+
+    removed = 0
+    for style_id, style in definitions.items():
+        if style_id not in used:
+            styles.remove(style)
+            removed += 1
+    return removed
+
+def remove_unused_fonts(package):
+    """
+    Drop the embedded data of fonts that no text, style or theme uses
+    (the font table entry stays; the font files go with remove_unused_parts)
+    """
+    if 'word/fontTable.xml' not in package.parts:
+        return
+    used = set()
+    for name in package.parts:
+        if name.endswith('.xml') and name.startswith('word/'):
+            root = package.xml(name)
+            for element in root.iter(f'{{{W}}}rFonts'):
+                used.update(value for attribute, value in element.attrib.items() if attribute in FONT_ATTRIBUTES)
+            for element in root.iter(f'{{{A}}}latin', f'{{{A}}}ea', f'{{{A}}}cs'):
+                used.add(element.get('typeface'))
+    for font in package.xml('word/fontTable.xml').findall(f'{{{W}}}font'):
+        if font.get(f'{{{W}}}name') not in used:
+            for embedded in [child for child in font if child.tag.startswith(f'{{{W}}}embed')]:
+                font.remove(embedded)
+
+def remove_unused_parts(package):
+    """
+    Drop unused relationships (thumbnail, glossary, unreferenced images and
+    fonts) and then every part no relationship points to; returns the removed part names
+    """
+    for source in [''] + [name for name in package.parts if name.endswith('.xml')]:
+        relationships = package.relationships(source)
+        if not relationships:
+            continue
+        referenced = set()
+        if source:
+            for element in package.xml(source).iter(etree.Element):
+                referenced.update(value for attribute, value in element.attrib.items()
+                                  if attribute.startswith(f'{{{R}}}'))
+        for root, rel, _ in relationships:
+            if rel.get('Type') in REL_UNUSED or (
+                    rel.get('Type') in (REL_IMAGE, REL_FONT) and rel.get('Id') not in referenced):
+                root.remove(rel)
+
+    removed = []
+    while True:
+        targets = {'[Content_Types].xml'}
+        for source in [''] + list(package.parts):
+            if source.endswith('.rels'):
+                continue
+            targets.update(target for _, _, target in package.relationships(source))
+        orphans = [name for name in package.parts
+                   if name not in targets and not name.endswith('.rels')]
+        # A relationships file whose part is gone goes with it
+        orphans += [name for name in package.parts if name.endswith('.rels') and name != '_rels/.rels'
+                    and package.source_name(name) not in package.parts]
+        if not orphans:
+            return sorted(removed)
+        for name in orphans:
+            package.remove(name)
+            if not name.endswith('.rels'):
+                removed.append(name)
+
+def _image_targets(package, dpi):
+    """
+    {image part: (width px, height px)} needed to print every use of it at dpi
+    (images placed without a drawing extent, e.g. VML, are not listed)
+    """
+    targets = {}
+    for name in _content_parts(package):
+        images = {rel.get('Id'): target for _, rel, target in package.relationships(name)
+                  if rel.get('Type') == REL_IMAGE and target}
+        if not images:
+            continue
+        for drawing in package.xml(name).iter(f'{{{WP}}}inline', f'{{{WP}}}anchor'):
+            extent = drawing.find(f'{{{WP}}}extent')
+            if extent is None:
+                continue
+            for blip in drawing.iter(f'{{{A}}}blip'):
+                part = images.get(blip.get(f'{{{R}}}embed'))
+                if part is None:
+                    continue
+                # A cropped picture shows only part of the image
+                visible_x = visible_y = 1.0
+                crop = blip.getparent().find(f'{{{A}}}srcRect')
+                if crop is not None:
+                    visible_x -= (int(crop.get('l', 0)) + int(crop.get('r', 0))) / 100000
+                    visible_y -= (int(crop.get('t', 0)) + int(crop.get('b', 0))) / 100000
+                width = int(extent.get('cx')) / EMU_PER_INCH * dpi / max(visible_x, 0.01)
+                height = int(extent.get('cy')) / EMU_PER_INCH * dpi / max(visible_y, 0.01)
+                previous = targets.get(part, (0, 0))
+                targets[part] = (max(previous[0], width), max(previous[1], height))
+    return targets
+
+def downsample_images(package, dpi=PRINT_DPI):
+    """
+    Downsample images larger than their printed size at dpi and recompress
+    PNGs losslessly; a new image is only kept if it is smaller. Returns one
+    entry per changed image.
+    """
+    if not PIL_AVAILABLE:
+        return []
+    targets = _image_targets(package, dpi)
+    changes = []
+    for part in sorted(targets):
+        data = package.parts.get(part)
+        if data is None:
+            continue
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except Exception as e:
+            logger.warning("Template image %s could not be read, left as is: %s", part, e)
+            continue
+        if image.format not in ('PNG', 'JPEG'):
+            continue
+
+        width, height = targets[part]
+        scale = max(width / image.width, height / image.height)
+        resized = image
+        if scale * RESAMPLE_THRESHOLD < 1:
+            if resized.mode not in ('RGB', 'RGBA', 'L', 'LA', 'CMYK'):
+                resized = resized.convert('RGBA' if 'transparency' in image.info or image.mode == 'P' else 'RGB')
+            resized = resized.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                                     Image.LANCZOS)
+        elif image.format == 'JPEG':
+            # Re-encoding a JPEG at its own size only loses quality
+            continue
+
+        output = io.BytesIO()
+        options = {"dpi": (dpi, dpi)} if resized is not image else {}
+        if 'icc_profile' in image.info:
+            options["icc_profile"] = image.info['icc_profile']
+        if image.format == 'JPEG':
+            resized.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, **options)
+        else:
+            resized.save(output, 'PNG', optimize=True, **options)
+        if output.tell() < len(data):
+            package.parts[part] = output.getvalue()
+            changes.append({
+                "part": part,
+                "pixels": [f"{image.width}x{image.height}", f"{resized.width}x{resized.height}"],
+                "bytes": [len(data), output.tell()]
+            })
+    return changes
+
+def optimize(data, dpi=PRINT_DPI):
+    """
+    Optimize a DOCX template; returns (optimized bytes, report)
+    The optimized template has the same text, placeholders and layout.
+    """
+    package = Package(data)
+    report = {
+        "dpi": dpi,
+        "merged_runs": merge_runs(package),
+        "removed_styles": remove_unused_styles(package)
+    }
+    remove_unused_fonts(package)
+    report["removed_parts"] = remove_unused_parts(package)
+    report["images"] = downsample_images(package, dpi)
+    optimized = package.save()
+    report["bytes"] = [len(data), len(optimized)]
+    return optimized, report
+
+def docx_seconds(data, repeat=3):
+    """
+    Best time of loading a template with python-docx and saving it, as every certificate does
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        Document(io.BytesIO(data)).save(io.BytesIO())
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 4)
+
+def conversion_seconds(data):
+    """
+    Time of one LibreOffice conversion of a template, or None without a converter
+    """
+    import host_sizing
+
+    workdir = tempfile.mkdtemp(prefix='template_')
+    try:
+        path = os.path.join(workdir, 'template.docx')
+        with open(path, 'wb') as f:
+            f.write(data)
+        sample = host_sizing.sample_conversion(path)
+        return sample and sample["seconds"]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def compiled_paths(path):
+    """
+    (optimized template, report) paths of a template
+    """
+    stem = os.path.splitext(path)[0]
+    return f"{stem}.optimized.docx", f"{stem}.optimized.json"
+
+def _write_atomically(path, data):
+    scratch = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(scratch, 'wb') as f:
+        f.write(data)
+    os.replace(scratch, path)
+
+def version(data):
+    return hashlib.sha256(data).hexdigest()[:16]
+
+def compile_template(path, data, dpi=PRINT_DPI):
+    """
+    The optimized version of a template's bytes; returns (optimized bytes, report)
+    The compile output next to the template is reused while it matches the
+    template's content; otherwise the template is optimized and the output
+    written for the other workers (kept in memory if the directory is read-only).
+    """
+    output_path, report_path = compiled_paths(path)
+    source_version = version(data)
+    try:
+        with open(report_path) as f:
+            report = json.load(f)
+        with open(output_path, 'rb') as f:
+            optimized = f.read()
+        if (report.get("source_version") == source_version and report.get("dpi") == dpi
+                and report.get("version") == version(optimized)):
+            return optimized, report
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    optimized, report = optimize(data, dpi)
+    report["source_version"] = source_version
+    report["version"] = version(optimized)
+    report["docx_seconds"] = [docx_seconds(data), docx_seconds(optimized)]
+    try:
+        _write_atomically(output_path, optimized)
+        _write_atomically(report_path, json.dumps(report, indent=2).encode())
+    except OSError as e:
+        logger.warning("Could not write the optimized template %s: %s", output_path, e)
+    logger.info("Optimized template %s: %d -> %d bytes, %d styles and %d parts removed, %d images downsampled",
+                path, report["bytes"][0], report["bytes"][1], report["removed_styles"],
+                len(report["removed_parts"]), len(report["images"]), extra={"event": "template_optimized"})
+    return optimized, report
+
+def main(argv=None):
+    """
+    Compile templates (the registry's templates by default) and print the before/after report
+    """
+    import template_registry
+
+    paths = (argv if argv is not None else sys.argv[1:]) or template_registry.registry.paths()
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        optimized, report = compile_template(os.path.abspath(path), data)
+        report = dict(report, convert_seconds=[conversion_seconds(data), conversion_seconds(optimized)])
+        print(json.dumps({"template": path, **report}, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
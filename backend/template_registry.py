@@ -0,0 +1,225 @@
+"""
+Certificate template registry
+Maps each domain (program) to its Word template instead of sharing one
+hard-coded file:
+
+- A JSON map (CERTIFICATE_TEMPLATE_MAP, "templates.json" by default) names
+  the templates; paths are relative to the map file:
+      {"default": "SpectoV_Cert.docx",
+       "domains": {"Data Science": "templates/data_science.docx"}}
+  Domains match case-insensitively; unmapped ones (or all of them, without a
+  map) use the default template (CERTIFICATE_TEMPLATE).
+- Templates are compiled once (read, validated, placeholders indexed, content
+  version computed) and kept in an LRU cache bounded by total size
+  (CERTIFICATE_TEMPLATE_CACHE_MB).
+- Every lookup stats the template and the map, so an edited file is picked up
+  by the next request in every worker, without a restart. The content version
+  lets callers discard outputs rendered from an older template.
+- With CERTIFICATE_OPTIMIZE_TEMPLATES=1 templates are compiled through the
+  template optimizer (template_optimizer.py) and the optimized copy is served.
+"""
+import io
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from docx import Document
+
+import template_optimizer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEMPLATE = os.environ.get('CERTIFICATE_TEMPLATE', 'SpectoV_Cert.docx')
+
+TEMPLATE_MAP = os.environ.get('CERTIFICATE_TEMPLATE_MAP', 'templates.json')
+
+# Total size of compiled templates kept in memory
+CACHE_LIMIT_MB = float(os.environ.get('CERTIFICATE_TEMPLATE_CACHE_MB', 32))
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{[^{}]+\}\}')
+
+def file_signature(path):
+    """
+    (mtime, size) of a file, or None if it does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+class CompiledTemplate:
+    """
+    A template loaded into memory, ready to be instantiated per certificate
+    """
+    __slots__ = ('path', 'signature', 'data', 'version', 'placeholders', 'optimization')
+
+    def __init__(self, path, signature, data, optimization=None):
+        self.path = path
+        self.signature = signature
+        self.data = data
+        self.optimization = optimization
+        self.version = hashlib.sha256(data).hexdigest()[:16]
+        self.placeholders = frozenset(self._placeholders(Document(io.BytesIO(data))))
+
+    @staticmethod
+    def _placeholders(doc):
+        paragraphs = list(doc.paragraphs)
+        for table in doc.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    paragraphs.extend(cell.paragraphs)
+        for para in paragraphs:
+            yield from PLACEHOLDER_PATTERN.findall(para.text)
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def document(self):
+        """
+        A fresh python-docx Document of this template (no disk access)
+        """
+        return Document(io.BytesIO(self.data))
+
+class TemplateRegistry:
+    """
+    Resolves domains to templates and caches compiled templates (LRU, size-bounded)
+    """
+
+    def __init__(self, map_path=TEMPLATE_MAP, default_template=DEFAULT_TEMPLATE, limit_mb=CACHE_LIMIT_MB):
+        self.map_path = map_path
+        self.default_template = default_template
+        self.limit_bytes = int(limit_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._map = (None, None, {})  # (path, signature, {domain: template path})
+        self.hits = 0
+        self.loads = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    def _domains(self):
+        """
+        The domain -> template mapping, re-read whenever the map file changes
+        """
+        map_path = os.path.abspath(self.map_path)
+        signature = file_signature(map_path)
+        path, cached_signature, mapping = self._map
+        if path == map_path and cached_signature == signature:
+            return mapping
+
+        mapping = {}
+        if signature is not None:
+            try:
+                with open(map_path) as f:
+                    config = json.load(f)
+                base = os.path.dirname(map_path)
+                if config.get('default'):
+                    mapping[None] = os.path.join(base, config['default'])
+                for domain, template in (config.get('domains') or {}).items():
+                    mapping[domain.strip().lower()] = os.path.join(base, template)
+            except (OSError, ValueError, AttributeError) as e:
+                logger.error("Invalid template map %s, using the default template: %s", map_path, e)
+                mapping = {}
+            else:
+                logger.info("Loaded template map %s (%d domains)", map_path, len(mapping) - (None in mapping))
+        self._map = (map_path, signature, mapping)
+        return mapping
+
+    def resolve(self, domain=None):
+        """
+        Absolute path of the template for a domain
+        """
+        with self._lock:
+            mapping = self._domains()
+        key = domain.strip().lower() if isinstance(domain, str) else None
+        path = mapping.get(key) or mapping.get(None) or self.default_template
+        return os.path.abspath(path)
+
+    def paths(self):
+        """
+        Absolute paths of the default template and every mapped one
+        """
+        with self._lock:
+            mapping = self._domains()
+        return sorted({self.resolve()} | {os.path.abspath(path) for path in mapping.values()})
+
+    def get(self, domain=None):
+        """
+        Compiled template for a domain, recompiled if the file changed since it was cached
+        Raises FileNotFoundError if the template does not exist.
+        """
+        path = self.resolve(domain)
+        signature = file_signature(path)
+        if signature is None:
+            with self._lock:
+                self._cache.pop(path, None)
+            raise FileNotFoundError(f"Certificate template not found: {path}")
+
+        with self._lock:
+            template = self._cache.get(path)
+            if template is not None and template.signature == signature:
+                self._cache.move_to_end(path)
+                self.hits += 1
+                return template
+
+        # Compile outside the lock; concurrent compiles of the same file are harmless
+        with open(path, 'rb') as f:
+            data = f.read()
+        optimization = None
+        if template_optimizer.OPTIMIZE_TEMPLATES:
+            data, optimization = template_optimizer.compile_template(path, data)
+        compiled = CompiledTemplate(path, signature, data, optimization)
+
+        with self._lock:
+            if template is not None:
+                self.reloads += 1
+                logger.info("Template %s changed (version %s -> %s), reloaded", path, template.version,
+                            compiled.version, extra={"event": "template_reloaded"})
+            else:
+                self.loads += 1
+            self._cache[path] = compiled
+            self._cache.move_to_end(path)
+            # Evict least recently used templates, always keeping the one just loaded
+            while len(self._cache) > 1 and sum(t.size for t in self._cache.values()) > self.limit_bytes:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        return compiled
+
+    def version(self, domain=None):
+        """
+        Content version of a domain's current template, or None if it is missing
+        """
+        try:
+            return self.get(domain).version
+        except Exception as e:
+            logger.warning("Certificate template unavailable for %r: %s", domain, e)
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._map = (None, None, {})
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached": {path: template.version for path, template in self._cache.items()},
+                "cached_bytes": sum(t.size for t in self._cache.values()),
+                "limit_bytes": self.limit_bytes,
+                "hits": self.hits,
+                "loads": self.loads,
+                "reloads": self.reloads,
+                "evictions": self.evictions,
+                "optimized": {
+                    path: {key: template.optimization[key] for key in ("bytes", "docx_seconds")}
+                    for path, template in self._cache.items() if template.optimization
+                }
+            }
+
+registry = TemplateRegistry()
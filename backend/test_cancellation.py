@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Test that abandoned certificate requests stop their conversion
+Uses the benchmark's stand-in converter so no LibreOffice is needed
+"""
+
+import os
+import sys
+import time
+import glob
+import socket
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cancellation
+import certificate_service
+from benchmark_services import prepare_workdir
+from cancellation import CancellationToken, ConversionCancelled, client_disconnected
+from conversion_scheduler import ConversionScheduler, INTERACTIVE
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+def issue_in_thread(token):
+    """Issue the test certificate in a thread, capturing the raised exception"""
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = certificate_service.issue_certificate(cancel_token=token, **CERTIFICATE_DATA)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+def test_cancel_kills_running_converter():
+    """Cancelling mid-conversion kills the converter and removes scratch files"""
+    original_commands = certificate_service.LIBREOFFICE_COMMANDS
+    with service_workdir() as workdir:
+        certificate_service.LIBREOFFICE_COMMANDS = [prepare_workdir(workdir, converter_delay=30)]
+        try:
+            before = cancellation.summary()["by_stage"].get("converting", 0)
+            token = CancellationToken()
+            thread, outcome = issue_in_thread(token)
+
+            time.sleep(1.0)
+            cancelled_at = time.monotonic()
+            token.cancel()
+            thread.join(timeout=5)
+
+            assert not thread.is_alive()
+            assert time.monotonic() - cancelled_at < 2
+            assert isinstance(outcome.get("error"), ConversionCancelled)
+            assert cancellation.summary()["by_stage"]["converting"] == before + 1
+            assert glob.glob(os.path.join(certificate_service.OUTPUT_DIR, "temp_certificate_*")) == []
+            assert glob.glob(os.path.join(certificate_service.OUTPUT_DIR, "*.pdf")) == []
+        finally:
+            certificate_service.LIBREOFFICE_COMMANDS = original_commands
+
+def test_cancel_while_queued_leaves_queue():
+    """A request cancelled while waiting for a slot gives up its place in the queue"""
+    scheduler = ConversionScheduler(1)
+    token = CancellationToken()
+    errors = []
+
+    def wait_for_slot():
+        try:
+            with scheduler.slot(INTERACTIVE, cancel_token=token):
+                pass
+        except ConversionCancelled as e:
+            errors.append(e)
+
+    with scheduler.slot(INTERACTIVE):
+        waiter = threading.Thread(target=wait_for_slot)
+        waiter.start()
+        time.sleep(0.1)
+        assert scheduler.stats()["lanes"][INTERACTIVE]["queue_depth"] == 1
+        token.cancel()
+        waiter.join(timeout=2)
+
+    assert len(errors) == 1
+    assert scheduler.stats()["lanes"][INTERACTIVE]["queue_depth"] == 0
+    assert scheduler.stats()["free_slots"] == 1
+
+def test_client_disconnected_detects_eof():
+    """A closed peer is a disconnect; pending request bytes are not"""
+    server, client = socket.socketpair()
+    try:
+        assert not client_disconnected(server)
+        client.sendall(b"GET / HTTP/1.1\r\n")
+        assert not client_disconnected(server)
+        server.recv(1024)
+        client.close()
+        assert client_disconnected(server)
+    finally:
+        server.close()
+
+def main():
+    """Main test function"""
+    print("Cancellation Test")
+    print("=" * 40)
+
+    tests = [
+        test_cancel_kills_running_converter,
+        test_cancel_while_queued_leaves_queue,
+        test_client_disconnected_detects_eof
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
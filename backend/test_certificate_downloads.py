@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Test certificate IDs and conditional / ranged downloads of issued certificates
+Runs without LibreOffice: conversion falls back to reportlab
+"""
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from docx import Document
+import certificate_registry
+import certificate_service
+
+CERTIFICATE_DATA = {
+    "name": "Jane Smith",
+    "domain": "Data Science",
+    "start_date": "February 1, 2024",
+    "end_date": "April 30, 2024",
+    "gender": "female"
+}
+
+@contextlib.contextmanager
+def service_workdir():
+    """Run the service in a scratch directory with a minimal template"""
+    original_cwd = os.getcwd()
+    original_output_dir = certificate_service.OUTPUT_DIR
+    original_registry_path = certificate_registry.REGISTRY_PATH
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            doc = Document()
+            doc.add_paragraph('This is to certify that {{Name}}')
+            doc.add_paragraph('has completed {{Domain}} from {{Start Date}} to {{End Date}}.')
+            doc.add_paragraph('ISSUED DATE :')
+            doc.save("SpectoV_Cert.docx")
+            certificate_service.OUTPUT_DIR = os.path.join(workdir, "static")
+            certificate_registry.REGISTRY_PATH = os.path.join(workdir, "static", "certificates.db")
+            yield workdir
+        finally:
+            certificate_service.OUTPUT_DIR = original_output_dir
+            certificate_registry.REGISTRY_PATH = original_registry_path
+            os.chdir(original_cwd)
+
+def test_generate_returns_stable_id():
+    """The same request issues the same certificate ID and reuses the file"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        first = client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+        second = client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+
+        assert first.status_code == 200
+        assert first.headers['X-Certificate-Id'] == second.headers['X-Certificate-Id']
+        assert first.data == second.data
+        assert first.data.startswith(b'%PDF')
+
+def test_conditional_get():
+    """A repeated download with a matching ETag is answered with 304"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        issued = client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+        certificate_id = issued.headers['X-Certificate-Id']
+
+        response = client.get(f'/api/certificates/{certificate_id}')
+        assert response.status_code == 200
+        assert response.headers.get('ETag')
+        assert response.headers.get('Last-Modified')
+
+        cached = client.get(
+            f'/api/certificates/{certificate_id}',
+            headers={'If-None-Match': response.headers['ETag']}
+        )
+        assert cached.status_code == 304
+        assert cached.data == b''
+
+def test_range_request():
+    """Byte ranges are served with 206 so downloads can resume"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        issued = client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+        certificate_id = issued.headers['X-Certificate-Id']
+
+        response = client.get(f'/api/certificates/{certificate_id}', headers={'Range': 'bytes=0-99'})
+        assert response.status_code == 206
+        assert response.data == issued.data[:100]
+        assert response.headers['Content-Range'].startswith('bytes 0-99/')
+
+def test_unknown_and_invalid_ids():
+    """Unknown IDs are 404, malformed IDs are rejected before touching the disk"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        missing = client.get('/api/certificates/00000000-0000-0000-0000-000000000000')
+        assert missing.status_code == 404
+
+        invalid = client.get('/api/certificates/..%2Fsecret')
+        assert invalid.status_code in (400, 404)
+
+def test_accel_redirect():
+    """With a proxy prefix configured the body is left to the front proxy"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        issued = client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+        certificate_id = issued.headers['X-Certificate-Id']
+
+        certificate_service.ACCEL_REDIRECT_PREFIX = '/protected-certificates/'
+        try:
+            response = client.get(f'/api/certificates/{certificate_id}')
+        finally:
+            certificate_service.ACCEL_REDIRECT_PREFIX = None
+
+        assert response.headers['X-Accel-Redirect'] == f'/protected-certificates/certificate_{certificate_id}.pdf'
+        assert response.data == b''
+
+def test_format_negotiation():
+    """The output format follows the format parameter, then the Accept header"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+
+        docx = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, format='docx'))
+        assert docx.status_code == 200
+        assert docx.mimetype == certificate_service.FORMAT_MIMETYPES['docx']
+        assert docx.data.startswith(b'PK')
+
+        pdf = client.post('/api/generate-certificate', json=CERTIFICATE_DATA, headers={'Accept': '*/*'})
+        assert pdf.mimetype == 'application/pdf'
+        assert pdf.headers['X-Certificate-Id'] == docx.headers['X-Certificate-Id']
+
+        by_accept = client.post(
+            '/api/generate-certificate',
+            json=CERTIFICATE_DATA,
+            headers={'Accept': certificate_service.FORMAT_MIMETYPES['docx']}
+        )
+        assert by_accept.mimetype == certificate_service.FORMAT_MIMETYPES['docx']
+
+        unsupported = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, format='tiff'))
+        assert unsupported.status_code == 406
+
+def test_preview_is_cached():
+    """Previews are rendered from the cached PDF and cached themselves"""
+    preview = certificate_service.certificate_preview
+    installed = preview.PYMUPDF_AVAILABLE or shutil.which('pdftoppm')
+    real_rasterizer = preview.rasterize_with_pymupdf if preview.PYMUPDF_AVAILABLE else preview.rasterize_with_pdftoppm
+    rasterized = []
+
+    def rasterizer(pdf_path):
+        rasterized.append(pdf_path)
+        if installed:
+            return real_rasterizer(pdf_path)
+        # No rasterizer installed here: stand in with a blank page
+        from PIL import Image
+        output = io.BytesIO()
+        Image.new('RGB', (410, 585), 'white').save(output, 'PNG')
+        return output.getvalue()
+
+    original = preview.PYMUPDF_AVAILABLE, preview.rasterize_with_pdftoppm
+    preview.PYMUPDF_AVAILABLE, preview.rasterize_with_pdftoppm = False, rasterizer
+    try:
+        with service_workdir():
+            client = certificate_service.app.test_client()
+            response = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, format='png'))
+            assert response.status_code == 200
+            assert response.mimetype == 'image/png'
+            assert response.headers['Content-Disposition'].startswith('inline')
+            assert response.data.startswith(b'\x89PNG')
+
+            certificate_id = response.headers['X-Certificate-Id']
+            preview_path = certificate_service.certificate_path(certificate_id, 'png')
+            assert os.path.exists(preview_path)
+            assert rasterized == [certificate_service.certificate_path(certificate_id)]
+
+            again = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, format='png'))
+            assert again.data == response.data and len(rasterized) == 1
+
+            webp = client.get(f'/api/certificates/{certificate_id}?format=webp')
+            assert webp.status_code == 200
+            assert webp.data[8:12] == b'WEBP'
+    finally:
+        preview.PYMUPDF_AVAILABLE, preview.rasterize_with_pdftoppm = original
+
+def main():
+    """Main test function"""
+    print("Certificate Download Test")
+    print("=" * 40)
+
+    tests = [
+        test_generate_returns_stable_id,
+        test_conditional_get,
+        test_range_request,
+        test_unknown_and_invalid_ids,
+        test_accel_redirect,
+        test_format_negotiation,
+        test_preview_is_cached
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
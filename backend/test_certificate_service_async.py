@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Test the ASGI variant of the certificate service
+Uses a stand-in converter so it runs without LibreOffice
+"""
+
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cancellation
+import certificate_service
+from benchmark_services import prepare_workdir
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+try:
+    from starlette.testclient import TestClient
+    import certificate_service_async
+    ASYNC_SERVICE_AVAILABLE = True
+except ImportError:
+    ASYNC_SERVICE_AVAILABLE = False
+
+def test_generate_and_conditional_get():
+    """The async routes match the Flask ones: IDs, 304 and 206"""
+    if not ASYNC_SERVICE_AVAILABLE:
+        print("  starlette/httpx not installed, skipping")
+        return
+
+    with service_workdir():
+        client = TestClient(certificate_service_async.app)
+        issued = client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+        assert issued.status_code == 200
+        assert issued.content.startswith(b'%PDF')
+        certificate_id = issued.headers['x-certificate-id']
+
+        cached = client.get(f'/api/certificates/{certificate_id}', headers={'If-None-Match': issued.headers['etag']})
+        assert cached.status_code == 304
+
+        ranged = client.get(f'/api/certificates/{certificate_id}', headers={'Range': 'bytes=0-9'})
+        assert ranged.status_code == 206
+        assert ranged.content == issued.content[:10]
+
+        verified = client.get(f'/api/verify/{certificate_id}')
+        assert verified.json()['valid'] is True
+
+        missing = client.post('/api/generate-certificate', json={"name": "Only Name"})
+        assert missing.status_code == 400
+
+def test_conversions_overlap():
+    """Several slow conversions run at once instead of one after another"""
+    if not ASYNC_SERVICE_AVAILABLE:
+        print("  starlette/httpx not installed, skipping")
+        return
+
+    original_commands = certificate_service.LIBREOFFICE_COMMANDS
+    with service_workdir() as workdir:
+        certificate_service.LIBREOFFICE_COMMANDS = [prepare_workdir(workdir, 0.5)]
+        try:
+            async def issue_all():
+                return await asyncio.gather(*[
+                    certificate_service_async.issue_certificate_async(
+                        f"Student {i}", "Web Development", "May 1, 2025", "June 30, 2025", "other"
+                    )
+                    for i in range(4)
+                ])
+
+            start = time.perf_counter()
+            results = asyncio.run(issue_all())
+            elapsed = time.perf_counter() - start
+        finally:
+            certificate_service.LIBREOFFICE_COMMANDS = original_commands
+
+        assert len({certificate_id for certificate_id, _ in results}) == 4
+        assert all(os.path.exists(path) for _, path in results)
+        assert elapsed < 4 * 0.5, f"conversions did not overlap ({elapsed:.2f}s)"
+
+def test_cancelled_task_kills_converter():
+    """Cancelling an issuing task kills LibreOffice and leaves no scratch files"""
+    if not ASYNC_SERVICE_AVAILABLE:
+        print("  starlette/httpx not installed, skipping")
+        return
+
+    original_commands = certificate_service.LIBREOFFICE_COMMANDS
+    with service_workdir() as workdir:
+        certificate_service.LIBREOFFICE_COMMANDS = [prepare_workdir(workdir, 30)]
+        try:
+            before = cancellation.summary()["by_stage"].get("converting", 0)
+
+            async def issue_then_cancel():
+                task = asyncio.ensure_future(certificate_service_async.issue_certificate_async(**CERTIFICATE_DATA))
+                await asyncio.sleep(1.0)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    return True
+                return False
+
+            start = time.perf_counter()
+            cancelled = asyncio.run(issue_then_cancel())
+            elapsed = time.perf_counter() - start
+        finally:
+            certificate_service.LIBREOFFICE_COMMANDS = original_commands
+
+        assert cancelled
+        assert elapsed < 3
+        assert cancellation.summary()["by_stage"]["converting"] == before + 1
+        assert not [f for f in os.listdir(certificate_service.OUTPUT_DIR) if f.startswith('temp_certificate_')]
+
+def main():
+    """Main test function"""
+    print("Async Certificate Service Test")
+    print("=" * 40)
+
+    tests = [
+        test_generate_and_conditional_get,
+        test_conversions_overlap,
+        test_cancelled_task_kills_converter
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
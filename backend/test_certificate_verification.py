@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test the embedded verification registry and the QR code on issued certificates
+"""
+
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from docx import Document
+import certificate_registry
+import certificate_service
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+def test_verify_issued_certificate():
+    """An issued certificate verifies by ID with its recorded details"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        issued = client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+        certificate_id = issued.headers['X-Certificate-Id']
+
+        response = client.get(f'/api/verify/{certificate_id}')
+        assert response.status_code == 200
+        body = response.get_json()
+        assert body['valid'] is True
+        assert body['certificate']['name'] == CERTIFICATE_DATA['name']
+        assert body['certificate']['domain'] == CERTIFICATE_DATA['domain']
+
+        unknown = client.get(f'/api/verify/{uuid.uuid4()}')
+        assert unknown.status_code == 404
+        assert unknown.get_json()['valid'] is False
+
+def test_bulk_verify():
+    """Thousands of IDs are verified in a single call"""
+    with service_workdir():
+        issued_ids = [str(uuid.uuid4()) for _ in range(2000)]
+        for certificate_id in issued_ids:
+            certificate_registry.record_certificate(
+                certificate_id, "Student", "Web Development", "May 1, 2025", "June 30, 2025", "July 1, 2025"
+            )
+        unknown_ids = [str(uuid.uuid4()) for _ in range(1000)] + ["not-an-id"]
+
+        client = certificate_service.app.test_client()
+        response = client.post('/api/verify', json={"ids": issued_ids + unknown_ids})
+        assert response.status_code == 200
+        body = response.get_json()
+        assert body['valid_count'] == len(issued_ids)
+        assert body['invalid_count'] == len(unknown_ids)
+        assert body['results'][issued_ids[0]]['name'] == "Student"
+        assert body['results']["not-an-id"] is None
+
+        bad = client.post('/api/verify', json={"ids": "not-a-list"})
+        assert bad.status_code == 400
+
+def test_qr_code_embedded():
+    """The rendered DOCX carries the QR code image"""
+    if not certificate_service.QRCODE_AVAILABLE:
+        print("  qrcode not installed, skipping")
+        return
+
+    doc = Document()
+    doc.add_paragraph('{{QR Code}}')
+    assert certificate_service.add_qr_code(doc, str(uuid.uuid4()))
+    assert doc.inline_shapes
+    assert '{{QR Code}}' not in doc.paragraphs[0].text
+
+def main():
+    """Main test function"""
+    print("Certificate Verification Test")
+    print("=" * 40)
+
+    tests = [
+        test_verify_issued_certificate,
+        test_bulk_verify,
+        test_qr_code_embedded
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Test priority lanes and weighted fair queuing of conversion slots
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from conversion_scheduler import (
+    FairQueue, ConversionScheduler, AsyncConversionScheduler, INTERACTIVE, BULK, parse_lane_weights
+)
+
+WEIGHTS = {INTERACTIVE: 8.0, BULK: 1.0}
+
+def test_parse_lane_weights():
+    """Lane weights are read from "lane=weight" pairs"""
+    assert parse_lane_weights("interactive=8, bulk=1") == WEIGHTS
+
+def test_interactive_overtakes_queued_bulk_work():
+    """An interactive ticket queued behind many bulk tickets is granted next"""
+    queue = FairQueue(1, WEIGHTS)
+    running = queue.enqueue(BULK)
+    queue.dispatch()
+    bulk = [queue.enqueue(BULK) for _ in range(50)]
+    interactive = queue.enqueue(INTERACTIVE)
+
+    queue.release(running)
+    granted = queue.dispatch()
+    assert granted == [interactive]
+    assert queue.stats()["lanes"][BULK]["queue_depth"] == 50
+    assert not any(ticket.granted for ticket in bulk)
+
+def test_weighted_share_under_contention():
+    """With both lanes saturated, slots are shared by weight and bulk still progresses"""
+    queue = FairQueue(1, WEIGHTS)
+    for _ in range(100):
+        queue.enqueue(INTERACTIVE)
+        queue.enqueue(BULK)
+
+    order = []
+    for _ in range(90):
+        ticket = queue.dispatch()[0]
+        order.append(ticket.lane)
+        queue.release(ticket)
+
+    assert 75 <= order.count(INTERACTIVE) <= 85
+    assert order.count(BULK) >= 5
+
+def test_threaded_interactive_latency_bounded():
+    """A student request waits about one conversion, not the whole batch"""
+    scheduler = ConversionScheduler(1, WEIGHTS)
+    conversion_time = 0.02
+
+    def convert(lane):
+        with scheduler.slot(lane):
+            time.sleep(conversion_time)
+
+    bulk_threads = [threading.Thread(target=convert, args=(BULK,)) for _ in range(30)]
+    for thread in bulk_threads:
+        thread.start()
+    time.sleep(conversion_time * 2)
+
+    start = time.perf_counter()
+    convert(INTERACTIVE)
+    interactive_latency = time.perf_counter() - start
+
+    for thread in bulk_threads:
+        thread.join()
+
+    assert interactive_latency < conversion_time * 5, f"interactive waited {interactive_latency:.3f}s"
+    stats = scheduler.stats()["lanes"]
+    assert stats[BULK]["granted"] == 30
+    assert stats[INTERACTIVE]["granted"] == 1
+    assert stats[BULK]["wait_p99_seconds"] > stats[INTERACTIVE]["wait_p99_seconds"]
+
+def test_async_cancelled_waiter_leaves_queue():
+    """A cancelled waiter gives up its place without leaking a slot"""
+    async def scenario():
+        scheduler = AsyncConversionScheduler(1, WEIGHTS)
+        async with scheduler.slot(BULK):
+            waiter = asyncio.ensure_future(scheduler.slot(INTERACTIVE).__aenter__())
+            await asyncio.sleep(0)
+            assert scheduler.stats()["lanes"][INTERACTIVE]["queue_depth"] == 1
+            waiter.cancel()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                pass
+        stats = scheduler.stats()
+        assert stats["free_slots"] == 1
+        assert stats["lanes"][INTERACTIVE]["queue_depth"] == 0
+
+    asyncio.run(scenario())
+
+def main():
+    """Main test function"""
+    print("Conversion Scheduler Test")
+    print("=" * 40)
+
+    tests = [
+        test_parse_lane_weights,
+        test_interactive_overtakes_queued_bulk_work,
+        test_weighted_share_under_contention,
+        test_threaded_interactive_latency_bounded,
+        test_async_cancelled_waiter_leaves_queue
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
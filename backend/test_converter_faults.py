@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Fault-injection tests of the converter path, using fake_soffice.py in place of LibreOffice
+Checks tail latency, timeouts, failing / crashing / silent converters and
+cleanup of scratch files and converter processes.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pikepdf
+import certificate_service
+from converter_supervisor import supervisor
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+from test_converter_supervisor import gone
+
+FAKE_SOFFICE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_soffice.py')
+
+@contextlib.contextmanager
+def fake_converter(timeout=5, **settings):
+    """
+    Run the service in a scratch directory with fake_soffice as its only converter
+    settings become FAKE_SOFFICE_* variables (latency="uniform:0.1,0.2", hang_rate=1, ...).
+    Yields (client, invocations), invocations() returning the converter's log records.
+    """
+    original = (certificate_service.LIBREOFFICE_COMMANDS, certificate_service.LIBREOFFICE_TIMEOUT)
+    saved_environ = dict(os.environ)
+    with service_workdir() as workdir:
+        log_path = os.path.join(workdir, 'fake_soffice.jsonl')
+        os.environ['FAKE_SOFFICE_LOG'] = log_path
+        os.environ['FAKE_SOFFICE_SEED'] = '41'
+        for key, value in settings.items():
+            os.environ[f'FAKE_SOFFICE_{key.upper()}'] = str(value)
+        certificate_service.LIBREOFFICE_COMMANDS = [FAKE_SOFFICE]
+        certificate_service.LIBREOFFICE_TIMEOUT = timeout
+
+        def invocations():
+            if not os.path.exists(log_path):
+                return []
+            with open(log_path) as f:
+                return [json.loads(line) for line in f]
+
+        try:
+            yield certificate_service.app.test_client(), invocations
+            leftovers = [name for name in os.listdir(certificate_service.OUTPUT_DIR)
+                         if name.startswith('temp_certificate_')]
+            assert not leftovers, f"scratch files left behind: {leftovers}"
+        finally:
+            certificate_service.LIBREOFFICE_COMMANDS, certificate_service.LIBREOFFICE_TIMEOUT = original
+            os.environ.clear()
+            os.environ.update(saved_environ)
+
+def issue(client, index=0):
+    """Issue a uniquely named certificate; returns (latency, response)"""
+    start = time.perf_counter()
+    response = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, name=f"Fault Student {index}"))
+    return time.perf_counter() - start, response
+
+def converted_by_fake(response):
+    """True if the PDF came from fake_soffice rather than the reportlab fallback"""
+    with pikepdf.open(io.BytesIO(response.data)) as pdf:
+        return b'fake_soffice' in pdf.pages[0].Contents.read_bytes()
+
+def test_tail_latency():
+    """With a converter latency distribution, p95 stays within the slowest conversion plus overhead"""
+    with fake_converter(latency='uniform:0.05,0.2') as (client, invocations):
+        latencies = []
+        for index in range(10):
+            latency, response = issue(client, index)
+            assert response.status_code == 200
+            assert converted_by_fake(response)
+            latencies.append(latency)
+
+        latencies.sort()
+        p95 = latencies[int(0.95 * len(latencies)) - 1]
+        slowest_conversion = max(record["latency"] for record in invocations())
+        assert len(invocations()) == 10
+        assert p95 < slowest_conversion + 1.5, f"p95 {p95:.2f}s"
+
+def test_hanging_converter_times_out():
+    """A hung converter is killed at the timeout and the request falls back to reportlab"""
+    timed_out = supervisor.stats()["timed_out"]
+    with fake_converter(timeout=1, hang_rate=1, orphan=1) as (client, invocations):
+        latency, response = issue(client)
+        assert response.status_code == 200
+        assert not converted_by_fake(response)
+        assert 1.0 <= latency < 4.0, f"latency {latency:.2f}s"
+
+        record, = invocations()
+        assert record["outcome"] == "hang"
+        assert gone(record["pid"]) and gone(record["child"])
+    assert supervisor.stats()["timed_out"] == timed_out + 1
+
+def test_failing_converters_fall_back():
+    """Non-zero exits, crashes and missing outputs all end in the reportlab fallback"""
+    for fault in ('fail_rate', 'crash_rate', 'missing_rate'):
+        with fake_converter(**{fault: 1}) as (client, invocations):
+            latency, response = issue(client)
+            assert response.status_code == 200, fault
+            assert not converted_by_fake(response), fault
+            assert [record["outcome"] for record in invocations()] == [fault.split('_')[0]]
+
+def test_orphaned_children_are_killed():
+    """A child left running by a successful converter is killed with its group"""
+    with fake_converter(orphan=1) as (client, invocations):
+        latency, response = issue(client)
+        assert response.status_code == 200
+        assert converted_by_fake(response)
+        record, = invocations()
+        assert gone(record["child"])
+
+def test_partial_failures_under_load():
+    """With a mix of faults every request still succeeds and nothing is left behind"""
+    with fake_converter(latency='exponential:0.05', fail_rate=0.3, missing_rate=0.3) as (client, invocations):
+        results = [issue(client, index)[1] for index in range(12)]
+        assert all(response.status_code == 200 for response in results)
+        outcomes = {record["outcome"] for record in invocations()}
+        assert 'ok' in outcomes and outcomes & {'fail', 'missing'}
+        assert sum(converted_by_fake(response) for response in results) == \
+            sum(record["outcome"] == 'ok' for record in invocations())
+
+def main():
+    """Main test function"""
+    print("Converter Fault Injection Test")
+    print("=" * 40)
+
+    tests = [
+        test_tail_latency,
+        test_hanging_converter_times_out,
+        test_failing_converters_fall_back,
+        test_orphaned_children_are_killed,
+        test_partial_failures_under_load
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
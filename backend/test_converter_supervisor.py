@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Test the converter supervisor: process groups, rlimits, stray reaping and drain
+Uses small Python scripts in place of soffice
+"""
+
+import os
+import sys
+import time
+import signal
+import tempfile
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import converter_supervisor
+from converter_supervisor import ConverterSupervisor, SupervisorShuttingDown, OWNER_ENV
+
+# Like soffice: the launcher starts a long-lived child and writes its pid
+FORKING_CONVERTER = '''
+import sys, time, subprocess
+child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+with open(sys.argv[1], "w") as f:
+    f.write(str(child.pid))
+time.sleep(float(sys.argv[2]))
+'''
+
+def child_pid(pid_file):
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        if os.path.exists(pid_file) and open(pid_file).read():
+            return int(open(pid_file).read())
+        time.sleep(0.05)
+    raise AssertionError("converter did not start its child")
+
+def gone(pid, wait=2.0):
+    """True once pid has exited (zombies of other parents count as gone)"""
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                if f.read().rsplit(')', 1)[1].split()[0] == 'Z':
+                    return True
+        except OSError:
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_timeout_kills_whole_group():
+    """On timeout the launcher and the child it started are both killed"""
+    supervisor = ConverterSupervisor()
+    with tempfile.TemporaryDirectory() as workdir:
+        pid_file = os.path.join(workdir, 'child.pid')
+        try:
+            supervisor.run([sys.executable, '-c', FORKING_CONVERTER, pid_file, '30'], timeout=1)
+            raise AssertionError("expected a timeout")
+        except subprocess.TimeoutExpired:
+            pass
+        assert gone(child_pid(pid_file))
+    assert supervisor.stats()["timed_out"] == 1
+    assert supervisor.stats()["in_flight"] == 0
+
+def test_finished_converter_leaves_no_children():
+    """Children still running when the launcher exits are cleaned up"""
+    supervisor = ConverterSupervisor()
+    with tempfile.TemporaryDirectory() as workdir:
+        pid_file = os.path.join(workdir, 'child.pid')
+        returncode, _, _ = supervisor.run([sys.executable, '-c', FORKING_CONVERTER, pid_file, '0'], timeout=30)
+        assert returncode == 0
+        assert gone(child_pid(pid_file))
+
+def test_memory_limit():
+    """A converter allocating past its memory limit fails instead of exhausting the host"""
+    supervisor = ConverterSupervisor(memory_mb=256)
+    returncode, _, stderr = supervisor.run(
+        [sys.executable, '-c', 'x = bytearray(512 * 1024 * 1024)'], timeout=30
+    )
+    assert returncode != 0
+    assert 'MemoryError' in stderr
+
+def test_rlimits_applied_without_preexec_fn():
+    """The converter is started under prlimit and sees the CPU and memory limits"""
+    if converter_supervisor.PRLIMIT is None:
+        print("  prlimit not installed, skipping")
+        return
+
+    supervisor = ConverterSupervisor(cpu_seconds=7, memory_mb=3000)
+    assert 'preexec_fn' not in supervisor.popen_kwargs()
+    supervisor.spawn_failed()
+    returncode, stdout, _ = supervisor.run([sys.executable, '-c', (
+        'import resource; '
+        'print(resource.getrlimit(resource.RLIMIT_CPU), resource.getrlimit(resource.RLIMIT_AS))'
+    )], timeout=30)
+    assert returncode == 0
+    assert stdout.strip() == f"(7, 12) ({3000 * 1024 * 1024}, {3000 * 1024 * 1024})"
+    assert supervisor.stats()["rlimits_enforced"]
+
+    try:
+        supervisor.command(['no-such-converter', '--headless'])
+        raise AssertionError("expected FileNotFoundError")
+    except FileNotFoundError:
+        pass
+
+def test_default_memory_limit_allows_reservations():
+    """
+    Like soffice.bin, a converter may reserve much more address space than it
+    touches; the default limit must leave room for that
+    """
+    supervisor = ConverterSupervisor()
+    returncode, stdout, stderr = supervisor.run([sys.executable, '-c', (
+        'import mmap; reserved = mmap.mmap(-1, 2560 * 1024 * 1024); print("started")'
+    )], timeout=30)
+    assert returncode == 0, stderr
+    assert stdout.strip() == "started"
+
+def test_reaps_orphans_of_dead_workers():
+    """Marked processes whose owning worker has died are reaped"""
+    dead_worker = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead_worker.wait()
+
+    env = dict(os.environ)
+    env[OWNER_ENV] = str(dead_worker.pid)
+    stray = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'],
+                             env=env, start_new_session=True)
+    try:
+        time.sleep(0.2)
+        supervisor = ConverterSupervisor()
+        assert supervisor.reap_strays() >= 1
+        stray.wait(timeout=5)
+        assert stray.returncode == -signal.SIGKILL
+    finally:
+        if stray.poll() is None:
+            stray.kill()
+
+def test_shutdown_drains_in_flight():
+    """Shutdown waits for a running conversion, then refuses new ones"""
+    supervisor = ConverterSupervisor()
+    results = []
+
+    def convert():
+        results.append(supervisor.run([sys.executable, '-c', 'import time; time.sleep(1)'], timeout=30))
+
+    worker = threading.Thread(target=convert)
+    worker.start()
+    time.sleep(0.3)
+    assert supervisor.shutdown(drain_timeout=10) == 0
+    worker.join()
+
+    assert results[0][0] == 0
+    try:
+        supervisor.run([sys.executable, '-c', 'pass'], timeout=30)
+        raise AssertionError("expected SupervisorShuttingDown")
+    except SupervisorShuttingDown:
+        pass
+
+def test_shutdown_kills_after_drain_timeout():
+    """Conversions still running when the drain times out are killed"""
+    supervisor = ConverterSupervisor()
+
+    def convert():
+        supervisor.run([sys.executable, '-c', 'import time; time.sleep(30)'], timeout=60)
+
+    worker = threading.Thread(target=convert)
+    worker.start()
+    time.sleep(0.3)
+    start = time.time()
+    assert supervisor.shutdown(drain_timeout=0.5) == 1
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+    assert time.time() - start < 3
+    assert supervisor.stats()["killed_on_shutdown"] == 1
+
+def main():
+    """Main test function"""
+    print("Converter Supervisor Test")
+    print("=" * 40)
+
+    if not converter_supervisor.RESOURCE_AVAILABLE:
+        print("  process groups and rlimits not available on this platform, skipping")
+        return True
+
+    tests = [
+        test_timeout_kills_whole_group,
+        test_finished_converter_leaves_no_children,
+        test_memory_limit,
+        test_rlimits_applied_without_preexec_fn,
+        test_default_memory_limit_allows_reservations,
+        test_reaps_orphans_of_dead_workers,
+        test_shutdown_drains_in_flight,
+        test_shutdown_kills_after_drain_timeout
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Test deterministic output: identical requests give byte-identical DOCX and PDF files
+Runs without LibreOffice: conversion falls back to reportlab
+"""
+
+import os
+import sys
+import hashlib
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pikepdf
+import certificate_service
+import deterministic_output
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+REQUEST = dict(CERTIFICATE_DATA, issued_date="2024-05-02")
+
+def issue(output_format):
+    """Issue a certificate in a fresh workdir; returns (certificate_id, bytes)"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        response = client.post('/api/generate-certificate', json=dict(REQUEST, format=output_format))
+        assert response.status_code == 200, response.data
+        return response.headers['X-Certificate-Id'], response.data
+
+def test_pdf_is_byte_identical():
+    """Two runs of the same request produce the same PDF bytes, dated from issued_date"""
+    first_id, first = issue('pdf')
+    second_id, second = issue('pdf')
+    assert first_id == second_id
+    assert hashlib.sha256(first).hexdigest() == hashlib.sha256(second).hexdigest()
+
+    with service_workdir() as workdir:
+        path = os.path.join(workdir, 'certificate.pdf')
+        with open(path, 'wb') as f:
+            f.write(first)
+        with pikepdf.open(path) as pdf:
+            assert str(pdf.docinfo['/CreationDate']) == 'D:20240502000000Z'
+            assert '/Metadata' not in pdf.Root
+
+def test_docx_is_byte_identical():
+    """The DOCX has pinned core properties and zip timestamps"""
+    _, first = issue('docx')
+    _, second = issue('docx')
+    assert first == second
+
+    with service_workdir() as workdir:
+        path = os.path.join(workdir, 'certificate.docx')
+        with open(path, 'wb') as f:
+            f.write(first)
+        with zipfile.ZipFile(path) as archive:
+            assert all(info.date_time == deterministic_output.ZIP_EPOCH for info in archive.infolist())
+            core = archive.read('docProps/core.xml').decode()
+            assert '2024-05-02T00:00:00Z' in core
+
+def test_issued_date_validation():
+    """issued_date accepts the certificate format or ISO dates and rejects anything else"""
+    assert deterministic_output.parse_issued_date("2024-05-02") == "May 02, 2024"
+    assert deterministic_output.parse_issued_date("May 02, 2024") == "May 02, 2024"
+    assert deterministic_output.parse_issued_date("02/05/2024") is None
+
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        response = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, issued_date="soon"))
+        assert response.status_code == 400
+        response = client.post('/api/generate-certificates', json={
+            "certificates": [CERTIFICATE_DATA, dict(CERTIFICATE_DATA, issued_date="soon")]
+        })
+        assert response.status_code == 400
+        assert "[1]" in response.get_json()["error"]
+
+def main():
+    """Main test function"""
+    print("Deterministic Output Test")
+    print("=" * 40)
+
+    tests = [
+        test_pdf_is_byte_identical,
+        test_docx_is_byte_identical,
+        test_issued_date_validation
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
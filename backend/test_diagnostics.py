@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Test opt-in request profiling and the memory diagnostics endpoint
+"""
+
+import os
+import sys
+import pstats
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import diagnostics
+import certificate_service
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+try:
+    from starlette.testclient import TestClient
+    import certificate_service_async
+    ASYNC_SERVICE_AVAILABLE = True
+except ImportError:
+    ASYNC_SERVICE_AVAILABLE = False
+
+TOKEN = 'test-diagnostics-token'
+
+@contextlib.contextmanager
+def diagnostics_enabled(workdir):
+    original = (diagnostics.DIAGNOSTICS_TOKEN, diagnostics.DIAGNOSTICS_DIR)
+    diagnostics.DIAGNOSTICS_TOKEN = TOKEN
+    diagnostics.DIAGNOSTICS_DIR = os.path.join(workdir, 'diagnostics')
+    try:
+        yield diagnostics.DIAGNOSTICS_DIR
+    finally:
+        diagnostics.DIAGNOSTICS_TOKEN, diagnostics.DIAGNOSTICS_DIR = original
+
+def test_profile_requested_by_header():
+    """A request carrying the token is profiled and the profile is stored"""
+    with service_workdir() as workdir, diagnostics_enabled(workdir) as diagnostics_dir:
+        client = certificate_service.app.test_client()
+        response = client.post('/api/generate-certificate', json=CERTIFICATE_DATA,
+                               headers={diagnostics.PROFILE_HEADER: TOKEN})
+        assert response.status_code == 200
+        profile_id = response.headers['X-Profile-Id']
+
+        prof = os.path.join(diagnostics_dir, f'profile_{profile_id}.prof')
+        stats = pstats.Stats(prof)
+        assert any(function == 'issue_certificate' for _, _, function in stats.stats)
+        with open(os.path.join(diagnostics_dir, f'profile_{profile_id}.txt')) as f:
+            assert 'POST /api/generate-certificate' in f.read()
+
+        listed = client.get('/api/diagnostics/profiles', headers={diagnostics.TOKEN_HEADER: TOKEN})
+        assert listed.json['profiles'] == [f'profile_{profile_id}.prof']
+
+def test_no_profile_without_valid_token():
+    """A wrong token, or diagnostics switched off, does not profile"""
+    with service_workdir() as workdir:
+        client = certificate_service.app.test_client()
+        response = client.post('/api/generate-certificate', json=CERTIFICATE_DATA,
+                               headers={diagnostics.PROFILE_HEADER: TOKEN})
+        assert 'X-Profile-Id' not in response.headers
+
+        with diagnostics_enabled(workdir):
+            response = client.post('/api/generate-certificate', json=CERTIFICATE_DATA,
+                                   headers={diagnostics.PROFILE_HEADER: 'wrong'})
+            assert 'X-Profile-Id' not in response.headers
+
+def test_memory_endpoint():
+    """The memory report is protected and reports allocators once tracemalloc runs"""
+    with service_workdir() as workdir:
+        client = certificate_service.app.test_client()
+        assert client.get('/api/diagnostics/memory').status_code == 404
+
+        with diagnostics_enabled(workdir):
+            assert client.get('/api/diagnostics/memory').status_code == 403
+
+            headers = {diagnostics.TOKEN_HEADER: TOKEN}
+            try:
+                started = client.get('/api/diagnostics/memory?tracemalloc=start', headers=headers)
+                assert started.status_code == 200
+                assert started.json['tracemalloc'] is True
+
+                client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+                report = client.get('/api/diagnostics/memory?limit=5', headers=headers).json
+                assert len(report['top_allocators']) == 5
+                assert report['traced_mb'] > 0
+                assert 'docx_objects' in report
+            finally:
+                stopped = client.get('/api/diagnostics/memory?tracemalloc=stop', headers=headers)
+                assert stopped.json['tracemalloc'] is False
+
+def test_async_service_profiles_requests():
+    """The ASGI service profiles requests too and lists the stored profiles"""
+    if not ASYNC_SERVICE_AVAILABLE:
+        print("  starlette not installed, skipping")
+        return
+
+    with service_workdir() as workdir, diagnostics_enabled(workdir) as diagnostics_dir:
+        client = TestClient(certificate_service_async.app)
+        unprofiled = client.post('/api/generate-certificate', json=CERTIFICATE_DATA,
+                                 headers={diagnostics.PROFILE_HEADER: 'wrong'})
+        assert unprofiled.status_code == 200 and 'x-profile-id' not in unprofiled.headers
+
+        response = client.post('/api/generate-certificate', json=CERTIFICATE_DATA,
+                               headers={diagnostics.PROFILE_HEADER: TOKEN})
+        assert response.status_code == 200
+        profile_id = response.headers['x-profile-id']
+        stats = pstats.Stats(os.path.join(diagnostics_dir, f'profile_{profile_id}.prof'))
+        assert any(function == 'generate_certificate_api' for _, _, function in stats.stats)
+
+        assert client.get('/api/diagnostics/profiles').status_code == 403
+        listed = client.get('/api/diagnostics/profiles', headers={diagnostics.TOKEN_HEADER: TOKEN})
+        assert listed.json()['profiles'] == [f'profile_{profile_id}.prof']
+    assert TestClient(certificate_service_async.app).get('/api/diagnostics/profiles').status_code == 404
+
+def main():
+    """Main test function"""
+    print("Diagnostics Test")
+    print("=" * 40)
+
+    tests = [
+        test_profile_requested_by_header,
+        test_no_profile_without_valid_token,
+        test_memory_endpoint,
+        test_async_service_profiles_requests
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
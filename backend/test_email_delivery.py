@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Test queued email delivery against a local SMTP sink (aiosmtpd)
+"""
+
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+from email import message_from_bytes, policy
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import email_delivery
+import certificate_service
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+try:
+    from aiosmtpd.controller import Controller
+    AIOSMTPD_AVAILABLE = True
+except ImportError:
+    AIOSMTPD_AVAILABLE = False
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_certificate.pdf')
+
+class SinkHandler:
+    """Collects messages; can refuse recipients, defer messages or answer slowly"""
+
+    def __init__(self, refuse=(), defer=0, delay=0.0):
+        self.refuse = set(refuse)
+        self.defer = defer
+        self.delay = delay
+        self.sessions = 0
+        self.messages = []
+        self.lock = threading.Lock()
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        with self.lock:
+            self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refuse:
+            return '550 5.1.1 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            if self.defer:
+                self.defer -= 1
+                return '451 4.3.0 Try again later'
+            self.messages.append(message_from_bytes(envelope.content, policy=policy.default))
+        return '250 Message accepted'
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class SmtpSink:
+    """A local SMTP server for the duration of a with block"""
+
+    def __init__(self, **behaviour):
+        self.handler = SinkHandler(**behaviour)
+        self.port = free_port()
+        self.controller = Controller(self.handler, hostname='127.0.0.1', port=self.port)
+
+    def __enter__(self):
+        self.controller.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.controller.stop()
+
+def delivery_queue(sink, outbox_dir, attachment=lambda certificate_id, output_format: SAMPLE_PDF, **options):
+    options.setdefault('rate', 0)
+    return email_delivery.DeliveryQueue(
+        email_delivery.Outbox(os.path.join(outbox_dir, 'outbox.db')), attachment,
+        host='127.0.0.1', port=sink.port, sender='certificates@example.com', **options
+    )
+
+def delivery(index, recipient=None):
+    return {
+        "certificate_id": f"00000000-0000-4000-8000-{index:012d}",
+        "format": "pdf",
+        "recipient": recipient or f"student{index}@example.com",
+        "name": f"Student {index}",
+        "domain": "Data Science"
+    }
+
+def wait_for(condition, timeout=30):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.05)
+
+def test_many_messages_per_session_and_throttle():
+    """One pooled session carries every message, paced to the configured rate"""
+    if not AIOSMTPD_AVAILABLE:
+        print("  aiosmtpd not installed, skipping")
+        return
+
+    with SmtpSink() as sink, tempfile.TemporaryDirectory() as workdir:
+        queue = delivery_queue(sink, workdir, pool_size=1, rate=40)
+        started = time.monotonic()
+        delivery_ids = queue.enqueue([delivery(index) for index in range(10)])
+        wait_for(lambda: queue.stats()["sent"] == 10)
+        elapsed = time.monotonic() - started
+        queue.stop()
+
+        assert sink.handler.sessions == 1
+        assert queue.stats()["messages_per_session"] == 10
+        # 10 messages at 40/s are spread over at least 9 intervals
+        assert elapsed >= 9 / 40, elapsed
+
+        message = sink.handler.messages[0]
+        assert message['To'] == 'student0@example.com'
+        assert message['Subject'] == 'Your Data Science certificate'
+        attachment, = message.iter_attachments()
+        assert attachment.get_content_type() == 'application/pdf'
+        assert attachment.get_filename() == 'Certificate_Student_0.pdf'
+        with open(SAMPLE_PDF, 'rb') as f:
+            assert attachment.get_payload(decode=True) == f.read()
+
+        status = queue.status(delivery_ids[0])
+        assert status["status"] == "sent" and status["attempts"] == 1 and status["sent_at"]
+        assert queue.outbox.counts() == {"sent": 10}
+
+def test_retry_with_backoff():
+    """Temporary failures are retried with backoff until the message goes through"""
+    if not AIOSMTPD_AVAILABLE:
+        print("  aiosmtpd not installed, skipping")
+        return
+
+    original = email_delivery.RETRY_BASE_SECONDS
+    email_delivery.RETRY_BASE_SECONDS = 0.05
+    try:
+        with SmtpSink(defer=2) as sink, tempfile.TemporaryDirectory() as workdir:
+            queue = delivery_queue(sink, workdir, pool_size=1)
+            delivery_id, = queue.enqueue([delivery(1)])
+            wait_for(lambda: queue.status(delivery_id)["status"] == "sent")
+            queue.stop()
+
+            assert queue.status(delivery_id)["attempts"] == 3
+            assert queue.stats()["retried"] == 2
+            assert len(sink.handler.messages) == 1
+    finally:
+        email_delivery.RETRY_BASE_SECONDS = original
+
+    assert 0.8 * original <= email_delivery.retry_delay(1) <= 1.2 * original
+    assert email_delivery.retry_delay(100) <= 1.2 * email_delivery.RETRY_MAX_SECONDS
+
+def test_permanent_failures():
+    """Rejected recipients and missing certificates fail at once; other messages still go out"""
+    if not AIOSMTPD_AVAILABLE:
+        print("  aiosmtpd not installed, skipping")
+        return
+
+    def attachment(certificate_id, output_format):
+        return None if certificate_id.endswith('2') else SAMPLE_PDF
+
+    with SmtpSink(refuse={'nobody@example.com'}) as sink, tempfile.TemporaryDirectory() as workdir:
+        queue = delivery_queue(sink, workdir, attachment, pool_size=1)
+        refused, missing, good = queue.enqueue([delivery(1, 'nobody@example.com'), delivery(2), delivery(3)])
+        wait_for(lambda: queue.status(good)["status"] == "sent" and queue.status(refused)["status"] != "sending")
+        queue.stop()
+
+        assert queue.status(refused)["status"] == "failed" and queue.status(refused)["attempts"] == 1
+        assert "No such user" in queue.status(refused)["last_error"]
+        assert queue.status(missing)["status"] == "failed"
+        assert "not available" in queue.status(missing)["last_error"]
+        # The refusal did not cost the session
+        assert sink.handler.sessions == 1
+
+def test_expired_lease_is_picked_up():
+    """Deliveries claimed by a worker that went away are sent by another one"""
+    if not AIOSMTPD_AVAILABLE:
+        print("  aiosmtpd not installed, skipping")
+        return
+
+    original = email_delivery.LEASE_SECONDS
+    email_delivery.LEASE_SECONDS = 0.2
+    try:
+        with SmtpSink() as sink, tempfile.TemporaryDirectory() as workdir:
+            outbox = email_delivery.Outbox(os.path.join(workdir, 'outbox.db'))
+            outbox.add([delivery(1)])
+            # A worker claims it and dies before sending
+            assert len(outbox.claim(10)) == 1
+            assert outbox.claim(10) == []
+
+            queue = delivery_queue(sink, workdir, pool_size=1)
+            queue.start()
+            wait_for(lambda: queue.stats()["sent"] == 1)
+            queue.stop()
+            assert len(sink.handler.messages) == 1
+    finally:
+        email_delivery.LEASE_SECONDS = original
+
+def test_batch_emails_without_waiting():
+    """Batch entries with an email are delivered after issuing; a slow SMTP server does not slow the batch"""
+    if not AIOSMTPD_AVAILABLE:
+        print("  aiosmtpd not installed, skipping")
+        return
+
+    original = certificate_service.delivery_queue
+    with SmtpSink(delay=0.5) as sink, service_workdir() as workdir:
+        client = certificate_service.app.test_client()
+
+        # Without SMTP settings, emails are refused up front
+        response = client.post('/api/generate-certificates', json={
+            "certificates": [dict(CERTIFICATE_DATA, email="ada@example.com")]
+        })
+        assert response.status_code == 503
+
+        certificate_service.delivery_queue = delivery_queue(sink, workdir, certificate_service.delivery_attachment,
+                                                            pool_size=1)
+        try:
+            response = client.post('/api/generate-certificates', json={"certificates": [
+                dict(CERTIFICATE_DATA, name="Ada Lovelace", email="ada@example.com"),
+                dict(CERTIFICATE_DATA, name="Alan Turing"),
+                dict(CERTIFICATE_DATA, name="Grace Hopper", email="grace@example.com")
+            ]})
+            assert response.status_code == 202
+            status_url = response.get_json()["status_url"]
+            wait_for(lambda: client.get(status_url).get_json()["status"] == "done")
+
+            batch = client.get(status_url).get_json()
+            first, second, third = batch["certificates"]
+            assert "delivery_id" in first and "delivery_id" not in second and "delivery_id" in third
+            # Generation finished while the (slow) deliveries are still under way
+            assert client.get(f'/api/deliveries/{third["delivery_id"]}').get_json()["status"] != "sent"
+
+            wait_for(lambda: client.get(f'/api/deliveries/{third["delivery_id"]}').get_json()["status"] == "sent")
+            assert sorted(m['To'] for m in sink.handler.messages) == ["ada@example.com", "grace@example.com"]
+
+            # Issued certificates can be (re)sent on their own
+            response = client.post('/api/deliveries', json={"deliveries": [
+                {"certificate_id": second["certificate_id"], "email": "alan@example.com"}
+            ]})
+            assert response.status_code == 202
+            resent, = response.get_json()["deliveries"]
+            wait_for(lambda: client.get(resent["status_url"]).get_json()["status"] == "sent")
+
+            response = client.post('/api/deliveries', json={"deliveries": [
+                {"certificate_id": second["certificate_id"], "email": "not an address"},
+                {"certificate_id": "00000000-0000-4000-8000-000000000000", "email": "x@example.com"}
+            ]})
+            assert response.status_code == 400
+            assert set(response.get_json()["details"]) == {"0", "1"}
+            assert client.get('/api/deliveries/unknown').status_code == 404
+
+            health = client.get('/health').get_json()["email_delivery"]
+            assert health["enabled"] and health["sent"] == 3 and health["outbox"] == {"sent": 3}
+        finally:
+            certificate_service.delivery_queue.stop()
+            certificate_service.delivery_queue = original
+
+def main():
+    """Main test function"""
+    print("Email Delivery Test")
+    print("=" * 40)
+
+    tests = [
+        test_many_messages_per_session_and_throttle,
+        test_retry_with_backoff,
+        test_permanent_failures,
+        test_expired_lease_is_picked_up,
+        test_batch_emails_without_waiting
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
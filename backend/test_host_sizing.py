@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test host-aware sizing of workers, converter pool and timeouts
+Uses fake_soffice.py as the sample converter, so it runs without LibreOffice
+"""
+
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import host_sizing
+import certificate_service
+from test_certificate_downloads import service_workdir
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_SOFFICE = os.path.join(BACKEND_DIR, 'fake_soffice.py')
+
+def cgroup_root(files):
+    """A scratch directory laid out like /sys/fs/cgroup with the given files"""
+    root = tempfile.mkdtemp(prefix='cgroup_')
+    for path, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+        with open(os.path.join(root, path), 'w') as f:
+            f.write(content + '\n')
+    return root
+
+def test_cgroup_limits():
+    """cgroup v1 and v2 CPU quotas and memory limits are read; "max" means no limit"""
+    v2 = cgroup_root({'cpu.max': '150000 100000', 'memory.max': str(512 * 1024 * 1024)})
+    assert host_sizing.cgroup_cpu_limit(v2) == 1.5
+    assert host_sizing.cgroup_memory_limit(v2) == 512 * 1024 * 1024
+    assert host_sizing.available_memory_mb(v2) <= 512
+
+    unlimited = cgroup_root({'cpu.max': 'max 100000', 'memory.max': 'max'})
+    assert host_sizing.cgroup_cpu_limit(unlimited) is None
+    assert host_sizing.cgroup_memory_limit(unlimited) is None
+
+    v1 = cgroup_root({
+        'cpu/cpu.cfs_quota_us': '10000',
+        'cpu/cpu.cfs_period_us': '100000',
+        'memory/memory.limit_in_bytes': str(1 << 62)
+    })
+    assert host_sizing.cgroup_cpu_limit(v1) == 0.1
+    assert host_sizing.cgroup_memory_limit(v1) is None
+    # A tenth of a CPU still gets one worker
+    assert host_sizing.available_cpus(v1) == 1
+
+def test_plans_scale_with_host():
+    """The free plan gets one worker, larger instances more, bounded by CPUs and memory"""
+    sample = {"converter": "soffice", "seconds": 2.5, "peak_memory_mb": 250}
+
+    free = host_sizing.size_for(1, 512, sample)
+    assert free["workers"] == free["converter_pool"] == 1
+    assert free["converter_timeout"] == 15
+    assert free["request_timeout"] >= 2 * free["converter_timeout"]
+
+    large = host_sizing.size_for(8, 16384, sample)
+    assert large["workers"] == 8
+
+    memory_bound = host_sizing.size_for(8, 2048, sample)
+    assert memory_bound["workers"] == int(2048 * 0.8 // (host_sizing.WORKER_MEMORY_MB + 250))
+
+    unmeasured = host_sizing.size_for(2, None)
+    assert unmeasured["converter_timeout"] == host_sizing.DEFAULT_CONVERTER_TIMEOUT
+    assert unmeasured["workers"] == 2
+
+    slow = host_sizing.size_for(1, 512, dict(sample, seconds=60))
+    assert slow["converter_timeout"] == host_sizing.MAX_CONVERTER_TIMEOUT
+
+def test_sample_conversion():
+    """The sample conversion is timed; a failing converter gives no sample"""
+    saved_environ = dict(os.environ)
+    try:
+        os.environ['FAKE_SOFFICE_LATENCY'] = '0.3'
+        sample = host_sizing.sample_conversion(converter=FAKE_SOFFICE)
+        assert sample["converter"] == FAKE_SOFFICE
+        assert 0.3 <= sample["seconds"] < 5
+
+        os.environ['FAKE_SOFFICE_FAIL_RATE'] = '1'
+        assert host_sizing.sample_conversion(converter=FAKE_SOFFICE) is None
+        assert host_sizing.sample_conversion(converter='/nonexistent/soffice') is None
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environ)
+
+def test_gunicorn_config():
+    """gunicorn.conf.py applies the calibrated plan, explicit settings win, workers see the plan"""
+    env = dict(os.environ, CERTIFICATE_LIBREOFFICE_COMMANDS=FAKE_SOFFICE, FAKE_SOFFICE_LATENCY='0.2',
+               WEB_CONCURRENCY='3', PYTHONPATH=BACKEND_DIR)
+    env.pop('CERTIFICATE_LIBREOFFICE_TIMEOUT', None)
+    env.pop('CERTIFICATE_REQUEST_TIMEOUT', None)
+    script = (
+        "import os, json, runpy\n"
+        "config = runpy.run_path('gunicorn.conf.py')\n"
+        "print(json.dumps({key: config[key] for key in ('workers', 'threads', 'timeout')}))\n"
+        "print(os.environ['CERTIFICATE_SIZING'])\n"
+    )
+    result = subprocess.run([sys.executable, '-c', script], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    config, plan = [json.loads(line) for line in result.stdout.strip().splitlines()[-2:]]
+
+    assert config["workers"] == 3
+    assert plan["workers"] == 3 and plan["overridden"] == ["workers"]
+    assert plan["sample_conversion"]["seconds"] >= 0.2
+    assert plan["converter_timeout"] == host_sizing.MIN_CONVERTER_TIMEOUT
+    assert config["timeout"] == plan["request_timeout"]
+
+def test_health_shows_sizing():
+    """/health reports the plan in effect"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        sizing = client.get('/health').get_json()["sizing"]
+        assert sizing["workers"] >= 1
+        assert sizing["cpus"] == host_sizing.available_cpus()
+
+def main():
+    """Main test function"""
+    print("Host Sizing Test")
+    print("=" * 40)
+
+    tests = [
+        test_cgroup_limits,
+        test_plans_scale_with_host,
+        test_sample_conversion,
+        test_gunicorn_config,
+        test_health_shows_sizing
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Test RSS guardrails: soft-limit recycling and hard-limit refusal
+"""
+
+import os
+import sys
+import time
+import json
+import socket
+import tempfile
+import subprocess
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import memory_guard
+import certificate_service
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+try:
+    from starlette.testclient import TestClient
+    import certificate_service_async
+    ASYNC_SERVICE_AVAILABLE = True
+except ImportError:
+    ASYNC_SERVICE_AVAILABLE = False
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class FakeWorker:
+    """Stands in for a gunicorn worker"""
+    alive = True
+
+class FakeRss:
+    """RSS readings in MB, one per measurement (the last one repeats)"""
+
+    def __init__(self, *readings):
+        self.readings = list(readings)
+
+    def __call__(self):
+        return self.readings.pop(0) if len(self.readings) > 1 else self.readings[0]
+
+def test_soft_limit_recycles():
+    """Over the soft limit a collection is tried first, then the worker is recycled"""
+    # The collection brings RSS back under the limit: no recycling
+    guard = memory_guard.MemoryGuard(soft_mb=100, hard_mb=200, rss=FakeRss(150, 90))
+    assert guard.after_request() is False
+    assert guard.stats()["collections"] == 1
+
+    guard = memory_guard.MemoryGuard(soft_mb=100, hard_mb=200, rss=FakeRss(50, 150))
+    worker = FakeWorker()
+    assert guard.after_request() is False
+    assert guard.recycle_if_requested(worker) is False and worker.alive
+
+    assert guard.after_request() is True
+    assert guard.recycle_if_requested(worker) is True
+    assert worker.alive is False
+
+    stats = guard.stats()
+    assert stats["recycle_requested"] == "soft"
+    assert stats["requests"] == 2
+    assert stats["peak_rss_mb"] == 150
+
+def test_hard_limit_refuses():
+    """Over the hard limit a gunicorn worker refuses new work and is recycled; without gunicorn nothing is refused"""
+    guard = memory_guard.MemoryGuard(soft_mb=100, hard_mb=200, rss=FakeRss(150, 250))
+    guard.worker = FakeWorker()
+    assert guard.admit() is True
+    assert guard.admit() is False
+    stats = guard.stats()
+    assert stats["refused"] == 1
+    assert stats["recycle_requested"] == "hard"
+
+    standalone = memory_guard.MemoryGuard(soft_mb=100, hard_mb=200, rss=FakeRss(250))
+    assert standalone.admit() is True and standalone.admit() is True
+    assert standalone.stats()["refused"] == 0
+    assert standalone.after_request() is True
+
+    unlimited = memory_guard.MemoryGuard(rss=FakeRss(10000))
+    assert unlimited.admit() is True
+    assert unlimited.after_request() is False
+
+def test_default_limits():
+    """Default limits are each worker's share of the budget after the converters"""
+    plan = {"memory_mb": 4096, "workers": 2, "converter_pool": 2, "conversion_memory_mb": 300}
+    soft, hard = memory_guard.default_limits(plan)
+    assert hard == int((4096 * 0.8 - 600) / 2)
+    assert soft == int(hard * memory_guard.SOFT_LIMIT_FRACTION)
+
+    free = memory_guard.default_limits({"memory_mb": 512, "workers": 1, "converter_pool": 1,
+                                        "conversion_memory_mb": 300})
+    assert free[1] == memory_guard.MIN_HARD_LIMIT_MB
+    assert memory_guard.default_limits({"memory_mb": None}) == (None, None)
+
+def test_recycles_are_counted_across_workers():
+    """Recycles are counted per reason in a store every worker (and its replacement) shares"""
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'recycles.db')
+        first = memory_guard.MemoryGuard(soft_mb=100, rss=FakeRss(150), counter=memory_guard.RecycleCounter(path))
+        assert first.after_request() and first.after_request()
+        replacement = memory_guard.MemoryGuard(soft_mb=100, hard_mb=200, rss=FakeRss(250),
+                                               counter=memory_guard.RecycleCounter(path))
+        assert replacement.stats()["recycles"]["soft"]["count"] == 1
+        replacement.admit()
+        other = memory_guard.MemoryGuard(soft_mb=100, rss=FakeRss(150), counter=memory_guard.RecycleCounter(path))
+        other.after_request()
+
+        recycles = replacement.stats()["recycles"]
+        assert {reason: entry["count"] for reason, entry in recycles.items()} == {"soft": 2, "hard": 1}
+        assert recycles["hard"]["last_rss_mb"] == 250 and recycles["soft"]["last_requests"] == 1
+        assert memory_guard.MemoryGuard().stats()["recycles"] is None
+
+def test_service_refuses_over_hard_limit():
+    """A gunicorn worker answers 503 + Retry-After over the hard limit; /health keeps working"""
+    original = memory_guard.guard
+    memory_guard.guard = memory_guard.MemoryGuard(soft_mb=100, hard_mb=200, rss=FakeRss(500))
+    memory_guard.guard.worker = FakeWorker()
+    try:
+        with service_workdir():
+            client = certificate_service.app.test_client()
+            response = client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == str(memory_guard.RETRY_AFTER_SECONDS)
+
+            health = client.get('/health')
+            assert health.status_code == 200
+            assert health.get_json()["memory_guard"]["refused"] == 1
+    finally:
+        memory_guard.guard = original
+
+def test_async_service_retires_instead_of_refusing():
+    """Under plain uvicorn the ASGI service keeps serving over the hard limit and shuts down gracefully"""
+    if not ASYNC_SERVICE_AVAILABLE:
+        print("  starlette not installed, skipping")
+        return
+
+    retired = []
+    original = memory_guard.guard, certificate_service_async.retire_process
+    memory_guard.guard = memory_guard.MemoryGuard(hard_mb=1, rss=FakeRss(500))
+    certificate_service_async.retire_process = lambda: retired.append(True)
+    try:
+        with service_workdir():
+            client = TestClient(certificate_service_async.app)
+            statuses = [client.get('/api/verify/abc').status_code for _ in range(3)]
+            assert 503 not in statuses, statuses
+            assert len(retired) == 3 and memory_guard.guard.stats()["recycle_requested"] == 'hard'
+
+            # A gunicorn worker refuses instead, and is retired too
+            memory_guard.guard.worker = FakeWorker()
+            refused = client.get('/api/verify/abc')
+            assert refused.status_code == 503 and 'replaced' in refused.json()['error']
+            assert len(retired) == 4
+    finally:
+        memory_guard.guard, certificate_service_async.retire_process = original
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def worker_health(port):
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=10) as response:
+        return json.load(response)["memory_guard"]
+
+def test_gunicorn_recycles_worker():
+    """Under gunicorn a worker over its soft limit is replaced after its request, and /health counts it"""
+    port = free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, PORT=str(port), CERTIFICATE_CALIBRATE='0', WEB_CONCURRENCY='1',
+                   CERTIFICATE_RSS_SOFT_LIMIT_MB='1', CERTIFICATE_RSS_HARD_LIMIT_MB='0',
+                   CERTIFICATE_RECYCLE_STATS_PATH=os.path.join(workdir, 'recycles.db'),
+                   CERTIFICATE_LOG_LEVEL='ERROR')
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                                   'certificate_service:app'],
+                                  cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            reports = []
+            deadline = time.time() + 60
+            while len({report["pid"] for report in reports}) < 2:
+                assert time.time() < deadline, f"worker was not recycled: {reports}"
+                try:
+                    reports.append(worker_health(port))
+                except OSError:
+                    time.sleep(0.2)
+            # /health itself is a request: the worker serving it was over 1 MB and got replaced
+            assert reports[-1]["pid"] != reports[0]["pid"]
+            # The replacement reports its predecessor's recycle
+            assert reports[-1]["recycles"]["soft"]["count"] >= 1
+            assert reports[-1]["recycles"]["soft"]["last_pid"] != reports[-1]["pid"]
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+def main():
+    """Main test function"""
+    print("Memory Guard Test")
+    print("=" * 40)
+
+    tests = [
+        test_soft_limit_recycles,
+        test_hard_limit_refuses,
+        test_default_limits,
+        test_recycles_are_counted_across_workers,
+        test_service_refuses_over_hard_limit,
+        test_async_service_retires_instead_of_refusing,
+        test_gunicorn_recycles_worker
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Test output storage backends and signed download URLs
+The S3 test runs against moto's local S3 server as a MinIO stand-in
+"""
+
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from docx import Document
+import output_storage
+import certificate_service
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+def test_local_signed_url_download():
+    """url delivery returns a signed link that downloads the same file"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        issued = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, delivery='url'))
+        assert issued.status_code == 200
+        body = issued.get_json()
+        assert body['download_url'].startswith('/api/downloads/')
+        assert body['expires_at'] > time.time()
+
+        download = client.get(body['download_url'])
+        assert download.status_code == 200
+        assert download.data.startswith(b'%PDF')
+        assert download.headers['X-Certificate-Id'] == body['certificate_id']
+
+        tampered = client.get(body['download_url'].replace('signature=', 'signature=0'))
+        assert tampered.status_code == 403
+
+def test_expired_signature_rejected():
+    """Signatures stop working once they expire"""
+    storage = output_storage.LocalStorage()
+    filename = "certificate_00000000-0000-0000-0000-000000000000.pdf"
+    expired = int(time.time()) - 1
+    assert not storage.verify(filename, expired, output_storage.sign(filename, expired))
+    valid = int(time.time()) + 60
+    assert storage.verify(filename, valid, output_storage.sign(filename, valid))
+
+def test_s3_backend():
+    """Certificates are uploaded once, replaced when re-rendered, and served by presigned URLs from the bucket"""
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        print("  moto not installed, skipping")
+        return
+    if not output_storage.BOTO3_AVAILABLE:
+        print("  boto3 not installed, skipping")
+        return
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=0)
+    server.start()
+    try:
+        host, port = server.get_host_and_port()
+        storage = output_storage.S3Storage('certificates', endpoint_url=f'http://{host}:{port}', region='us-east-1')
+        storage.client.create_bucket(Bucket='certificates')
+
+        original_storage = certificate_service.storage
+        certificate_service.storage = storage
+        try:
+            with service_workdir():
+                client = certificate_service.app.test_client()
+                issued = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, delivery='url'))
+                body = issued.get_json()
+                local_path = certificate_service.certificate_path(body['certificate_id'])
+                with open(local_path, 'rb') as f:
+                    local_bytes = f.read()
+                assert body['download_url'].startswith(f'http://{host}:{port}/certificates/')
+                with urllib.request.urlopen(body['download_url']) as response:
+                    assert response.read() == local_bytes
+
+                # After a template change the bucket serves the re-rendered certificate
+                # (as a DOCX: without LibreOffice the PDF fallback does not use the template)
+                docx = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, format='docx', delivery='url'))
+                with open(certificate_service.certificate_path(body['certificate_id'], 'docx'), 'rb') as f:
+                    local_bytes = f.read()
+                with urllib.request.urlopen(docx.get_json()['download_url']) as response:
+                    assert response.read() == local_bytes
+
+                doc = Document()
+                doc.add_paragraph('SECOND EDITION {{Name}}')
+                doc.save("SpectoV_Cert.docx")
+                reissued = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, format='docx', delivery='url'))
+                assert reissued.get_json()['certificate_id'] == body['certificate_id']
+                with open(certificate_service.certificate_path(body['certificate_id'], 'docx'), 'rb') as f:
+                    rerendered = f.read()
+                assert rerendered != local_bytes
+                with urllib.request.urlopen(reissued.get_json()['download_url']) as response:
+                    assert response.read() == rerendered
+        finally:
+            certificate_service.storage = original_storage
+
+        keys = storage.client.list_objects_v2(Bucket='certificates')['Contents']
+        assert sorted(item['Key'] for item in keys) == [storage.key(local_path.replace('.pdf', '.docx')),
+                                                         storage.key(local_path)]
+    finally:
+        server.stop()
+
+def main():
+    """Main test function"""
+    print("Output Storage Test")
+    print("=" * 40)
+
+    tests = [
+        test_local_signed_url_download,
+        test_expired_signature_rejected,
+        test_s3_backend
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
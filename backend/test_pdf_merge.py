@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test merged (print-ready) PDFs of many issued certificates
+Runs without LibreOffice: conversion falls back to reportlab
+"""
+
+import io
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pikepdf
+import certificate_service
+import pdf_merge
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+STUDENTS = [dict(CERTIFICATE_DATA, name=f"Student {i}", issued_date="2024-05-02") for i in range(12)]
+
+def page_texts(data):
+    """Decoded content of each page of a PDF"""
+    with pikepdf.open(io.BytesIO(data)) as pdf:
+        return [page.Contents.read_bytes().decode('latin-1') for page in pdf.pages]
+
+def test_merge_issued_certificates():
+    """Issued PDFs are merged in order, sharing their fonts"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        certificate_ids = [client.post('/api/generate-certificate', json=data).headers['X-Certificate-Id']
+                           for data in STUDENTS]
+        paths = [certificate_service.certificate_path(certificate_id) for certificate_id in certificate_ids]
+
+        response = client.post('/api/certificates/merge', json={"ids": certificate_ids})
+        assert response.status_code == 200, response.data
+        assert response.headers['X-Certificate-Count'] == str(len(STUDENTS))
+
+        texts = page_texts(response.data)
+        assert len(texts) == len(STUDENTS)
+        assert all(f"Student {i}" in text for i, text in enumerate(texts))
+        assert len(response.data) < sum(os.path.getsize(path) for path in paths)
+
+        # Repeated merges of unchanged certificates reuse the merged file
+        again = client.post('/api/certificates/merge', json={"ids": certificate_ids})
+        assert again.data == response.data
+
+def test_shared_resources():
+    """Identical fonts of separate documents end up as one object"""
+    with service_workdir() as workdir:
+        client = certificate_service.app.test_client()
+        certificate_ids = [client.post('/api/generate-certificate', json=data).headers['X-Certificate-Id']
+                           for data in STUDENTS[:3]]
+        output = os.path.join(workdir, 'merged.pdf')
+        stats = pdf_merge.merge_pdfs([certificate_service.certificate_path(i) for i in certificate_ids], output)
+        assert stats["pages"] == 3
+        assert stats["shared_resources"] > 0
+
+        with pikepdf.open(output) as pdf:
+            fonts = [page.Resources.Font for page in pdf.pages]
+            first = {name: font.objgen for name, font in fonts[0].items()}
+            assert all({name: font.objgen for name, font in other.items()} == first for other in fonts[1:])
+
+def test_merge_errors():
+    """Unknown or malformed IDs are rejected"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        response = client.post('/api/certificates/merge', json={"ids": [str(uuid.uuid4())]})
+        assert response.status_code == 404
+        response = client.post('/api/certificates/merge', json={"ids": ["not-an-id"]})
+        assert response.status_code == 400
+
+def test_merged_batch():
+    """A finished batch can be downloaded as one PDF"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        accepted = client.post('/api/generate-certificates', json={"certificates": STUDENTS[:4]})
+        assert accepted.status_code == 202
+        batch_id = accepted.get_json()["batch_id"]
+
+        deadline = time.time() + 30
+        while client.get(f'/api/batches/{batch_id}').get_json()["status"] != "done":
+            assert time.time() < deadline, "batch did not finish"
+            time.sleep(0.1)
+
+        response = client.get(f'/api/batches/{batch_id}/merged')
+        assert response.status_code == 200, response.data
+        assert len(page_texts(response.data)) == 4
+
+def main():
+    """Main test function"""
+    print("PDF Merge Test")
+    print("=" * 40)
+
+    tests = [
+        test_merge_issued_certificates,
+        test_shared_resources,
+        test_merge_errors,
+        test_merged_batch
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Test the optional PDF optimization stage
+"""
+
+import os
+import sys
+import zlib
+import subprocess
+import time
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pdf_optimizer
+import tracing
+import certificate_service
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+from test_tracing import TRACE_ID, PARENT_ID, exporting_to
+
+def build_pdf_with_duplicate_images(path, pages=3):
+    """Write a PDF whose pages each embed their own copy of the same image"""
+    import pikepdf
+
+    pdf = pikepdf.Pdf.new()
+    pixels = bytes(range(256)) * 3 * 64
+    for _ in range(pages):
+        image = pikepdf.Stream(pdf, zlib.compress(pixels, 1))
+        image.Type = pikepdf.Name.XObject
+        image.Subtype = pikepdf.Name.Image
+        image.Width = 128
+        image.Height = 128
+        image.ColorSpace = pikepdf.Name.DeviceRGB
+        image.BitsPerComponent = 8
+        image.Filter = pikepdf.Name.FlateDecode
+
+        page = pikepdf.Page(pikepdf.Dictionary(
+            Type=pikepdf.Name.Page,
+            MediaBox=[0, 0, 595, 842],
+            Resources=pikepdf.Dictionary(XObject=pikepdf.Dictionary(Im0=image)),
+            Contents=pikepdf.Stream(pdf, b"q 128 0 0 128 100 600 cm /Im0 Do Q")
+        ))
+        pdf.pages.append(page)
+    pdf.save(path, compress_streams=False)
+
+def test_optimize_deduplicates_and_shrinks():
+    """Duplicate images collapse to one copy and the file gets smaller"""
+    if not pdf_optimizer.PIKEPDF_AVAILABLE:
+        print("  pikepdf not installed, skipping")
+        return
+
+    import pikepdf
+
+    with tempfile.TemporaryDirectory() as workdir:
+        pdf_path = os.path.join(workdir, "certificate.pdf")
+        build_pdf_with_duplicate_images(pdf_path)
+
+        stats = pdf_optimizer.optimize_pdf(pdf_path)
+        assert stats is not None
+        assert stats["duplicate_images"] == 2
+        assert stats["bytes_after"] < stats["bytes_before"]
+        assert stats["cpu_seconds"] >= 0
+        assert stats["ghostscript_cpu_seconds"] <= stats["cpu_seconds"]
+
+        with pikepdf.open(pdf_path) as pdf:
+            assert len(pdf.pages) == 3
+            images = {page.Resources.XObject.Im0.objgen for page in pdf.pages}
+            assert len(images) == 1
+            assert pdf.is_linearized == pdf_optimizer.LINEARIZE_PDF
+
+        assert sorted(os.listdir(workdir)) == ["certificate.pdf"]
+
+def test_optimize_leaves_broken_pdf_untouched():
+    """A file that cannot be parsed is left as it was"""
+    if not pdf_optimizer.PIKEPDF_AVAILABLE:
+        print("  pikepdf not installed, skipping")
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        pdf_path = os.path.join(workdir, "broken.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(b"not a pdf")
+
+        assert pdf_optimizer.optimize_pdf(pdf_path) is None
+        with open(pdf_path, "rb") as f:
+            assert f.read() == b"not a pdf"
+
+def test_child_cpu_is_measured_alone():
+    """Only the measured child's CPU time is reported, not other threads' or other children's"""
+    stop = threading.Event()
+
+    def busy():
+        # Another request thread, with its own converter child, working meanwhile
+        other = subprocess.Popen([sys.executable, '-c', 'import time\nwhile True: pass'])
+        while not stop.is_set():
+            sum(range(10000))
+        other.kill()
+        other.wait()
+
+    spin = "import time\nend = time.process_time() + 0.3\nwhile time.process_time() < end: pass"
+    worker = threading.Thread(target=busy)
+    worker.start()
+    try:
+        returncode, _, cpu_seconds = pdf_optimizer.run_measured([sys.executable, '-c', spin], 10)
+        assert returncode == 0
+        assert 0.25 <= cpu_seconds < 0.6, cpu_seconds
+
+        returncode, stderr, cpu_seconds = pdf_optimizer.run_measured(
+            [sys.executable, '-c', 'import sys, time\nsys.stderr.write("failed")\ntime.sleep(0.5)\nsys.exit(3)'], 10)
+        assert (returncode, stderr) == (3, "failed") and cpu_seconds < 0.2, cpu_seconds
+
+        started = time.monotonic()
+        returncode, _, _ = pdf_optimizer.run_measured([sys.executable, '-c', 'import time\ntime.sleep(30)'], 0.5)
+        assert returncode is None and time.monotonic() - started < 10
+    finally:
+        stop.set()
+        worker.join()
+
+def test_issued_certificate_reports_its_optimization():
+    """The size and CPU cost of each certificate's optimization are exported on its optimize span"""
+    if not pdf_optimizer.PIKEPDF_AVAILABLE:
+        print("  pikepdf not installed, skipping")
+        return
+
+    original = pdf_optimizer.OPTIMIZE_PDF
+    pdf_optimizer.OPTIMIZE_PDF = True
+    try:
+        with service_workdir() as workdir:
+            trace_file = os.path.join(workdir, 'traces.jsonl')
+            with exporting_to(trace_file=trace_file):
+                client = certificate_service.app.test_client()
+                response = client.post('/api/generate-certificate', json=CERTIFICATE_DATA,
+                                       headers={'traceparent': f'00-{TRACE_ID}-{PARENT_ID}-01'})
+                assert response.status_code == 200
+
+            optimize, = [span for span in tracing.load_traces(trace_file)[TRACE_ID] if span['name'] == 'optimize']
+            attributes = optimize['attributes']
+            assert attributes['pdf.bytes_after'] == len(response.data)
+            assert 0 <= attributes['pdf.cpu_seconds'] and attributes['pdf.ghostscript_cpu_seconds'] == 0
+    finally:
+        pdf_optimizer.OPTIMIZE_PDF = original
+
+def main():
+    """Main test function"""
+    print("PDF Optimizer Test")
+    print("=" * 40)
+
+    tests = [
+        test_optimize_deduplicates_and_shrinks,
+        test_optimize_leaves_broken_pdf_untouched,
+        test_child_cpu_is_measured_alone,
+        test_issued_certificate_reports_its_optimization
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
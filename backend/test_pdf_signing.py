@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Test PDF signing with a locally generated self-signed key
+"""
+
+import os
+import re
+import sys
+import shutil
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pdf_signing
+import pdf_optimizer
+import certificate_service
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_PDF = os.path.join(BACKEND_DIR, 'test_certificate.pdf')
+SIGNING_TIME = 'D:20240331000000Z'
+
+def write_key_pair(directory):
+    """Self-signed RSA key and certificate in PEM files; returns (key path, cert path)"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, 'Test Certificate Signer')])
+    now = datetime.now(timezone.utc)
+    certificate = (x509.CertificateBuilder()
+                   .subject_name(name).issuer_name(name).public_key(key.public_key())
+                   .serial_number(x509.random_serial_number())
+                   .not_valid_before(now - timedelta(days=1)).not_valid_after(now + timedelta(days=30))
+                   .sign(key, hashes.SHA256()))
+
+    key_path = os.path.join(directory, 'signing-key.pem')
+    cert_path = os.path.join(directory, 'signing-cert.pem')
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    with open(cert_path, 'wb') as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    return key_path, cert_path
+
+def signed_parts(path):
+    """(signed bytes, CMS signature) of the last signature in a PDF"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    start, first, second, length = map(int, re.findall(rb'/ByteRange \[([^\]]*)\]', data)[-1].split())
+    assert start == 0 and second + length == len(data), "signature must cover the whole file"
+    assert data[first:first + 1] == b'<' and data[second - 1:second] == b'>'
+    return data[:first] + data[second:], data[first + 1:second - 1]
+
+def signature_valid(path, signer):
+    """
+    Check the signature with the signer's public key
+    Deterministic signatures have no signed attributes: the RSA signature over
+    the signed bytes is the last field of the CMS structure.
+    """
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    content, contents = signed_parts(path)
+    cms = bytes.fromhex(contents.decode())
+    # /Contents is zero-padded: the DER header (SEQUENCE, two length bytes) gives the real end
+    assert cms[:2] == b'\x30\x82'
+    cms = cms[:4 + int.from_bytes(cms[2:4], 'big')]
+    public_key = signer.certificate.public_key()
+    try:
+        public_key.verify(cms[-public_key.key_size // 8:], content, padding.PKCS1v15(), hashes.SHA256())
+        return True
+    except InvalidSignature:
+        return False
+
+def openssl_verifies(path, cert_path, workdir):
+    """Verify with `openssl cms` where available; None if openssl is not installed"""
+    if not shutil.which('openssl'):
+        return None
+    content, contents = signed_parts(path)
+    content_path = os.path.join(workdir, 'content.bin')
+    signature_path = os.path.join(workdir, 'signature.der')
+    with open(content_path, 'wb') as f:
+        f.write(content)
+    with open(signature_path, 'wb') as f:
+        f.write(bytes.fromhex(contents.decode()))
+    result = subprocess.run(['openssl', 'cms', '-verify', '-binary', '-inform', 'DER', '-in', signature_path,
+                             '-content', content_path, '-CAfile', cert_path, '-out', os.devnull],
+                            capture_output=True)
+    return result.returncode == 0
+
+def test_signature_verifies():
+    """The signed PDF is intact, carries a signature field and verifies against the key"""
+    import pikepdf
+
+    with tempfile.TemporaryDirectory() as workdir:
+        key_path, cert_path = write_key_pair(workdir)
+        signer = pdf_signing.PdfSigner(key_path, cert_path)
+        pdf_path = os.path.join(workdir, 'certificate.pdf')
+        shutil.copyfile(SAMPLE_PDF, pdf_path)
+
+        signer.sign(pdf_path, SIGNING_TIME)
+        with open(SAMPLE_PDF, 'rb') as original, open(pdf_path, 'rb') as signed:
+            # An incremental update: the original bytes are untouched
+            assert signed.read().startswith(original.read())
+
+        with pikepdf.open(pdf_path) as pdf:
+            assert pdf.check() == []
+            field, = pdf.Root.AcroForm.Fields
+            assert field.FT == '/Sig' and field.V.SubFilter == '/adbe.pkcs7.detached'
+            assert str(field.V.Name) == 'Test Certificate Signer'
+            assert str(field.V.M) == SIGNING_TIME
+            assert field.objgen in {annot.objgen for annot in pdf.pages[0].Annots}
+
+        assert signature_valid(pdf_path, signer)
+        assert openssl_verifies(pdf_path, cert_path, workdir) in (True, None)
+
+def test_tampering_breaks_signature():
+    """Changing any signed byte invalidates the signature"""
+    with tempfile.TemporaryDirectory() as workdir:
+        key_path, cert_path = write_key_pair(workdir)
+        signer = pdf_signing.PdfSigner(key_path, cert_path)
+        pdf_path = os.path.join(workdir, 'certificate.pdf')
+        shutil.copyfile(SAMPLE_PDF, pdf_path)
+        signer.sign(pdf_path, SIGNING_TIME)
+
+        with open(pdf_path, 'r+b') as f:
+            f.seek(2000)
+            byte = f.read(1)
+            f.seek(2000)
+            f.write(bytes([byte[0] ^ 0x01]))
+        assert not signature_valid(pdf_path, signer)
+        assert openssl_verifies(pdf_path, cert_path, workdir) in (False, None)
+
+def test_object_stream_pdf_and_determinism():
+    """Optimized PDFs (xref streams) are signed too, and signing is reproducible"""
+    import pikepdf
+
+    with tempfile.TemporaryDirectory() as workdir:
+        key_path, cert_path = write_key_pair(workdir)
+        signer = pdf_signing.PdfSigner(key_path, cert_path)
+        first, second = os.path.join(workdir, 'first.pdf'), os.path.join(workdir, 'second.pdf')
+        shutil.copyfile(SAMPLE_PDF, first)
+        assert pdf_optimizer.optimize_pdf(first) is not None
+        shutil.copyfile(first, second)
+
+        signer.sign(first, SIGNING_TIME)
+        signer.sign(second, SIGNING_TIME)
+        with open(first, 'rb') as a, open(second, 'rb') as b:
+            assert a.read() == b.read()
+        with pikepdf.open(first) as pdf:
+            assert pdf.check() == []
+            assert pdf.Root.AcroForm.SigFlags == 3
+        assert signature_valid(first, signer)
+
+        # Key material is loaded once; each signature costs only milliseconds
+        stats = signer.stats()
+        assert stats["signed"] == 2
+        assert 0 < stats["avg_ms"] < 500
+        assert stats["avg_bytes_added"] > 0
+
+def test_concurrent_signing():
+    """Convert threads share one signer; a failure reaches only its own caller"""
+    with tempfile.TemporaryDirectory() as workdir:
+        key_path, cert_path = write_key_pair(workdir)
+        signer = pdf_signing.PdfSigner(key_path, cert_path)
+
+        paths = []
+        for index in range(8):
+            paths.append(os.path.join(workdir, f'certificate_{index}.pdf'))
+            shutil.copyfile(SAMPLE_PDF, paths[-1])
+        broken = os.path.join(workdir, 'broken.pdf')
+        with open(broken, 'wb') as f:
+            f.write(b'not a pdf')
+
+        errors = {}
+        def sign(path):
+            try:
+                signer.sign(path, SIGNING_TIME)
+            except pdf_signing.SigningError as e:
+                errors[path] = e
+        threads = [threading.Thread(target=sign, args=(path,)) for path in paths + [broken]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+
+        assert list(errors) == [broken]
+        assert all(signature_valid(path, signer) for path in paths)
+        stats = signer.stats()
+        assert stats["signed"] == 8 and stats["failed"] == 1
+
+def test_service_signs_issued_pdfs():
+    """With signing on, issued PDFs are signed and /health reports the cost"""
+    original = pdf_signing.signer
+    with service_workdir() as workdir:
+        key_path, cert_path = write_key_pair(workdir)
+        pdf_signing.signer = pdf_signing.PdfSigner(key_path, cert_path)
+        try:
+            client = certificate_service.app.test_client()
+            response = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, name="Signed Student"))
+            assert response.status_code == 200
+            certificate_id = response.headers['X-Certificate-Id']
+            assert signature_valid(certificate_service.certificate_path(certificate_id), pdf_signing.signer)
+
+            certificate_id, path = certificate_service.issue_certificate(
+                "Bulk Signed Student", CERTIFICATE_DATA["domain"], CERTIFICATE_DATA["start_date"],
+                CERTIFICATE_DATA["end_date"], CERTIFICATE_DATA["gender"], lane=certificate_service.BULK
+            )
+            assert signature_valid(path, pdf_signing.signer)
+
+            signing = client.get('/health').get_json()["pdf_signing"]
+            assert signing["enabled"] and signing["signed"] == 2
+        finally:
+            pdf_signing.signer = original
+
+    assert certificate_service.app.test_client().get('/health').get_json()["pdf_signing"] == {"enabled": False}
+
+def main():
+    """Main test function"""
+    print("PDF Signing Test")
+    print("=" * 40)
+
+    tests = [
+        test_signature_verifies,
+        test_tampering_breaks_signature,
+        test_object_stream_pdf_and_determinism,
+        test_concurrent_signing,
+        test_service_signs_issued_pdfs
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Test the inbox pre-generation daemon
+Runs without LibreOffice: conversion falls back to reportlab
+"""
+
+import os
+import sys
+import json
+import threading
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import certificate_service
+import pregeneration
+
+try:
+    from starlette.testclient import TestClient
+    import certificate_service_async
+    ASYNC_SERVICE_AVAILABLE = True
+except ImportError:
+    ASYNC_SERVICE_AVAILABLE = False
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+ROSTER_CSV = """Name,Domain,Start Date,End Date,Gender
+Ada Lovelace,Data Science,2024-02-01,2024-04-30,female
+Alan Turing,Data Science,February 1 2024,April 30 2024,male
+<script>,Data Science,2024-02-01,2024-04-30,other
+"""
+
+def write_roster(inbox, name, content):
+    """Drop a roster into the inbox, old enough to count as fully written"""
+    os.makedirs(inbox, exist_ok=True)
+    path = os.path.join(inbox, name)
+    with open(path, 'w') as f:
+        f.write(content)
+    settled = os.path.getmtime(path) - 2 * pregeneration.SETTLE_SECONDS
+    os.utime(path, (settled, settled))
+    return path
+
+def test_roster_warms_cache():
+    """Every valid row is issued, failures are recorded, and live requests hit the cache"""
+    with service_workdir() as workdir:
+        inbox = os.path.join(workdir, 'inbox')
+        roster = write_roster(inbox, 'cohort.csv', ROSTER_CSV)
+
+        manifest, = pregeneration.Pregenerator(inbox).run_once()
+        assert manifest["status"] == "done"
+        assert (manifest["total"], manifest["completed"], manifest["failed"]) == (3, 2, 1)
+        assert "not allowed" in manifest["certificates"][2]["error"]
+        with open(roster + pregeneration.MANIFEST_SUFFIX) as f:
+            assert json.load(f) == manifest
+
+        issued = {record["name"]: record["certificate_id"] for record in manifest["certificates"] if "name" in record}
+        assert all(os.path.exists(certificate_service.certificate_path(i)) for i in issued.values())
+
+        # The student's own request, with the roster's issued date, is served from the cache
+        client = certificate_service.app.test_client()
+        mtime = os.path.getmtime(certificate_service.certificate_path(issued["Ada Lovelace"]))
+        response = client.post('/api/generate-certificate', json=dict(
+            CERTIFICATE_DATA, name="Ada Lovelace", issued_date=manifest["issued_date"]
+        ))
+        assert response.headers['X-Certificate-Id'] == issued["Ada Lovelace"]
+        assert os.path.getmtime(certificate_service.certificate_path(issued["Ada Lovelace"])) == mtime
+
+        # Finished rosters (and manifests) are left alone until they change
+        settled = os.path.getmtime(roster) - 2 * pregeneration.SETTLE_SECONDS
+        os.utime(roster + pregeneration.MANIFEST_SUFFIX, (settled, settled))
+        assert pregeneration.Pregenerator(inbox).run_once() == []
+        write_roster(inbox, 'cohort.csv', ROSTER_CSV.replace("Alan Turing", "Grace Hopper"))
+        manifest, = pregeneration.Pregenerator(inbox).run_once()
+        assert manifest["completed"] == 2
+        assert manifest["certificates"][0]["certificate_id"] == issued["Ada Lovelace"]
+
+def test_json_roster_and_errors():
+    """JSON rosters carry their own issued date and format; unreadable rosters fail as a whole"""
+    with service_workdir() as workdir:
+        inbox = os.path.join(workdir, 'inbox')
+        write_roster(inbox, 'a.json', json.dumps({
+            "issued_date": "2024-05-02",
+            "format": "docx",
+            "certificates": [CERTIFICATE_DATA]
+        }))
+        write_roster(inbox, 'b.json', '{"certificates": ')
+        write_roster(inbox, 'notes.txt', 'not a roster')
+
+        first, second = pregeneration.Pregenerator(inbox).run_once()
+        assert first["status"] == "done" and first["issued_date"] == "May 02, 2024"
+        assert first["certificates"][0]["url"].endswith("?format=docx")
+        assert second["status"] == "failed" and "Cannot read roster" in second["error"]
+        assert not os.path.exists(os.path.join(inbox, 'notes.txt' + pregeneration.MANIFEST_SUFFIX))
+
+def test_live_request_on_a_later_day():
+    """A roster processed on an earlier day is still a cache hit for a live request without an issued date"""
+    class ThreeDaysAgo(datetime):
+        @classmethod
+        def today(cls):
+            return datetime.today() - timedelta(days=3)
+
+    with service_workdir() as workdir:
+        inbox = os.path.join(workdir, 'inbox')
+        write_roster(inbox, 'cohort.csv', ROSTER_CSV)
+        pregeneration.datetime = ThreeDaysAgo
+        try:
+            manifest, = pregeneration.Pregenerator(inbox).run_once()
+        finally:
+            pregeneration.datetime = datetime
+        assert manifest["issued_date"] != datetime.today().strftime('%B %d, %Y')
+        certificate_id = manifest["certificates"][0]["certificate_id"]
+        path = certificate_service.certificate_path(certificate_id)
+        mtime = os.path.getmtime(path)
+
+        client = certificate_service.app.test_client()
+        response = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, name="Ada Lovelace"))
+        assert response.status_code == 200
+        assert response.headers['X-Certificate-Id'] == certificate_id
+        assert os.path.getmtime(path) == mtime
+        assert certificate_service.certificate_registry.lookup_certificate(certificate_id)["issued_date"] == manifest["issued_date"]
+
+        if ASYNC_SERVICE_AVAILABLE:
+            async_client = TestClient(certificate_service_async.app)
+            response = async_client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, name="Ada Lovelace"))
+            assert response.headers['x-certificate-id'] == certificate_id
+
+        # Students not on a roster still get today's date, and an explicit date wins
+        other = client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+        assert other.headers['X-Certificate-Id'] != certificate_id
+        explicit = client.post('/api/generate-certificate', json=dict(
+            CERTIFICATE_DATA, name="Ada Lovelace", issued_date="2024-05-02"
+        ))
+        assert explicit.headers['X-Certificate-Id'] != certificate_id
+
+def test_time_window():
+    """Windows may wrap midnight; outside the window a roster waits and can be stopped"""
+    window = pregeneration.parse_window("22:00-06:00")
+    assert pregeneration.in_window(window, datetime(2024, 5, 1, 23, 30))
+    assert pregeneration.in_window(window, datetime(2024, 5, 1, 5, 59))
+    assert not pregeneration.in_window(window, datetime(2024, 5, 1, 12, 0))
+    assert pregeneration.seconds_until_window(window, datetime(2024, 5, 1, 21, 0)) == 3600
+    assert pregeneration.parse_window(None) is None
+
+    with service_workdir() as workdir:
+        inbox = os.path.join(workdir, 'inbox')
+        roster = write_roster(inbox, 'cohort.csv', ROSTER_CSV)
+        now = datetime.now()
+        closed = pregeneration.parse_window(f"{(now.hour + 2) % 24:02d}:00-{(now.hour + 3) % 24:02d}:00")
+
+        stop_event = threading.Event()
+        pregenerator = pregeneration.Pregenerator(inbox, closed, stop_event)
+        worker = threading.Thread(target=pregenerator.run_once)
+        worker.start()
+        while (pregeneration.load_manifest(roster) or {}).get("status") != "waiting":
+            assert worker.is_alive()
+            worker.join(0.05)
+        stop_event.set()
+        worker.join(10)
+
+        manifest = pregeneration.load_manifest(roster)
+        assert manifest["status"] == "paused" and manifest["completed"] == 0
+        # Paused rosters are picked up again
+        assert pregeneration.Pregenerator(inbox).pending_rosters() == [roster]
+
+def main():
+    """Main test function"""
+    print("Pre-generation Test")
+    print("=" * 40)
+
+    tests = [
+        test_roster_warms_cache,
+        test_json_roster_and_errors,
+        test_live_request_on_a_later_day,
+        test_time_window
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
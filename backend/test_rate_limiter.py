@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Test per-client token-bucket rate limiting of the generation endpoints
+"""
+
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import rate_limiter
+import certificate_service
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+try:
+    from starlette.testclient import TestClient
+    import certificate_service_async
+    ASYNC_SERVICE_AVAILABLE = True
+except ImportError:
+    ASYNC_SERVICE_AVAILABLE = False
+
+def test_bucket_refill_and_debt():
+    """Tokens are spent and refilled over time; an oversized request empties a full bucket into debt"""
+    with tempfile.TemporaryDirectory() as workdir:
+        # 600 tokens per minute: one every 0.1 s
+        limiter = rate_limiter.RateLimiter(os.path.join(workdir, 'limits.db'), 600, 3)
+        decisions = [limiter.charge('ip:a', 1) for _ in range(4)]
+        assert [d.allowed for d in decisions] == [True, True, True, False]
+        assert decisions[2].remaining == 0 and decisions[3].retry_after == 1
+        assert decisions[0].limit == 3 and decisions[0].window == 1
+        # Other clients have their own bucket
+        assert limiter.charge('ip:b', 1).allowed
+
+        time.sleep(0.35)
+        assert limiter.peek('ip:a').remaining == 3
+        big = limiter.charge('ip:a', 13)
+        assert big.allowed and big.remaining == 0
+        refused = limiter.charge('ip:a', 1)
+        assert not refused.allowed and refused.retry_after == 2
+
+        stats = limiter.stats()
+        assert stats["allowed"] == 5 and stats["limited"] == 2
+        limiter.prune()
+        assert limiter.connection().execute('SELECT client FROM buckets').fetchall() == [('ip:a',)]
+
+def charge_many(path, results):
+    limiter = rate_limiter.RateLimiter(path, 0.001, 10)
+    results.put(sum(limiter.charge('ip:shared', 1).allowed for _ in range(10)))
+
+def test_buckets_are_shared_by_workers():
+    """Worker processes draw from one bucket per client"""
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'limits.db')
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=charge_many, args=(path, results)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        allowed = sum(results.get(timeout=30) for _ in workers)
+        for worker in workers:
+            worker.join(30)
+        assert allowed == 10
+
+def test_client_key():
+    """Known API keys get their own bucket; otherwise the trusted forwarded address is the client"""
+    original = rate_limiter.API_KEYS, rate_limiter.TRUSTED_PROXIES
+    rate_limiter.API_KEYS = frozenset({'secret-key'})
+    try:
+        key = rate_limiter.client_key({'X-API-Key': 'secret-key'}, '10.0.0.1')
+        assert key.startswith('key:') and 'secret-key' not in key
+        assert rate_limiter.client_key({'X-API-Key': 'made-up'}, '10.0.0.1') == 'ip:10.0.0.1'
+
+        forwarded = {'X-Forwarded-For': '1.1.1.1, 2.2.2.2, 3.3.3.3'}
+        assert rate_limiter.client_key(forwarded, '10.0.0.1') == 'ip:3.3.3.3'
+        rate_limiter.TRUSTED_PROXIES = 2
+        assert rate_limiter.client_key(forwarded, '10.0.0.1') == 'ip:2.2.2.2'
+        rate_limiter.TRUSTED_PROXIES = 0
+        assert rate_limiter.client_key(forwarded, '10.0.0.1') == 'ip:10.0.0.1'
+    finally:
+        rate_limiter.API_KEYS, rate_limiter.TRUSTED_PROXIES = original
+
+    assert rate_limiter.request_cost('docx') < rate_limiter.request_cost('pdf') < rate_limiter.request_cost('png')
+    assert rate_limiter.request_cost('pdf', 5) == 5 * rate_limiter.request_cost('pdf')
+
+def test_service_limits_clients():
+    """A client over its budget gets 429 with Retry-After; every response carries RateLimit headers"""
+    original = rate_limiter.limiter
+    with service_workdir() as workdir:
+        rate_limiter.limiter = rate_limiter.RateLimiter(os.path.join(workdir, 'limits.db'), 1, 2)
+        try:
+            client = certificate_service.app.test_client()
+            first = client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+            assert first.status_code == 200
+            assert first.headers['RateLimit-Limit'] == '2' and first.headers['RateLimit-Remaining'] == '1'
+            assert first.headers['RateLimit-Policy'] == '2;w=120'
+            # The cached certificate is still a request; invalid ones cost nothing
+            assert client.post('/api/generate-certificate', json={"name": "x"}).status_code == 400
+            assert client.post('/api/generate-certificate', json=CERTIFICATE_DATA).status_code == 200
+
+            refused = client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+            assert refused.status_code == 429
+            assert 50 <= int(refused.headers['Retry-After']) <= 60
+            assert refused.headers['RateLimit-Remaining'] == '0'
+
+            # A batch is charged per certificate, and other clients are unaffected
+            other = {'X-Forwarded-For': '203.0.113.7'}
+            response = client.post('/api/generate-certificates', headers=other, json={"certificates": [
+                dict(CERTIFICATE_DATA, name=f"Student {index}") for index in range(3)
+            ]})
+            assert response.status_code == 202
+            assert response.headers['RateLimit-Remaining'] == '0'
+            status_url = response.get_json()["status_url"]
+            deadline = time.time() + 60
+            while client.get(status_url).get_json()["status"] != "done":
+                assert time.time() < deadline, "batch timed out"
+                time.sleep(0.05)
+            assert client.post('/api/generate-certificate', headers=other, json=CERTIFICATE_DATA).status_code == 429
+
+            # Other endpoints report the bucket without charging it
+            lookup = client.get(f'/api/certificates/{first.headers["X-Certificate-Id"]}')
+            assert lookup.headers['RateLimit-Remaining'] == '0' and 'Retry-After' not in lookup.headers
+            health = client.get('/health')
+            assert 'RateLimit-Limit' not in health.headers
+            assert health.get_json()["rate_limit"]["limited"] == 2
+
+            if ASYNC_SERVICE_AVAILABLE:
+                # The same client (behind a proxy) shares its bucket across both services
+                async_client = TestClient(certificate_service_async.app)
+                refused = async_client.post('/api/generate-certificate', json=CERTIFICATE_DATA,
+                                            headers={'X-Forwarded-For': '127.0.0.1'})
+                assert refused.status_code == 429 and refused.headers['retry-after']
+                fresh = async_client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, format='docx'),
+                                          headers={'X-Forwarded-For': '198.51.100.1'})
+                assert fresh.status_code == 200 and fresh.headers['ratelimit-remaining'] == '1'
+        finally:
+            rate_limiter.limiter = original
+
+def main():
+    """Main test function"""
+    print("Rate Limiter Test")
+    print("=" * 40)
+
+    tests = [
+        test_bucket_refill_and_debt,
+        test_buckets_are_shared_by_workers,
+        test_client_key,
+        test_service_limits_clients
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Test the two-stage render -> convert pipeline
+Runs without LibreOffice: conversion falls back to reportlab
+"""
+
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import render_pipeline
+import certificate_service
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+def sleeper(seconds):
+    """A stage function that takes a fixed time and tags its payload"""
+    def stage(payload):
+        time.sleep(seconds)
+        return payload + [seconds]
+    return stage
+
+def test_stages_overlap():
+    """Rendering the next jobs overlaps converting the current one"""
+    pipeline = render_pipeline.StagedPipeline(
+        [('render', sleeper(0.05), 1), ('convert', sleeper(0.1), 1)], queue_size=2
+    )
+    started = time.monotonic()
+    futures = [pipeline.submit([index]) for index in range(10)]
+    results = [future.result(timeout=10) for future in futures]
+    elapsed = time.monotonic() - started
+
+    assert results == [[index, 0.05, 0.1] for index in range(10)]
+    # Sequentially this is 10 x 0.15s; pipelined it is bounded by the slower stage
+    assert elapsed < 1.35, elapsed
+
+    stats = pipeline.stats()
+    assert stats["stages"]["render"]["processed"] == 10
+    assert stats["stages"]["convert"]["processed"] == 10
+    assert stats["bottleneck"] == "convert"
+    assert stats["stages"]["convert"]["utilization"] > stats["stages"]["render"]["utilization"]
+
+def test_bounded_queue_backpressure():
+    """A slow second stage holds the first one back instead of piling up work"""
+    release = threading.Event()
+
+    def convert(payload):
+        release.wait(10)
+        return payload
+
+    pipeline = render_pipeline.StagedPipeline([('render', lambda p: p, 1), ('convert', convert, 1)], queue_size=2)
+    futures = [pipeline.submit(index) for index in range(8)]
+    time.sleep(0.3)
+    release.set()
+    assert [future.result(timeout=10) for future in futures] == list(range(8))
+
+    stats = pipeline.stats()["stages"]
+    assert stats["convert"]["queue_capacity"] == 2
+    assert stats["convert"]["max_queue_depth"] <= 2
+    assert stats["render"]["queue_capacity"] is None
+    assert stats["render"]["blocked_seconds"] > 0
+
+def test_failure_stops_the_job():
+    """A failing stage fails the job's future and the job goes no further"""
+    calls = []
+
+    def render(payload):
+        if payload == 'bad':
+            raise ValueError("cannot render")
+        return payload
+
+    def convert(payload):
+        calls.append(payload)
+        return payload.upper()
+
+    pipeline = render_pipeline.StagedPipeline([('render', render, 1), ('convert', convert, 2)], queue_size=1)
+    good, bad = pipeline.submit('good'), pipeline.submit('bad')
+    assert good.result(timeout=10) == 'GOOD'
+    assert isinstance(bad.exception(timeout=10), ValueError)
+    assert calls == ['good']
+
+    stats = pipeline.stats()["stages"]
+    assert stats["render"]["failed"] == 1 and stats["render"]["processed"] == 1
+    assert stats["convert"]["workers"] == 2
+
+def test_batch_through_pipeline():
+    """Batches are issued through the service's pipeline, which /health reports"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        entries = [dict(CERTIFICATE_DATA, name=f"Pipeline Student {index}") for index in range(3)]
+        response = client.post('/api/generate-certificates', json={"certificates": entries})
+        assert response.status_code == 202
+        status_url = response.get_json()["status_url"]
+
+        deadline = time.time() + 60
+        while True:
+            batch = client.get(status_url).get_json()
+            if batch["status"] == "done":
+                break
+            assert time.time() < deadline, batch
+            time.sleep(0.1)
+        assert batch["completed"] == 3 and batch["failed"] == 0
+
+        pipeline = client.get('/health').get_json()["pipeline"]
+        assert set(pipeline["stages"]) == {"render", "convert"}
+        assert pipeline["stages"]["convert"]["processed"] >= 3
+        assert pipeline["stages"]["convert"]["workers"] == certificate_service.CONVERT_WORKERS
+
+def main():
+    """Main test function"""
+    print("Render Pipeline Test")
+    print("=" * 40)
+
+    tests = [
+        test_stages_overlap,
+        test_bounded_queue_backpressure,
+        test_failure_stops_the_job,
+        test_batch_through_pipeline
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
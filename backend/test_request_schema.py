@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Test strict validation and normalization of certificate requests
+Runs without LibreOffice: conversion falls back to reportlab
+"""
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import certificate_service
+import request_schema
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+try:
+    from starlette.testclient import TestClient
+    import certificate_service_async
+    ASYNC_SERVICE_AVAILABLE = True
+except ImportError:
+    ASYNC_SERVICE_AVAILABLE = False
+
+def rejected(data):
+    """The ValidationError message for data, or None if it is accepted"""
+    try:
+        request_schema.normalize_certificate(data)
+    except request_schema.ValidationError as e:
+        return str(e)
+    return None
+
+def test_normalization():
+    """Equivalent spellings normalize to the same fields"""
+    spelled = request_schema.normalize_certificate(dict(
+        CERTIFICATE_DATA, name="  Jane \t Smith ", start_date="2024-02-01", end_date="30 Apr 2024", gender="Female"
+    ))
+    assert spelled == request_schema.normalize_certificate(CERTIFICATE_DATA)
+    assert spelled["start_date"] == "February 1, 2024"
+    assert spelled["gender"] == "female"
+    assert spelled["issued_date"] is None
+
+    # NFC: a decomposed accent equals the composed one
+    assert request_schema.normalize_certificate(dict(CERTIFICATE_DATA, name="Jose\u0301 Smith"))["name"] == \
+        "Jos\u00e9 Smith"
+
+def test_field_rules():
+    """Unknown fields, bad characters, long values, bad dates and genders are rejected"""
+    assert rejected(dict(CERTIFICATE_DATA, role="admin")).startswith("Unknown fields")
+    assert "not allowed" in rejected(dict(CERTIFICATE_DATA, name="<script>alert(1)</script>"))
+    assert "not allowed" in rejected(dict(CERTIFICATE_DATA, name="{{Name}}"))
+    assert "not allowed" in rejected(dict(CERTIFICATE_DATA, domain="1234"))
+    assert "longer than" in rejected(dict(CERTIFICATE_DATA, name="A" * 101))
+    assert "longer than" in rejected(dict(CERTIFICATE_DATA, name="A" * 100000))
+    assert "must be a string" in rejected(dict(CERTIFICATE_DATA, name=["Jane"]))
+    assert rejected(dict(CERTIFICATE_DATA, start_date="yesterday")).startswith("Invalid start_date")
+    assert rejected(dict(CERTIFICATE_DATA, end_date="3024-01-01")).startswith("Invalid end_date")
+    assert rejected(dict(CERTIFICATE_DATA, end_date="January 1, 2024")) == "end_date is before start_date"
+    assert rejected(dict(CERTIFICATE_DATA, gender="robot")).startswith("Invalid gender")
+    assert rejected(dict(CERTIFICATE_DATA, issued_date="soon")).startswith("Invalid issued_date")
+    assert rejected({key: value for key, value in CERTIFICATE_DATA.items() if key != 'domain'}) == \
+        "Missing required field: domain"
+    assert rejected(dict(CERTIFICATE_DATA, name="Ana-María O'Neil Jr.")) is None
+
+def test_indic_names():
+    """Names in Indic scripts (vowel signs are combining marks, conjuncts may use joiners) are accepted"""
+    for name in ("रूपेश कुमार", "அருண் குமார்", "സ്‌നേഹ", "ক্ষিতীশ"):
+        fields = request_schema.normalize_certificate(dict(CERTIFICATE_DATA, name=name))
+        assert fields["name"] == name, name
+    # Marks alone are not a name, and the usual rejections still apply
+    assert "not allowed" in rejected(dict(CERTIFICATE_DATA, name="\u093f\u0947"))
+    assert "not allowed" in rejected(dict(CERTIFICATE_DATA, name="रूपेश_कुमार"))
+    assert "not allowed" in rejected(dict(CERTIFICATE_DATA, name="रूपेश <b>"))
+
+def test_service_rejects_early():
+    """The service answers 400 / 413 without issuing anything"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        response = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, name="{{Name}}"))
+        assert response.status_code == 400
+        assert "not allowed" in response.get_json()["error"]
+
+        oversized = json.dumps(dict(CERTIFICATE_DATA, padding="x" * request_schema.MAX_BODY_BYTES))
+        response = client.post('/api/generate-certificate', data=oversized, content_type='application/json')
+        assert response.status_code == 413
+
+        response = client.post('/api/generate-certificate', data="{not json", content_type='application/json')
+        assert response.status_code == 400
+
+        response = client.post('/api/generate-certificates', json={"certificates": [
+            CERTIFICATE_DATA, dict(CERTIFICATE_DATA, gender="robot"), dict(CERTIFICATE_DATA, extra=1)
+        ]})
+        assert response.status_code == 400
+        assert set(response.get_json()["details"]) == {"1", "2"}
+
+        output_dir = certificate_service.OUTPUT_DIR
+        assert not os.path.isdir(output_dir) or not any(name.startswith('certificate_') for name in os.listdir(output_dir))
+
+def test_canonical_dates_share_certificate_id():
+    """Differently spelled dates issue the same certificate"""
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        first = client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+        second = client.post('/api/generate-certificate', json=dict(
+            CERTIFICATE_DATA, start_date="2024-02-01", end_date="April 30 2024"
+        ))
+        assert first.status_code == second.status_code == 200
+        assert first.headers['X-Certificate-Id'] == second.headers['X-Certificate-Id']
+
+def test_async_service_rejects_early():
+    """The async service applies the same schema and limits"""
+    if not ASYNC_SERVICE_AVAILABLE:
+        print("  starlette/httpx not installed, skipping")
+        return
+
+    with service_workdir():
+        client = TestClient(certificate_service_async.app)
+        response = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, role="admin"))
+        assert response.status_code == 400
+
+        oversized = json.dumps(dict(CERTIFICATE_DATA, padding="x" * request_schema.MAX_BODY_BYTES))
+        response = client.post('/api/generate-certificate', content=oversized,
+                               headers={'Content-Type': 'application/json'})
+        assert response.status_code == 413
+
+        response = client.post('/api/generate-certificate', content=json.dumps(CERTIFICATE_DATA),
+                               headers={'Content-Type': 'application/json', 'Content-Length': 'abc'})
+        assert response.status_code == 400
+        assert "Content-Length" in response.json()["error"]
+
+        response = client.post('/api/generate-certificates', json={"certificates": [dict(CERTIFICATE_DATA, name="")]})
+        assert response.status_code == 400
+        assert set(response.json()["details"]) == {"0"}
+
+def test_id_list_endpoints_read_bodies_strictly():
+    """Merge and bulk verify answer 400 / 413 for malformed or oversized bodies"""
+    oversized = json.dumps({"ids": ["x" * 64] * (request_schema.MAX_BATCH_BODY_BYTES // 64)})
+    with service_workdir():
+        client = certificate_service.app.test_client()
+        for path in ('/api/certificates/merge', '/api/verify'):
+            response = client.post(path, data="{not json", content_type='application/json')
+            assert response.status_code == 400
+            assert "not valid JSON" in response.get_json()["error"]
+
+            response = client.post(path, data=oversized, content_type='application/json')
+            assert response.status_code == 413
+
+        if not ASYNC_SERVICE_AVAILABLE:
+            print("  starlette/httpx not installed, skipping async service")
+            return
+
+        client = TestClient(certificate_service_async.app)
+        for path in ('/api/certificates/merge', '/api/verify'):
+            response = client.post(path, content="{not json", headers={'Content-Type': 'application/json'})
+            assert response.status_code == 400
+            assert "not valid JSON" in response.json()["error"]
+
+            response = client.post(path, content=oversized, headers={'Content-Type': 'application/json'})
+            assert response.status_code == 413
+
+def main():
+    """Main test function"""
+    print("Request Schema Test")
+    print("=" * 40)
+
+    tests = [
+        test_normalization,
+        test_field_rules,
+        test_indic_names,
+        test_service_rejects_early,
+        test_canonical_dates_share_certificate_id,
+        test_async_service_rejects_early,
+        test_id_list_endpoints_read_bodies_strictly
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
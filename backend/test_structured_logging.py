@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Test structured logging: JSON records, lazy formatting, sampling and bounded dumps
+"""
+
+import os
+import sys
+import json
+import queue
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tracing
+import structured_logging
+from structured_logging import (
+    JsonFormatter, SamplingFilter, TraceContextFilter, NonBlockingQueueHandler, bounded, bounded_listing
+)
+
+class CountingArgument:
+    """Logging argument that counts how often it is rendered"""
+
+    def __init__(self):
+        self.renders = 0
+
+    def __str__(self):
+        self.renders += 1
+        return "rendered"
+
+def make_logger(records, sample_rate=1.0, level=logging.INFO):
+    logger = logging.getLogger(f"test_structured_logging.{id(records)}")
+    logger.propagate = False
+    logger.setLevel(level)
+    handler = NonBlockingQueueHandler(records)
+    handler.addFilter(SamplingFilter(sample_rate))
+    handler.addFilter(TraceContextFilter())
+    logger.addHandler(handler)
+    return logger
+
+def test_json_record_with_fields_and_trace_id():
+    """Records become one JSON object carrying extra fields and the trace ID"""
+    records = queue.Queue()
+    logger = make_logger(records)
+    with tracing.request_span('GET /test') as span:
+        logger.info("Issued certificate %s", "abc", extra={"event": "issued", "certificate_id": "abc"})
+
+    entry = json.loads(JsonFormatter().format(records.get_nowait()))
+    assert entry["message"] == "Issued certificate abc"
+    assert entry["level"] == "INFO"
+    assert entry["event"] == "issued"
+    assert entry["certificate_id"] == "abc"
+    assert entry["trace_id"] == span.trace_id
+
+def test_formatting_is_deferred():
+    """Arguments are not rendered by the logging thread, nor at all for dropped records"""
+    records = queue.Queue()
+    logger = make_logger(records, sample_rate=0.0)
+    argument = CountingArgument()
+
+    logger.debug("Below the level: %s", argument)
+    logger.info("Sampled out: %s", argument, extra={"event": "libreoffice_attempt"})
+    assert records.empty()
+
+    logger.info("Queued: %s", argument)
+    assert argument.renders == 0
+    JsonFormatter().format(records.get_nowait())
+    assert argument.renders == 1
+
+def test_sampling_never_drops_warnings():
+    """Sampling only applies to event-tagged records below WARNING"""
+    records = queue.Queue()
+    logger = make_logger(records, sample_rate=0.0)
+    logger.info("Untagged")
+    logger.warning("Tagged warning", extra={"event": "libreoffice_missing"})
+    logger.info("Tagged info", extra={"event": "libreoffice_attempt"})
+
+    messages = [records.get_nowait().getMessage() for _ in range(records.qsize())]
+    assert messages == ["Untagged", "Tagged warning"]
+
+def test_full_queue_drops_instead_of_blocking():
+    """A full queue drops records rather than stalling the request thread"""
+    records = queue.Queue(maxsize=2)
+    logger = make_logger(records)
+    for i in range(10):
+        logger.info("Record %d", i)
+    assert records.qsize() == 2
+
+def test_bounded_dumps():
+    """Directory listings and converter output are capped"""
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(500):
+            open(os.path.join(directory, f"certificate_{i}.pdf"), 'w').close()
+        open(os.path.join(directory, "temp_certificate_x.docx"), 'w').close()
+
+        assert len(bounded_listing(directory)) == structured_logging.MAX_DUMP_ENTRIES
+        assert bounded_listing(directory, 'temp_certificate_') == ["temp_certificate_x.docx"]
+        assert bounded_listing(os.path.join(directory, 'missing')) == []
+
+    assert bounded("short") == "short"
+    assert bounded("x" * 5000, 100).endswith("[4900 more characters]")
+
+def test_async_converter_output_is_bounded():
+    """The ASGI service logs LibreOffice's output lazily and capped, like the Flask service"""
+    try:
+        import asyncio
+        import certificate_service
+        import certificate_service_async
+    except ImportError:
+        print("  starlette not installed, skipping")
+        return
+
+    records = []
+
+    class Capture(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    logger = logging.getLogger('certificate_service_async')
+    handler, level = Capture(), logger.level
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    original = certificate_service.LIBREOFFICE_COMMANDS
+    with tempfile.TemporaryDirectory() as directory:
+        converter = os.path.join(directory, 'soffice')
+        with open(converter, 'w') as f:
+            f.write(f"#!{sys.executable}\nimport sys\nsys.stderr.write('e' * 50000)\nsys.exit(1)\n")
+        os.chmod(converter, 0o755)
+        certificate_service.LIBREOFFICE_COMMANDS = [converter, os.path.join(directory, 'missing')]
+        try:
+            converted = asyncio.run(certificate_service_async.convert_with_libreoffice_async(
+                os.path.join(directory, 'in.docx'), os.path.join(directory, 'out.pdf')))
+        finally:
+            certificate_service.LIBREOFFICE_COMMANDS = original
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+
+    assert converted is False
+    stderr, = [record for record in records if record.msg.startswith("LibreOffice stderr")]
+    assert len(stderr.getMessage()) < structured_logging.MAX_DUMP_CHARS + 100
+    events = [getattr(record, 'event', None) for record in records]
+    assert events.count('libreoffice_attempt') == 2
+    assert 'libreoffice_result' in events and 'libreoffice_missing' in events
+
+def main():
+    """Main test function"""
+    print("Structured Logging Test")
+    print("=" * 40)
+
+    tests = [
+        test_json_record_with_fields_and_trace_id,
+        test_formatting_is_deferred,
+        test_sampling_never_drops_warnings,
+        test_full_queue_drops_instead_of_blocking,
+        test_bounded_dumps,
+        test_async_converter_output_is_bounded
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
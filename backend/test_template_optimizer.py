@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Test the template optimizer: smaller templates with the same text and placeholders
+"""
+
+import io
+import os
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from docx import Document
+from docx.shared import Inches
+import certificate_service
+import template_optimizer
+import template_registry
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+def write_bloated_template(path):
+    """
+    A template with split placeholder runs, an oversized image (printed 2 inches
+    wide), an image nothing shows and python-docx's full style set
+    """
+    from PIL import Image
+
+    doc = Document()
+    doc.add_paragraph('CERTIFICATE OF COMPLETION')
+    para = doc.add_paragraph('This is to certify that ')
+    for piece in ('{{Na', 'me}}', ' has completed ', '{{Dom', 'ain}}', '.'):
+        para.add_run(piece)
+    bold = para.add_run(' With distinction.')
+    bold.bold = True
+    doc.add_paragraph('ISSUED DATE :')
+
+    image = io.BytesIO()
+    Image.radial_gradient('L').resize((3000, 2000)).convert('RGB').save(image, 'PNG')
+    image.seek(0)
+    doc.add_picture(image, width=Inches(2))
+
+    unused = io.BytesIO()
+    Image.new('RGB', (400, 400), 'red').save(unused, 'PNG')
+    doc.part.get_or_add_image(unused)
+    doc.save(path)
+
+def test_optimized_template_keeps_text():
+    """Runs are merged, unused styles and parts go, the image is printed-size; the text is unchanged"""
+    if not template_optimizer.PIL_AVAILABLE:
+        print("  Pillow not installed, skipping")
+        return
+
+    with service_workdir():
+        write_bloated_template('bloated.docx')
+        with open('bloated.docx', 'rb') as f:
+            data = f.read()
+        optimized, report = template_optimizer.optimize(data)
+
+        assert len(optimized) < len(data) / 2, report["bytes"]
+        assert report["bytes"] == [len(data), len(optimized)]
+        assert report["merged_runs"] == 6 and report["removed_styles"] > 100
+        image, = report["images"]
+        assert image["pixels"] == ["3000x2000", "600x400"]
+
+        original, compiled = Document(io.BytesIO(data)), Document(io.BytesIO(optimized))
+        assert [p.text for p in compiled.paragraphs] == [p.text for p in original.paragraphs]
+        runs = [run.text for run in compiled.paragraphs[1].runs]
+        assert runs == ['This is to certify that {{Name}} has completed {{Domain}}.', ' With distinction.']
+        assert compiled.paragraphs[1].runs[1].bold
+        assert 'Normal' in [style.name for style in compiled.styles]
+
+        with zipfile.ZipFile(io.BytesIO(optimized)) as archive:
+            names = archive.namelist()
+        assert 'docProps/thumbnail.jpeg' not in names
+        assert [name for name in names if name.startswith('word/media/')] == [image["part"]]
+        # Every worker compiles the same bytes, so the template version agrees
+        assert template_optimizer.optimize(data)[0] == optimized
+
+def test_registry_serves_compiled_template():
+    """With optimization on, certificates are rendered from the compiled template, compiled once for all workers"""
+    if not template_optimizer.PIL_AVAILABLE:
+        print("  Pillow not installed, skipping")
+        return
+
+    original = template_optimizer.OPTIMIZE_TEMPLATES
+    template_optimizer.OPTIMIZE_TEMPLATES = True
+    try:
+        with service_workdir():
+            write_bloated_template('SpectoV_Cert.docx')
+            client = certificate_service.app.test_client()
+            response = client.post('/api/generate-certificate', json=dict(CERTIFICATE_DATA, format='docx'))
+            assert response.status_code == 200
+            text = "\n".join(para.text for para in Document(io.BytesIO(response.data)).paragraphs)
+            assert 'Jane Smith has completed Data Science.' in text
+
+            path = os.path.abspath('SpectoV_Cert.docx')
+            output_path, report_path = template_optimizer.compiled_paths(path)
+            assert os.path.exists(output_path) and os.path.exists(report_path)
+            optimized = template_registry.registry.stats()["optimized"][path]
+            assert optimized["bytes"][1] < optimized["bytes"][0]
+            assert len(optimized["docx_seconds"]) == 2
+
+            # Another worker reuses the compile output instead of optimizing again
+            compile_output = os.stat(output_path).st_mtime_ns
+            other = template_registry.TemplateRegistry()
+            assert other.get().version == template_registry.registry.get().version
+            assert os.stat(output_path).st_mtime_ns == compile_output
+
+            assert template_optimizer.main([path]) == 0
+    finally:
+        template_optimizer.OPTIMIZE_TEMPLATES = original
+
+def main():
+    """Main test function"""
+    print("Template Optimizer Test")
+    print("=" * 40)
+
+    tests = [
+        test_optimized_template_keeps_text,
+        test_registry_serves_compiled_template
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Test the template registry: per-domain templates, hot reload and stale output invalidation
+"""
+
+import io
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from docx import Document
+import certificate_service
+import template_registry
+from template_registry import TemplateRegistry
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+def write_template(path, heading):
+    """Save a minimal certificate template whose first paragraph is heading"""
+    doc = Document()
+    doc.add_paragraph(heading)
+    doc.add_paragraph('This is to certify that {{Name}} has completed {{Domain}}.')
+    doc.save(path)
+
+def issued_text(client, data):
+    """Issue a DOCX certificate; returns (certificate_id, document text)"""
+    response = client.post('/api/generate-certificate', json=dict(data, format='docx'))
+    assert response.status_code == 200, response.data
+    doc = Document(io.BytesIO(response.data))
+    return response.headers['X-Certificate-Id'], "\n".join(para.text for para in doc.paragraphs)
+
+def test_domains_map_to_templates():
+    """Mapped domains use their own template, others the default"""
+    with service_workdir() as workdir:
+        os.makedirs(os.path.join(workdir, 'templates'))
+        write_template(os.path.join(workdir, 'templates', 'data_science.docx'), 'DATA SCIENCE PROGRAM')
+        with open(os.path.join(workdir, 'templates.json'), 'w') as f:
+            json.dump({"domains": {"data science": "templates/data_science.docx"}}, f)
+
+        client = certificate_service.app.test_client()
+        _, text = issued_text(client, CERTIFICATE_DATA)
+        assert 'DATA SCIENCE PROGRAM' in text
+        assert 'Jane Smith has completed Data Science.' in text
+
+        _, text = issued_text(client, dict(CERTIFICATE_DATA, domain="Web Development"))
+        assert 'DATA SCIENCE PROGRAM' not in text
+        assert 'Jane Smith' in text
+
+def test_template_change_reloads_and_invalidates():
+    """Editing a template is picked up without a restart and replaces cached outputs"""
+    with service_workdir() as workdir:
+        client = certificate_service.app.test_client()
+        first_id, first = issued_text(client, CERTIFICATE_DATA)
+        assert 'SECOND EDITION' not in first
+        client.post('/api/generate-certificate', json=CERTIFICATE_DATA)
+        assert os.path.exists(certificate_service.certificate_path(first_id))
+
+        write_template(os.path.join(workdir, 'SpectoV_Cert.docx'), 'SECOND EDITION')
+        second_id, second = issued_text(client, CERTIFICATE_DATA)
+        assert second_id == first_id
+        assert 'SECOND EDITION' in second
+        # The PDF from the old template is gone until it is requested again
+        assert not os.path.exists(certificate_service.certificate_path(first_id))
+
+def test_lru_is_bounded_by_size():
+    """Least recently used templates are evicted once the size limit is exceeded"""
+    with service_workdir() as workdir:
+        for name in ('a', 'b', 'c'):
+            write_template(os.path.join(workdir, f'{name}.docx'), name)
+        with open('templates.json', 'w') as f:
+            json.dump({"default": "a.docx", "domains": {"b": "b.docx", "c": "c.docx"}}, f)
+
+        size = os.path.getsize('a.docx')
+        registry = TemplateRegistry(limit_mb=2.5 * size / (1024 * 1024))
+        first = registry.get('a')
+        registry.get('b')
+        registry.get('a')
+        registry.get('c')
+
+        stats = registry.stats()
+        assert set(stats["cached"]) == {os.path.abspath('a.docx'), os.path.abspath('c.docx')}
+        assert stats["evictions"] == 1
+        assert registry.get('a') is first
+        assert first.placeholders == {'{{Name}}', '{{Domain}}'}
+
+def test_missing_template():
+    """A missing template is reported, not cached"""
+    registry = TemplateRegistry(map_path='missing.json', default_template='missing.docx')
+    try:
+        registry.get('anything')
+        assert False, "expected FileNotFoundError"
+    except FileNotFoundError:
+        pass
+    assert registry.version('anything') is None
+    assert template_registry.registry.limit_bytes > 0
+
+def main():
+    """Main test function"""
+    print("Template Registry Test")
+    print("=" * 40)
+
+    tests = [
+        test_domains_map_to_templates,
+        test_template_change_reloads_and_invalidates,
+        test_lru_is_bounded_by_size,
+        test_missing_template
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Test request tracing: traceparent propagation, spans and exporters
+"""
+
+import os
+import sys
+import json
+import threading
+import contextlib
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tracing
+import certificate_service
+from test_certificate_downloads import CERTIFICATE_DATA, service_workdir
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+@contextlib.contextmanager
+def exporting_to(trace_file=None, otlp_endpoint=None):
+    original = (tracing.exporter.trace_file, tracing.exporter.otlp_endpoint)
+    tracing.exporter.trace_file = trace_file
+    tracing.exporter.otlp_endpoint = otlp_endpoint
+    try:
+        yield
+    finally:
+        tracing.exporter.flush()
+        tracing.exporter.trace_file, tracing.exporter.otlp_endpoint = original
+
+def test_parse_traceparent():
+    """Valid W3C traceparent headers are accepted, malformed ones ignored"""
+    assert tracing.parse_traceparent(f'00-{TRACE_ID}-{PARENT_ID}-01') == (TRACE_ID, PARENT_ID)
+    assert tracing.parse_traceparent('00-abc-def-01') is None
+    assert tracing.parse_traceparent(f'00-{"0" * 32}-{PARENT_ID}-01') is None
+    assert tracing.parse_traceparent(None) is None
+
+def test_request_spans_share_the_callers_trace():
+    """A certificate request is broken down into spans under the proxy's trace"""
+    with service_workdir() as workdir:
+        trace_file = os.path.join(workdir, 'traces.jsonl')
+        with exporting_to(trace_file=trace_file):
+            client = certificate_service.app.test_client()
+            response = client.post('/api/generate-certificate', json=CERTIFICATE_DATA,
+                                   headers={'traceparent': f'00-{TRACE_ID}-{PARENT_ID}-01'})
+            assert response.status_code == 200
+            assert response.headers['X-Trace-Id'] == TRACE_ID
+
+        spans = tracing.load_traces(trace_file)[TRACE_ID]
+        by_name = {span['name']: span for span in spans}
+        for name in ('parse', 'render', 'save', 'queue', 'convert.reportlab', 'send'):
+            assert name in by_name, f"missing span {name}"
+
+        root = by_name['POST /api/generate-certificate']
+        assert root['parent_id'] == PARENT_ID
+        assert root['attributes']['status_code'] == 200
+        assert by_name['parse']['parent_id'] == root['span_id']
+        assert by_name['save']['parent_id'] == by_name['render']['span_id']
+        assert all(span['duration_ms'] <= root['duration_ms'] for span in spans)
+
+        tree = tracing.format_trace(spans)
+        assert tree.splitlines()[0].endswith('POST /api/generate-certificate [certificate-service]')
+
+def test_otlp_export():
+    """Spans are posted to an OTLP/HTTP collector in the JSON encoding"""
+    received = []
+
+    class Collector(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Collector)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with exporting_to(otlp_endpoint=f'http://127.0.0.1:{server.server_port}/v1/traces'):
+            with tracing.request_span('GET /test', f'00-{TRACE_ID}-{PARENT_ID}-01'):
+                with tracing.span('child', attempt=1):
+                    pass
+    finally:
+        server.shutdown()
+
+    spans = [span for payload in received
+             for resource in payload['resourceSpans']
+             for scope in resource['scopeSpans']
+             for span in scope['spans']]
+    assert {span['name'] for span in spans} == {'GET /test', 'child'}
+    assert all(span['traceId'] == TRACE_ID for span in spans)
+    child = next(span for span in spans if span['name'] == 'child')
+    assert child['attributes'] == [{'key': 'attempt', 'value': {'intValue': '1'}}]
+
+def main():
+    """Main test function"""
+    print("Tracing Test")
+    print("=" * 40)
+
+    tests = [
+        test_parse_traceparent,
+        test_request_spans_share_the_callers_trace,
+        test_otlp_export
+    ]
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            failures += 1
+
+    print(f"\nPassed: {len(tests) - failures}/{len(tests)}")
+    return failures == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,323 @@
+"""
+Lightweight request tracing
+Each certificate request gets a trace ID, taken from the W3C `traceparent`
+header sent by the Node proxy or generated here, and is broken down into spans
+(parse, render, save, each converter attempt, send, ...). Finished spans are
+exported in the background to:
+
+- a JSON-lines file (CERTIFICATE_TRACE_FILE), one span per line, and/or
+- an OTLP/HTTP collector (CERTIFICATE_OTLP_ENDPOINT, e.g.
+  http://localhost:4318/v1/traces) using the OTLP JSON encoding
+
+The current span lives in a context variable, so it follows the request
+through threads started with contextvars.copy_context() and asyncio tasks.
+
+Show the latency breakdown of the slowest (or a given) trace in a span file:
+    python tracing.py traces.jsonl [trace_id]
+"""
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+# JSON-lines file receiving finished spans (unset: no file export)
+TRACE_FILE = os.environ.get('CERTIFICATE_TRACE_FILE')
+
+# OTLP/HTTP traces endpoint (unset: no collector export)
+OTLP_ENDPOINT = os.environ.get('CERTIFICATE_OTLP_ENDPOINT')
+
+SERVICE_NAME = os.environ.get('CERTIFICATE_SERVICE_NAME', 'certificate-service')
+
+# Spans kept in the export queue before new ones are dropped
+MAX_QUEUED_SPANS = 10000
+
+TRACEPARENT_PATTERN = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+def parse_traceparent(header):
+    """
+    Parse a W3C traceparent header into (trace_id, parent_span_id), or None
+    """
+    match = TRACEPARENT_PATTERN.match((header or '').strip().lower())
+    if not match or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2)
+
+def new_trace_id():
+    return os.urandom(16).hex()
+
+def new_span_id():
+    return os.urandom(8).hex()
+
+class Span:
+    """
+    One timed operation within a trace; use as a context manager
+    """
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'kind', 'attributes',
+                 'start_ns', 'end_ns', 'error', '_token')
+
+    def __init__(self, name, trace_id, parent_id=None, kind='internal', attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = None
+        self.end_ns = None
+        self.error = None
+        self._token = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6 if self.end_ns else None
+
+    def start(self):
+        self.start_ns = time.time_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def end(self, error=None):
+        """
+        Finish the span and hand it to the exporter (no-op if never started or already ended)
+        """
+        if self.start_ns is None or self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Ended from a different context than it was started in
+            _current_span.set(None)
+        exporter.export(self)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(exc)
+        return False
+
+    def to_record(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": SERVICE_NAME,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+def current_span():
+    return _current_span.get()
+
+def request_span(name, traceparent=None, **attributes):
+    """
+    Root span of an incoming request, continuing the caller's trace if it sent one
+    """
+    parent = parse_traceparent(traceparent)
+    trace_id, parent_id = parent if parent else (new_trace_id(), None)
+    return Span(name, trace_id, parent_id, kind='server', attributes=attributes)
+
+def span(name, **attributes):
+    """
+    Child span of the current span (or the root of a new trace if there is none)
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return Span(name, new_trace_id(), attributes=attributes)
+    return Span(name, parent.trace_id, parent.span_id, attributes=attributes)
+
+def otlp_payload(spans):
+    """
+    Encode spans as an OTLP/HTTP JSON ExportTraceServiceRequest
+    """
+    kinds = {'internal': 1, 'server': 2, 'client': 3}
+
+    def attribute(key, value):
+        if isinstance(value, bool):
+            encoded = {"boolValue": value}
+        elif isinstance(value, int):
+            encoded = {"intValue": str(value)}
+        elif isinstance(value, float):
+            encoded = {"doubleValue": value}
+        else:
+            encoded = {"stringValue": str(value)}
+        return {"key": key, "value": encoded}
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{
+                "scope": {"name": "certificate_service.tracing"},
+                "spans": [{
+                    "traceId": s.trace_id,
+                    "spanId": s.span_id,
+                    "parentSpanId": s.parent_id or "",
+                    "name": s.name,
+                    "kind": kinds.get(s.kind, 1),
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns),
+                    "attributes": [attribute(k, v) for k, v in s.attributes.items()],
+                    "status": {"code": 2, "message": s.error} if s.error else {"code": 1}
+                } for s in spans]
+            }]
+        }]
+    }
+
+class SpanExporter:
+    """
+    Exports finished spans from a background thread so requests never wait on it
+    """
+
+    def __init__(self, trace_file=None, otlp_endpoint=None):
+        self.trace_file = trace_file
+        self.otlp_endpoint = otlp_endpoint
+        self._queue = queue.Queue(maxsize=MAX_QUEUED_SPANS)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    @property
+    def enabled(self):
+        return bool(self.trace_file or self.otlp_endpoint)
+
+    def export(self, finished_span):
+        if not self.enabled:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(finished_span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Collect whatever else is already waiting into the same write/POST
+            while len(batch) < 512:
+                try:
+                    batch.append(self._queue.get(timeout=0.2))
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as e:
+                logger.warning("Span export failed: %s", e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def write(self, spans):
+        if self.trace_file:
+            with open(self.trace_file, 'a') as f:
+                for s in spans:
+                    f.write(json.dumps(s.to_record()) + '\n')
+        if self.otlp_endpoint:
+            request = urllib.request.Request(
+                self.otlp_endpoint,
+                data=json.dumps(otlp_payload(spans)).encode(),
+                headers={'Content-Type': 'application/json'}
+            )
+            urllib.request.urlopen(request, timeout=5).close()
+
+    def flush(self, timeout=5.0):
+        """
+        Wait until queued spans are exported (bounded by timeout)
+        """
+        if not self.enabled or self._thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+exporter = SpanExporter(TRACE_FILE, OTLP_ENDPOINT)
+atexit.register(exporter.flush)
+
+def load_traces(path):
+    """
+    Group the span records of a JSON-lines trace file by trace ID
+    """
+    traces = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                traces.setdefault(record["trace_id"], []).append(record)
+    return traces
+
+def format_trace(records):
+    """
+    Render one trace as an indented tree of spans with their durations
+    """
+    children = {}
+    span_ids = {record["span_id"] for record in records}
+    for record in sorted(records, key=lambda r: int(r["start_ns"])):
+        parent = record["parent_id"] if record["parent_id"] in span_ids else None
+        children.setdefault(parent, []).append(record)
+
+    start = min(int(record["start_ns"]) for record in records)
+    lines = []
+
+    def walk(parent, depth):
+        for record in children.get(parent, []):
+            offset_ms = (int(record["start_ns"]) - start) / 1e6
+            error = f"  ! {record['error']}" if record.get("error") else ""
+            lines.append(f"{offset_ms:9.1f} ms  {record['duration_ms']:9.1f} ms  "
+                         f"{'  ' * depth}{record['name']} [{record['service']}]{error}")
+            walk(record["span_id"], depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+    traces = load_traces(sys.argv[1])
+    if not traces:
+        print("No spans found")
+        return 1
+    if len(sys.argv) > 2:
+        trace_id = sys.argv[2]
+    else:
+        trace_id = max(traces, key=lambda t: max(r["duration_ms"] for r in traces[t]))
+    print(f"Trace {trace_id}")
+    print(f"{'start':>12}  {'duration':>12}  span")
+    print(format_trace(traces.get(trace_id, [])))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
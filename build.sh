@@ -17,13 +17,14 @@ for i in {1..3}; do
     fi
 done
 
-# Install LibreOffice for PDF conversion
+# Install LibreOffice for PDF conversion (and poppler for certificate previews)
 echo "Installing LibreOffice..."
 apt-get install -y --no-install-recommends \
     libreoffice \
     libreoffice-writer \
     libreoffice-common \
-    libreoffice-core
+    libreoffice-core \
+    poppler-utils
 
 # Verify LibreOffice installation
 echo "Verifying LibreOffice installation..."
@@ -39,4 +40,10 @@ echo "Installing Python dependencies..."
 cd backend
 pip install --no-cache-dir -r requirements.txt
 
+# Compile the certificate templates ahead of time (see template_optimizer.py)
+if [ "$CERTIFICATE_OPTIMIZE_TEMPLATES" = "1" ]; then
+    echo "Optimizing certificate templates..."
+    python template_optimizer.py || echo "Warning: template optimization failed, templates will be compiled at runtime"
+fi
+
 echo "Build completed successfully!"